@@ -0,0 +1,114 @@
+"""
+Benchmark the cdist grouping engine (match.group_suppliers) against the
+pairwise reference (match.group_suppliers_pairwise) on synthetic supplier
+lists.
+
+Names are built from a lab-vendor-like vocabulary plus the variations seen
+in procurement data (legal suffixes, regions, dropped spaces, typos,
+punctuation, account numbers), so prefix blocks like "bio" get large the
+same way they do on the real list.
+
+Usage:
+    python benchmark_grouping.py                       # 10k, 50k, 100k, 500k
+    python benchmark_grouping.py --sizes 10000 20000 --pairwise-max 20000
+"""
+import argparse
+import random
+import time
+
+import match
+
+_STEMS = [
+    'bio', 'biotech', 'bioscience', 'biosystems', 'chem', 'chemical', 'gen',
+    'genomics', 'cell', 'cellular', 'lab', 'medical', 'scientific', 'tech',
+    'pharma', 'molecular', 'analytical', 'instrument', 'supply', 'research',
+    'diagnostic', 'clinical', 'micro', 'nano', 'optic', 'vision', 'life',
+    'precision', 'advanced', 'applied', 'integrated', 'quantum', 'allied',
+]
+_WORDS = [
+    'alpha', 'apex', 'summit', 'river', 'harbor', 'north', 'pioneer', 'atlas',
+    'crescent', 'keystone', 'liberty', 'meridian', 'orion', 'pinnacle',
+    'sierra', 'vertex', 'zenith', 'cobalt', 'granite', 'maple', 'oak', 'cedar',
+    'falcon', 'eagle', 'phoenix', 'delta', 'sigma', 'omega', 'nova', 'stellar',
+]
+_SUFFIXES = ['inc', 'llc', 'corp', 'co', 'ltd', 'company', 'corporation',
+             'international', 'usa', 'north america', 'group', 'sales']
+
+
+def _base_name(rng):
+    parts = [rng.choice(_WORDS)] if rng.random() < 0.5 else []
+    parts += rng.sample(_STEMS, rng.randint(1, 3))
+    if rng.random() < 0.3:
+        parts.append(str(rng.randint(1, 999)))
+    return ' '.join(parts)
+
+
+def _variant(base, rng):
+    name = base
+    r = rng.random()
+    if r < 0.25:
+        name = f"{name} {rng.choice(_SUFFIXES)}"
+    elif r < 0.35:
+        name = name.replace(' ', '', 1)
+    elif r < 0.50 and len(name) > 6:
+        i = rng.randrange(1, len(name) - 1)
+        name = name[:i] + rng.choice('aeiourstn') + name[i + 1:]
+    elif r < 0.55:
+        name = f"{name}, {rng.choice(_SUFFIXES).upper()}."
+    elif r < 0.60:
+        name = f"{name} acct {rng.randint(10000, 99999)}"
+    if rng.random() < 0.5:
+        name = name.title()
+    return name
+
+
+def make_supplier_list(n, seed=0):
+    """n distinct raw supplier names, ~4 variants per underlying company."""
+    rng = random.Random(seed)
+    bases = [_base_name(rng) for _ in range(max(1, n // 4))]
+    # A sprinkling of real canonical vendors exercises the VIP lock.
+    bases += list(match.CANONICAL_MAPPING)[:50]
+    names = set()
+    while len(names) < n:
+        names.add(_variant(rng.choice(bases), rng))
+    return sorted(names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10_000, 50_000, 100_000, 500_000])
+    parser.add_argument('--pairwise-max', type=int, default=50_000,
+                        help='Also run (and compare against) the pairwise engine up to this size.')
+    parser.add_argument('--threshold', type=int, default=92)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.sizes:
+        names = make_supplier_list(n, seed=args.seed)
+        print(f"\n=== {n:,} supplier names ===")
+        t0 = time.perf_counter()
+        fast = match.group_suppliers(names, threshold=args.threshold)
+        t_fast = time.perf_counter() - t0
+
+        t_pair, same = float('nan'), None
+        if n <= args.pairwise_max:
+            t0 = time.perf_counter()
+            slow = match.group_suppliers_pairwise(names, threshold=args.threshold)
+            t_pair = time.perf_counter() - t0
+            same = slow == fast
+            if not same:
+                diff = [k for k in fast if fast[k] != slow[k]]
+                print(f"   !! {len(diff)} names map differently, e.g. {diff[:5]}")
+        rows.append((n, len(set(fast.values())), t_fast, t_pair, same))
+
+    print(f"\n{'names':>9} {'groups':>9} {'cdist (s)':>10} {'pairwise (s)':>13} {'speedup':>8}  identical")
+    for n, groups, t_fast, t_pair, same in rows:
+        speedup = t_pair / t_fast if t_pair == t_pair else float('nan')
+        print(f"{n:>9,} {groups:>9,} {t_fast:>10.2f} {t_pair:>13.2f} {speedup:>7.1f}x  "
+              f"{'-' if same is None else same}")
+
+
+if __name__ == '__main__':
+    main()
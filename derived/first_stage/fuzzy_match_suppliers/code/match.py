@@ -1,10 +1,17 @@
+import functools
+import numpy as np
 import pandas as pd
 import re
 from collections import defaultdict
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
 import os
 import time
 
+try:
+    import ahocorasick
+except ImportError:  # fall back to the per-alias regex loop
+    ahocorasick = None
+
 # --- MAPPING DICTIONARY ---
 # This dictionary handles exact overrides. Keys are the variations found in data;
 # Values are the target canonical name.
@@ -718,6 +725,14 @@ IGNORABLE_TOKENS = {
 _SORTED_ALIASES = sorted(CANONICAL_MAPPING.keys(), key=len, reverse=True)
 # Pre-compile a regex for each alias
 _ALIAS_PATTERNS = [(alias, re.compile(r'\b' + re.escape(alias) + r'\b')) for alias in _SORTED_ALIASES]
+# One Aho-Corasick automaton over every alias; payload is the alias's rank
+# in _SORTED_ALIASES so a single scan can pick the alias the regex loop would.
+_ALIAS_AUTOMATON = None
+if ahocorasick is not None:
+    _ALIAS_AUTOMATON = ahocorasick.Automaton()
+    for _rank, _alias in enumerate(_SORTED_ALIASES):
+        _ALIAS_AUTOMATON.add_word(_alias, (_rank, len(_alias)))
+    _ALIAS_AUTOMATON.make_automaton()
 # Set of locked canonical names for VIP protection
 _LOCKED_NAMES = frozenset(val.lower() for val in CANONICAL_MAPPING.values())
 
@@ -739,10 +754,101 @@ _RE_TRAILING_ACCT = re.compile(r'\s*(acct|account|vendor|vend)?[#]?\s*\d{4,}\s*$
 # FKA / formerly known as
 _RE_FKA = re.compile(r'\b(fka|f/k/a|formerly\s+known\s+as|formerly)\s+.*$')
 
+# Step 3 rewrite stage: every substitution normalize_name applies after the
+# DBA / FKA logic, in order.  Order matters -- e.g. "laboratoriess" becomes
+# "labs" and only then "lab" -- so this is applied as one ordered pass
+# rather than a single alternation regex.
+_REWRITES = [
+    ('&', ' and '),
+    # Strip parenthetical annotations: (inactive), (see 49183), etc.
+    (_RE_PARENS, ''),
+    # Strip "see #12345" / "use vendor #456" redirects
+    (_RE_SEE_USE, ''),
+    # Strip trailing account/vendor numbers
+    (_RE_TRAILING_ACCT, ''),
+    # Specific Keyword Protections
+    ('biotechnologies', 'biotech'),
+    ('biotechnology', 'biotech'),
+    # University Sledgehammer
+    ('university of california', 'uc'),
+    ('uni of california', 'uc'),
+    (_RE_UNIVERSITY, 'uni'),
+    ('univ', 'uni'),
+    ('united states', 'us'),
+    ('u s ', 'us'),
+    # Lab variants (order matters: longest first to avoid partial replacements)
+    ('laboratories', 'lab'),
+    ('labortories', 'lab'),
+    ('laboratory', 'lab'),
+    ('labs', 'lab'),
+    ('technologies', 'tech'),
+    # Supply variants
+    ('supplies', 'supply'),
+    # Services/service normalization
+    ('services', 'service'),
+    # Remove junk prefixes (zz_dnu_, zzz_dnu_, xx_)
+    (_RE_JUNK_PREFIX, ''),
+    # Remove standard corporate suffixes for matching
+    (_RE_SUFFIXES, ''),
+    (_RE_THE, ''),
+    # Remove noise words
+    ('zzz', ''),
+    ('xxxx', ''),
+    ('xxx', ''),
+    ('www', ''),
+    ('inactive', ''),
+    ('do not use', ''),
+    ('blocked vendor', ''),
+    ('dnu', ''),
+]
+# Compiled once into plain callables: str.replace for literals, Pattern.sub
+# for regexes.
+_REWRITE_STEPS = [
+    functools.partial(old.sub, new) if isinstance(old, re.Pattern)
+    else functools.partial(lambda text, o, n: text.replace(o, n), o=old, n=new)
+    for old, new in _REWRITES
+]
+
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+
+def _at_word_boundary(text, pos):
+    """re's \b at index pos of text."""
+    left = pos > 0 and _is_word_char(text[pos - 1])
+    right = pos < len(text) and _is_word_char(text[pos])
+    return left != right
+
+
+def _find_alias(text):
+    """
+    Return the alias the _ALIAS_PATTERNS loop would pick for text (the first
+    alias, longest-first, occurring with word boundaries on both sides), or
+    None.  With the automaton this is one scan of text: every occurrence is
+    reported and the lowest-ranked one with valid boundaries wins.
+    """
+    if _ALIAS_AUTOMATON is None:
+        for alias, pattern in _ALIAS_PATTERNS:
+            if pattern.search(text):
+                return alias
+        return None
+    best = None
+    for end, (rank, length) in _ALIAS_AUTOMATON.iter(text):
+        if best is not None and rank >= best:
+            continue
+        if _at_word_boundary(text, end - length + 1) and _at_word_boundary(text, end + 1):
+            best = rank
+    return None if best is None else _SORTED_ALIASES[best]
 
+
+@functools.lru_cache(maxsize=1 << 20)
 def normalize_name(name):
     """
     Standard Cleaning with specific word protections.
+
+    Memoized: on the full first-stage panel the same supplier string recurs
+    many times, and the result is a pure function of the input.
     """
     if not isinstance(name, str) or not name.strip():
         return "", ""
@@ -752,10 +858,10 @@ def normalize_name(name):
     # --- Step 0: Strip CSV artifacts and obvious junk ---
     cleaned_for_search = _RE_LEADING_QUOTE.sub('', cleaned_for_search).strip()
 
-    # --- Step 1: Check Canonical Mapping (uses pre-sorted, pre-compiled patterns) ---
-    for alias, pattern in _ALIAS_PATTERNS:
-        if pattern.search(cleaned_for_search):
-            return cleaned_for_search, CANONICAL_MAPPING[alias]
+    # --- Step 1: Check Canonical Mapping (single automaton scan) ---
+    alias = _find_alias(cleaned_for_search)
+    if alias is not None:
+        return cleaned_for_search, CANONICAL_MAPPING[alias]
 
     # --- Step 2: DBA Logic ---
     cleaned = cleaned_for_search.replace('d.b.a.', 'dba').replace('d/b/a', 'dba')
@@ -767,60 +873,9 @@ def normalize_name(name):
     # --- Step 2b: FKA / formerly logic (keep the current name, drop old) ---
     cleaned = _RE_FKA.sub('', cleaned)
 
-    # --- Step 3: General Cleaning ---
-    cleaned = cleaned.replace('&', ' and ')
-
-    # Strip parenthetical annotations: (inactive), (see 49183), etc.
-    cleaned = _RE_PARENS.sub('', cleaned)
-
-    # Strip "see #12345" / "use vendor #456" redirects
-    cleaned = _RE_SEE_USE.sub('', cleaned)
-
-    # Strip trailing account/vendor numbers
-    cleaned = _RE_TRAILING_ACCT.sub('', cleaned)
-
-    # Specific Keyword Protections
-    cleaned = cleaned.replace('biotechnologies', 'biotech')
-    cleaned = cleaned.replace('biotechnology', 'biotech')
-
-    # University Sledgehammer
-    cleaned = cleaned.replace('university of california', 'uc')
-    cleaned = cleaned.replace('uni of california', 'uc')
-    cleaned = _RE_UNIVERSITY.sub('uni', cleaned)
-    cleaned = cleaned.replace('univ', 'uni')
-
-    cleaned = cleaned.replace('united states', 'us')
-    cleaned = cleaned.replace('u s ', 'us')
-
-    # Lab variants (order matters: longest first to avoid partial replacements)
-    cleaned = cleaned.replace('laboratories', 'lab')
-    cleaned = cleaned.replace('labortories', 'lab')
-    cleaned = cleaned.replace('laboratory', 'lab')
-    cleaned = cleaned.replace('labs', 'lab')
-    cleaned = cleaned.replace('technologies', 'tech')
-
-    # Supply variants
-    cleaned = cleaned.replace('supplies', 'supply')
-
-    # Services/service normalization
-    cleaned = cleaned.replace('services', 'service')
-
-    # Remove junk prefixes (zz_dnu_, zzz_dnu_, xx_)
-    cleaned = _RE_JUNK_PREFIX.sub('', cleaned)
-
-    # Remove standard corporate suffixes for matching
-    cleaned = _RE_SUFFIXES.sub('', cleaned)
-    cleaned = _RE_THE.sub('', cleaned)
-
-    # Remove noise words
-    cleaned = cleaned.replace("zzz", "")
-    cleaned = cleaned.replace("xxxx", "")
-    cleaned = cleaned.replace("xxx", "")
-    cleaned = cleaned.replace("www", "")
-    cleaned = cleaned.replace("inactive", "")
-    cleaned = cleaned.replace("do not use", "")
-    cleaned = cleaned.replace("blocked vendor", "")
-    cleaned = cleaned.replace("dnu", "")
+    # --- Step 3: General Cleaning (ordered rewrite stage, see _REWRITES) ---
+    for step in _REWRITE_STEPS:
+        cleaned = step(cleaned)
 
     # Remove punctuation
     cleaned = _RE_NONALNUM.sub('', cleaned).strip()
@@ -847,25 +902,13 @@ def is_safe_subset(shorter, longer):
     # Both sets of extra tokens must be ignorable (or empty)
     return extra_in_longer.issubset(IGNORABLE_TOKENS) and extra_in_shorter.issubset(IGNORABLE_TOKENS)
 
-def group_suppliers(supplier_list, threshold=92):
+def _build_blocks(unique_names):
     """
-    Advanced Grouping with Safe Subset Logic and multi-key blocking.
+    Assign each name to multiple block keys.
+    Use both the first 3 chars WITH spaces and WITHOUT spaces.
+    This catches "bio rad" (key "bio") grouping with "biorad" (key "bio").
+    Also add a no-space full prefix key for very short names (<=4 chars).
     """
-    start_time = time.time()
-    print("   -> Step 1/4: Normalizing all supplier names...")
-
-    clean_map = {name: normalize_name(name)[1] for name in supplier_list}
-    unique_names = list(set(clean_map.values()))
-
-    # Sort by Length (Shortest First) — shorter names become parents
-    unique_names.sort(key=len)
-    print(f"   -> Found {len(unique_names)} unique cleaned groups to start.")
-
-    # --- Blocking: assign each name to multiple block keys ---
-    # Use both the first 3 chars WITH spaces and WITHOUT spaces.
-    # This catches "bio rad" (key "bio") grouping with "biorad" (key "bio").
-    # Also add a no-space full prefix key for very short names (<=4 chars).
-    print("   -> Step 2/4: Building blocks...")
     blocks = defaultdict(set)
     name_to_keys = defaultdict(set)
     for name in unique_names:
@@ -880,15 +923,169 @@ def group_suppliers(supplier_list, threshold=92):
         for k in keys:
             blocks[k].add(name)
             name_to_keys[name].add(k)
+    return blocks, name_to_keys
+
+
+def _is_vip_veto(name, candidate):
+    """VIP Check: don't merge distinct canonical names unless near-exact."""
+    return candidate in _LOCKED_NAMES and fuzz.ratio(name, candidate) < 98
+
+
+def _is_match(name, candidate, threshold):
+    """Pairwise match rule shared by both grouping engines."""
+    if _is_vip_veto(name, candidate):
+        return False
+    # Check 1: No-Space Match ("bio rad" == "biorad")
+    if name.replace(" ", "") == candidate.replace(" ", ""):
+        return True
+    # Check 2: Safe Subset Logic
+    # Only merge if extra tokens in EITHER direction are all ignorable
+    if is_safe_subset(name, candidate) and fuzz.token_set_ratio(name, candidate) == 100:
+        return True
+    # Check 3: Standard Fuzzy Match
+    return fuzz.token_sort_ratio(name, candidate) >= threshold
+
+
+# Rows of a block scored per cdist call; bounds each score matrix to
+# CDIST_TILE_ROWS x block_size bytes.
+CDIST_TILE_ROWS = 2048
+
+
+def _sorted_tokens(name):
+    """token_sort_ratio(a, b) is ratio() of these forms of a and b."""
+    return " ".join(sorted(name.split()))
+
+
+def _core_tokens(name):
+    """is_safe_subset(a, b) holds exactly when these sets are equal."""
+    return frozenset(set(name.split()) - IGNORABLE_TOKENS)
+
+
+def _block_matches(block, threshold, matches, sorted_form, core_key, workers=-1):
+    """
+    Find every ordered pair in one block that passes _is_match (apart from
+    Check 1, handled in group_suppliers) and record it in `matches`
+    (name -> set of candidates).
+
+    Check 3 is scored in bulk: process.cdist runs fuzz.ratio over the
+    pre-sorted token forms (== token_sort_ratio) for a tile of rows against
+    the whole block, multi-threaded, with score_cutoff=threshold so failing
+    cells come back as 0.  Check 2 needs is_safe_subset, i.e. equal
+    non-ignorable token sets, so only pairs sharing a core_key bucket are
+    tested with token_set_ratio.
+    """
+    names = sorted(block)
+    n = len(names)
+    if n < 2:
+        return
+    forms = [sorted_form[name] for name in names]
+    for start in range(0, n, CDIST_TILE_ROWS):
+        rows = names[start:start + CDIST_TILE_ROWS]
+        scores = process.cdist(forms[start:start + CDIST_TILE_ROWS], forms,
+                               scorer=fuzz.ratio, score_cutoff=threshold,
+                               dtype=np.uint8, workers=workers)
+        # A row never matches itself.
+        diag = np.arange(len(rows))
+        scores[diag, start + diag] = 0
+        for i, j in zip(*np.nonzero(scores)):
+            name, candidate = rows[i], names[j]
+            if not _is_vip_veto(name, candidate):
+                matches[name].add(candidate)
+
+    buckets = defaultdict(list)
+    for name in names:
+        buckets[core_key[name]].append(name)
+    for bucket in buckets.values():
+        for name in bucket:
+            for candidate in bucket:
+                if (candidate != name
+                        and fuzz.token_set_ratio(name, candidate) == 100
+                        and not _is_vip_veto(name, candidate)):
+                    matches[name].add(candidate)
+
+
+def group_suppliers(supplier_list, threshold=92, workers=-1):
+    """
+    Advanced Grouping with Safe Subset Logic and multi-key blocking.
+
+    Pair scores are computed up front per block with rapidfuzz cdist (see
+    _block_matches); the shortest-first parent assignment is then replayed
+    on the precomputed matches, so the mapping is the same as
+    group_suppliers_pairwise's.
+    """
+    start_time = time.time()
+    print("   -> Step 1/4: Normalizing all supplier names...")
+
+    clean_map = {name: normalize_name(name)[1] for name in supplier_list}
+    unique_names = list(set(clean_map.values()))
+
+    # Sort by Length (Shortest First) — shorter names become parents
+    unique_names.sort(key=len)
+    print(f"   -> Found {len(unique_names)} unique cleaned groups to start.")
+
+    print("   -> Step 2/4: Building blocks...")
+    blocks, _ = _build_blocks(unique_names)
+
+    print(f"   -> Step 3/4: Scoring {len(blocks)} blocks with cdist...")
+    named = [name for name in unique_names if name]
+    sorted_form = dict(zip(named, map(_sorted_tokens, named)))
+    core_key = dict(zip(named, map(_core_tokens, named)))
+    matches = defaultdict(set)
+    n_blocks = len(blocks)
+    last_pct = -1
+    for b, block in enumerate(sorted(blocks.values(), key=len, reverse=True)):
+        _block_matches(block, threshold, matches, sorted_form, core_key,
+                       workers=workers)
+        pct = ((b + 1) * 100) // n_blocks
+        if pct >= last_pct + 10:
+            last_pct = pct
+            print(f"      {pct}% of blocks scored...")
+
+    # Check 1 (no-space match): names sharing a no-space form always share
+    # their no-space prefix block, so group them directly.
+    by_nospace = defaultdict(list)
+    for name in unique_names:
+        if name:
+            by_nospace[name.replace(" ", "")].append(name)
+    for group in by_nospace.values():
+        for name in group:
+            for candidate in group:
+                if candidate != name and not _is_vip_veto(name, candidate):
+                    matches[name].add(candidate)
+
+    # Replay the shortest-first assignment on the precomputed matches.
+    parent_map = {}
+    for name in unique_names:
+        if not name or name in parent_map:
+            continue
+        parent_map[name] = name
+        for candidate in matches.get(name, ()):
+            if candidate not in parent_map:
+                parent_map[candidate] = name
+
+    print("   -> Step 4/4: Assembling the final mapping...")
+    final_result = {original: parent_map.get(cleaned, cleaned) for original, cleaned in clean_map.items()}
+    elapsed = time.time() - start_time
+    unique_groups = len(set(parent_map.values()))
+    print(f"   -> Grouping completed in {elapsed:.2f}s: {len(unique_names)} names -> {unique_groups} groups")
+    return final_result
+
+
+def group_suppliers_pairwise(supplier_list, threshold=92):
+    """
+    Reference engine: scores one (name, candidate) pair at a time while
+    walking names shortest-first.  Quadratic in large blocks; kept to
+    validate group_suppliers (see benchmark_grouping.py).
+    """
+    start_time = time.time()
+    clean_map = {name: normalize_name(name)[1] for name in supplier_list}
+    unique_names = list(set(clean_map.values()))
+    unique_names.sort(key=len)
+    blocks, name_to_keys = _build_blocks(unique_names)
 
     # Deduplicate: each name may appear in multiple blocks,
     # so we track globally which names are already assigned a parent.
-    print(f"   -> Step 3/4: Matching with Advanced Logic ({len(blocks)} blocks)...")
     parent_map = {}
-    total_names = len(unique_names)
-    processed = 0
-    last_pct = -1
-
     # Process names shortest-first globally (not per-block) for deterministic parent assignment
     for name in unique_names:
         if not name or name in parent_map:
@@ -896,50 +1093,21 @@ def group_suppliers(supplier_list, threshold=92):
 
         # This name becomes a parent (it's the shortest unmatched in its group)
         parent_map[name] = name
-        processed += 1
-
-        # Progress reporting every 10%
-        pct = (processed * 100) // total_names
-        if pct >= last_pct + 10:
-            last_pct = pct
-            print(f"      {pct}% done ({processed}/{total_names} names assigned)...")
 
         # Gather all candidates from this name's blocks that aren't yet assigned
         candidates = set()
         for k in name_to_keys[name]:
             candidates.update(blocks[k])
         candidates.discard(name)
-        # Remove already-assigned names
         candidates = {c for c in candidates if c not in parent_map}
 
         for candidate in candidates:
-            is_match = False
-
-            # VIP Check: don't merge distinct canonical names unless near-exact
-            if candidate in _LOCKED_NAMES and fuzz.ratio(name, candidate) < 98:
-                is_match = False
-            else:
-                # Check 1: No-Space Match ("bio rad" == "biorad")
-                if name.replace(" ", "") == candidate.replace(" ", ""):
-                    is_match = True
-
-                # Check 2: Safe Subset Logic
-                # Only merge if extra tokens in EITHER direction are all ignorable
-                elif is_safe_subset(name, candidate) and fuzz.token_set_ratio(name, candidate) == 100:
-                    is_match = True
-
-                # Check 3: Standard Fuzzy Match
-                elif fuzz.token_sort_ratio(name, candidate) >= threshold:
-                    is_match = True
-
-            if is_match:
+            if _is_match(name, candidate, threshold):
                 parent_map[candidate] = name
 
-    print("   -> Step 4/4: Assembling the final mapping...")
     final_result = {original: parent_map.get(cleaned, cleaned) for original, cleaned in clean_map.items()}
     elapsed = time.time() - start_time
-    unique_groups = len(set(parent_map.values()))
-    print(f"   -> Grouping completed in {elapsed:.2f}s: {total_names} names -> {unique_groups} groups")
+    print(f"   -> Pairwise grouping completed in {elapsed:.2f}s")
     return final_result
 
 def main():
@@ -1,19 +1,21 @@
+import glob
+import hashlib
+import json
 import os
-import re
 import random
 import numpy as np
-import pandas as pd
 import polars as pl
 import nltk
 from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
+
+from stemming import StemCache, stem_texts
 
 # --- SETUP ---
 nltk.download("stopwords", quiet=True)
 SEED = 42
 random.seed(SEED)
 np.random.seed(SEED)
-stemmer = PorterStemmer()
+N_JOBS = int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count() or 1))
 
 # --- CONFIGURATION ---
 REGEX_CLEAN = r"[^a-z0-9\s]" 
@@ -129,114 +131,164 @@ all_custom_stopwords = (
 custom_stopwords_set = set(stopwords.words("english")).union(set(all_custom_stopwords))
 custom_stopwords_list = list(custom_stopwords_set)
 
-# --- LOAD DATA ---
-print("Loading Master ID List...")
-pd_samp = pd.read_stata("../external/appended/openalex_all_jrnls_merged.dta")
+# --- PAPER-LEVEL TOKEN CACHE ---
+# Every paper's cleaned + stemmed text is computed once and kept under
+# PAPER_TOKENS_DIR/<key>/part-*.parquet (id, processed_text); key = hash of
+# everything that changes the tokens (stopwords, cleaning regex, NLTK
+# version, CACHE_VERSION). A rerun only cleans and stems papers whose id is
+# not cached yet -- new papers -- and new authors are just new edges. The
+# author corpus is then a concatenation of cached paper texts. Papers are
+# keyed by id only: if an existing paper's abstract/title/MeSH is revised
+# upstream, delete the key directory (or bump CACHE_VERSION) to rebuild.
+#
+# Inputs are the parquet shards and author-paper edges written by
+# bert/0_build_paper_text.py (run it first), not the 58GB appended .dta.
+# Stemming is per token, so stemming each paper and joining the results is
+# the same token multiset per author as stemming the author's concatenated
+# text; only the (arbitrary) paper order inside an author's text differs.
+BERT_DIR = "../output/bert"
+EDGES = f"{BERT_DIR}/author_paper_edges.parquet"
+WORKS_PARQUET = f"{BERT_DIR}/_tmp/works__*.parquet"
+MESH_PARQUET = f"{BERT_DIR}/_tmp/mesh__*.parquet"
+ABSTRACTS_CSV = "../output/combined_abstracts.csv"
+OUT_PARQUET = "../output/cleaned_static_author_text_pre.parquet"
+PAPER_TOKENS_DIR = "../output/paper_tokens"
+CACHE_VERSION = 1
+PAPER_BATCH = 1_000_000     # papers stemmed + written per cache part
 
-df_base = pl.from_pandas(pd_samp).lazy()
 
-q_master_list = (
-    df_base
-    .select(["id", "athr_id", "pub_date"])
-    .with_columns(
-        pl.col("pub_date")
-        .str.slice(0, 4)                 # Take "1991" from "1991-09-23"
-        .cast(pl.Int32, strict=False)    # Convert to Number
-        .alias("publication_year")       # Rename to your target column
-    )
-    .filter(pl.col("publication_year") <= CUTOFF_YEAR)
-    .select(["id", "athr_id"])           # Keep only what we need for the join
-    .unique()
-)
+def _cache_key():
+    payload = json.dumps({
+        "stopwords": sorted(custom_stopwords_set),
+        "regex_clean": REGEX_CLEAN,
+        "regex_spaces": REGEX_SPACES,
+        "nltk": nltk.__version__,
+        "version": CACHE_VERSION,
+    }, sort_keys=True).encode()
+    return hashlib.blake2b(payload, digest_size=10).hexdigest()
 
-print("Configuring Abstracts...")
-q_abstracts = (
-    pl.scan_csv("../output/combined_abstracts.csv")
-    .with_columns(
-        pl.col("id").str.replace("https://openalex.org/", ""),
-        pl.col("abstract").str.to_lowercase()
-        .str.replace_all(REGEX_CLEAN, " ")
-        .str.replace_all(REGEX_SPACES, " ")
-        .str.strip_chars()
-        .alias("cleaned_abstract")
-    )
-    .select(["id", "cleaned_abstract"]) 
-)
 
-print("Configuring Titles...")
-q_titles = (
-    df_base
-    .select(["id", "title"])
-    .unique()
-    .with_columns(
-        pl.col("title").str.to_lowercase()
-        .str.replace_all(REGEX_CLEAN, " ")
-        .str.replace_all(REGEX_SPACES, " ")
-        .str.strip_chars()
-        .alias("cleaned_title")
+def _clean(col):
+    return (col.str.to_lowercase()
+            .str.replace_all(REGEX_CLEAN, " ")
+            .str.replace_all(REGEX_SPACES, " ")
+            .str.strip_chars())
+
+
+def paper_text_rows(ids):
+    """Cleaned, unstemmed text rows for the paper ids in `ids` (LazyFrame
+    with an `id` column): one row per abstract x title match, as the author
+    join has always produced them."""
+    q_abstracts = (
+        pl.scan_csv(ABSTRACTS_CSV)
+        .with_columns(pl.col("id").str.replace("https://openalex.org/", ""))
+        .join(ids, on="id", how="semi")
+        .select("id", _clean(pl.col("abstract")).alias("cleaned_abstract"))
+    )
+    q_titles = (
+        pl.scan_parquet(WORKS_PARQUET)
+        .select(["id", "title"])
+        .join(ids, on="id", how="semi")
+        .unique()
+        .select("id", _clean(pl.col("title")).alias("cleaned_title"))
+    )
+    q_mesh_agg = (
+        pl.scan_parquet(MESH_PARQUET)
+        .join(ids, on="id", how="semi")
+        .with_columns([
+            pl.col("qualifier_name").str.to_lowercase().str.replace_all(REGEX_CLEAN, "_").fill_null(""),
+            pl.col("gen_mesh").str.to_lowercase().str.replace_all(REGEX_CLEAN, "_").fill_null("")
+        ])
+        .group_by("id")
+        .agg([
+            pl.col("qualifier_name").str.join(" ").alias("paper_qualifiers"),
+            pl.col("gen_mesh").str.join(" ").alias("paper_mesh")
+        ])
+    )
+    return (
+        ids
+        .join(q_abstracts, on="id", how="left")
+        .join(q_titles, on="id", how="left")
+        .join(q_mesh_agg, on="id", how="left")
+        .select(
+            "id",
+            (
+                pl.col("cleaned_abstract").fill_null("") + " " +
+                pl.col("cleaned_title").fill_null("") + " " +
+                pl.col("paper_qualifiers").fill_null("") + " " +
+                pl.col("paper_mesh").fill_null("")
+            ).alias("paper_text"),
+        )
     )
-    .select(["id", "cleaned_title"])
-)
 
-print("Configuring MeSH Sets...")
-pd_mesh = pd.read_stata("../external/appended/contracted_gen_mesh_all_jrnls.dta")
-q_mesh_raw = pl.from_pandas(pd_mesh).lazy()
-
-q_mesh_agg = (
-    q_mesh_raw
-    .with_columns([
-        pl.col("qualifier_name").str.to_lowercase().str.replace_all(REGEX_CLEAN, "_").fill_null(""),
-        pl.col("gen_mesh").str.to_lowercase().str.replace_all(REGEX_CLEAN, "_").fill_null("")
-    ])
-    .group_by("id")
-    .agg([
-        pl.col("qualifier_name").str.concat(" ").alias("paper_qualifiers"),
-        pl.col("gen_mesh").str.concat(" ").alias("paper_mesh")
-    ])
-)
 
-print("Merging all text data onto Master List...")
+def update_paper_tokens(q_edges, cache_dir):
+    """Clean + stem the papers in q_edges that cache_dir does not hold yet;
+    each batch becomes one new part file."""
+    os.makedirs(cache_dir, exist_ok=True)
+    parts = sorted(glob.glob(f"{cache_dir}/part-*.parquet"))
+    q_ids = q_edges.select("id").unique()
+    if parts:
+        q_ids = q_ids.join(pl.scan_parquet(parts).select("id"), on="id", how="anti")
+    new_ids = q_ids.collect(engine="streaming")
+    n_cached = (pl.scan_parquet(parts).select(pl.len()).collect().item()
+                if parts else 0)
+    print(f"  cached papers: {n_cached:,} in {len(parts)} parts   "
+          f"new papers: {len(new_ids):,}")
+    if not len(new_ids):
+        return
+
+    stem_cache = StemCache()
+    for b, start in enumerate(range(0, len(new_ids), PAPER_BATCH)):
+        batch = new_ids.slice(start, PAPER_BATCH).lazy()
+        rows = paper_text_rows(batch).collect(engine="streaming")
+        rows = rows.with_columns(stem_texts(
+            rows["paper_text"], custom_stopwords_set,
+            cache=stem_cache, n_workers=N_JOBS, verbose=False,
+        ))
+        papers = (
+            rows.lazy()
+            .group_by("id")
+            .agg(pl.col("processed_text").filter(pl.col("processed_text") != "")
+                 .str.join(" "))
+            .collect()
+        )
+        part = f"{cache_dir}/part-{len(parts) + b:05d}.parquet"
+        papers.write_parquet(f"{part}.tmp")
+        os.replace(f"{part}.tmp", part)
+        print(f"    batch {b}: {len(papers):,} papers ({len(rows):,} text rows) -> {part}")
+    stem_cache.report()
+    stem_cache.save()
+
+
+for p in (EDGES, ABSTRACTS_CSV, WORKS_PARQUET, MESH_PARQUET):
+    if not glob.glob(p):
+        raise SystemExit(f"missing: {p}  (run bert/0_build_paper_text.py first)")
 
-q_full_data = (
-    q_master_list
-    .join(q_abstracts, on="id", how="left")  
-    .join(q_titles, on="id", how="left")     
-    .join(q_mesh_agg, on="id", how="left")   
+print("Loading author-paper edges...")
+q_edges = (
+    pl.scan_parquet(EDGES)
+    .filter(pl.col("publication_year") <= CUTOFF_YEAR)
+    .select(["id", "athr_id"])
+    .unique()
 )
 
-print("Aggregating TOTAL career text by Author (Static Measure)...")
+cache_dir = os.path.join(PAPER_TOKENS_DIR, _cache_key())
+print(f"Updating paper token cache ({cache_dir}, {N_JOBS} workers)...")
+update_paper_tokens(q_edges, cache_dir)
 
-q_static_corpus = (
-    q_full_data
+print("Assembling TOTAL career text by Author (Static Measure)...")
+df_lifetime = (
+    q_edges
+    .join(pl.scan_parquet(f"{cache_dir}/part-*.parquet"), on="id", how="inner")
+    .filter(pl.col("processed_text") != "")
     .group_by("athr_id")
-    .agg([
-        (
-            pl.col("cleaned_abstract").fill_null("") + " " +
-            pl.col("cleaned_title").fill_null("") + " " +
-            pl.col("paper_qualifiers").fill_null("") + " " +
-            pl.col("paper_mesh").fill_null("")
-        ).str.concat(" ").alias("full_text_lifetime")
-    ])
+    .agg(pl.col("processed_text").str.join(" "))
+    .collect(engine="streaming")
 )
-
-df_lifetime = q_static_corpus.collect(streaming=True)
 print(f"Total Unique Authors to Cluster: {len(df_lifetime)}")
 
-pdf = df_lifetime.to_pandas()
-
-print("Applying Stemming (Single Core)...")
-def clean_and_stem(text):
-    if not text or len(text) < 5: return ""
-    tokens = text.split()
-    tokens = [
-        stemmer.stem(t) for t in tokens 
-        if len(t) > 2 and not t.isdigit() and t not in custom_stopwords_set
-    ]
-    return " ".join(tokens)
-
-pdf['processed_text'] = pdf['full_text_lifetime'].apply(clean_and_stem)
-
-pdf = pdf[pdf['processed_text'].str.len() > 50] 
+df_lifetime = df_lifetime.filter(pl.col("processed_text").str.len_chars() > 50)
 
 print("Saving pre-clustered text data (Parquet)...")
-pdf[['athr_id', 'processed_text']].to_parquet("../output/cleaned_static_author_text_pre.parquet", index=False)
\ No newline at end of file
+df_lifetime.select(["athr_id", "processed_text"]).write_parquet(OUT_PARQUET)
@@ -1,36 +1,60 @@
 """
 SPECTER embeddings, one per paper.
 
-Streams the parquet so memory stays bounded. Each paper's text is truncated
+Streams the parquet by row group so memory stays bounded, and writes
+fixed-size shards (embeddings + ids) with a progress manifest as it goes: a
+killed job rerun with the same arguments resumes from the last completed
+shard (--restart starts over). Each paper's text is truncated
 inside the SentenceTransformer tokenizer (max_seq_length); papers in OpenAlex
 are title + abstract + a few MeSH terms, so one forward pass per paper is fine.
 
 Output:
   ../../output/bert/paper_embeddings.npy    (float16, shape [N, D])
   ../../output/bert/papers_aligned.parquet  (id column in the same order)
+
+With --store-format int8 (or float16) the embeddings go to
+../../output/bert/paper_embeddings.store/ instead: a sharded embedding store
+written while encoding (no (N, D) array in RAM), int8 = a quarter of the
+float16 .npy on disk. 2_cluster_papers.py and 4_describe_clusters.py read
+either form.
 """
 import argparse
 import os
+import sys
 import time
 import numpy as np
 import polars as pl
+import pyarrow.parquet as pq
 import torch
 from sentence_transformers import SentenceTransformer
 
+# Shared sharded / int8 embedding store (lives with the foia_similarity_wts BERT code).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "..", "..", "foia_similarity_wts", "code", "bert"))
+from embedding_store import (STORE_FORMATS, STORE_SUFFIX, EmbeddingStore,  # noqa: E402
+                             EmbeddingStoreWriter, iter_parquet_batches, stitch_npy)
+
 MODEL_NAME = "allenai-specter"  # matches existing pipelines in foia_similarity_wts / us_cluster_fields
 INPUT_PARQUET = "../../output/bert/papers_text.parquet"
 OUT_DIR = "../../output/bert"
 OUT_EMB = f"{OUT_DIR}/paper_embeddings.npy"
+OUT_STORE = f"{OUT_DIR}/paper_embeddings{STORE_SUFFIX}"
 OUT_IDS = f"{OUT_DIR}/papers_aligned.parquet"
 
-ROW_BATCH = 16384          # papers per parquet slice
-ENCODE_BATCH = 256         # papers per GPU forward pass
+ROW_BATCH = 16384           # papers per parquet batch
+SHARD_ROWS = 8 * ROW_BATCH  # papers per resumable shard
+ENCODE_BATCH = 256          # papers per GPU forward pass
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--limit", type=int, default=None, help="Smoke-test cap.")
     parser.add_argument("--model", type=str, default=MODEL_NAME)
+    parser.add_argument("--store-format", default="npy", choices=("npy",) + STORE_FORMATS,
+                        help="'npy' = float16 paper_embeddings.npy (default); "
+                             "int8/float16/float32 = sharded paper_embeddings.store/.")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore shards left by an interrupted run.")
     args = parser.parse_args()
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -45,25 +69,28 @@ def main():
     dim = model.get_sentence_embedding_dimension()
     print(f"Embedding dim: {dim}")
 
-    lf = pl.scan_parquet(INPUT_PARQUET).select(["id", "paper_text"])
-    n_total = lf.select(pl.len()).collect().item()
+    n_total = pq.ParquetFile(INPUT_PARQUET).metadata.num_rows
     if args.limit:
         n_total = min(n_total, args.limit)
     print(f"Papers to embed: {n_total:,}")
 
     os.makedirs(OUT_DIR, exist_ok=True)
-    # Pre-allocate as float16 to halve disk and RAM.
-    embeddings = np.zeros((n_total, dim), dtype=np.float16)
-    paper_ids: list[str] = []
+    if args.store_format == "npy":
+        # float16 shards, stitched into OUT_EMB at the end.
+        store_path, fmt = f"{OUT_EMB}.shards", "float16"
+    else:
+        store_path, fmt = OUT_STORE, args.store_format
+    writer = EmbeddingStoreWriter(store_path, dim, fmt, shard_rows=SHARD_ROWS,
+                                  meta={"model": args.model, "n_total": n_total},
+                                  resume=not args.restart)
 
     t0 = time.time()
-    written = 0
-    offset = 0
-    while offset < n_total:
-        take = min(ROW_BATCH, n_total - offset)
-        batch_df = lf.slice(offset, take).collect(streaming=True)
-        ids = batch_df["id"].to_list()
-        texts = batch_df["paper_text"].fill_null("").to_list()
+    resumed = writer.n
+    written = writer.n
+    for batch in iter_parquet_batches(INPUT_PARQUET, ["id", "paper_text"], ROW_BATCH,
+                                      start=written, stop=n_total):
+        ids = batch.column("id").to_pylist()
+        texts = [t or "" for t in batch.column("paper_text").to_pylist()]
 
         embs = model.encode(
             texts,
@@ -71,22 +98,24 @@ def main():
             convert_to_numpy=True,
             normalize_embeddings=True,
             show_progress_bar=False,
-        ).astype(np.float16)
+        )
 
-        embeddings[written:written + take] = embs
-        paper_ids.extend(ids)
-        written += take
-        offset += take
+        writer.append(embs, ids=ids)
+        written += len(ids)
 
         elapsed = time.time() - t0
-        rate = written / elapsed if elapsed else 0
+        rate = (written - resumed) / elapsed if elapsed else 0
         eta = (n_total - written) / rate if rate else float("inf")
         print(f"  {written:,}/{n_total:,} ({rate:.0f}/s, ETA {eta/3600:.2f}h)", flush=True)
 
     print("Saving embeddings...")
-    np.save(OUT_EMB, embeddings)
-    pl.DataFrame({"id": paper_ids}).write_parquet(OUT_IDS)
-    print(f"Done. {OUT_EMB}  shape={embeddings.shape}  dtype={embeddings.dtype}")
+    writer.close()
+    if args.store_format == "npy":
+        out = stitch_npy(store_path, OUT_EMB, OUT_IDS, id_col="id", dtype=np.float16)
+    else:
+        out = OUT_STORE
+        pl.DataFrame({"id": EmbeddingStore(OUT_STORE).ids()}).write_parquet(OUT_IDS)
+    print(f"Done. {out}  shape=({written:,}, {dim})  format={fmt}")
 
 
 if __name__ == "__main__":
@@ -1,60 +1,100 @@
 """
-MiniBatchKMeans on L2-normalized SPECTER embeddings = spherical k-means.
+Spherical k-means on L2-normalized SPECTER embeddings.
+
+Reads paper_embeddings.npy, or paper_embeddings.store/ (1_embed_papers.py
+--store-format) when there is no .npy. Out of core: the embeddings stay
+memory-mapped and ../spherical_kmeans.py reads them in mini-batches and
+blocks (rows are normalized on read), so memory does not grow with the
+number of papers.
+
+--clusters-grid 30,50,100,200 runs every K in one job (parallel forked
+workers over the shared memory map), writes the usual per-K files, and
+../../output/bert/cluster_grid_summary.csv (inertia, size distribution,
+largest-cluster share per K).
 
 Output:
   ../../output/bert/paper_clusters_K{K}.parquet  (id, cluster_label)
   ../../output/bert/cluster_centroids_K{K}.npy   (float32, [K, D], L2-normalized)
 """
 import argparse
+import os
+import sys
 import numpy as np
 import polars as pl
-from sklearn.cluster import MiniBatchKMeans
 
-EMB_PATH = "../../output/bert/paper_embeddings.npy"
+# Shared sharded / int8 embedding store (lives with the foia_similarity_wts BERT code).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "..", "..", "foia_similarity_wts", "code", "bert"))
+from embedding_store import open_embeddings, resolve_embeddings  # noqa: E402
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from spherical_kmeans import grid_summary, spherical_kmeans_grid  # noqa: E402
+
+N_JOBS = int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count() or 1))
+EMB_STEM = "../../output/bert/paper_embeddings"
 IDS_PATH = "../../output/bert/papers_aligned.parquet"
 OUT_DIR = "../../output/bert"
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--clusters", type=int, required=True)
+group = parser.add_mutually_exclusive_group(required=True)
+group.add_argument("--clusters", type=int)
+group.add_argument("--clusters-grid", default="",
+                   help="Comma-separated K list, e.g. 30,50,100,200: K-means per "
+                        "K in parallel workers, plus cluster_grid_summary.csv.")
 parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--jobs", type=int, default=N_JOBS,
+                    help="Parallel K-means workers for --clusters-grid "
+                         "(BLAS threads are split between them).")
+parser.add_argument("--emb", default=None,
+                    help="Embeddings (.npy or .store dir). Default: "
+                         "paper_embeddings.npy, else paper_embeddings.store.")
 args = parser.parse_args()
 
-K = args.clusters
-print(f"--- PAPER-LEVEL CLUSTER: K={K} ---")
+K_LIST = ([int(k) for k in args.clusters_grid.split(",") if k.strip()]
+          if args.clusters_grid else [args.clusters])
+print(f"--- PAPER-LEVEL CLUSTER: K={','.join(map(str, K_LIST))} ---")
 
-print("Loading embeddings...")
-X = np.load(EMB_PATH).astype(np.float32)  # promote fp16 -> fp32 for sklearn
+emb_path = args.emb or resolve_embeddings(EMB_STEM) or f"{EMB_STEM}.npy"
+print(f"Loading embeddings ({emb_path})...")
+# Memory-mapped .npy (fp16/fp32) or EmbeddingStore; rows are read, promoted
+# to fp32 and re-normalized block by block inside spherical_kmeans.
+X = open_embeddings(emb_path)
 print(f"  shape: {X.shape}")
-# Embeddings are already normalized from encode(...), but re-normalize defensively.
-norms = np.linalg.norm(X, axis=1, keepdims=True)
-norms[norms == 0] = 1.0
-X /= norms
 
 ids = pl.read_parquet(IDS_PATH)
 assert len(ids) == X.shape[0], "embedding/id length mismatch"
 
-print(f"Clustering into {K}...")
-km = MiniBatchKMeans(
-    n_clusters=K,
-    random_state=args.seed,
+n_jobs = min(args.jobs, len(K_LIST))
+print(f"Clustering into K={','.join(map(str, K_LIST))} "
+      f"({n_jobs} worker{'s' if n_jobs > 1 else ''})...")
+results = spherical_kmeans_grid(
+    X,
+    K_LIST,
+    n_jobs=n_jobs,
+    seed=args.seed,
     batch_size=16384,
     n_init=10,
     max_iter=200,
     reassignment_ratio=0.005,
 )
-km.fit(X)
 
-print("Saving labels and centroids...")
-out_clusters = ids.with_columns(pl.Series("cluster_label", km.labels_.astype(np.int32)))
-out_clusters.write_parquet(f"{OUT_DIR}/paper_clusters_K{K}.parquet")
+for K, km in results.items():
+    print(f"K={K}: {km.n_steps:,} mini-batch steps   inertia (sum 1-cos): {km.inertia:,.1f}")
+    print("  Saving labels and centroids...")
+    out_clusters = ids.with_columns(pl.Series("cluster_label", km.labels))
+    out_clusters.write_parquet(f"{OUT_DIR}/paper_clusters_K{K}.parquet")
+
+    # Centroids are already L2-normalized for cosine lookups downstream.
+    np.save(f"{OUT_DIR}/cluster_centroids_K{K}.npy", km.centers)
 
-# Normalize centroids for cosine lookups downstream.
-C = km.cluster_centers_.astype(np.float32)
-C /= np.linalg.norm(C, axis=1, keepdims=True).clip(min=1e-12)
-np.save(f"{OUT_DIR}/cluster_centroids_K{K}.npy", C)
+    # Cluster size summary (empty clusters count as 0).
+    counts = km.sizes
+    print("  Cluster sizes (min/median/max):",
+          int(counts.min()), int(np.median(counts)), int(counts.max()))
 
-# Cluster size summary.
-unique, counts = np.unique(km.labels_, return_counts=True)
-print("Cluster sizes (min/median/max):",
-      int(counts.min()), int(np.median(counts)), int(counts.max()))
+if args.clusters_grid:
+    summary = pl.DataFrame(grid_summary(results))
+    summary.write_csv(f"{OUT_DIR}/cluster_grid_summary.csv")
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_width_chars=200):
+        print(summary)
+    print(f"Saved {OUT_DIR}/cluster_grid_summary.csv")
 print("Done.")
@@ -3,8 +3,9 @@ Aggregate paper-cluster labels into per-author field distributions.
 
 Output:
   ../../output/bert/author_field_dist_K{K}.parquet
-    columns: athr_id, n_papers, modal_cluster, modal_share, entropy,
-             top1_cluster, top1_share, top2_cluster, top2_share, top3_cluster, top3_share
+    columns: athr_id, n_papers, entropy, top1_cluster, top1_share,
+             top2_cluster, top2_share, top3_cluster, top3_share,
+             modal_cluster, modal_share          (all but athr_id Float64)
 
   ../../output/bert/author_field_shares_K{K}_long.parquet
     columns: athr_id, cluster_label, share        (only nonzero rows)
@@ -15,10 +16,30 @@ Output:
 import argparse
 import numpy as np
 import polars as pl
-import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 OUT_DIR = "../../output/bert"
+N_TOP = 3          # top-k clusters per author in the summary
+N_TERMS = 15       # top TF-IDF terms per cluster description
+
+# Column order / dtypes of author_field_dist (the pandas per-author Series it
+# used to be built from made every summary column Float64; kept as is).
+SUMMARY_COLS = (["n_papers", "entropy"]
+                + [f"top{i}_{c}" for i in range(1, N_TOP + 1) for c in ("cluster", "share")]
+                + ["modal_cluster", "modal_share"])
+
+
+def row_topk(M, k):
+    """Column indices of the k largest entries of every CSR row, descending
+    (ties: lower column first), from one lexsort over all nonzeros."""
+    M = M.tocsr()
+    row = np.repeat(np.arange(M.shape[0]), np.diff(M.indptr))
+    order = np.lexsort((M.indices, -M.data, row))
+    rank = np.arange(len(order)) - M.indptr[row[order]]
+    keep = order[rank < k]
+    bounds = np.searchsorted(row[keep], np.arange(M.shape[0] + 1))
+    return [M.indices[keep[bounds[i]:bounds[i + 1]]] for i in range(M.shape[0])]
+
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--clusters", type=int, required=True)
@@ -50,25 +71,36 @@ shares.select(["athr_id", "cluster_label", "share"]).write_parquet(
 )
 
 print("Computing per-author summary (modal, entropy, top-3)...")
-pdf = shares.to_pandas()
-
-def per_author(g):
-    s = g.sort_values("share", ascending=False)
-    H = -(s["share"] * np.log(s["share"].clip(lower=1e-12))).sum()
-    out = {"n_papers": int(g["n"].sum()), "entropy": float(H)}
-    for i in range(3):
-        if i < len(s):
-            out[f"top{i+1}_cluster"] = int(s.iloc[i]["cluster_label"])
-            out[f"top{i+1}_share"]   = float(s.iloc[i]["share"])
-        else:
-            out[f"top{i+1}_cluster"] = -1
-            out[f"top{i+1}_share"]   = 0.0
-    out["modal_cluster"] = out["top1_cluster"]
-    out["modal_share"]   = out["top1_share"]
-    return pd.Series(out)
-
-summary = pdf.groupby("athr_id").apply(per_author).reset_index()
-pl.from_pandas(summary).write_parquet(f"{OUT_DIR}/author_field_dist_K{K}.parquet")
+# Rank each author's clusters by share (ties: lower cluster_label first) with
+# a window over athr_id, then pick ranks 0..N_TOP-1 in one group_by.
+rank = pl.col("rank")
+summary = (
+    shares.lazy()
+    .sort(["athr_id", "share", "cluster_label"], descending=[False, True, False])
+    .with_columns(pl.int_range(pl.len()).over("athr_id").alias("rank"))
+    .group_by("athr_id")
+    .agg(
+        pl.col("n").sum().alias("n_papers"),
+        (-(pl.col("share") * pl.col("share").clip(lower_bound=1e-12).log()).sum())
+        .alias("entropy"),
+        *[expr
+          for i in range(N_TOP)
+          for expr in (
+              pl.col("cluster_label").filter(rank == i).first().alias(f"top{i + 1}_cluster"),
+              pl.col("share").filter(rank == i).first().alias(f"top{i + 1}_share"),
+          )],
+    )
+    .with_columns(
+        [pl.col(f"top{i + 1}_cluster").fill_null(-1) for i in range(N_TOP)]
+        + [pl.col(f"top{i + 1}_share").fill_null(0.0) for i in range(N_TOP)]
+    )
+    .with_columns(pl.col("top1_cluster").alias("modal_cluster"),
+                  pl.col("top1_share").alias("modal_share"))
+    .select("athr_id", *[pl.col(c).cast(pl.Float64) for c in SUMMARY_COLS])
+    .sort("athr_id")
+    .collect()
+)
+summary.write_parquet(f"{OUT_DIR}/author_field_dist_K{K}.parquet")
 print(f"  authors: {len(summary):,}")
 
 # --- Cluster descriptions ---
@@ -83,30 +115,27 @@ title_proxy = (
 pooled = (
     papers_text.join(clusters, on="id", how="inner")
     .group_by("cluster_label")
-    .agg(pl.col("paper_text").str.concat(" ").alias("blob"))
+    .agg(pl.col("paper_text").str.join(" ").alias("blob"))
     .sort("cluster_label")
-    .to_pandas()
 )
 vec = TfidfVectorizer(stop_words="english", min_df=2, max_df=0.6,
                       ngram_range=(1, 2), max_features=50000)
 M = vec.fit_transform(pooled["blob"])
 features = np.array(vec.get_feature_names_out())
 
+top_terms = row_topk(M, N_TERMS)
+
 # Example titles per cluster (first 5 papers, by id order).
-ex = (
-    title_proxy.group_by("cluster_label")
+ex = dict(
+    title_proxy.sort("id").group_by("cluster_label")
     .agg(pl.col("snippet").head(5).alias("examples"))
-    .sort("cluster_label")
-    .to_pandas()
+    .iter_rows()
 )
 
 with open(f"{OUT_DIR}/cluster_descriptions_K{K}.txt", "w") as f:
-    for i in range(len(pooled)):
-        row = M.getrow(i).toarray().ravel()
-        top = features[row.argsort()[-15:][::-1]]
-        examples = ex.iloc[i]["examples"] if i < len(ex) else []
-        f.write(f"Cluster {i}\n  terms: {', '.join(top)}\n")
-        for s in examples[:3]:
+    for label, top in zip(pooled["cluster_label"].to_list(), top_terms):
+        f.write(f"Cluster {label}\n  terms: {', '.join(features[top])}\n")
+        for s in ex.get(label, [])[:3]:
             f.write(f"    - {s}\n")
         f.write("\n")
 
@@ -7,7 +7,7 @@ Usage:
 Reads:
   ../../output/bert/paper_clusters_K{K}.parquet
   ../../output/bert/author_field_dist_K{K}.parquet
-  ../../output/bert/paper_embeddings.npy
+  ../../output/bert/paper_embeddings.npy   (or paper_embeddings.store/)
   ../../output/bert/cluster_centroids_K{K}.npy
   ../../output/bert/papers_aligned.parquet
 
@@ -16,9 +16,16 @@ Writes:
   ../../output/bert/cluster_descriptives_K{K}.png   (size + entropy + modal-share histograms)
 """
 import argparse
+import os
+import sys
 import numpy as np
 import polars as pl
 
+# Shared sharded / int8 embedding store (lives with the foia_similarity_wts BERT code).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "..", "..", "foia_similarity_wts", "code", "bert"))
+from embedding_store import open_embeddings, resolve_embeddings  # noqa: E402
+
 OUT_DIR = "../../output/bert"
 
 parser = argparse.ArgumentParser()
@@ -64,7 +71,8 @@ print(f"  share modal >= 0.8:         {(modal >= 0.8).mean():.3%}")
 
 # 3. Intra- vs inter-cluster cosine on a sample ------------------------------
 print(f"\n[Cosine separation]  sample = {args.sample:,}")
-embeddings = np.load(f"{OUT_DIR}/paper_embeddings.npy", mmap_mode="r")
+embeddings = open_embeddings(resolve_embeddings(f"{OUT_DIR}/paper_embeddings")
+                             or f"{OUT_DIR}/paper_embeddings.npy")
 centroids = np.load(f"{OUT_DIR}/cluster_centroids_K{K}.npy")
 papers_aligned = pl.read_parquet(f"{OUT_DIR}/papers_aligned.parquet")
 N = embeddings.shape[0]
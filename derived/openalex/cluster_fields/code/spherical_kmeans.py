@@ -0,0 +1,280 @@
+"""
+Out-of-core spherical k-means for the field clusterings.
+
+us_cluster_fields/code/2_cluster.py (SVD-reduced author TF-IDF) and
+bert/2_cluster_papers.py (paper SPECTER embeddings) used to materialize the
+whole float32 matrix for sklearn's MiniBatchKMeans, and 2_cluster.py then
+recomputed TF-IDF-space centroids with one matrix[rows].mean() per
+cluster. Here rows are only ever read in blocks, straight from wherever
+they live -- a memory-mapped .npy, an EmbeddingStore, or a CSR matrix:
+
+  spherical_kmeans(X, n_clusters, seed, ...)
+      k-means++ seeding on a random init sample (n_init candidates, the
+      one with the lowest inertia on a shared validation sample wins), then
+      mini-batch steps on sorted random row batches: assign by max cosine,
+      fold the batch's per-cluster sums into each cluster's running mean
+      (count-weighted, as MiniBatchKMeans does); rows are assigned against
+      those means projected onto the unit sphere. Clusters whose count
+      falls below reassignment_ratio * the largest are re-seeded from batch
+      rows drawn in proportion to their distance. Stops after max_iter
+      epochs, or once the smoothed batch inertia has not improved for
+      max_no_improvement steps. A final block-wise pass fills a
+      preallocated int32 label array.
+
+  spherical_kmeans_grid(X, ks, n_jobs, ...)
+      One run per K in a fork pool: workers inherit X (memory-mapped pages
+      are shared, nothing is pickled) and split the BLAS threads. Every K
+      uses the same seed, so each result equals the single-K run.
+      grid_summary(results) tabulates inertia and the size distribution.
+
+  segment_means(M, labels, n_clusters)
+      Per-cluster mean rows of any matrix (e.g. the TF-IDF behind an SVD
+      projection) as one sparse (K, n) indicator product.
+
+  project_to_memmap(M, components, path)
+      Row blocks of M @ components.T, L2-normalized, written into a float32
+      .npy memory map, so an SVD projection never sits in RAM as a whole.
+
+Rows are L2-normalized on read, so Euclidean k-means on them is cosine
+k-means; inertia is sum(1 - max cos). Every random draw comes from one
+np.random.default_rng(seed), and block_rows only changes how rows are read,
+never which batches are drawn, so a fixed seed reproduces the labels. Peak
+memory is O(batch_size + init_size + block_rows) rows plus the (n,) labels.
+"""
+import multiprocessing
+import os
+from typing import NamedTuple
+
+import numpy as np
+import scipy.sparse
+from sklearn.preprocessing import normalize
+from threadpoolctl import threadpool_limits
+
+BLOCK_ROWS = 65_536
+BATCH_SIZE = 16_384
+
+
+class KMeansResult(NamedTuple):
+    labels: np.ndarray   # (n,) int32
+    centers: np.ndarray  # (K, D) float32, L2-normalized
+    inertia: float       # sum over rows of 1 - cos(row, its center)
+    sizes: np.ndarray    # (K,) int64 rows per cluster
+    n_steps: int         # mini-batch steps run
+
+
+def _read(X, key):
+    """Rows of X (slice or sorted index array) as L2-normalized float32:
+    ndarray, or CSR when X is sparse."""
+    B = X[key]
+    if scipy.sparse.issparse(B):
+        return normalize(B.tocsr().astype(np.float32), copy=False)
+    return normalize(np.array(B, dtype=np.float32), copy=False)
+
+
+def _dense(B):
+    return B.toarray() if scipy.sparse.issparse(B) else B
+
+
+def _segment_sum(B, labels, n_clusters):
+    """(K, D) per-cluster row sums of B as one sparse indicator product."""
+    ind = scipy.sparse.csr_matrix(
+        (np.ones(len(labels), dtype=np.float32), (labels, np.arange(len(labels)))),
+        shape=(n_clusters, B.shape[0]))
+    return np.asarray(_dense(ind @ B), dtype=np.float64)
+
+
+def _assign(B, C):
+    sim = np.asarray(B @ C.T)
+    lab = sim.argmax(axis=1)
+    return lab.astype(np.int32), sim[np.arange(len(lab)), lab]
+
+
+def _sample(X, n, size, rng):
+    return _read(X, np.sort(rng.choice(n, size=min(size, n), replace=False)))
+
+
+def _kmeanspp(S, n_clusters, rng):
+    """Greedy k-means++ on sample rows S with cosine distance."""
+    m = S.shape[0]
+    n_trials = 2 + int(np.log(n_clusters))
+    C = np.empty((n_clusters, S.shape[1]), dtype=np.float32)
+    C[0] = _dense(S[[int(rng.integers(m))]])
+    closest = np.maximum(1.0 - np.asarray(S @ C[0]).ravel(), 0.0).astype(np.float64)
+    pot = closest.sum()
+    for c in range(1, n_clusters):
+        if pot > 0:
+            cand = np.searchsorted(np.cumsum(closest), rng.random(n_trials) * pot)
+            cand = np.minimum(cand, m - 1)
+        else:
+            cand = rng.integers(m, size=n_trials)
+        rows = _dense(S[cand])
+        d = np.maximum(1.0 - np.asarray(S @ rows.T), 0.0).astype(np.float64)
+        np.minimum(d, closest[:, None], out=d)
+        pots = d.sum(axis=0)
+        best = int(pots.argmin())
+        C[c] = rows[best]
+        closest, pot = d[:, best], pots[best]
+    return C
+
+
+def spherical_kmeans(X, n_clusters, seed=42, batch_size=BATCH_SIZE, n_init=3,
+                     max_iter=100, reassignment_ratio=0.01, max_no_improvement=10,
+                     init_size=None, block_rows=BLOCK_ROWS, verbose=True):
+    """Mini-batch spherical k-means over the rows of X, read in blocks.
+
+    X: anything that slices rows and takes sorted index arrays -- ndarray /
+    np.memmap, EmbeddingStore, scipy sparse. max_iter is in epochs
+    (max_iter * n / batch_size steps at most)."""
+    n = X.shape[0]
+    if n < n_clusters:
+        raise ValueError(f"{n} rows < {n_clusters} clusters")
+    rng = np.random.default_rng(seed)
+    batch_size = min(batch_size, n)
+    init_size = max(min(init_size or 3 * batch_size, n), n_clusters)
+
+    # ---- seeding ----
+    V = _sample(X, n, init_size, rng)
+    best = None
+    for i in range(n_init):
+        C = _kmeanspp(_sample(X, n, init_size, rng), n_clusters, rng)
+        inertia = float((1.0 - _assign(V, C)[1]).sum())
+        if verbose:
+            print(f"    init {i + 1}/{n_init}: sample inertia={inertia:,.2f}")
+        if best is None or inertia < best[0]:
+            best = (inertia, C)
+    C = best[1]
+    del V
+
+    # ---- mini-batch steps ----
+    # mean: running mean of the rows assigned to each center (norm < 1);
+    # C, its projection onto the sphere, is what rows are assigned against.
+    mean = C.astype(np.float64)
+    counts = np.zeros(n_clusters, dtype=np.float64)
+    n_steps = max(1, int(np.ceil(max_iter * n / batch_size)))
+    alpha = min(1.0, 2.0 * batch_size / (n + 1))
+    ewa, ewa_best, no_improve = None, np.inf, 0
+    step = 0
+    for step in range(1, n_steps + 1):
+        B = _sample(X, n, batch_size, rng)
+        lab, sim = _assign(B, C)
+        nb = np.bincount(lab, minlength=n_clusters)
+        upd = nb > 0
+        mean[upd] = ((mean[upd] * counts[upd, None]
+                      + _segment_sum(B, lab, n_clusters)[upd])
+                     / (counts[upd] + nb[upd])[:, None])
+        counts += nb
+
+        small = counts < reassignment_ratio * counts.max()
+        dist = np.maximum(1.0 - sim.astype(np.float64), 0.0)
+        n_re = min(int(small.sum()), batch_size // 2, int(np.count_nonzero(dist)))
+        if n_re and step > 1:
+            pick = np.sort(rng.choice(len(lab), size=n_re, replace=False,
+                                      p=dist / dist.sum()))
+            re = np.flatnonzero(small)[:n_re]
+            mean[re] = _dense(B[pick])
+            counts[re] = counts[~small].min() if (~small).any() else 0.0
+        C = normalize(mean, copy=True).astype(np.float32)
+
+        batch_inertia = float((1.0 - sim).sum()) / len(lab)
+        ewa = batch_inertia if ewa is None else ewa * (1 - alpha) + batch_inertia * alpha
+        if verbose and (step % 100 == 0 or step == n_steps):
+            print(f"    step {step:,}/{n_steps:,}: batch inertia={batch_inertia:.5f}  "
+                  f"ewa={ewa:.5f}")
+        if ewa < ewa_best:
+            ewa_best, no_improve = ewa, 0
+        else:
+            no_improve += 1
+            if no_improve >= max_no_improvement:
+                if verbose:
+                    print(f"    converged at step {step:,}/{n_steps:,} "
+                          f"(no ewa improvement in {max_no_improvement} steps)")
+                break
+
+    # ---- final block-wise assignment ----
+    labels = np.empty(n, dtype=np.int32)
+    inertia = 0.0
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        labels[start:stop], sim = _assign(_read(X, slice(start, stop)), C)
+        inertia += float((1.0 - sim.astype(np.float64)).sum())
+    sizes = np.bincount(labels, minlength=n_clusters).astype(np.int64)
+    return KMeansResult(labels=labels, centers=C, inertia=inertia, sizes=sizes,
+                        n_steps=step)
+
+
+_FORK_STATE = {}
+
+
+def _grid_task(k):
+    """Worker: one K over the inherited X, with this worker's BLAS share."""
+    with threadpool_limits(limits=_FORK_STATE["threads"]):
+        return k, spherical_kmeans(_FORK_STATE["X"], k, verbose=False,
+                                   **_FORK_STATE["kwargs"])
+
+
+def spherical_kmeans_grid(X, ks, n_jobs=1, **kwargs):
+    """{K: KMeansResult} for every K in ks (kwargs as spherical_kmeans).
+    With n_jobs > 1 the workers run quietly and verbose only controls the
+    per-K summary line printed as each K finishes."""
+    verbose = kwargs.pop("verbose", True)
+    ks = sorted(set(int(k) for k in ks), reverse=True)  # biggest first
+    n_jobs = max(1, min(n_jobs, len(ks)))
+    if n_jobs == 1:
+        return {k: spherical_kmeans(X, k, verbose=verbose, **kwargs)
+                for k in sorted(ks)}
+    results = {}
+    n_cpus = (len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity")
+              else os.cpu_count() or 1)
+    _FORK_STATE.update(X=X, kwargs=kwargs, threads=max(1, n_cpus // n_jobs))
+    try:
+        with multiprocessing.get_context("fork").Pool(n_jobs) as pool:
+            for k, res in pool.imap_unordered(_grid_task, ks):
+                results[k] = res
+                if verbose:
+                    print(f"    K={k}: {res.n_steps:,} steps  inertia={res.inertia:,.1f}  "
+                          f"({len(results)}/{len(ks)} done)")
+    finally:
+        _FORK_STATE.clear()
+    return {k: results[k] for k in sorted(results)}
+
+
+def grid_summary(results):
+    """Columns (K, inertia, size distribution, largest-cluster share) per K."""
+    ks = sorted(results)
+    sizes = [results[k].sizes for k in ks]
+    n = np.array([s.sum() for s in sizes], dtype=np.float64)
+    return {
+        "K": np.array(ks, dtype=np.int32),
+        "inertia": np.array([results[k].inertia for k in ks]),
+        "mean_cos": 1.0 - np.array([results[k].inertia for k in ks]) / n,
+        "n_steps": np.array([results[k].n_steps for k in ks], dtype=np.int64),
+        "n_empty": np.array([int((s == 0).sum()) for s in sizes], dtype=np.int64),
+        "size_min": np.array([s.min() for s in sizes], dtype=np.int64),
+        "size_p10": np.array([np.quantile(s, 0.1) for s in sizes]),
+        "size_median": np.array([np.median(s) for s in sizes]),
+        "size_p90": np.array([np.quantile(s, 0.9) for s in sizes]),
+        "size_max": np.array([s.max() for s in sizes], dtype=np.int64),
+        "largest_share": np.array([s.max() for s in sizes]) / n,
+    }
+
+
+def segment_means(M, labels, n_clusters):
+    """(K, M.shape[1]) float32 mean row of M per cluster (0 for empty)."""
+    sums = _segment_sum(M, np.asarray(labels), n_clusters)
+    sizes = np.bincount(labels, minlength=n_clusters)
+    return (sums / np.maximum(sizes, 1)[:, None]).astype(np.float32)
+
+
+def project_to_memmap(M, components, path, block_rows=BLOCK_ROWS):
+    """Write L2-normalized M @ components.T to a float32 .npy block by block;
+    returns it reopened read-only as a memory map."""
+    CT = np.ascontiguousarray(np.asarray(components, dtype=np.float32).T)
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32,
+                                    shape=(M.shape[0], CT.shape[1]))
+    for start in range(0, M.shape[0], block_rows):
+        stop = min(start + block_rows, M.shape[0])
+        out[start:stop] = normalize(np.asarray(M[start:stop] @ CT, dtype=np.float32),
+                                    copy=False)
+    out.flush()
+    del out
+    return np.load(path, mmap_mode="r")
@@ -0,0 +1,152 @@
+"""
+Shared Porter-stemming stage for the TF-IDF text pipelines.
+
+0_combine_data.py (every author's lifetime text) and
+foia_similarity_wts/code/0c_get_coauthor_stemmed.py (coauthor text) both
+turn whitespace-tokenized lowercase text into
+
+    " ".join(stem(t) for t in text.split()
+             if len(t) > 2 and not t.isdigit() and t not in stopwords)
+
+("" when the text is empty or shorter than 5 characters). Done per token
+occurrence, that is one PorterStemmer.stem call per token of every career
+-- hundreds of millions of calls for a vocabulary of a few million distinct
+tokens. stem_texts() instead:
+
+  - splits each row group (CHUNK_ROWS texts) into token lists in Polars,
+  - decides keep/drop and stems only the chunk's tokens not seen before
+    (a multiprocessing pool when there are many; stems come from the
+    persistent cache when any earlier run already stemmed them),
+  - maps every token occurrence through that token -> output table with one
+    vectorized replace_strict + list.join over the chunk.
+
+The token -> stem table persists across runs and scripts:
+
+  <STEM_CACHE_DIR>/porter_nltk<version>.parquet    (token, stem)
+
+Stems do not depend on the stopword set, so both scripts share the file;
+the keep/drop filter is re-applied per call. Keyed by the NLTK version
+because Porter rules have changed between releases. Delete the file to
+rebuild. Output is identical to the per-token loop above, including the
+str.split() whitespace rules (Unicode whitespace plus \\x1c-\\x1f).
+"""
+import os
+
+import nltk
+import polars as pl
+from nltk.stem import PorterStemmer
+
+STEM_CACHE_DIR = os.environ.get("STEM_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "temp", "stem_cache")
+
+CHUNK_ROWS = 20_000        # texts per row group
+POOL_MIN_TOKENS = 50_000   # stem new tokens in a pool above this many
+
+# Characters str.split() treats as whitespace: Unicode White_Space (\s in
+# the Polars regex engine) plus the ASCII separators \x1c-\x1f.
+_SPLIT_WS = r"[\s\x1c-\x1f]+"
+
+_stemmer = PorterStemmer()
+
+
+def _stem_all(tokens):
+    return [_stemmer.stem(t) for t in tokens]
+
+
+class StemCache:
+    """Token -> Porter stem dict, persisted to one parquet per NLTK version
+    (persist=False keeps it in memory for this process only)."""
+
+    def __init__(self, cache_dir=None, persist=True):
+        cache_dir = cache_dir or STEM_CACHE_DIR
+        self.path = (os.path.join(cache_dir, f"porter_nltk{nltk.__version__}.parquet")
+                     if persist else None)
+        self.stems = {}
+        if self.path and os.path.exists(self.path):
+            df = pl.read_parquet(self.path)
+            self.stems = dict(zip(df["token"].to_list(), df["stem"].to_list()))
+        self.n_loaded = len(self.stems)
+
+    def stem(self, tokens, n_workers=1):
+        """Stems of tokens (list), computing and remembering the missing ones."""
+        todo = [t for t in tokens if t not in self.stems]
+        if n_workers > 1 and len(todo) >= POOL_MIN_TOKENS:
+            import multiprocessing as mp
+            step = max(1_000, len(todo) // (n_workers * 8))
+            with mp.Pool(n_workers) as pool:
+                parts = pool.map(_stem_all, [todo[i:i + step]
+                                             for i in range(0, len(todo), step)])
+            self.stems.update(zip(todo, (t for part in parts for t in part)))
+        elif todo:
+            self.stems.update(zip(todo, _stem_all(todo)))
+        return [self.stems[t] for t in tokens]
+
+    def report(self, label="Stem cache"):
+        print(f"  {label}: {self.n_loaded:,} tokens loaded, "
+              f"{len(self.stems) - self.n_loaded:,} stemmed this run"
+              + (f"  [{self.path}]" if self.path else ""))
+
+    def save(self):
+        if self.path is None or len(self.stems) == self.n_loaded:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp{os.getpid()}"
+        pl.DataFrame({"token": list(self.stems.keys()),
+                      "stem": list(self.stems.values())},
+                     schema={"token": pl.String, "stem": pl.String}).write_parquet(tmp)
+        os.replace(tmp, self.path)
+        self.n_loaded = len(self.stems)
+
+
+def stem_texts(texts, stopwords, cache=None, n_workers=1, chunk_rows=CHUNK_ROWS,
+               verbose=True):
+    """Porter-stem + stopword-filter every text; returns a pl.Series of
+    processed text aligned with texts (list, pandas or Polars Series).
+
+    cache: a StemCache to read stems from and add new ones to (the caller
+    saves it); None stems in memory for this call only."""
+    if cache is None:
+        cache = StemCache(persist=False)
+
+    s = texts if isinstance(texts, pl.Series) else pl.Series(
+        "text", list(texts), dtype=pl.String)
+    s = s.cast(pl.String).fill_null("")
+    out_map = {}                       # token -> output stem, or None = drop
+    parts = []
+    n_tok = 0
+    for start in range(0, len(s), chunk_rows):
+        chunk = s.slice(start, chunk_rows)
+        toks = (chunk.str.replace_all(_SPLIT_WS, " ").str.strip_chars(" ")
+                .str.split(" "))
+        distinct = toks.explode().unique().to_list()
+        new = [t for t in distinct if t not in out_map]
+        keep = [t for t in new
+                if len(t) > 2 and not t.isdigit() and t not in stopwords]
+        out_map.update(dict.fromkeys(new))
+        out_map.update(zip(keep, cache.stem(keep, n_workers)))
+        old_s = pl.Series(distinct, dtype=pl.String)
+        new_s = pl.Series([out_map[t] for t in distinct], dtype=pl.String)
+        processed = (
+            pl.DataFrame({"text": chunk, "tok": toks})
+            .select(
+                pl.when(pl.col("text").str.len_chars() < 5).then(pl.lit(""))
+                .otherwise(
+                    pl.col("tok").list.eval(
+                        pl.element().replace_strict(old_s, new_s, default=None)
+                        .drop_nulls()
+                    ).list.join(" ")
+                )
+                .alias("processed_text")
+            )
+            .to_series()
+        )
+        parts.append(processed)
+        n_tok += int(toks.list.len().sum() or 0)
+        if verbose:
+            print(f"    stemmed {min(start + chunk_rows, len(s)):,}/{len(s):,} texts  "
+                  f"tokens={n_tok:,}  distinct={len(out_map):,}  "
+                  f"stem cache={len(cache.stems):,}")
+
+    if not parts:
+        return pl.Series("processed_text", [], dtype=pl.String)
+    return pl.concat(parts).rename("processed_text")
@@ -5,8 +5,9 @@ bert/0c_build_coauthor_unstemmed.py.
 
 The unstemmed text is assembled from paper-level data, then the same Porter-
 stem + custom-stopword cleaning used in cluster_fields/code/0_combine_data.py
-is applied so the coauthor vectors live in the same vocabulary space as the
-FOIA TF-IDF matrix saved by tfidf/1_vectorize.py.
+(the shared cluster_fields/code/stemming.py stage) is applied so the coauthor
+vectors live in the same vocabulary space as the FOIA TF-IDF matrix saved by
+tfidf/1_vectorize.py.
 
 Inputs:
   /n/home02/cxu75/sci_eq/derived/openalex/get_coauthors/temp/relevant_pprs.dta
@@ -25,12 +26,13 @@ import time
 import multiprocessing as mp
 import pandas as pd
 import polars as pl
-from nltk.stem import PorterStemmer
 
 # Reuse the project-wide stopword set (NLTK english + ~hundreds of academic
-# scaffolding terms). Imported rather than duplicated to stay in sync.
+# scaffolding terms) and the shared stemming stage. Imported rather than
+# duplicated to stay in sync.
 sys.path.insert(0, "/n/home02/cxu75/sci_eq/derived/openalex/cluster_fields/code")
 from config import stopwords_set  # noqa: E402
+from stemming import StemCache, stem_texts  # noqa: E402
 
 EDGES = "/n/home02/cxu75/sci_eq/derived/openalex/cluster_fields/output/bert/author_paper_edges.parquet"
 PAPERS = "/n/home02/cxu75/sci_eq/derived/openalex/cluster_fields/output/bert/papers_text.parquet"
@@ -39,18 +41,6 @@ COAUTHORS_DTA = "../external/coauthors/coauthors.dta"
 OUT_CSV = "../output/coauthor_text_stemmed.csv"
 
 REGEX_SPACES = re.compile(r"\s+")
-_stemmer = PorterStemmer()
-
-
-def clean_and_stem(text: str) -> str:
-    """Match cluster_fields/code/0_combine_data.py:clean_and_stem so the
-    coauthor vocabulary aligns with the FOIA TF-IDF vocabulary."""
-    if not text or len(text) < 5:
-        return ""
-    return " ".join(
-        _stemmer.stem(t) for t in text.split()
-        if len(t) > 2 and not t.isdigit() and t not in stopwords_set
-    )
 
 
 def main():
@@ -100,12 +90,12 @@ def main():
 
     n_workers = int(os.environ.get("SLURM_CPUS_PER_TASK", mp.cpu_count() or 1))
     n_workers = max(1, n_workers - 1)
-    texts = df["raw_text"].tolist()
-    chunksize = max(200, len(texts) // (n_workers * 16))
-    print(f"Porter-stemming ({n_workers} workers, chunksize={chunksize:,})...")
-    with mp.Pool(n_workers) as pool:
-        df["processed_text"] = pool.map(clean_and_stem, texts, chunksize=chunksize)
-    del texts
+    print(f"Porter-stemming (cached token map, {n_workers} workers)...")
+    stem_cache = StemCache()
+    df["processed_text"] = stem_texts(df["raw_text"], stopwords_set,
+                                      cache=stem_cache, n_workers=n_workers).to_list()
+    stem_cache.report()
+    stem_cache.save()
 
     before = len(df)
     df = df[df["processed_text"].str.len() > 50]
@@ -18,6 +18,10 @@ Inputs:
 
 Output:
   ../../output/coauthor_text_unstemmed.csv  (athr_id [=coauthor], processed_text)
+
+Embedded by 1_vectorize.py --foia-csv (run_coauthor_embed.sbatch); chunks
+already in the shared embedding cache (embedding_cache.py) -- e.g. from the
+universe run -- are looked up rather than re-encoded.
 """
 import re
 import time
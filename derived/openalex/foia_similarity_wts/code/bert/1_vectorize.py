@@ -4,6 +4,18 @@ Dense BERT/SciBERT/SPECTER embeddings for the FOIA validation pipeline.
 For LOOV validation we only need the 188 FOIA authors (FOIA-vs-FOIA similarity).
 A `--universe` flag adds embeddings for the full ~2.66M-author universe, which
 is needed for the production imputation step but not for validation.
+The universe is always written shard by shard while encoding
+(bert/embedding_store.py), with a progress manifest: a job killed after
+hours resumes from the last completed shard when rerun with the same
+arguments (--restart discards the partial output). `--store-format int8`
+(or float16) keeps the sharded store as the output; the default stitches
+the shards into bert_universe_<tag>.npy at the end.
+
+Chunk embeddings go through the shared embedding cache
+(bert/embedding_cache.py, keyed by model, its dtype / max_seq_length and
+the normalized chunk text), so FOIA and coauthor authors whose text was
+already encoded -- e.g. by an earlier --universe run on the same device
+type -- are not re-encoded. --no-cache bypasses it.
 
 NOTE on text quality: the input parquet contains Porter-stemmed text. Subword
 tokenizers expect real words, so embedding quality is degraded. To run on
@@ -15,10 +27,15 @@ import os
 import time
 import numpy as np
 import pandas as pd
-import polars as pl
+import pyarrow.parquet as pq
 import torch
 from sentence_transformers import SentenceTransformer
 
+from embedding_cache import EmbeddingCache, encode_cached, encoder_settings
+from embedding_store import (STORE_FORMATS, STORE_SUFFIX, EmbeddingStore,
+                             EmbeddingStoreWriter, iter_parquet_batches,
+                             stitch_npy)
+
 DEFAULT_MODEL = "allenai-specter"  # other options:
 # "pritamdeka/S-Scibert-snli-multinli-stsb"
 # "allenai/scibert_scivocab_uncased"
@@ -28,6 +45,7 @@ FOIA_CSV = "../../output/foia_author_text_final.csv"
 OUT_DIR = "../../output/"
 
 ROW_BATCH = 4096
+SHARD_ROWS = 16 * ROW_BATCH  # authors per resumable shard (~200 MB float32)
 ENCODE_BATCH = 256
 CHUNK_WORDS = 200
 MAX_CHUNKS_PER_AUTHOR = 20
@@ -45,7 +63,8 @@ def chunk_text(text: str, chunk_words: int, max_chunks: int) -> list[str]:
     return chunks[:max_chunks] if chunks else [""]
 
 
-def encode_authors(model, ids: list[str], texts: list[str]) -> np.ndarray:
+def encode_authors(model, ids: list[str], texts: list[str],
+                   cache: EmbeddingCache | None = None) -> np.ndarray:
     flat_chunks: list[str] = []
     boundaries: list[tuple[int, int]] = []
     for t in texts:
@@ -54,13 +73,8 @@ def encode_authors(model, ids: list[str], texts: list[str]) -> np.ndarray:
         flat_chunks.extend(chunks)
         boundaries.append((start, len(flat_chunks)))
 
-    chunk_embs = model.encode(
-        flat_chunks,
-        batch_size=ENCODE_BATCH,
-        convert_to_numpy=True,
-        normalize_embeddings=True,
-        show_progress_bar=False,
-    ).astype(np.float32)
+    chunk_embs = encode_cached(model, flat_chunks, cache, batch_size=ENCODE_BATCH,
+                               verbose=False)
 
     out = np.zeros((len(boundaries), chunk_embs.shape[1]), dtype=np.float32)
     for i, (s, e) in enumerate(boundaries):
@@ -72,7 +86,8 @@ def encode_authors(model, ids: list[str], texts: list[str]) -> np.ndarray:
     return out
 
 
-def embed_foia(model, out_emb: str, out_ids: str, foia_csv: str = FOIA_CSV) -> None:
+def embed_foia(model, out_emb: str, out_ids: str, foia_csv: str = FOIA_CSV,
+               cache: EmbeddingCache | None = None) -> None:
     print(f"Loading FOIA texts from {foia_csv}...")
     df = pd.read_csv(foia_csv)
     df[TEXT_COL] = df[TEXT_COL].fillna("").astype(str)
@@ -85,7 +100,7 @@ def embed_foia(model, out_emb: str, out_ids: str, foia_csv: str = FOIA_CSV) -> N
         df = df.loc[text_len >= 50].reset_index(drop=True)
     print(f"FOIA authors: {len(df)}")
 
-    embs = encode_authors(model, df["athr_id"].tolist(), df[TEXT_COL].tolist())
+    embs = encode_authors(model, df["athr_id"].tolist(), df[TEXT_COL].tolist(), cache)
     print(f"FOIA embedding shape: {embs.shape}")
 
     np.save(out_emb, embs)
@@ -93,40 +108,57 @@ def embed_foia(model, out_emb: str, out_ids: str, foia_csv: str = FOIA_CSV) -> N
     print(f"Saved {out_emb} and {out_ids}")
 
 
-def embed_universe(model, out_emb: str, out_ids: str, limit: int | None) -> None:
-    lf = pl.scan_parquet(UNIVERSE_PARQUET).select(["athr_id", TEXT_COL])
-    n_total = lf.select(pl.len()).collect().item()
+def embed_universe(model, out_emb: str, out_ids: str, limit: int | None,
+                   store_format: str = "npy", model_name: str = "",
+                   restart: bool = False, cache: EmbeddingCache | None = None) -> None:
+    """Encode the universe into shards as it goes, resumably.
+
+    Shards (embeddings + athr_id) are written every SHARD_ROWS authors under
+    <store>.tmp with a progress manifest; rerunning the same command after a
+    killed job skips the completed shards. The parquet is read sequentially
+    by row group from the first unfinished row. In npy mode the float32
+    shards are stitched into out_emb at the end and removed.
+    """
+    n_total = pq.ParquetFile(UNIVERSE_PARQUET).metadata.num_rows
     if limit:
         n_total = min(n_total, limit)
     print(f"Universe authors to embed: {n_total:,}")
 
     dim = model.get_sentence_embedding_dimension()
-    embeddings = np.zeros((n_total, dim), dtype=np.float32)
-    author_ids: list[str] = []
+    if store_format == "npy":
+        store_path, fmt = f"{out_emb}.shards", "float32"
+    else:
+        store_path, fmt = out_emb, store_format
+    writer = EmbeddingStoreWriter(store_path, dim, fmt, shard_rows=SHARD_ROWS,
+                                  meta={"model": model_name, "n_total": n_total},
+                                  resume=not restart)
 
     t0 = time.time()
-    written = 0
-    offset = 0
-    while offset < n_total:
-        take = min(ROW_BATCH, n_total - offset)
-        batch_df = lf.slice(offset, take).collect(streaming=True)
-        ids = batch_df["athr_id"].to_list()
-        texts = batch_df[TEXT_COL].fill_null("").to_list()
-
-        embs = encode_authors(model, ids, texts)
-        embeddings[written:written + len(ids)] = embs
-        author_ids.extend(ids)
+    resumed = writer.n
+    written = writer.n
+    for batch in iter_parquet_batches(UNIVERSE_PARQUET, ["athr_id", TEXT_COL],
+                                      ROW_BATCH, start=written, stop=n_total):
+        ids = batch.column("athr_id").to_pylist()
+        texts = batch.column(TEXT_COL).to_pylist()
+
+        writer.append(encode_authors(model, ids, texts, cache), ids=ids)
         written += len(ids)
-        offset += take
 
         elapsed = time.time() - t0
-        rate = written / elapsed if elapsed else 0.0
+        rate = (written - resumed) / elapsed if elapsed else 0.0
         eta = (n_total - written) / rate if rate else float("inf")
-        print(f"  {written:,}/{n_total:,}  ({rate:.1f}/s, ETA {eta/3600:.2f}h)", flush=True)
+        hits = (f", cache hits {cache.stats[0] / max(cache.stats[1], 1):.1%}"
+                if cache is not None else "")
+        print(f"  {written:,}/{n_total:,}  ({rate:.1f}/s, ETA {eta/3600:.2f}h{hits})", flush=True)
 
-    np.save(out_emb, embeddings)
-    pl.DataFrame({"athr_id": author_ids}).write_parquet(out_ids)
-    print(f"Saved {out_emb} shape={embeddings.shape} and {out_ids}")
+    writer.close()
+    if store_format == "npy":
+        print(f"Stitching {len(writer.shards)} shards -> {out_emb}")
+        stitch_npy(store_path, out_emb, out_ids, id_col="athr_id")
+    else:
+        ids = EmbeddingStore(out_emb).ids()
+        pd.DataFrame({"athr_id": ids}).to_parquet(out_ids, index=False)
+    print(f"Saved {out_emb} shape=({written:,}, {dim}) and {out_ids}")
 
 
 def main():
@@ -141,6 +173,17 @@ def main():
                         help="Override the FOIA-text CSV (e.g. the un-stemmed variant).")
     parser.add_argument("--tag-suffix", default="",
                         help="Appended to output filenames so variants don't clobber each other.")
+    parser.add_argument("--store-format", default="npy", choices=("npy",) + STORE_FORMATS,
+                        help="Universe output: 'npy' = one float32 .npy (default); "
+                             "int8/float16/float32 = sharded embedding store "
+                             "bert_universe_<tag>.store/ written as it encodes.")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore shards left by an interrupted --universe run.")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Embedding cache directory (default: $EMBEDDING_CACHE_DIR, "
+                             "else ../../temp/embedding_cache).")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Encode every chunk; neither read nor write the cache.")
     args = parser.parse_args()
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -153,15 +196,24 @@ def main():
     if device == "cuda":
         model = model.half()
 
+    cache = None if args.no_cache else EmbeddingCache(args.model, args.cache_dir,
+                                                      **encoder_settings(model))
+
     model_tag = args.model.replace("/", "_") + args.tag_suffix
     foia_emb = os.path.join(OUT_DIR, f"bert_foia_{model_tag}.npy")
     foia_ids = os.path.join(OUT_DIR, f"bert_foia_ids_{model_tag}.csv")
-    embed_foia(model, foia_emb, foia_ids, args.foia_csv)
+    embed_foia(model, foia_emb, foia_ids, args.foia_csv, cache)
+    if cache is not None:
+        cache.report("FOIA chunk cache")
 
     if args.universe:
-        univ_emb = os.path.join(OUT_DIR, f"bert_universe_{model_tag}.npy")
+        ext = ".npy" if args.store_format == "npy" else STORE_SUFFIX
+        univ_emb = os.path.join(OUT_DIR, f"bert_universe_{model_tag}{ext}")
         univ_ids = os.path.join(OUT_DIR, f"bert_universe_ids_{model_tag}.parquet")
-        embed_universe(model, univ_emb, univ_ids, args.limit)
+        embed_universe(model, univ_emb, univ_ids, args.limit, args.store_format,
+                       args.model, restart=args.restart, cache=cache)
+        if cache is not None:
+            cache.report("Chunk cache (FOIA + universe)")
 
 
 if __name__ == "__main__":
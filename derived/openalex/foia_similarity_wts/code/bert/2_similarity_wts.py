@@ -1,17 +1,50 @@
 """
-GPU cosine similarity: universe BERT embeddings x FOIA BERT embeddings.
+Cosine similarity: universe BERT embeddings x FOIA BERT embeddings.
 
 Mirrors tfidf/2_similarity_wts.py but operates on dense L2-normalized
 embeddings produced by bert/1_vectorize.py --universe. Cosine sim is just a
-torch matmul; we batch rows of the universe to bound peak GPU memory, apply
-top-K + threshold filters, row-normalize, and stream into a sparse COO matrix
-to keep the on-disk artifact small.
+matmul against the memory-mapped universe; we keep each author's top-K,
+apply the threshold filter, row-normalize, and write W as CSR to keep the
+on-disk artifact small.
+
+Two backends (bert/similarity_backends.py), same W:
+  torch  fp16 matmul in large batches -- use on a GPU.
+  cpu    float32 BLAS over cache-sized tiles of the mmap with a running
+         top-K, one thread per core in the affinity mask -- use on CPU-only
+         nodes (fp16 torch on CPU is slower, not faster).
+--backend auto (default) picks torch when CUDA is available, else cpu.
+bert/benchmark_similarity.py compares the two.
+
+The universe may be a float32 .npy or a sharded (int8) embedding store from
+1_vectorize.py --store-format; both are memory-mapped and read tile by tile.
+
+The raw top-K neighbor list (pre-threshold cosine) is also saved as
+bert_neighbor_index_{model}/ in the tfidf/neighbor_index.py format, so other
+recipes and max_sim filters can be derived without another similarity pass.
 """
 import argparse
+import os
+import sys
 import time
 import numpy as np
+import pandas as pd
 import scipy.sparse
-import torch
+
+from embedding_store import open_embeddings, resolve_embeddings
+from similarity_backends import (CPU_TILE_ROWS, available_cpus,
+                                 threshold_l1_weights, topk_cpu, topk_torch)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tfidf"))
+from neighbor_index import INDEX_K, save_index  # noqa: E402
+from topk_engine import weights_to_csr  # noqa: E402
+
+
+def _cuda_available():
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
 
 
 def main():
@@ -22,23 +55,46 @@ def main():
                         help="Top-K neighbors to keep per universe author.")
     parser.add_argument("--threshold", type=float, default=0.0,
                         help="Drop similarities below this cutoff (cosine).")
+    parser.add_argument("--backend", default="auto", choices=["auto", "torch", "cpu"],
+                        help="auto = torch on a GPU, cpu otherwise.")
     parser.add_argument("--batch-size", type=int, default=200_000,
-                        help="Rows of universe per GPU matmul batch.")
+                        help="Rows of universe per GPU matmul batch (torch backend).")
+    parser.add_argument("--tile-rows", type=int, default=CPU_TILE_ROWS,
+                        help="Rows of universe per BLAS tile (cpu backend).")
+    parser.add_argument("--n-jobs", type=int, default=None,
+                        help="Threads for the cpu backend (default: SLURM "
+                             "allocation, else the CPU affinity mask).")
+    parser.add_argument("--universe-emb", default=None,
+                        help="Universe embeddings (.npy or .store dir). Default: "
+                             "bert_universe_<tag>.npy, else bert_universe_<tag>.store.")
+    parser.add_argument("--index-k", type=int, default=INDEX_K,
+                        help="Neighbors per author kept in the saved neighbor "
+                             "index (W still uses --k).")
+    parser.add_argument("--no-index", action="store_true",
+                        help="Do not write bert_neighbor_index_{model}/.")
     args = parser.parse_args()
 
     tag = args.model.replace("/", "_")
-    univ_emb_path = f"../../output/bert_universe_{tag}.npy"
+    univ_emb_path = (args.universe_emb
+                     or resolve_embeddings(f"../../output/bert_universe_{tag}")
+                     or f"../../output/bert_universe_{tag}.npy")
     foia_emb_path = f"../../output/bert_foia_{tag}.npy"
     out_path = f"../../output/bert_weight_matrix_{tag}.npz"
-
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    if device == "cpu":
-        print("WARNING: no GPU detected — this will be slow.")
-    print(f"Device: {device}")
+    index_path = f"../../output/bert_neighbor_index_{tag}"
+    univ_ids_path = f"../../output/bert_universe_ids_{tag}.parquet"
+
+    backend = args.backend
+    if backend == "auto":
+        backend = "torch" if _cuda_available() else "cpu"
+    elif backend == "torch" and not _cuda_available():
+        print("WARNING: no GPU detected — torch fp16 on CPU is slow; "
+              "--backend cpu is the fast CPU path.")
+    n_jobs = args.n_jobs or available_cpus()
+    print(f"Backend: {backend}" + (f"  ({n_jobs} threads)" if backend == "cpu" else ""))
 
     # mmap universe so we don't pay 4GB+ host RAM up front
     print(f"Loading {univ_emb_path}")
-    X_univ = np.load(univ_emb_path, mmap_mode="r")
+    X_univ = open_embeddings(univ_emb_path)
     print(f"Loading {foia_emb_path}")
     X_foia = np.load(foia_emb_path)
     n_univ, dim = X_univ.shape
@@ -46,58 +102,41 @@ def main():
     print(f"Universe: {n_univ:,} x {dim}   FOIA: {n_foia} x {dim}")
     assert X_foia.shape[1] == dim, "FOIA and universe embedding dims must match"
 
-    foia_t = torch.from_numpy(X_foia).to(device).half()  # (n_foia, dim) fp16
-
-    row_ind: list[np.ndarray] = []
-    col_ind: list[np.ndarray] = []
-    data_val: list[np.ndarray] = []
-
     k = min(args.k, n_foia)
+    # The top-K lists come back sorted, so one pass at the index's K also
+    # gives W's first k.
+    k_top = k if args.no_index else min(max(args.index_k, k), n_foia)
     t0 = time.time()
-    for start in range(0, n_univ, args.batch_size):
-        end = min(start + args.batch_size, n_univ)
-        batch = torch.from_numpy(np.ascontiguousarray(X_univ[start:end])).to(device).half()
-        sim = batch @ foia_t.T  # (B, n_foia)
-        del batch
-
-        # top-K per row
-        topk_vals, topk_idx = torch.topk(sim, k=k, dim=1)  # (B, k)
-        if args.threshold > 0:
-            topk_vals = torch.where(topk_vals >= args.threshold,
-                                    topk_vals, torch.zeros_like(topk_vals))
-
-        # row-normalize so weights sum to 1
-        row_sums = topk_vals.sum(dim=1, keepdim=True)
-        row_sums = torch.where(row_sums > 0, row_sums, torch.ones_like(row_sums))
-        topk_vals = topk_vals / row_sums
-
-        # back to numpy COO triples
-        vals = topk_vals.cpu().float().numpy()
-        cols = topk_idx.cpu().numpy()
-        rows = np.repeat(np.arange(start, end, dtype=np.int64), k).reshape(-1, k)
-
-        keep = vals > 0
-        row_ind.append(rows[keep])
-        col_ind.append(cols[keep])
-        data_val.append(vals[keep])
-
-        elapsed = time.time() - t0
-        rate = end / elapsed if elapsed else 0.0
-        eta = (n_univ - end) / rate if rate else float("inf")
-        print(f"  {end:,}/{n_univ:,}  ({rate:,.0f}/s, ETA {eta/60:.1f}min)", flush=True)
+    if backend == "cpu":
+        top = topk_cpu(X_univ, X_foia, k_top, threshold=args.threshold,
+                       n_jobs=n_jobs, tile_rows=args.tile_rows)
+    else:
+        top = topk_torch(X_univ, X_foia, k_top, threshold=args.threshold,
+                         batch_size=args.batch_size)
+    elapsed = time.time() - t0
+    print(f"Top-{k_top} similarity: {elapsed:.1f}s  "
+          f"({n_univ / max(elapsed, 1e-9):,.0f} authors/s)")
 
     print("Building sparse matrix...")
-    rows_all = np.concatenate(row_ind)
-    cols_all = np.concatenate(col_ind)
-    vals_all = np.concatenate(data_val).astype(np.float32)
-    W = scipy.sparse.coo_matrix(
-        (vals_all, (rows_all, cols_all)),
-        shape=(n_univ, n_foia),
-    ).tocsr()
+    W = weights_to_csr(top, threshold_l1_weights(top, k, args.threshold), n_foia)
 
     print(f"Saving {out_path}  shape={W.shape}  nnz={W.nnz:,}")
     scipy.sparse.save_npz(out_path, W)
 
+    if not args.no_index:
+        if os.path.exists(univ_ids_path):
+            athr_id = pd.read_parquet(univ_ids_path)["athr_id"].to_numpy()
+        else:
+            print(f"WARNING: {univ_ids_path} missing; index rows keyed by position.")
+            athr_id = np.arange(n_univ)
+        save_index(index_path, top, athr_id, n_foia, floors=[args.threshold],
+                   meta={"source": "bert", "model": args.model,
+                         "backend": backend,
+                         "universe_matrix": univ_emb_path,
+                         "foia_matrix": foia_emb_path,
+                         "built": pd.Timestamp.now().isoformat(timespec="seconds")})
+        print(f"Saved neighbor index (K={k_top}) -> {index_path}")
+
 
 if __name__ == "__main__":
     main()
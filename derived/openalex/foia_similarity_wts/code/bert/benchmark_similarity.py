@@ -0,0 +1,150 @@
+"""
+Benchmark the bert/2_similarity_wts.py backends (cpu vs torch) on a
+synthetic memory-mapped universe.
+
+Embeddings are drawn around a few hundred topic centroids and L2-normalized,
+so nearest-FOIA lists look like real ones (a handful of close anchors, a long
+tail near zero) rather than the flat sims of isotropic noise. The universe is
+written once as a float32 .npy under --workdir and memory-mapped the way
+2_similarity_wts.py reads bert_universe_{model}.npy.
+
+Reports wall time and authors/s per backend, and how the torch (fp16) top-k
+lists and W compare against the cpu (fp32) ones.
+
+Usage:
+    python benchmark_similarity.py                         # 1M x 768, 200 FOIAs
+    python benchmark_similarity.py --n-univ 200000 --threads 1 4 16
+    python benchmark_similarity.py --backends cpu          # no torch installed
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from similarity_backends import (available_cpus, threshold_l1_weights,
+                                 topk_cpu, topk_torch)
+
+GEN_BLOCK = 65_536
+
+
+def _normalize(a):
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    return a
+
+
+def make_embeddings(path, n_univ, n_foia, dim, n_topics=300, seed=0):
+    """Write an (n_univ, dim) float32 universe .npy; return the FOIA block."""
+    rng = np.random.default_rng(seed)
+    centroids = _normalize(rng.standard_normal((n_topics, dim)).astype(np.float32))
+
+    def draw(n):
+        topic = rng.integers(n_topics, size=n)
+        noise = rng.standard_normal((n, dim)).astype(np.float32)
+        return _normalize(centroids[topic] + 0.06 * noise)
+
+    X = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32,
+                                  shape=(n_univ, dim))
+    for s in range(0, n_univ, GEN_BLOCK):
+        e = min(s + GEN_BLOCK, n_univ)
+        X[s:e] = draw(e - s)
+    X.flush()
+    del X
+    return draw(n_foia)
+
+
+def compare(ref, other, k, threshold):
+    """(mean top-k overlap, exact top-k set match share, max |W diff|)."""
+    a, b = np.sort(ref.idx[:, :k], axis=1), np.sort(other.idx[:, :k], axis=1)
+    overlap = np.mean([len(np.intersect1d(x, y)) / k for x, y in zip(a[:5000], b[:5000])])
+    same = float(np.mean((a == b).all(axis=1)))
+    wa = threshold_l1_weights(ref, k, threshold)
+    wb = threshold_l1_weights(other, k, threshold)
+    ia = np.argsort(ref.idx[:, :k], axis=1)
+    ib = np.argsort(other.idx[:, :k], axis=1)
+    wa = np.take_along_axis(wa, ia, axis=1)
+    wb = np.take_along_axis(wb, ib, axis=1)
+    rows = (a == b).all(axis=1)
+    w_diff = float(np.abs(wa[rows] - wb[rows]).max()) if rows.any() else float("nan")
+    return overlap, same, w_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--n-univ", type=int, default=1_000_000)
+    parser.add_argument("--n-foia", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--index-k", type=int, default=20,
+                        help="Neighbors kept per author (2_similarity_wts.py "
+                             "computes top-max(k, index-k)).")
+    parser.add_argument("--threshold", type=float, default=0.0)
+    parser.add_argument("--backends", nargs="+", default=["cpu", "torch"],
+                        choices=["cpu", "torch"])
+    parser.add_argument("--threads", type=int, nargs="+", default=None,
+                        help="cpu backend thread counts to time (default: all "
+                             "available cores).")
+    parser.add_argument("--tile-rows", type=int, nargs="+", default=[1024])
+    parser.add_argument("--batch-size", type=int, default=200_000)
+    parser.add_argument("--workdir", default=None,
+                        help="Where to write the synthetic universe .npy "
+                             "(default: a temp dir, removed afterwards).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tmp = None
+    if args.workdir is None:
+        tmp = tempfile.TemporaryDirectory(prefix="bert_sim_bench_")
+        args.workdir = tmp.name
+    path = os.path.join(args.workdir, f"universe_{args.n_univ}x{args.dim}.npy")
+    print(f"Writing synthetic universe {args.n_univ:,} x {args.dim} -> {path}")
+    t0 = time.perf_counter()
+    X_foia = make_embeddings(path, args.n_univ, args.n_foia, args.dim, seed=args.seed)
+    print(f"  {time.perf_counter() - t0:.1f}s")
+    X_univ = np.load(path, mmap_mode="r")
+    k_top = max(args.k, args.index_k)
+
+    rows, tops = [], {}
+    if "cpu" in args.backends:
+        for n_jobs in args.threads or [available_cpus()]:
+            for tile in args.tile_rows:
+                name = f"cpu  threads={n_jobs} tile={tile}"
+                print(f"\n=== {name} ===")
+                t0 = time.perf_counter()
+                top = topk_cpu(X_univ, X_foia, k_top, args.threshold,
+                               n_jobs=n_jobs, tile_rows=tile)
+                rows.append((name, time.perf_counter() - t0))
+                tops.setdefault("cpu", top)
+    if "torch" in args.backends:
+        try:
+            import torch
+        except ImportError:
+            print("\ntorch not installed; skipping the torch backend.")
+        else:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            name = f"torch fp16 {device} batch={args.batch_size}"
+            print(f"\n=== {name} ===")
+            t0 = time.perf_counter()
+            top = topk_torch(X_univ, X_foia, k_top, args.threshold,
+                             batch_size=args.batch_size, progress=False)
+            rows.append((name, time.perf_counter() - t0))
+            tops["torch"] = top
+
+    print(f"\n{'backend':<36} {'time (s)':>9} {'authors/s':>12} {'vs first':>9}")
+    for name, t in rows:
+        print(f"{name:<36} {t:>9.2f} {args.n_univ / t:>12,.0f} {rows[0][1] / t:>8.2f}x")
+
+    if "cpu" in tops and "torch" in tops:
+        overlap, same, w_diff = compare(tops["cpu"], tops["torch"], args.k, args.threshold)
+        print(f"\ntorch vs cpu top-{args.k}: mean overlap {overlap:.4f}  "
+              f"identical neighbor sets {same:.2%}  "
+              f"max |W diff| on identical rows {w_diff:.2e}")
+
+    del X_univ
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
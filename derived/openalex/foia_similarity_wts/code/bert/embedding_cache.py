@@ -0,0 +1,189 @@
+"""
+Persistent embedding cache keyed by (model id, weight dtype, max_seq_length,
+normalized text hash).
+
+The same texts are encoded over and over: bert/1_vectorize.py re-embeds FOIA
+authors who are also in the universe, the coauthor text built by
+0c_build_coauthor_unstemmed.py (encoded with 1_vectorize.py --foia-csv)
+overlaps the universe, and prdct_classification's 1b / 1c scripts encode
+the same procurement descriptions on every run. encode_cached() looks every
+text up first and only sends the misses to the model.
+
+One SQLite file per encoder setting under the cache dir:
+
+  <cache_dir>/<model_id with / -> _>__<dtype>_seq<max_seq_length>.sqlite
+    meta(name, value)                 model id, dtype, max_seq_length, dim
+    emb(key BLOB PRIMARY KEY, vec)    key = blake2b(normalized text), vec =
+                                      float32 bytes of the L2-normalized vector
+
+Texts are normalized before hashing (whitespace runs -> one space,
+stripped), which the tokenizers do anyway, so "a  b" and "a b" share an
+entry; case and accents are kept (cased models). Vectors are stored as
+returned by model.encode(..., normalize_embeddings=True). The scripts run
+the model in fp16 on GPU and fp32 on CPU, and truncation depends on
+max_seq_length, so both are part of the file name (encoder_settings(model))
+and are checked on open and on every encode_cached call: a cache only ever
+serves vectors from the same model, precision and truncation, so cached and
+fresh results are identical.
+
+Default location, shared by bert/1_vectorize.py and prdct_classification's
+1b / 1c: $EMBEDDING_CACHE_DIR, else foia_similarity_wts/temp/embedding_cache.
+Delete a .sqlite file to invalidate it.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "temp", "embedding_cache")
+
+# SQLite caps the number of bound parameters per statement (999 on older
+# builds); look keys up in batches below that.
+_LOOKUP_BATCH = 900
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    if text is None:
+        return ""
+    return _SPACES.sub(" ", str(text)).strip()
+
+
+def _digest(normalized):
+    return hashlib.blake2b(normalized.encode("utf-8", "surrogatepass"),
+                           digest_size=16).digest()
+
+
+def encoder_settings(model):
+    """Settings of a loaded SentenceTransformer that change its vectors."""
+    return {"dtype": str(next(model.parameters()).dtype).replace("torch.", ""),
+            "max_seq_length": int(model.max_seq_length)}
+
+
+def text_key(text):
+    """16-byte cache key of a raw text."""
+    return _digest(normalize_text(text))
+
+
+class EmbeddingCache:
+    """Vectors of one model_id at one encoder_settings() (dtype,
+    max_seq_length); open it with the settings of the model that will fill
+    it, e.g. EmbeddingCache(model_id, **encoder_settings(model))."""
+
+    def __init__(self, model_id, cache_dir=None, *, dtype, max_seq_length):
+        cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        self.model_id = model_id
+        self.settings = {"dtype": str(dtype), "max_seq_length": int(max_seq_length)}
+        self.path = os.path.join(
+            cache_dir, f"{model_id.replace('/', '_')}__{dtype}_seq{int(max_seq_length)}.sqlite")
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS emb (key BLOB PRIMARY KEY, vec BLOB) WITHOUT ROWID")
+        expected = {"model_id": model_id, **{k: str(v) for k, v in self.settings.items()}}
+        self.conn.executemany("INSERT OR IGNORE INTO meta VALUES (?, ?)", expected.items())
+        self.conn.commit()
+        stored = dict(self.conn.execute("SELECT name, value FROM meta"))
+        for name, value in expected.items():
+            if stored[name] != value:
+                raise ValueError(f"{self.path} holds {name}={stored[name]!r}, not {value!r}")
+        self.dim = int(stored["dim"]) if "dim" in stored else None
+        # [unique texts hit, unique texts looked up] over this object's life.
+        self.stats = [0, 0]
+
+    def check(self, model):
+        """Raise unless model encodes with this cache's settings."""
+        got = encoder_settings(model)
+        if got != self.settings:
+            raise ValueError(f"{self.path} caches {self.settings}, model runs with {got}")
+
+    def _set_dim(self, dim):
+        if self.dim is None:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(dim),))
+            self.dim = int(dim)
+        elif self.dim != dim:
+            raise ValueError(f"{self.path}: cached dim {self.dim}, got {dim}")
+
+    def get(self, keys):
+        """Look up digests. Returns (hit_mask, (len(keys), dim) float32 with
+        zero rows for misses); vectors is None when the cache is empty."""
+        found = {}
+        for start in range(0, len(keys), _LOOKUP_BATCH):
+            batch = keys[start:start + _LOOKUP_BATCH]
+            rows = self.conn.execute(
+                f"SELECT key, vec FROM emb WHERE key IN ({','.join('?' * len(batch))})",
+                batch)
+            found.update(rows)
+        hit = np.fromiter((k in found for k in keys), dtype=bool, count=len(keys))
+        if self.dim is None:
+            return hit, None
+        vecs = np.zeros((len(keys), self.dim), dtype=np.float32)
+        for i in np.flatnonzero(hit):
+            vecs[i] = np.frombuffer(found[keys[i]], dtype=np.float32)
+        return hit, vecs
+
+    def put(self, keys, vecs):
+        """Store (len(keys), dim) vectors for digests (aligned)."""
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+        self._set_dim(vecs.shape[1])
+        self.conn.executemany("INSERT OR REPLACE INTO emb (key, vec) VALUES (?, ?)",
+                              zip(keys, (v.tobytes() for v in vecs)))
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM emb").fetchone()[0]
+
+    def report(self, label="Embedding cache"):
+        hits, total = self.stats
+        if total:
+            print(f"  {label}: {hits:,} / {total:,} unique texts hit "
+                  f"({hits / total:.1%})  [{self.path}]")
+
+    def close(self):
+        self.conn.close()
+
+
+def encode_cached(model, texts, cache=None, batch_size=256, show_progress_bar=False,
+                  verbose=True):
+    """model.encode(texts, normalize_embeddings=True) as float32, encoding
+    each distinct normalized text once and only the ones `cache` misses.
+    cache=None just dedupes."""
+    if not len(texts):
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    norm = [normalize_text(t) for t in texts]
+    codes, uniques = pd.factorize(pd.Series(norm, dtype=object), sort=False)
+    uniques = list(uniques)
+    if cache is None:
+        hit, vecs = np.zeros(len(uniques), dtype=bool), None
+        keys = None
+    else:
+        cache.check(model)
+        keys = [_digest(u) for u in uniques]
+        hit, vecs = cache.get(keys)
+        cache.stats[0] += int(hit.sum())
+        cache.stats[1] += len(uniques)
+    miss = np.flatnonzero(~hit)
+    if verbose:
+        print(f"    {len(texts):,} texts, {len(uniques):,} unique, "
+              f"{len(uniques) - len(miss):,} cached -> encoding {len(miss):,}")
+    if len(miss):
+        fresh = model.encode(
+            [uniques[i] for i in miss],
+            batch_size=batch_size,
+            show_progress_bar=show_progress_bar,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        ).astype(np.float32)
+        if vecs is None:
+            vecs = np.zeros((len(uniques), fresh.shape[1]), dtype=np.float32)
+        vecs[miss] = fresh
+        if cache is not None:
+            cache.put([keys[i] for i in miss], fresh)
+    return vecs[codes]
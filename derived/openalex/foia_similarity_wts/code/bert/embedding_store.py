@@ -0,0 +1,377 @@
+"""
+Sharded, optionally int8-quantized embedding store.
+
+bert/1_vectorize.py --universe and cluster_fields/code/bert/1_embed_papers.py
+used to preallocate the whole (N, D) array in RAM and np.save it at the end;
+every consumer then reloaded the multi-GB file (2_cluster_papers.py even
+promotes it to float32 in one go). A store is a directory written shard by
+shard while encoding runs:
+
+  <stem>.store/
+    manifest.json                format, dim, n rows, shard list, model
+    shard-000000.codes.npy       (rows, D) int8     -- format "int8"
+    shard-000000.scale.npy       (rows,)   float32  -- per-row scale
+    shard-000000.npy             (rows, D) float16/float32 -- other formats
+    shard-000000.ids.parquet     optional row ids ("id" column)
+
+int8 is symmetric scalar quantization with one scale per row
+(x ~= scale * code, scale = max|x| / 127), i.e. a quarter of float32 on disk.
+For L2-normalized embeddings the per-coordinate error is <= scale / 2, and
+cosine top-K lists are nearly unchanged; bert/validate_quantization.py
+measures recall@K against float32 on the real files.
+
+The writer is resumable: after every shard it rewrites progress.json in the
+partial directory (<stem>.store.tmp), so a killed job restarted with the
+same settings keeps the completed shards and the caller skips writer.n
+input rows (iter_parquet_batches(..., start=writer.n) reads on from there
+by row group). stitch_npy() turns a finished store back into the single
+.npy + ids parquet that older consumers read.
+
+EmbeddingStore is read through memory maps and dequantizes on the fly: row
+slices / index arrays return float32, so it drops into anything that
+slices rows (tfidf/topk_engine.topk_similarity, the torch backend, sample
+lookups), and dot(Q) streams blocks through a float32 matmul.
+
+  open_embeddings(path)      .npy (memory-mapped) or .store directory
+  resolve_embeddings(stem)   stem.npy if present, else stem.store
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+STORE_FORMATS = ("int8", "float16", "float32")
+STORE_SUFFIX = ".store"
+STORE_VERSION = 1
+SHARD_ROWS = 262_144
+READ_BLOCK_ROWS = 65_536
+
+
+def quantize_int8(X):
+    """(n, D) float -> (int8 codes, float32 per-row scale)."""
+    X = np.asarray(X, dtype=np.float32)
+    scale = np.abs(X).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    codes = np.rint(X / scale[:, None])
+    np.clip(codes, -127, 127, out=codes)
+    return codes.astype(np.int8), scale.astype(np.float32)
+
+
+def dequantize_int8(codes, scale):
+    out = np.asarray(codes, dtype=np.float32)
+    out *= np.asarray(scale, dtype=np.float32)[:, None]
+    return out
+
+
+class EmbeddingStoreWriter:
+    """Append (rows, D) blocks; a shard is written every shard_rows rows.
+
+    Written under <path>.tmp and renamed on close(), so readers never see a
+    partial store. Use as a context manager or call close() explicitly.
+
+    resume=True picks up <path>.tmp if its progress.json was written with
+    the same dim / format / shard_rows / meta; self.n is then the number of
+    rows already on disk, which the caller must skip in its input. Rows
+    buffered after the last completed shard are lost with the job and
+    simply re-encoded.
+    """
+
+    def __init__(self, path, dim, fmt="int8", shard_rows=SHARD_ROWS, meta=None,
+                 resume=False):
+        if fmt not in STORE_FORMATS:
+            raise ValueError(f"store format {fmt!r} not in {STORE_FORMATS}")
+        self.path = path
+        self.tmp = f"{path}.tmp"
+        self.dim = int(dim)
+        self.fmt = fmt
+        self.shard_rows = int(shard_rows)
+        self.meta = dict(meta or {})
+        self.shards = []
+        self.n = 0
+        self._buf = []
+        self._buf_ids = []
+        self._buf_rows = 0
+        self._has_ids = None
+        if resume and self._resume():
+            return
+        if os.path.isdir(self.tmp):
+            shutil.rmtree(self.tmp)
+        os.makedirs(self.tmp)
+
+    def _settings(self):
+        return {"version": STORE_VERSION, "format": self.fmt, "dim": self.dim,
+                "shard_rows": self.shard_rows, **self.meta}
+
+    def _resume(self):
+        progress = os.path.join(self.tmp, "progress.json")
+        if not os.path.isfile(progress):
+            return False
+        with open(progress) as f:
+            state = json.load(f)
+        if state.get("settings") != json.loads(json.dumps(self._settings())):
+            print(f"  {self.tmp}: settings changed since the last run; starting over")
+            return False
+        self.shards = state["shards"]
+        self.n = int(state["n"])
+        self._has_ids = state["has_ids"]
+        # Drop shard files past the last recorded one (killed mid-write).
+        keep = {s["name"] for s in self.shards} | {"progress.json"}
+        for name in os.listdir(self.tmp):
+            if name.split(".")[0] not in keep and name not in keep:
+                os.remove(os.path.join(self.tmp, name))
+        print(f"  resuming {self.tmp}: {len(self.shards)} shards, {self.n:,} rows done")
+        return True
+
+    def _write_progress(self):
+        tmp = os.path.join(self.tmp, "progress.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"settings": self._settings(), "n": int(self.n),
+                       "has_ids": self._has_ids, "shards": self.shards}, f)
+        os.replace(tmp, os.path.join(self.tmp, "progress.json"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def append(self, X, ids=None):
+        X = np.asarray(X)
+        if X.ndim != 2 or X.shape[1] != self.dim:
+            raise ValueError(f"expected (rows, {self.dim}) block, got {X.shape}")
+        if self._has_ids is None:
+            self._has_ids = ids is not None
+        elif self._has_ids != (ids is not None):
+            raise ValueError("pass ids for every block or for none")
+        if ids is not None and len(ids) != len(X):
+            raise ValueError(f"{len(ids)} ids for {len(X)} rows")
+        self._buf.append(X)
+        if ids is not None:
+            self._buf_ids.extend(ids)
+        self._buf_rows += len(X)
+        while self._buf_rows >= self.shard_rows:
+            self._flush(self.shard_rows)
+
+    def _flush(self, rows):
+        block = np.concatenate(self._buf) if len(self._buf) > 1 else self._buf[0]
+        shard, rest = block[:rows], block[rows:]
+        self._buf = [rest] if len(rest) else []
+        self._buf_rows = len(rest)
+        name = f"shard-{len(self.shards):06d}"
+        base = os.path.join(self.tmp, name)
+        if self.fmt == "int8":
+            codes, scale = quantize_int8(shard)
+            np.save(f"{base}.codes.npy", codes)
+            np.save(f"{base}.scale.npy", scale)
+        else:
+            np.save(f"{base}.npy", np.asarray(shard, dtype=self.fmt))
+        if self._has_ids:
+            pd.DataFrame({"id": self._buf_ids[:rows]}).to_parquet(
+                f"{base}.ids.parquet", index=False)
+            self._buf_ids = self._buf_ids[rows:]
+        self.shards.append({"name": name, "rows": int(len(shard))})
+        self.n += len(shard)
+        self._write_progress()
+
+    def close(self):
+        if self._buf_rows:
+            self._flush(self._buf_rows)
+        with open(os.path.join(self.tmp, "manifest.json"), "w") as f:
+            json.dump({
+                "version": STORE_VERSION,
+                "format": self.fmt,
+                "dim": self.dim,
+                "n": int(self.n),
+                "has_ids": bool(self._has_ids),
+                "shards": self.shards,
+                **self.meta,
+            }, f, indent=2)
+        os.remove(os.path.join(self.tmp, "progress.json"))
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.replace(self.tmp, self.path)
+        return self.path
+
+
+class EmbeddingStore:
+    """Read-only view of a store; rows come back as float32."""
+
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, path, mmap=True):
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != STORE_VERSION:
+            raise ValueError(f"{path}: store version {self.manifest.get('version')} "
+                             f"!= {STORE_VERSION}")
+        self.path = path
+        self.format = self.manifest["format"]
+        mode = "r" if mmap else None
+        self._data, self._scale = [], []
+        for s in self.manifest["shards"]:
+            base = os.path.join(path, s["name"])
+            if self.format == "int8":
+                self._data.append(np.load(f"{base}.codes.npy", mmap_mode=mode))
+                self._scale.append(np.load(f"{base}.scale.npy"))
+            else:
+                self._data.append(np.load(f"{base}.npy", mmap_mode=mode))
+                self._scale.append(None)
+        rows = [s["rows"] for s in self.manifest["shards"]]
+        self._offsets = np.concatenate([[0], np.cumsum(rows)]).astype(np.int64)
+        self.shape = (int(self._offsets[-1]), int(self.manifest["dim"]))
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes_on_disk(self):
+        return sum(os.path.getsize(os.path.join(self.path, f))
+                   for f in os.listdir(self.path))
+
+    def _rows(self, shard, lo, hi):
+        block = self._data[shard][lo:hi]
+        if self.format == "int8":
+            return dequantize_int8(block, self._scale[shard][lo:hi])
+        return np.asarray(block, dtype=np.float32)
+
+    def _take(self, shard, local):
+        block = self._data[shard][local]
+        if self.format == "int8":
+            return dequantize_int8(block, self._scale[shard][local])
+        return np.asarray(block, dtype=np.float32)
+
+    def __getitem__(self, key):
+        n = self.shape[0]
+        if isinstance(key, (int, np.integer)):
+            return self[np.array([key])][0]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(n)
+            if step != 1:
+                return self[np.arange(start, stop, step)]
+            out = np.empty((max(stop - start, 0), self.shape[1]), dtype=np.float32)
+            first = int(np.searchsorted(self._offsets, start, side="right")) - 1
+            pos = start
+            for s in range(max(first, 0), len(self._data)):
+                if pos >= stop:
+                    break
+                lo, hi = self._offsets[s], self._offsets[s + 1]
+                e = min(stop, hi)
+                out[pos - start:e - start] = self._rows(s, pos - lo, e - lo)
+                pos = e
+            return out
+        idx = np.asarray(key)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        idx = np.where(idx < 0, idx + n, idx).astype(np.int64)
+        if len(idx) and (idx.min() < 0 or idx.max() >= n):
+            raise IndexError(f"row index out of range for {n} rows")
+        out = np.empty((len(idx), self.shape[1]), dtype=np.float32)
+        shard_of = np.searchsorted(self._offsets, idx, side="right") - 1
+        for s in np.unique(shard_of):
+            sel = np.flatnonzero(shard_of == s)
+            out[sel] = self._take(s, idx[sel] - self._offsets[s])
+        return out
+
+    def iter_blocks(self, block_rows=READ_BLOCK_ROWS):
+        """Yield (start, float32 block) over all rows in order."""
+        for start in range(0, self.shape[0], block_rows):
+            yield start, self[start:start + block_rows]
+
+    def dot(self, Q, block_rows=READ_BLOCK_ROWS):
+        """X @ Q.T for query rows Q (m, D) -> (n, m) float32, dequantizing
+        one block at a time."""
+        Q_T = np.ascontiguousarray(np.asarray(Q, dtype=np.float32).T)
+        out = np.empty((self.shape[0], Q_T.shape[1]), dtype=np.float32)
+        for start, block in self.iter_blocks(block_rows):
+            np.matmul(block, Q_T, out=out[start:start + len(block)])
+        return out
+
+    def to_array(self, block_rows=READ_BLOCK_ROWS):
+        """Whole store as one float32 array, filled block by block."""
+        out = np.empty(self.shape, dtype=np.float32)
+        for start, block in self.iter_blocks(block_rows):
+            out[start:start + len(block)] = block
+        return out
+
+    def ids(self):
+        if not self.manifest.get("has_ids"):
+            return None
+        return pd.concat([pd.read_parquet(os.path.join(self.path, f"{s['name']}.ids.parquet"))
+                          for s in self.manifest["shards"]], ignore_index=True)["id"]
+
+
+def write_store(path, X, fmt="int8", ids=None, shard_rows=SHARD_ROWS, meta=None,
+                block_rows=READ_BLOCK_ROWS):
+    """Write an in-memory / memory-mapped array (or another store) as a store."""
+    with EmbeddingStoreWriter(path, X.shape[1], fmt, shard_rows, meta) as w:
+        for start in range(0, X.shape[0], block_rows):
+            stop = min(start + block_rows, X.shape[0])
+            w.append(X[start:stop], None if ids is None else list(ids[start:stop]))
+    return path
+
+
+def stitch_npy(store_path, out_npy, out_ids=None, id_col="id", dtype=np.float32,
+               block_rows=READ_BLOCK_ROWS, remove=True):
+    """Write a store as one .npy (and its ids as a one-column parquet), block
+    by block through a memory map; remove the store afterwards."""
+    store = EmbeddingStore(store_path)
+    X = np.lib.format.open_memmap(out_npy, mode="w+", dtype=dtype, shape=store.shape)
+    for start, block in store.iter_blocks(block_rows):
+        X[start:start + len(block)] = block
+    X.flush()
+    del X
+    if out_ids is not None:
+        pd.DataFrame({id_col: store.ids()}).to_parquet(out_ids, index=False)
+    if remove:
+        del store
+        shutil.rmtree(store_path)
+    return out_npy
+
+
+def iter_parquet_batches(path, columns, batch_rows, start=0, stop=None):
+    """Yield pyarrow RecordBatches of rows [start, stop) of a parquet file,
+    read sequentially by row group; row groups wholly before `start` are
+    skipped via the footer metadata instead of being scanned."""
+    pf = pq.ParquetFile(path)
+    n = pf.metadata.num_rows if stop is None else min(stop, pf.metadata.num_rows)
+    groups, first_row, row = [], None, 0
+    for i in range(pf.num_row_groups):
+        g_rows = pf.metadata.row_group(i).num_rows
+        if row + g_rows > start and row < n:
+            groups.append(i)
+            first_row = row if first_row is None else first_row
+        row += g_rows
+    if not groups:
+        return
+    pos = first_row
+    for batch in pf.iter_batches(batch_size=batch_rows, row_groups=groups,
+                                 columns=columns):
+        lo, hi = max(start - pos, 0), min(n - pos, batch.num_rows)
+        pos += batch.num_rows
+        if hi > lo:
+            yield batch.slice(lo, hi - lo)
+        if pos >= n:
+            break
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, "manifest.json"))
+
+
+def open_embeddings(path, mmap=True):
+    """Memory-mapped .npy or an EmbeddingStore, whichever path points at."""
+    if is_store(path):
+        return EmbeddingStore(path, mmap=mmap)
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+def resolve_embeddings(stem):
+    """stem.npy if it exists, else stem.store (None if neither)."""
+    for path in (f"{stem}.npy", f"{stem}{STORE_SUFFIX}"):
+        if os.path.exists(path):
+            return path
+    return None
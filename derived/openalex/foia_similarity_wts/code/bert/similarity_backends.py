@@ -0,0 +1,105 @@
+"""
+Universe x FOIA top-K cosine backends for bert/2_similarity_wts.py.
+
+  topk_torch(X_univ, X_foia, k, threshold, batch_size)
+      The original path: fp16 torch matmul in large universe batches,
+      torch.topk per batch. Right on a GPU; on CPU fp16 matmul is slower than
+      fp32 and every batch is copied out of the mmap first.
+
+  topk_cpu(X_univ, X_foia, k, threshold, n_jobs, tile_rows)
+      float32 BLAS through tfidf/topk_engine.py: the memory-mapped universe
+      is read in tile_rows blocks (a 1024 x 768 float32 block is 3 MB, its
+      similarity tile against ~200 FOIAs under 1 MB), each block is reduced
+      to its running top-K while hot, and n_jobs threads work on disjoint
+      row spans with single-threaded BLAS each (no oversubscription).
+
+Both return a topk_engine.TopK with float32 sims sorted descending and
+n_above_floor counted against `threshold`, so W and the neighbor index are
+built the same way whichever backend ran.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tfidf"))
+from topk_engine import TopK, topk_similarity  # noqa: E402
+
+CPU_TILE_ROWS = 1024
+
+
+def available_cpus():
+    """Cores this process may use: SLURM allocation, else the affinity mask."""
+    for var in ("BERT_SIM_WORKERS", "SLURM_CPUS_PER_TASK"):
+        v = os.environ.get(var)
+        if v:
+            try:
+                return max(1, int(v))
+            except ValueError:
+                pass
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def topk_cpu(X_univ, X_foia, k, threshold=0.0, n_jobs=None,
+             tile_rows=CPU_TILE_ROWS):
+    n_jobs = n_jobs or available_cpus()
+    X_foia = np.asarray(X_foia, dtype=np.float32)
+    with threadpool_limits(limits=1, user_api="blas"):
+        return topk_similarity(X_univ, X_foia, k, floor=threshold,
+                               n_jobs=n_jobs, tile_rows=tile_rows)
+
+
+def topk_torch(X_univ, X_foia, k, threshold=0.0, batch_size=200_000,
+               device=None, progress=True):
+    import torch
+
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    n_univ = X_univ.shape[0]
+    k = min(k, X_foia.shape[0])
+    foia_t = torch.from_numpy(np.asarray(X_foia)).to(device).half()  # (n_foia, dim) fp16
+
+    top = TopK(
+        idx=np.empty((n_univ, k), dtype=np.int32),
+        sim=np.empty((n_univ, k), dtype=np.float32),
+        max_sim=np.empty(n_univ, dtype=np.float32),
+        mean_topk_sim=np.empty(n_univ, dtype=np.float32),
+        n_above_floor=np.empty(n_univ, dtype=np.int32),
+    )
+    t0 = time.time()
+    for start in range(0, n_univ, batch_size):
+        end = min(start + batch_size, n_univ)
+        batch = torch.from_numpy(np.ascontiguousarray(X_univ[start:end])).to(device).half()
+        sim = batch @ foia_t.T  # (B, n_foia)
+        del batch
+
+        topk_vals, topk_idx = torch.topk(sim, k=k, dim=1)  # (B, k), sorted
+        top.idx[start:end] = topk_idx.cpu().numpy()
+        top.sim[start:end] = topk_vals.cpu().float().numpy()
+        top.n_above_floor[start:end] = (sim >= threshold).sum(dim=1).cpu().numpy()
+        del sim
+
+        if progress:
+            elapsed = time.time() - t0
+            rate = end / elapsed if elapsed else 0.0
+            eta = (n_univ - end) / rate if rate else float("inf")
+            print(f"  {end:,}/{n_univ:,}  ({rate:,.0f}/s, ETA {eta/60:.1f}min)", flush=True)
+
+    top.max_sim[:] = top.sim[:, 0]
+    top.mean_topk_sim[:] = top.sim.mean(axis=1)
+    return top
+
+
+def threshold_l1_weights(top, k, threshold=0.0):
+    """The bert W recipe on the first k neighbors: zero sims below threshold
+    (when > 0), then L1-normalize each row. Returns (n, k) float32."""
+    vals = np.array(top.sim[:, :k], dtype=np.float32)
+    if threshold > 0:
+        vals[vals < threshold] = 0.0
+    row_sums = vals.sum(axis=1, keepdims=True)
+    row_sums[row_sums <= 0] = 1.0
+    return vals / row_sums
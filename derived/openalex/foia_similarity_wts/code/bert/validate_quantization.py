@@ -0,0 +1,143 @@
+"""
+Recall@K of a quantized embedding store against the float32 embeddings.
+
+For a sample of universe rows, finds the top-K FOIA neighbors (the query
+set 2_similarity_wts.py uses) from the float32 .npy and from the store, and
+reports how much of the exact top-K list the store recovers, the cosine
+error, and the production W (top-5, L1) difference. Any other query matrix
+can be swapped in with --queries, e.g. cluster centroids to check that
+paper -> cluster assignments survive quantization (recall@1).
+
+If the store does not exist yet it is built from the .npy first, so this is
+also the conversion command:
+
+    python validate_quantization.py --model allenai-specter            # int8
+    python validate_quantization.py --model allenai-specter --format float16
+    python validate_quantization.py \\
+        --ref ../../../cluster_fields/output/bert/paper_embeddings.npy \\
+        --store ../../../cluster_fields/output/bert/paper_embeddings.store \\
+        --queries ../../../cluster_fields/output/bert/cluster_centroids_K50.npy
+
+Output: ../../output/quantization_recall_{tag}_{format}.csv (one row per K)
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from embedding_store import (STORE_FORMATS, STORE_SUFFIX, EmbeddingStore,
+                             write_store)
+from similarity_backends import available_cpus, threshold_l1_weights, topk_cpu
+
+OUT_DIR = "../../output"
+
+
+def recall_at_k(ref_idx, q_idx, k):
+    """Mean |top-k(ref) & top-k(quantized)| / k over rows."""
+    hits = (ref_idx[:, :k, None] == q_idx[:, None, :k]).any(axis=2).sum(axis=1)
+    return float(hits.mean() / k)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", default="allenai-specter",
+                    help="Model tag matching 1_vectorize.py output filenames.")
+    ap.add_argument("--format", default="int8", choices=STORE_FORMATS,
+                    help="Store format to build (if missing) and validate.")
+    ap.add_argument("--ref", default=None,
+                    help="float32/float16 .npy reference (default: bert_universe_<tag>.npy).")
+    ap.add_argument("--store", default=None,
+                    help="Store directory (default: bert_universe_<tag>.store).")
+    ap.add_argument("--queries", default=None,
+                    help="Query .npy (default: bert_foia_<tag>.npy).")
+    ap.add_argument("--ks", type=int, nargs="+", default=[1, 5, 20])
+    ap.add_argument("--w-k", type=int, default=5,
+                    help="k of the production W recipe compared (threshold 0, L1).")
+    ap.add_argument("--sample", type=int, default=200_000,
+                    help="Rows to validate on (0 = all).")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--rebuild", action="store_true",
+                    help="Rebuild the store from --ref even if it exists.")
+    args = ap.parse_args()
+
+    tag = args.model.replace("/", "_")
+    ref_path = args.ref or f"{OUT_DIR}/bert_universe_{tag}.npy"
+    store_path = args.store or f"{OUT_DIR}/bert_universe_{tag}{STORE_SUFFIX}"
+    query_path = args.queries or f"{OUT_DIR}/bert_foia_{tag}.npy"
+    out_csv = f"{OUT_DIR}/quantization_recall_{tag}_{args.format}.csv"
+    for p in (ref_path, query_path):
+        if not os.path.exists(p):
+            raise SystemExit(f"missing: {p}")
+
+    ref = np.load(ref_path, mmap_mode="r")
+    if args.rebuild or not os.path.exists(store_path):
+        print(f"Building {args.format} store {store_path} from {ref_path} ...")
+        t0 = time.time()
+        write_store(store_path, ref, args.format, meta={"model": args.model,
+                                                        "source": ref_path})
+        print(f"  {time.time() - t0:.1f}s")
+    store = EmbeddingStore(store_path)
+    if store.shape != ref.shape:
+        raise SystemExit(f"store {store.shape} != reference {ref.shape}")
+    if store.format != args.format:
+        print(f"NOTE: {store_path} is {store.format}, not {args.format}.")
+    Q = np.load(query_path).astype(np.float32)
+    ref_bytes = os.path.getsize(ref_path)
+    print(f"Reference {ref.shape} {ref.dtype}: {ref_bytes / 1e9:.2f} GB   "
+          f"store ({store.format}): {store.nbytes_on_disk / 1e9:.2f} GB   "
+          f"queries: {Q.shape}")
+
+    n = ref.shape[0]
+    rng = np.random.default_rng(args.seed)
+    rows = (np.arange(n) if not args.sample or args.sample >= n
+            else np.sort(rng.choice(n, size=args.sample, replace=False)))
+    X_ref = np.asarray(ref[rows], dtype=np.float32)
+    X_q = store[rows]
+    print(f"Validating on {len(rows):,} rows")
+
+    k_max = min(max(args.ks + [args.w_k]), Q.shape[0])
+    n_jobs = available_cpus()
+    top_ref = topk_cpu(X_ref, Q, k_max, n_jobs=n_jobs)
+    top_q = topk_cpu(X_q, Q, k_max, n_jobs=n_jobs)
+
+    # cosine error on the exact neighbors, computed directly
+    sim_ref = np.take_along_axis(X_ref @ Q.T, top_ref.idx, axis=1)
+    sim_q = np.take_along_axis(X_q @ Q.T, top_ref.idx, axis=1)
+    err = np.abs(sim_q - sim_ref)
+
+    w_k = min(args.w_k, k_max)
+    same_set = (np.sort(top_ref.idx[:, :w_k], axis=1)
+                == np.sort(top_q.idx[:, :w_k], axis=1)).all(axis=1)
+    w_ref = threshold_l1_weights(top_ref, w_k)
+    w_q = threshold_l1_weights(top_q, w_k)
+    order_ref = np.argsort(top_ref.idx[:, :w_k], axis=1)
+    order_q = np.argsort(top_q.idx[:, :w_k], axis=1)
+    w_diff = np.abs(np.take_along_axis(w_ref, order_ref, axis=1)
+                    - np.take_along_axis(w_q, order_q, axis=1))[same_set]
+
+    out = []
+    for k in sorted(set(min(k, k_max) for k in args.ks)):
+        out.append({
+            "k": k,
+            "recall": recall_at_k(top_ref.idx, top_q.idx, k),
+            "top1_agree": float((top_ref.idx[:, 0] == top_q.idx[:, 0]).mean()),
+            "n_rows": len(rows),
+            "format": store.format,
+            "mean_abs_cos_err": float(err[:, :k].mean()),
+            "max_abs_cos_err": float(err[:, :k].max()),
+            "max_sim_abs_err": float(np.abs(top_q.max_sim - top_ref.max_sim).max()),
+            f"w{w_k}_same_neighbors": float(same_set.mean()),
+            f"w{w_k}_max_abs_weight_diff": float(w_diff.max()) if len(w_diff) else np.nan,
+            "ref_gb": ref_bytes / 1e9,
+            "store_gb": store.nbytes_on_disk / 1e9,
+        })
+    df = pd.DataFrame(out)
+    print(df.to_string(index=False))
+    df.to_csv(out_csv, index=False)
+    print(f"Saved {out_csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -34,12 +34,16 @@ Outputs:
 import argparse
 import os
 import re
+import sys
 
 import numpy as np
 import pandas as pd
 import scipy.sparse
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tfidf"))
+from neighbor_index import index_path, load_max_sim  # noqa: E402
+
 CLUSTER_DIR = "../../us_cluster_fields/output"
 OUT_DIR = "../output"
 FIG_DIR = f"{OUT_DIR}/figures"
@@ -117,6 +121,7 @@ def main():
     universe_ids_path  = f"{OUT_DIR}/universe_ids{tag}.parquet"
     weight_matrix_path = f"{OUT_DIR}/weight_matrix{tag}.npz"
     diag_path          = f"{OUT_DIR}/match_diagnostics{tag}.parquet"
+    index_dir          = index_path(OUT_DIR, tag)
     exposure_dta       = f"{EXPOSURE_DIR}/athr_exposure_{args.version}.dta"
 
     filt_sfx = "" if args.min_foia_per_cluster <= 1 else f"_cf{args.min_foia_per_cluster}"
@@ -128,7 +133,7 @@ def main():
     out_overall = f"{OUT_DIR}/k{args.k}_cluster_sanity_overall_{args.version}{tag}{filt_sfx}.txt"
 
     for p in (cluster_csv, cluster_desc, foia_ids_path, universe_ids_path,
-              weight_matrix_path, diag_path, exposure_dta):
+              weight_matrix_path, exposure_dta):
         if not os.path.exists(p):
             raise SystemExit(f"missing: {p}")
 
@@ -160,8 +165,15 @@ def main():
             f"foia={len(foia_ids)}"
         )
 
-    print("Loading diagnostics + FOIA exposure...")
-    diag = pd.read_parquet(diag_path)[["athr_id", "max_sim"]]
+    # max_sim straight from the neighbor index when 2_similarity_wts.py
+    # wrote one; older runs only have the match diagnostics.
+    print("Loading max_sim + FOIA exposure...")
+    if os.path.exists(index_dir):
+        diag = load_max_sim(index_dir)
+    elif os.path.exists(diag_path):
+        diag = pd.read_parquet(diag_path)[["athr_id", "max_sim"]]
+    else:
+        raise SystemExit(f"missing: {index_dir}/ and {diag_path}")
     diag["athr_id"] = diag["athr_id"].astype(str)
     df_exp = pd.read_stata(exposure_dta)[["athr_id", "exposure"]]
     df_exp["athr_id"] = df_exp["athr_id"].astype(str)
@@ -1,10 +1,18 @@
 import argparse
+import hashlib
+import json
 import os
 import math
+import multiprocessing
 import pickle
+import resource
+import shutil
+import time
+import joblib
 import numpy as np
 import pandas as pd
 import scipy.sparse
+import pyarrow.parquet as pq
 from joblib import Parallel, delayed
 from sklearn.feature_extraction.text import TfidfVectorizer
 
@@ -53,6 +61,31 @@ FOIA_MAX_DF_FRAC = 0.85
 N_JOBS = int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count() or 1))
 TRANSFORM_CHUNK_SIZE = 20_000  # rows per worker task; smaller → better load balance
 
+# Universe transform backend (--transform-backend):
+#   fork: workers are forked after the fit, so the fitted vectorizer (100k-term
+#         4-gram vocab) is inherited copy-on-write instead of pickled per task.
+#         Each worker reads its own parquet row groups, transforms them and
+#         writes a CSR block to disk; blocks are then copied into one
+#         preallocated CSR by offset (no vstack of in-RAM chunk lists).
+#   loky: the original path -- joblib pickles the vectorizer + each text chunk
+#         to every task and vstacks the returned matrices. Kept for comparison.
+TRANSFORM_BACKEND = "fork"
+# Row groups larger than this are not streamed from parquet (one task would be
+# too coarse); the fork workers slice the inherited in-memory text list instead.
+STREAM_MAX_ROW_GROUP = 4 * TRANSFORM_CHUNK_SIZE
+
+# Fitted-vectorizer cache. The expensive part of this script (fit + full
+# universe transform) depends only on the universe file, the FOIA texts and
+# the vectorizer params, not on FOIA-aware pruning, --min-foia-words or the
+# LS-cluster restriction. So the fitted vectorizer and the *unpruned* FOIA and
+# universe matrices are stored under TFIDF_CACHE_DIR/<key>/, key = hash of
+# those inputs + CACHE_VERSION. Reruns that only change pruning / FOIA
+# filtering / restriction row- and column-slice the cached matrices and
+# re-L2-normalize, which is exactly what the transform→prune path computes.
+# Bump CACHE_VERSION whenever the fit or transform logic changes.
+TFIDF_CACHE_DIR = os.path.join(OUTPUT_DIR, "tfidf_cache")
+CACHE_VERSION = 1
+
 
 def _l2_normalize_rows(M):
     """Vectorized per-row L2 normalization for a sparse matrix."""
@@ -61,10 +94,249 @@ def _l2_normalize_rows(M):
     return (scipy.sparse.diags(inv) @ M).astype(np.float32)
 
 
-def transform_chunk(vec, texts, keep_idx):
-    """Worker: transform a slice of texts, prune to FOIA-relevant cols, L2-renormalize."""
-    m = vec.transform(texts)[:, keep_idx]
-    return _l2_normalize_rows(m).tocsr()
+def transform_chunk(vec, texts):
+    """Worker: transform a slice of texts (unpruned, rows L2-normalized by tfidf)."""
+    return vec.transform(texts).astype(np.float32).tocsr()
+
+
+def _prune(M, rows, keep_idx):
+    """Select rows, prune to FOIA-relevant cols, L2-renormalize."""
+    if rows is not None:
+        M = M[rows]
+    return _l2_normalize_rows(M[:, keep_idx]).tocsr()
+
+
+def _file_identity(path):
+    st = os.stat(path)
+    return [os.path.realpath(path), st.st_size, st.st_mtime_ns]
+
+
+def _digest_strings(values):
+    h = hashlib.blake2b(digest_size=16)
+    for v in values:
+        h.update(str(v).encode("utf-8", "surrogatepass"))
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+
+def _cache_key(inputs):
+    payload = json.dumps(inputs, sort_keys=True).encode()
+    return hashlib.blake2b(payload, digest_size=10).hexdigest()
+
+
+def load_universe():
+    """Universe authors with non-empty text, in parquet order."""
+    print("Loading Universe Data...")
+    df_universe = pd.read_parquet(UNIVERSE_PATH, columns=['athr_id', 'processed_text'])
+    print(f"Total authors loaded: {df_universe['athr_id'].nunique()}")
+
+    df_universe['processed_text'] = df_universe['processed_text'].fillna("").astype(str).str.strip()
+
+    print("Filtering empty text...")
+    initial_count = len(df_universe)
+    # raw_row = position in the parquet file, so fork workers can re-read a
+    # row's text from its row group instead of receiving it.
+    df_universe['raw_row'] = np.arange(initial_count)
+    df_universe = df_universe[df_universe['processed_text'].str.len() > 0].reset_index(drop=True)
+    final_count = len(df_universe)
+    print(f"Dropped {initial_count - final_count} authors with no text.")
+    print(f"Final Universe Size: {final_count}")
+    return df_universe
+
+
+def fit_vectorizer(universe_texts, foia_texts, min_df, max_df, max_features):
+    """Fit the TF-IDF vectorizer on (a sample of) the universe plus all FOIA docs."""
+    print(f"Fitting vectorizer (min_df={min_df}, max_df={max_df}, "
+          f"max_features={max_features})...")
+    tfidf = TfidfVectorizer(
+        min_df=min_df,
+        max_df=max_df,
+        max_features=max_features,
+        ngram_range=NGRAM_RANGE,
+        dtype=np.float32,
+        norm='l2',
+        sublinear_tf=True,
+        tokenizer=str.split,
+        token_pattern=None,
+    )
+
+    n_universe = len(universe_texts)
+    if n_universe > SAMPLE_SIZE:
+        sample_min_df = max(1, int(round(min_df * SAMPLE_SIZE / n_universe)))
+        print(f"  fit on {SAMPLE_SIZE:,}-row universe sample + {len(foia_texts)} FOIA docs (min_df={sample_min_df})...")
+        tfidf.set_params(min_df=sample_min_df)
+        fit_texts = (
+            universe_texts.sample(n=SAMPLE_SIZE, random_state=42).tolist()
+            + foia_texts.tolist()
+        )
+        tfidf.fit(fit_texts)
+        del fit_texts
+    else:
+        tfidf.fit(pd.concat([universe_texts, foia_texts]).tolist())
+
+    print(f"Vocab size after fit: {len(tfidf.get_feature_names_out())}")
+    return tfidf
+
+
+def _peak_rss_gb():
+    """(main process, largest reaped child) peak RSS in GB (Linux: KB units)."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own / 1e6, child / 1e6
+
+
+# Set in the parent right before forking the transform pool; workers read it
+# through fork inheritance, so nothing here is ever pickled.
+_FORK_STATE = {}
+
+
+def _read_universe_texts(raw_start, raw_end, raw_rows):
+    """Texts of raw_rows (sorted, within [raw_start, raw_end)) read straight
+    from the row groups that cover that range, normalized like load_universe."""
+    st = _FORK_STATE
+    pf = pq.ParquetFile(UNIVERSE_PATH)
+    first = int(np.searchsorted(st['rg_starts'], raw_start, side='right')) - 1
+    last = int(np.searchsorted(st['rg_starts'], raw_end, side='left'))
+    col = pd.concat([
+        pf.read_row_group(i, columns=['processed_text']).to_pandas()['processed_text']
+        for i in range(first, last)
+    ], ignore_index=True)
+    col = col.iloc[raw_rows - st['rg_starts'][first]]
+    return col.fillna("").astype(str).str.strip().tolist()
+
+
+def _fork_transform_task(task):
+    """Worker: transform universe rows in raw parquet range [raw_start,
+    raw_end) and write them to a CSR block on disk."""
+    task_id, raw_start, raw_end = task
+    st = _FORK_STATE
+    lo, hi = np.searchsorted(st['raw_rows'], [raw_start, raw_end])
+    if lo == hi:
+        return task_id, 0, 0, None
+    if st['texts'] is not None:
+        texts = st['texts'][lo:hi]
+    else:
+        texts = _read_universe_texts(raw_start, raw_end, st['raw_rows'][lo:hi])
+    parts = [transform_chunk(st['vec'], texts[i:i + TRANSFORM_CHUNK_SIZE])
+             for i in range(0, len(texts), TRANSFORM_CHUNK_SIZE)]
+    M = parts[0] if len(parts) == 1 else scipy.sparse.vstack(parts, format='csr')
+    path = os.path.join(st['block_dir'], f"block-{task_id:06d}.npz")
+    scipy.sparse.save_npz(path, M, compressed=False)
+    return task_id, M.shape[0], M.nnz, path
+
+
+def _concat_blocks(blocks, n_cols):
+    """Copy on-disk CSR blocks (in task order) into one preallocated CSR."""
+    n_rows = sum(b[1] for b in blocks)
+    nnz = sum(b[2] for b in blocks)
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    indices = np.empty(nnz, dtype=np.int32)
+    data = np.empty(nnz, dtype=np.float32)
+    row, off = 0, 0
+    for _, m, k, path in blocks:
+        if path is None:
+            continue
+        B = scipy.sparse.load_npz(path)
+        indptr[row + 1:row + m + 1] = B.indptr[1:] + off
+        indices[off:off + k] = B.indices
+        data[off:off + k] = B.data
+        row, off = row + m, off + k
+        os.remove(path)
+    return scipy.sparse.csr_matrix((data, indices, indptr), shape=(n_rows, n_cols))
+
+
+def transform_universe_fork(tfidf, raw_rows, texts, block_dir):
+    """Unpruned universe matrix via a fork pool (see TRANSFORM_BACKEND).
+
+    raw_rows: sorted parquet positions of the universe rows to transform.
+    texts:    the same rows' texts (Series), used only when the parquet row
+              groups are too coarse to stream.
+    """
+    pf = pq.ParquetFile(UNIVERSE_PATH)
+    rg_sizes = np.array([pf.metadata.row_group(i).num_rows
+                         for i in range(pf.metadata.num_row_groups)], dtype=np.int64)
+    rg_starts = np.concatenate([[0], np.cumsum(rg_sizes)])
+    stream = len(rg_sizes) > 0 and rg_sizes.max() <= STREAM_MAX_ROW_GROUP
+    if stream:
+        tasks = [(i, int(rg_starts[i]), int(rg_starts[i + 1])) for i in range(len(rg_sizes))]
+        source = f"{len(tasks)} parquet row groups (streamed in workers)"
+    else:
+        # Chunk in universe-row space, expressed as raw ranges.
+        bounds = list(range(0, len(raw_rows), TRANSFORM_CHUNK_SIZE)) + [len(raw_rows)]
+        edges = [int(raw_rows[b]) for b in bounds[:-1]] + [int(rg_starts[-1])]
+        tasks = [(i, edges[i], edges[i + 1]) for i in range(len(edges) - 1)]
+        source = f"{len(tasks)} chunks of ≤{TRANSFORM_CHUNK_SIZE:,} rows (inherited text)"
+    print(f"Transforming universe ({len(raw_rows):,} rows) from {source} "
+          f"across {N_JOBS} forked workers...")
+
+    os.makedirs(block_dir, exist_ok=True)
+    _FORK_STATE.update(vec=tfidf, raw_rows=np.asarray(raw_rows, dtype=np.int64),
+                       texts=None if stream else texts.tolist(), rg_starts=rg_starts,
+                       block_dir=block_dir)
+    blocks = []
+    try:
+        with multiprocessing.get_context("fork").Pool(N_JOBS) as pool:
+            for i, res in enumerate(pool.imap_unordered(_fork_transform_task, tasks), 1):
+                blocks.append(res)
+                if i % max(1, len(tasks) // 10) == 0 or i == len(tasks):
+                    print(f"  {i}/{len(tasks)} blocks written")
+    finally:
+        _FORK_STATE.clear()
+    blocks.sort()
+    matrix_universe = _concat_blocks(blocks, len(tfidf.vocabulary_))
+    shutil.rmtree(block_dir, ignore_errors=True)
+    return matrix_universe
+
+
+def transform_universe(tfidf, texts):
+    """Unpruned universe matrix, transformed in parallel chunks (loky)."""
+    n = len(texts)
+    n_chunks = math.ceil(n / TRANSFORM_CHUNK_SIZE)
+    print(f"Transforming universe in {n_chunks} chunks of ≤{TRANSFORM_CHUNK_SIZE:,} rows "
+          f"across {N_JOBS} workers...")
+
+    chunks = [texts[i:i + TRANSFORM_CHUNK_SIZE] for i in range(0, n, TRANSFORM_CHUNK_SIZE)]
+    chunk_mats = Parallel(n_jobs=N_JOBS, backend="loky", verbose=5)(
+        delayed(transform_chunk)(tfidf, c) for c in chunks
+    )
+    matrix_universe = scipy.sparse.vstack(chunk_mats, format='csr').astype(np.float32)
+    del chunk_mats
+    return matrix_universe
+
+
+def load_cached_fit(cache_dir):
+    """(feature_names, idf, universe_ids, X_universe_full, X_foia_full) or None."""
+    if not os.path.exists(os.path.join(cache_dir, "manifest.json")):
+        return None
+    print(f"Loading cached fit: {cache_dir}")
+    feature_names = np.load(os.path.join(cache_dir, "feature_names.npy"), allow_pickle=True)
+    idf = np.load(os.path.join(cache_dir, "idf.npy"))
+    universe_ids = pd.read_parquet(os.path.join(cache_dir, "universe_ids.parquet"))
+    X_univ = scipy.sparse.load_npz(os.path.join(cache_dir, "universe_full.npz")).tocsr()
+    X_foia = scipy.sparse.load_npz(os.path.join(cache_dir, "foia_full.npz")).tocsr()
+    return feature_names, idf, universe_ids, X_univ, X_foia
+
+
+def save_cached_fit(cache_dir, inputs, tfidf, universe_ids, X_univ, X_foia):
+    """Write the cache entry to a temp dir, then rename, so a killed run never
+    leaves a half-written entry that looks complete."""
+    tmp_dir = f"{cache_dir}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    joblib.dump(tfidf, os.path.join(tmp_dir, "vectorizer.joblib"))
+    np.save(os.path.join(tmp_dir, "feature_names.npy"), tfidf.get_feature_names_out())
+    np.save(os.path.join(tmp_dir, "idf.npy"), tfidf.idf_)
+    universe_ids.to_parquet(os.path.join(tmp_dir, "universe_ids.parquet"), index=False)
+    # Uncompressed: these are re-read on every rerun and load time is the point.
+    scipy.sparse.save_npz(os.path.join(tmp_dir, "universe_full.npz"), X_univ, compressed=False)
+    scipy.sparse.save_npz(os.path.join(tmp_dir, "foia_full.npz"), X_foia, compressed=False)
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump({"inputs": inputs, "universe_shape": list(X_univ.shape),
+                   "foia_shape": list(X_foia.shape),
+                   "created": time.strftime("%Y-%m-%d %H:%M:%S")}, f, indent=2)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    print(f"Saved fit cache: {cache_dir}")
 
 
 def restrict_to_ls_clusters(df_universe, df_foia, cluster_labels_path,
@@ -96,7 +368,7 @@ def restrict_to_ls_clusters(df_universe, df_foia, cluster_labels_path,
     univ_labeled = df_universe.merge(labels, on='athr_id', how='left')
     n_no_label = univ_labeled['cluster_label'].isna().sum()
     keep_mask = univ_labeled['cluster_label'].isin(ls_clusters)
-    kept = univ_labeled.loc[keep_mask, ['athr_id', 'processed_text']].reset_index(drop=True)
+    kept = univ_labeled.loc[keep_mask, list(df_universe.columns)].reset_index(drop=True)
 
     audit = {
         'cluster_labels_path': cluster_labels_path,
@@ -142,6 +414,18 @@ def main():
                          "many whitespace-split tokens. Use ~50 to remove the "
                          "idx-64 case where a 16-word doc behaves as a generic-"
                          "term magnet after sublinear_tf + L2.")
+    ap.add_argument("--fit-on-restricted", action="store_true",
+                    help="Fit the vectorizer on the restricted universe and the "
+                         "post --min-foia-words FOIA list (the pre-cache "
+                         "behaviour). Default fits on the full universe + all "
+                         "usable FOIA docs so that one cached fit serves every "
+                         "restriction / FOIA filter.")
+    ap.add_argument("--rebuild-cache", action="store_true",
+                    help="Refit and retransform even if a cached fit exists.")
+    ap.add_argument("--transform-backend", choices=["fork", "loky"],
+                    default=TRANSFORM_BACKEND,
+                    help="Universe transform path (see TRANSFORM_BACKEND). "
+                         "Timing and peak RSS are printed for either.")
     args = ap.parse_args()
 
     cfg_min_df            = args.min_df
@@ -157,20 +441,7 @@ def main():
 
     print(f"Using N_JOBS={N_JOBS} for parallel transform")
     print(f"Output tag suffix: {tag!r}")
-
-    # --- LOAD DATA ---
-    print("Loading Universe Data...")
-    df_universe = pd.read_parquet(UNIVERSE_PATH, columns=['athr_id', 'processed_text'])
-    print(f"Total authors loaded: {df_universe['athr_id'].nunique()}")
-
-    df_universe['processed_text'] = df_universe['processed_text'].fillna("").astype(str).str.strip()
-
-    print("Filtering empty text...")
-    initial_count = len(df_universe)
-    df_universe = df_universe[df_universe['processed_text'].str.len() > 0].reset_index(drop=True)
-    final_count = len(df_universe)
-    print(f"Dropped {initial_count - final_count} authors with no text.")
-    print(f"Final Universe Size: {final_count}")
+    t_start = time.time()
 
     print("Loading FOIA Data...")
     df_foia = pd.read_csv(FOIA_PATH)
@@ -183,58 +454,89 @@ def main():
         dropped = df_foia.loc[text_len < 50, 'athr_id'].tolist()
         print(f"  dropping {len(dropped)} FOIAs with empty/short text: {dropped}")
         df_foia = df_foia.loc[text_len >= 50].reset_index(drop=True)
+    # Rows of df_foia kept for this run; the cached FOIA matrix covers them all.
+    foia_rows = np.arange(len(df_foia))
     if cfg_min_foia_words > 0:
         word_counts = df_foia['processed_text'].str.split().str.len().fillna(0)
-        short = word_counts < cfg_min_foia_words
+        short = (word_counts < cfg_min_foia_words).to_numpy()
         if short.any():
             dropped = df_foia.loc[short, 'athr_id'].tolist()
             print(f"  dropping {int(short.sum())} FOIAs with <{cfg_min_foia_words} words: {dropped}")
-            df_foia = df_foia.loc[~short].reset_index(drop=True)
-    n_foia = len(df_foia)
+            foia_rows = np.flatnonzero(~short)
+    df_foia_run = df_foia.iloc[foia_rows].reset_index(drop=True)
+    n_foia = len(df_foia_run)
     print(f"FOIA PIs: {n_foia}")
 
-    # --- OPTIONAL: RESTRICT UNIVERSE TO LIFE-SCIENCE CLUSTERS ---
+    # --- CACHE KEY: everything the fit + unpruned transforms depend on ---
+    df_universe = None
     audit = None
-    if args.restrict_to_ls_clusters:
-        df_universe, audit = restrict_to_ls_clusters(
-            df_universe, df_foia,
+    fit_inputs = {
+        'version': CACHE_VERSION,
+        'universe': _file_identity(UNIVERSE_PATH),
+        'min_df': cfg_min_df, 'max_df': cfg_max_df,
+        'max_features': cfg_max_features, 'ngram_range': list(NGRAM_RANGE),
+        'sample_size': SAMPLE_SIZE,
+    }
+    if args.fit_on_restricted:
+        # The fit corpus is this run's universe/FOIA rows, so they key the cache.
+        df_universe = load_universe()
+        if args.restrict_to_ls_clusters:
+            df_universe, audit = restrict_to_ls_clusters(
+                df_universe, df_foia_run,
+                args.cluster_labels_path, args.cluster_worksheet_path,
+            )
+        df_foia = df_foia_run
+        foia_rows = np.arange(n_foia)
+        fit_inputs['universe_ids'] = _digest_strings(df_universe['athr_id'])
+    fit_inputs['foia'] = _digest_strings(df_foia['athr_id'].astype(str) + "\x1f" + df_foia['processed_text'])
+    cache_dir = os.path.join(TFIDF_CACHE_DIR, _cache_key(fit_inputs))
+
+    cached = None if args.rebuild_cache else load_cached_fit(cache_dir)
+    if cached is not None:
+        feature_names, idf, universe_ids, matrix_universe_full, matrix_foia_full = cached
+        print(f"  cache hit: vocab={len(feature_names):,}  universe={matrix_universe_full.shape}")
+    else:
+        if df_universe is None:
+            df_universe = load_universe()
+        # --- FIT VECTORIZER ---
+        tfidf = fit_vectorizer(df_universe['processed_text'], df_foia['processed_text'],
+                               cfg_min_df, cfg_max_df, cfg_max_features)
+
+        # --- TRANSFORM FOIA (single-threaded, 200 docs) ---
+        print("Transforming FOIA...")
+        matrix_foia_full = tfidf.transform(df_foia['processed_text'].tolist()).astype(np.float32).tocsr()
+
+        # --- TRANSFORM UNIVERSE IN PARALLEL (unpruned) ---
+        t0 = time.time()
+        if args.transform_backend == "fork":
+            matrix_universe_full = transform_universe_fork(
+                tfidf, df_universe['raw_row'].to_numpy(), df_universe['processed_text'],
+                f"{cache_dir}.blocks{os.getpid()}")
+        else:
+            matrix_universe_full = transform_universe(tfidf, df_universe['processed_text'].tolist())
+        rss_main, rss_child = _peak_rss_gb()
+        print(f"Universe transform ({args.transform_backend}): {time.time() - t0:.1f}s, "
+              f"nnz={matrix_universe_full.nnz:,}, peak RSS main={rss_main:.2f} GB "
+              f"worker={rss_child:.2f} GB")
+        universe_ids = df_universe[['athr_id']].reset_index(drop=True)
+        del df_universe
+        save_cached_fit(cache_dir, fit_inputs, tfidf, universe_ids,
+                        matrix_universe_full, matrix_foia_full)
+        feature_names = tfidf.get_feature_names_out()
+        idf = tfidf.idf_
+        del tfidf
+
+    # --- OPTIONAL: RESTRICT UNIVERSE TO LIFE-SCIENCE CLUSTERS (row slice) ---
+    universe_rows = None
+    if args.restrict_to_ls_clusters and not args.fit_on_restricted:
+        indexed = universe_ids.assign(_row=np.arange(len(universe_ids)))
+        kept, audit = restrict_to_ls_clusters(
+            indexed, df_foia_run,
             args.cluster_labels_path, args.cluster_worksheet_path,
         )
-        final_count = len(df_universe)
-
-    # --- FIT VECTORIZER ---
-    print(f"Fitting vectorizer (min_df={cfg_min_df}, max_df={cfg_max_df}, "
-          f"max_features={cfg_max_features})...")
-    tfidf = TfidfVectorizer(
-        min_df=cfg_min_df,
-        max_df=cfg_max_df,
-        max_features=cfg_max_features,
-        ngram_range=NGRAM_RANGE,
-        dtype=np.float32,
-        norm='l2',
-        sublinear_tf=True,
-        tokenizer=str.split,
-        token_pattern=None,
-    )
-
-    if final_count > SAMPLE_SIZE:
-        sample_min_df = max(1, int(round(cfg_min_df * SAMPLE_SIZE / final_count)))
-        print(f"  fit on {SAMPLE_SIZE:,}-row universe sample + {n_foia} FOIA docs (min_df={sample_min_df})...")
-        tfidf.set_params(min_df=sample_min_df)
-        fit_texts = (
-            df_universe['processed_text'].sample(n=SAMPLE_SIZE, random_state=42).tolist()
-            + df_foia['processed_text'].tolist()
-        )
-        tfidf.fit(fit_texts)
-        del fit_texts
-    else:
-        tfidf.fit(pd.concat([df_universe['processed_text'], df_foia['processed_text']]).tolist())
-
-    print(f"Vocab size after fit: {len(tfidf.get_feature_names_out())}")
-
-    # --- TRANSFORM FOIA (single-threaded, 200 docs) ---
-    print("Transforming FOIA...")
-    matrix_foia_full = tfidf.transform(df_foia['processed_text'].tolist())
+        universe_rows = kept['_row'].to_numpy()
+        universe_ids = kept[['athr_id']]
+    matrix_foia_full = matrix_foia_full[foia_rows]
 
     # --- FOIA-AWARE VOCAB PRUNING ---
     foia_binary = (matrix_foia_full > 0).astype(np.int32)
@@ -246,24 +548,10 @@ def main():
           f"keeping {keep_mask.sum()} / {len(keep_mask)} features "
           f"(dropped {(~keep_mask).sum()})")
 
-    matrix_foia = _l2_normalize_rows(matrix_foia_full[:, keep_idx]).tocsr()
+    matrix_foia = _prune(matrix_foia_full, None, keep_idx)
     del matrix_foia_full
-
-    # --- TRANSFORM UNIVERSE IN PARALLEL ---
-    texts = df_universe['processed_text'].tolist()
-    n = len(texts)
-    n_chunks = math.ceil(n / TRANSFORM_CHUNK_SIZE)
-    print(f"Transforming universe in {n_chunks} chunks of ≤{TRANSFORM_CHUNK_SIZE:,} rows "
-          f"across {N_JOBS} workers...")
-
-    chunks = [texts[i:i + TRANSFORM_CHUNK_SIZE] for i in range(0, n, TRANSFORM_CHUNK_SIZE)]
-    del texts
-
-    chunk_mats = Parallel(n_jobs=N_JOBS, backend="loky", verbose=5)(
-        delayed(transform_chunk)(tfidf, c, keep_idx) for c in chunks
-    )
-    matrix_universe = scipy.sparse.vstack(chunk_mats, format='csr').astype(np.float32)
-    del chunk_mats
+    matrix_universe = _prune(matrix_universe_full, universe_rows, keep_idx)
+    del matrix_universe_full
 
     print(f"Universe Matrix Shape: {matrix_universe.shape}")
     print(f"FOIA Matrix Shape:     {matrix_foia.shape}")
@@ -274,18 +562,18 @@ def main():
     scipy.sparse.save_npz(f"{OUTPUT_DIR}tfidf_foia{tag}.npz", matrix_foia)
 
     print("Saving ID Lists...")
-    df_universe[['athr_id']].to_parquet(f"{OUTPUT_DIR}universe_ids{tag}.parquet", index=False)
-    df_foia[['athr_id']].to_csv(f"{OUTPUT_DIR}foia_ids_ordered{tag}.csv", index=False)
+    universe_ids[['athr_id']].to_parquet(f"{OUTPUT_DIR}universe_ids{tag}.parquet", index=False)
+    df_foia_run[['athr_id']].to_csv(f"{OUTPUT_DIR}foia_ids_ordered{tag}.csv", index=False)
 
     print("Saving Feature Names (Vocabulary)...")
-    kept_features = tfidf.get_feature_names_out()[keep_idx]
+    kept_features = feature_names[keep_idx]
     with open(f"{OUTPUT_DIR}feature_names{tag}.pkl", "wb") as f:
         pickle.dump(kept_features, f)
 
     pd.DataFrame({
         'feature': kept_features,
         'foia_df': foia_df_counts[keep_idx],
-        'idf': tfidf.idf_[keep_idx],
+        'idf': idf[keep_idx],
     }).to_parquet(f"{OUTPUT_DIR}feature_diagnostics{tag}.parquet", index=False)
 
     if audit is not None:
@@ -294,7 +582,7 @@ def main():
             json.dump(audit, f, indent=2)
         print(f"Saved restrict audit: {OUTPUT_DIR}restrict_audit{tag}.json")
 
-    print("Vectorization Complete.")
+    print(f"Vectorization Complete ({time.time() - t_start:.1f}s).")
 
 
 if __name__ == "__main__":
@@ -3,7 +3,10 @@ import os
 import numpy as np
 import pandas as pd
 import scipy.sparse
-from joblib import Parallel, delayed
+
+from neighbor_index import (INDEX_K, NeighborIndex, index_path, load_index,
+                            match_diagnostics, recipe_weights, save_index)
+from topk_engine import topk_similarity
 
 # --- CONFIGURATION ---
 OUT_DIR = "../../output"
@@ -24,6 +27,7 @@ def _paths(tag: str, out_tag: str = None) -> dict:
         "universe_ids":    f"{OUT_DIR}/universe_ids{tag}.parquet",
         "out_weights":     f"{OUT_DIR}/weight_matrix{out_tag}.npz",
         "out_diag":        f"{OUT_DIR}/match_diagnostics{out_tag}.parquet",
+        "index":           index_path(OUT_DIR, tag),
     }
 
 # Each universe author gets weight on its top-K most-similar FOIA PIs. The weights
@@ -40,7 +44,6 @@ def _paths(tag: str, out_tag: str = None) -> dict:
 #   - UNMATCHED_MAX_SIM_THRESHOLD: authors whose best FOIA match is below this
 #     are flagged unmatched (zero weights). Downstream imputation should drop or
 #     handle these separately rather than receive a spurious imputation.
-BATCH_SIZE = 25_000
 # Defaults below are overridable via CLI. Recipe presets:
 #   variance-preserving (nearest neighbor): --k 1
 #   sharp soft-NN:                          --k 3  --sharpen 5
@@ -56,74 +59,48 @@ L1_NORMALIZE = True
 N_JOBS = int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count() or 1))
 
 
-def process_batch(start, end, X_univ, X_foia_T_dense, k, n_pis):
-    """Compute similarities for rows [start, end), extract top-K, build weight triplets."""
-    batch = X_univ[start:end]
-    # Sparse @ dense returns dense — uses GEMM, much faster than sparse @ sparse.
-    batch_sim = batch.dot(X_foia_T_dense)
-    b = batch_sim.shape[0]
-
-    # Per-row top-K via argpartition (unsorted within top-K, fine since we re-normalize).
-    if k < n_pis:
-        topk_idx = np.argpartition(-batch_sim, k - 1, axis=1)[:, :k]
-    else:
-        topk_idx = np.tile(np.arange(n_pis), (b, 1))
-    rows_local = np.repeat(np.arange(b), k)
-    topk_vals = batch_sim[rows_local, topk_idx.ravel()].reshape(b, k).astype(np.float32)
-
-    # Pre-modification diagnostics.
-    max_sim_b = batch_sim.max(axis=1).astype(np.float32)
-    mean_topk_b = topk_vals.mean(axis=1)
-    n_above_floor_b = (batch_sim >= SIMILARITY_FLOOR).sum(axis=1).astype(np.int32)
-
-    # Apply floor.
-    topk_vals[topk_vals < SIMILARITY_FLOOR] = 0.0
-
-    # Sharpen so the closest PI dominates the weight.
-    if SHARPEN_POWER != 1.0:
-        topk_vals = np.power(topk_vals, SHARPEN_POWER, dtype=np.float32)
-
-    # Unmatched rows: zero out all weights.
-    row_unmatched = max_sim_b < UNMATCHED_MAX_SIM_THRESHOLD
-    topk_vals[row_unmatched, :] = 0.0
-
-    if L1_NORMALIZE:
-        # Weighted-average form: row sums to 1, imputed exposure is a weighted
-        # avg of FOIA exposures. Compresses variance (Jensen-like shrinkage).
-        row_sums = topk_vals.sum(axis=1, keepdims=True)
-        row_sums[row_sums == 0] = 1.0
-        topk_weights = topk_vals / row_sums
-    else:
-        # Raw-sharpened-similarity form: rows do NOT sum to 1. Low-confidence
-        # universe authors get small weights (and thus small imputed values).
-        # Preserves more cross-PI variance at the cost of the "weighted-avg"
-        # interpretation. Use with --scale-by-confidence semantics in step 3.
-        topk_weights = topk_vals
-
-    # Flatten non-zero triplets (with global row offset).
-    nz_mask = (topk_weights > 0).ravel()
-    flat_rows = (rows_local + start)[nz_mask]
-    flat_cols = topk_idx.ravel()[nz_mask]
-    flat_vals = topk_weights.ravel()[nz_mask]
-
-    return {
-        'start': start, 'end': end,
-        'rows': flat_rows.astype(np.int64),
-        'cols': flat_cols.astype(np.int32),
-        'vals': flat_vals.astype(np.float32),
-        'max_sim': max_sim_b,
-        'mean_topk_sim': mean_topk_b,
-        'n_above_floor': n_above_floor_b,
-        'unmatched': row_unmatched,
-    }
+# --recipes keys -> recipe field. A recipe string is comma-separated
+# key=value pairs; unspecified keys fall back to the single-recipe flags.
+RECIPE_KEYS = {
+    "k": ("k", int),
+    "sharpen": ("sharpen", float),
+    "floor": ("floor", float),
+    "unmatched": ("unmatched_threshold", float),
+    "l1": ("l1_normalize", lambda v: v.lower() not in ("0", "false", "no")),
+    "out_tag": ("out_tag", str),
+}
+
+
+def _recipe_tag(r, base):
+    """Default out-tag for a --recipes entry: k{K} plus any non-default knob."""
+    parts = [f"k{r['k']}"]
+    if r["sharpen"] != base["sharpen"]:
+        parts.append(f"sh{r['sharpen']:g}")
+    if r["floor"] != base["floor"]:
+        parts.append(f"f{r['floor']:g}")
+    if r["unmatched_threshold"] != base["unmatched_threshold"]:
+        parts.append(f"u{r['unmatched_threshold']:g}")
+    if r["l1_normalize"] != base["l1_normalize"]:
+        parts.append("raw" if not r["l1_normalize"] else "l1")
+    return "_".join(parts)
+
+
+def parse_recipe(spec, base):
+    """'k=3,sharpen=5,out_tag=k3s5' -> recipe dict (base supplies defaults)."""
+    r = dict(base, out_tag=None)
+    for item in filter(None, (x.strip() for x in spec.split(","))):
+        key, sep, val = item.partition("=")
+        if not sep or key.strip() not in RECIPE_KEYS:
+            raise SystemExit(f"bad --recipes entry {spec!r}: expected key=value "
+                             f"with key in {sorted(RECIPE_KEYS)}")
+        field, conv = RECIPE_KEYS[key.strip()]
+        r[field] = conv(val.strip())
+    if r["out_tag"] is None:
+        r["out_tag"] = _recipe_tag(r, base)
+    return r
 
 
 def main():
-    # Declare globals first — Python requires this before any read of the names
-    # in this function scope (including reading them as argparse defaults).
-    global K_NEIGHBORS, SHARPEN_POWER, SIMILARITY_FLOOR
-    global UNMATCHED_MAX_SIM_THRESHOLD, L1_NORMALIZE
-
     ap = argparse.ArgumentParser()
     ap.add_argument("--tag", default="",
                     help="Suffix matching the --tag passed to 1_vectorize.py. "
@@ -153,80 +130,119 @@ def main():
                     help="Skip L1 normalization of top-K weights. Use this with "
                          "step-3's confidence-scaled imputation to preserve "
                          "cross-PI variance.")
+    ap.add_argument("--recipes", nargs="+", default=None, metavar="SPEC",
+                    help="Build several recipes from ONE similarity pass. Each "
+                         "SPEC is comma-separated key=value with keys "
+                         f"{', '.join(RECIPE_KEYS)}; missing keys use the flags "
+                         "above, missing out_tag is derived (e.g. k3_sh5). "
+                         "E.g. --recipes k=5,out_tag= k=3,out_tag=k3 "
+                         "k=1,out_tag=k1. Top-K is computed once at max(k).")
+    ap.add_argument("--index-k", type=int, default=INDEX_K,
+                    help=f"Neighbors per author kept in the persisted neighbor "
+                         f"index (default {INDEX_K}); any later recipe with "
+                         f"k <= this can be derived from the index alone.")
+    ap.add_argument("--index-dtype", default="float32",
+                    choices=["float32", "float16"],
+                    help="Storage dtype of the raw cosines in the index. "
+                         "float16 halves its size; recipes derived from it "
+                         "then differ from a direct run by fp16 rounding.")
+    ap.add_argument("--no-index", action="store_true",
+                    help="Do not write neighbor_index{tag}/.")
+    ap.add_argument("--from-index", action="store_true",
+                    help="Derive the recipes from an existing neighbor_index{tag}/ "
+                         "instead of recomputing similarity; the TF-IDF "
+                         "matrices are not loaded.")
     args = ap.parse_args()
-    paths = _paths(args.tag, args.out_tag)
-
-    # Override module-level constants so process_batch sees the chosen recipe.
-    K_NEIGHBORS = args.k
-    SHARPEN_POWER = args.sharpen
-    SIMILARITY_FLOOR = args.floor
-    UNMATCHED_MAX_SIM_THRESHOLD = args.unmatched_threshold
-    L1_NORMALIZE = not args.no_l1_normalize
-    print(f"Recipe: K={K_NEIGHBORS}  sharpen={SHARPEN_POWER}  floor={SIMILARITY_FLOOR}  "
-          f"unmatched<{UNMATCHED_MAX_SIM_THRESHOLD}  L1_normalize={L1_NORMALIZE}")
-
-    print(f"Using N_JOBS={N_JOBS} threads  tag={args.tag!r}")
-    print("Loading TF-IDF Matrices...")
-    X_univ = scipy.sparse.load_npz(paths["universe_matrix"]).tocsr().astype(np.float32)
-    X_foia = scipy.sparse.load_npz(paths["foia_matrix"]).tocsr().astype(np.float32)
-
-    # Densify the (n_pis × V) FOIA transpose once. Tiny: 200 × ~few-K features.
-    X_foia_T_dense = X_foia.T.toarray().astype(np.float32)
-
-    n_users = X_univ.shape[0]
-    n_pis = X_foia.shape[0]
-    k = min(K_NEIGHBORS, n_pis)
-
-    print(f"Universe Authors: {n_users:,}")
-    print(f"FOIA PIs (Targets): {n_pis}")
-    print(f"X_foia dense size: {X_foia_T_dense.nbytes / 1e6:.1f} MB")
-    print(f"Computing top-{k} weights in parallel (batch={BATCH_SIZE:,})...")
-
-    batches = [(i, min(i + BATCH_SIZE, n_users)) for i in range(0, n_users, BATCH_SIZE)]
-    # Threading backend: scipy sparse @ dense and numpy ops release the GIL, so
-    # threads scale well — and we avoid pickling huge sparse slices to subprocesses.
-    results = Parallel(n_jobs=N_JOBS, backend="threading", verbose=5)(
-        delayed(process_batch)(s, e, X_univ, X_foia_T_dense, k, n_pis) for s, e in batches
-    )
-
-    print("Merging results...")
-    all_rows = np.concatenate([r['rows'] for r in results])
-    all_cols = np.concatenate([r['cols'] for r in results])
-    all_vals = np.concatenate([r['vals'] for r in results])
-
-    max_sim = np.empty(n_users, dtype=np.float32)
-    mean_topk_sim = np.empty(n_users, dtype=np.float32)
-    n_above_floor = np.empty(n_users, dtype=np.int32)
-    unmatched = np.empty(n_users, dtype=bool)
-    for r in results:
-        s, e = r['start'], r['end']
-        max_sim[s:e] = r['max_sim']
-        mean_topk_sim[s:e] = r['mean_topk_sim']
-        n_above_floor[s:e] = r['n_above_floor']
-        unmatched[s:e] = r['unmatched']
-
-    W = scipy.sparse.coo_matrix(
-        (all_vals, (all_rows, all_cols)), shape=(n_users, n_pis)
-    ).tocsr()
-
-    print(f"Total non-zero weights: {W.nnz:,}")
-    print(f"Unmatched authors (max sim < {UNMATCHED_MAX_SIM_THRESHOLD}): "
-          f"{unmatched.sum():,} ({100*unmatched.mean():.2f}%)")
-    print(f"Mean max-similarity:   {max_sim.mean():.4f}")
-    print(f"Median max-similarity: {np.median(max_sim):.4f}")
-
-    print(f"Saving weight matrix -> {paths['out_weights']}")
-    scipy.sparse.save_npz(paths["out_weights"], W)
-
-    print("Saving per-author match diagnostics...")
-    universe_ids = pd.read_parquet(paths["universe_ids"])
-    pd.DataFrame({
-        'athr_id': universe_ids['athr_id'].values,
-        'max_sim': max_sim,
-        'mean_topk_sim': mean_topk_sim,
-        'n_foia_above_floor': n_above_floor,
-        'unmatched': unmatched,
-    }).to_parquet(paths["out_diag"], index=False)
+
+    base = {
+        "k": args.k, "sharpen": args.sharpen, "floor": args.floor,
+        "unmatched_threshold": args.unmatched_threshold,
+        "l1_normalize": not args.no_l1_normalize,
+    }
+    if args.recipes:
+        recipes = [parse_recipe(spec, base) for spec in args.recipes]
+    else:
+        recipes = [dict(base, out_tag=args.out_tag)]
+    out_tags = [_norm_tag(r["out_tag"] if r["out_tag"] is not None else args.tag)
+                for r in recipes]
+    if len(set(out_tags)) != len(out_tags):
+        raise SystemExit(f"--recipes produce duplicate out tags: {out_tags}")
+    for r in recipes:
+        print(f"Recipe: K={r['k']}  sharpen={r['sharpen']}  floor={r['floor']}  "
+              f"unmatched<{r['unmatched_threshold']}  "
+              f"L1_normalize={r['l1_normalize']}  out_tag={r['out_tag']!r}")
+    paths = _paths(args.tag)
+    floors = sorted({r["floor"] for r in recipes} | {SIMILARITY_FLOOR})
+
+    if args.from_index:
+        print(f"Loading neighbor index {paths['index']} ...")
+        try:
+            index = load_index(paths["index"])
+        except FileNotFoundError as e:
+            raise SystemExit(f"--from-index: {e}")
+        print(f"  K={index.top.idx.shape[1]}  sim dtype={index.meta['sim_dtype']}  "
+              f"built {index.meta.get('built', '?')}")
+    else:
+        print(f"Using N_JOBS={N_JOBS} threads  tag={args.tag!r}")
+        print("Loading TF-IDF Matrices...")
+        X_univ = scipy.sparse.load_npz(paths["universe_matrix"]).tocsr().astype(np.float32)
+        X_foia = scipy.sparse.load_npz(paths["foia_matrix"]).tocsr().astype(np.float32)
+        n_pis = X_foia.shape[0]
+        k_top = min(max([r["k"] for r in recipes] + [args.index_k]), n_pis)
+
+        print(f"Universe Authors: {X_univ.shape[0]:,}")
+        print(f"FOIA PIs (Targets): {n_pis}")
+        print(f"Computing top-{k_top} neighbors in parallel (tiled top-K engine, "
+              f"{len(recipes)} recipe(s))...")
+
+        # Top-K + pre-modification diagnostics (max, mean top-K, count >= each
+        # floor) in one tiled pass; the dense universe x FOIA block is never
+        # built. Every recipe is then derived from this shared buffer, which
+        # is also persisted as the neighbor index for later consumers.
+        top = topk_similarity(X_univ, X_foia, k_top, floor=floors, n_jobs=N_JOBS)
+        del X_univ
+        universe_ids = pd.read_parquet(paths["universe_ids"])["athr_id"].to_numpy()
+        index = NeighborIndex(top, universe_ids, n_pis, floors, {})
+        if not args.no_index:
+            save_index(paths["index"], top, universe_ids, n_pis, floors,
+                       sim_dtype=np.dtype(args.index_dtype),
+                       meta={"source": "tfidf", "tag": args.tag,
+                             "universe_matrix": paths["universe_matrix"],
+                             "foia_matrix": paths["foia_matrix"],
+                             "built": pd.Timestamp.now().isoformat(timespec="seconds")})
+            print(f"Saved neighbor index (K={k_top}, {args.index_dtype}) -> "
+                  f"{paths['index']}")
+
+    max_sim = index.top.max_sim
+    for r in recipes:
+        rpaths = _paths(args.tag, r["out_tag"])
+        # l1_normalize: weighted-average form -- row sums to 1, imputed
+        # exposure is a weighted avg of FOIA exposures (compresses variance,
+        # Jensen-like shrinkage). Without it rows keep raw sharpened
+        # similarity, so low-confidence authors get small weights; use with
+        # step 3's --scale-by-confidence semantics.
+        try:
+            W = recipe_weights(index, r["k"], r["floor"], r["sharpen"],
+                               unmatched_threshold=r["unmatched_threshold"],
+                               l1_normalize=r["l1_normalize"])
+        except ValueError as e:
+            raise SystemExit(str(e))
+        diag = match_diagnostics(index, r["k"], r["floor"], r["unmatched_threshold"])
+        unmatched = diag["unmatched"].to_numpy()
+
+        print(f"\n[{r['out_tag'] or 'untagged'}] K={min(r['k'], index.n_foia)}  "
+              f"sharpen={r['sharpen']}  floor={r['floor']}")
+        print(f"Total non-zero weights: {W.nnz:,}")
+        print(f"Unmatched authors (max sim < {r['unmatched_threshold']}): "
+              f"{unmatched.sum():,} ({100*unmatched.mean():.2f}%)")
+        print(f"Mean max-similarity:   {max_sim.mean():.4f}")
+        print(f"Median max-similarity: {np.median(max_sim):.4f}")
+
+        print(f"Saving weight matrix -> {rpaths['out_weights']}")
+        scipy.sparse.save_npz(rpaths["out_weights"], W)
+
+        print("Saving per-author match diagnostics...")
+        diag.to_parquet(rpaths["out_diag"], index=False)
 
     print("Done. Weights precomputed.")
 
@@ -10,7 +10,9 @@ Math:
   S       sparse FOIA x K_treated
   S_hat   = smoothed universe x K_treated
               K-NN:  W @ S
-              Ridge: fit Ridge(X_foia -> S[:,k]) per market k, predict on X_univ
+              Ridge: fit Ridge(X_foia -> S[:,k]) per market k (LOO alpha_k),
+                     predict on X_univ -- all markets from one
+                     decomposition (ridge_engine.py)
   z_hat   = S_hat @ g      universe x 1 shift-share exposure
   S_sum   = rowsum(S_hat)  universe x 1 sum-of-shares control (mkt_spend_shr)
 
@@ -39,10 +41,13 @@ Outputs (per --version, per --method):
   ../../output/final_imputed_shift_share_{version}{tag}{method_sfx}{filter_sfx}{k_sfx}.csv
        columns: athr_id, exposure_ss, sum_imputed_shares
   ../../output/imputed_shares_matrix_{version}{tag}{method_sfx}{filter_sfx}{k_sfx}.npz
-       S_hat as CSR
+       S_hat as CSR (--method knn)
+  ../../output/imputed_shares_matrix_{version}{tag}{method_sfx}{filter_sfx}{k_sfx}.npy
+       S_hat as dense float32 (--method ridge; ridge predictions are dense,
+       so they are streamed into this file block by block and memory-mapped)
   ../../output/imputed_shares_markets_{version}{tag}{method_sfx}{filter_sfx}{k_sfx}.csv
        per-market diagnostics: category, g, s_bar, rotemberg_wt, n_foia_pis
-       (+ alpha, in_r2 for --method ridge)
+       (+ alpha, in_r2, loo_mse for --method ridge)
   ../../output/shock_balance_{version}{tag}{method_sfx}{filter_sfx}{k_sfx}.csv
        BHJ shock-balance regression coefficients.
 
@@ -53,7 +58,8 @@ eb_sfx     = ""       --eb-alpha 0 (default, no shrinkage)
                       pseudo-spend a before imputation; also saves
                       foia_self_exposure{stem}.csv. --eb-prior cluster/peer
                       shrink toward local (field-specific) baskets instead of
-                      the pool mean: "_ebc{a}k" / "_ebp{a}k".
+                      the pool mean: "_ebc{a}k" / "_ebp{a}k" ("_ebp{n}n{a}k"
+                      with --eb-peer-k n: top-n TF-IDF peers only).
 filter_sfx = "_cf[N]" --cluster-filter on the full label file, N =
                       --min-foia-per-cluster when > 1
            + "_ls"    --ls-filter (life-science author mask; suffix via --ls-sfx,
@@ -71,7 +77,10 @@ import numpy as np
 import pandas as pd
 import scipy.sparse as sp
 from scipy.stats import norm
-from sklearn.linear_model import Ridge, RidgeCV
+
+from neighbor_index import index_path, load_max_sim
+from ridge_engine import PREDICT_BLOCK_ROWS, ridge_gcv, ridge_predict_blocks
+from topk_engine import topk_similarity
 
 OUT_DIR = "../../output"
 CATEGORY_SPEND_FILE = "../../external/exposure_wts/athr_category_spend.dta"
@@ -88,6 +97,8 @@ PRE_PERIOD_LAST_YEAR = 2013
 VERSIONS = ["hc", "all", "treated_hc"]
 DEFAULT_ALPHAS = np.logspace(-3, 4, 30)
 
+N_JOBS = int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count() or 1))
+
 CATEGORY_RENAMES = {
     "acrylamide/bis solution": "acrylamide-bis solution",
     "dmem/f-12": "dmem-f-12",
@@ -257,59 +268,92 @@ def eb_shrink_shares(S, T, alpha, prior=None):
     prior is an n x K matrix of per-anchor prior baskets; None = the spend-
     weighted pool mean for every anchor. Rows with T_i = 0 (no visible
     denominator spend) are left all-zero rather than assigned the prior.
+    S stays sparse; only the (n x K) prior term is dense.
     Returns (S_tilde csr, sbar, own_wt)."""
-    Sd = np.asarray(S.todense(), dtype=np.float64)
+    S = sp.csr_matrix(S, dtype=np.float64)
     obs = T > 0
-    sbar = (T[obs] @ Sd[obs]) / T[obs].sum()
-    if prior is None:
-        prior = np.tile(sbar, (len(T), 1))
+    sbar = np.asarray(S.T @ np.where(obs, T, 0.0)).ravel() / T[obs].sum()
     own_wt = np.zeros_like(T)
     own_wt[obs] = T[obs] / (T[obs] + alpha)
-    St = Sd.copy()
-    St[obs] = own_wt[obs, None] * Sd[obs] + (1.0 - own_wt[obs, None]) * prior[obs]
-    return sp.csr_matrix(St), sbar, own_wt
-
-
-def build_local_priors(S, T, args, foia_ids, tag, alpha):
-    """Per-anchor prior baskets for --eb-prior cluster/peer. Both are leave-
-    one-out and spend-weighted, so well-measured anchors define their
-    neighborhood's prior and no anchor is its own prior.
+    prior_wt = np.where(obs, 1.0 - own_wt, 0.0)
+    if prior is None:
+        prior_term = np.outer(prior_wt, sbar)
+    elif sp.issparse(prior):
+        prior_term = sp.diags(prior_wt) @ prior
+    else:
+        prior_term = prior_wt[:, None] * prior
+    St = sp.csr_matrix(sp.diags(np.where(obs, own_wt, 1.0)) @ S + prior_term)
+    St.eliminate_zeros()
+    return St, sbar, own_wt
+
+
+def peer_graph(X, k=0, n_jobs=1):
+    """Anchor x anchor TF-IDF cosine graph for --eb-prior peer, as (n, n) CSR
+    with the diagonal (self) removed. k > 0 keeps each anchor's top-k peers
+    (topk_engine over sparse row tiles, O(n k) memory); k = 0 keeps every
+    positive cosine, i.e. the full gram without ever densifying it."""
+    X = sp.csr_matrix(X, dtype=np.float64)
+    n = X.shape[0]
+    if k <= 0:
+        A = (X @ X.T).tocsr()
+        A = (A - sp.diags(A.diagonal())).tocsr()
+    else:
+        top = topk_similarity(X, X, min(k + 1, n), n_jobs=n_jobs,
+                              dtype=np.float64, sparse_anchors=True)
+        sim = top.sim.astype(np.float64)
+        is_self = top.idx == np.arange(n)[:, None]
+        # Exact-duplicate anchors can crowd self out of the k+1 list; then
+        # the (k+1)-th peer is the one dropped.
+        is_self[~is_self.any(axis=1), -1] = True
+        sim[is_self] = 0.0
+        rows = np.repeat(np.arange(n), sim.shape[1])
+        A = sp.csr_matrix((sim.ravel(), (rows, top.idx.ravel())), shape=(n, n))
+    A.data[A.data < 0] = 0.0
+    A.eliminate_zeros()
+    return A
+
+
+def build_local_priors(S, T, alpha, labels=None, peer=None):
+    """Per-anchor prior baskets for --eb-prior cluster (labels) or peer
+    (peer_graph output). Both are leave-one-out and spend-weighted, so well-
+    measured anchors define their neighborhood's prior and no anchor is its
+    own prior.
 
     cluster: LOO spend-weighted mean basket of same-cluster anchors, itself
              blended toward the global mean with weight T_cluster/(T_cluster
              + alpha) so single-anchor / thin clusters fall back gracefully.
-    peer   : LOO mean basket over all other anchors, weighted by
-             (TF-IDF cosine to the anchor) x (denominator spend)."""
-    Sd = np.asarray(S.todense(), dtype=np.float64)
+             Computed as cluster totals (one segment sum) minus the anchor's
+             own contribution.
+    peer   : LOO mean basket over the anchor's peers, weighted by
+             (TF-IDF cosine to the anchor) x (denominator spend): one sparse
+             product with the peer graph.
+    Returns a dense (n, K) array."""
+    S = sp.csr_matrix(S, dtype=np.float64)
     n = len(T)
-    tw = T[:, None] * Sd
-    gbar = tw.sum(axis=0) / T.sum()
-    prior = np.zeros_like(Sd)
-    if args.eb_prior == "peer":
-        X = sp.load_npz(f"{OUT_DIR}/tfidf_foia{tag}.npz").tocsr().astype(np.float64)
-        if X.shape[0] != n:
-            raise SystemExit(f"tfidf_foia{tag}.npz rows {X.shape[0]} != n_foia {n}")
-        A = np.asarray((X @ X.T).todense())
-        np.fill_diagonal(A, 0.0)
-        num = A @ tw
-        den = A @ T
+    tw = sp.diags(T) @ S
+    gbar = np.asarray(tw.sum(axis=0)).ravel() / T.sum()
+    prior = np.tile(gbar, (n, 1))
+    if peer is not None:
+        num = (peer @ tw).toarray()
+        den = peer @ T
         ok = den > 0
         prior[ok] = num[ok] / den[ok, None]
-        prior[~ok] = gbar
-    else:
-        cf = args.eb_cluster_file or args.cluster_filter
-        if not cf or not os.path.exists(cf):
-            raise SystemExit("--eb-prior cluster needs --eb-cluster-file (or --cluster-filter)")
-        cl = pd.read_csv(cf, dtype={"athr_id": str})
-        labels = cl.set_index("athr_id")["cluster_label"].reindex(foia_ids).to_numpy()
-        idx = np.arange(n)
-        for i in range(n):
-            same = (labels == labels[i]) & (idx != i) if pd.notna(labels[i]) else np.zeros(n, bool)
-            Tc = T[same].sum()
-            cbar = (T[same] @ Sd[same]) / Tc if Tc > 0 else gbar
-            w = Tc / (Tc + alpha)
-            prior[i] = w * cbar + (1.0 - w) * gbar
-    return prior
+        return prior
+
+    codes, uniques = pd.factorize(pd.Series(labels))
+    has = codes >= 0
+    members = np.flatnonzero(has)
+    G = sp.csr_matrix((np.ones(len(members)), (codes[has], members)),
+                      shape=(len(uniques), n))
+    cluster_tw = (G @ tw).toarray()
+    cluster_T = np.bincount(codes[has], weights=T[has], minlength=len(uniques))
+    Tc = np.zeros(n)
+    Tc[has] = np.maximum(cluster_T[codes[has]] - T[has], 0.0)
+    pos = Tc > 0
+    num = cluster_tw[codes[pos]] - tw[pos].toarray()
+    prior[pos] = np.maximum(num, 0.0) / Tc[pos, None]
+    w = Tc / (Tc + alpha)
+    return w[:, None] * prior + (1.0 - w)[:, None] * gbar
 
 
 def impute_knn(S, W):
@@ -317,58 +361,108 @@ def impute_knn(S, W):
     return (W @ S).tocsr()
 
 
-def impute_ridge(S, X_foia, X_univ, alphas, clip_nonneg=True, verbose=True):
-    """Per-market ridge. For each column k of S:
-        RidgeCV on (X_foia, S[:,k]) -> alpha_k
-        Ridge fit -> beta_k, intercept_k
-        pred_k = X_univ @ beta_k + intercept_k
-    Returns (S_hat as CSR, per-market diagnostics as DataFrame)."""
+def impute_ridge(S, X_foia, X_univ, alphas, out_path, clip_nonneg=True,
+                 verbose=True, block_rows=PREDICT_BLOCK_ROWS):
+    """Per-market ridge, all markets at once (ridge_engine.py). For each
+    column k of S:
+        exact-LOO (RidgeCV-equivalent) alpha_k over `alphas`
+        pred_k = ridge fit at alpha_k, predicted on X_univ
+    One eigendecomposition of the FOIA gram serves every market; the
+    universe is predicted in row blocks streamed into a float32 (n_univ, K)
+    .npy at out_path, so only one float64 block is ever in memory.
+    Zero-variance markets are imputed at their mean. Returns (S_hat
+    reopened read-only with mmap_mode="r", per-market diagnostics as
+    DataFrame)."""
     K = S.shape[1]
-    n_univ = X_univ.shape[0]
-    S_hat = np.zeros((n_univ, K), dtype=np.float64)
-    diag_rows = []
     S_dense = S.toarray() if sp.issparse(S) else np.asarray(S)
-    for k in range(K):
-        y = S_dense[:, k].astype(np.float64)
-        n_nz = int((y > 0).sum())
-        if y.std() == 0.0 or n_nz == 0:
-            S_hat[:, k] = float(y.mean())
-            diag_rows.append({"col": k, "alpha": np.nan, "in_r2": 0.0,
-                              "n_nonzero": n_nz})
+    S_dense = S_dense.astype(np.float64)
+    n_nz = (S_dense > 0).sum(axis=0)
+    fitted = (S_dense.std(axis=0) > 0) & (n_nz > 0)
+    col_mean = S_dense.mean(axis=0)
+    if verbose:
+        print(f"    {fitted.sum()}/{K} markets fitted; "
+              f"{K - fitted.sum()} zero-variance markets use their mean", flush=True)
+
+    fit = ridge_gcv(X_foia, S_dense[:, fitted], alphas) if fitted.any() else None
+    n_univ = X_univ.shape[0]
+    tmp_path = f"{out_path}.tmp"
+    S_hat = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                      shape=(n_univ, K))
+    fill = np.maximum(col_mean, 0.0) if clip_nonneg else col_mean
+    for start in range(0, n_univ, block_rows):
+        S_hat[start:start + block_rows, ~fitted] = fill[~fitted]
+    if fit is not None:
+        for start, pred in ridge_predict_blocks(fit, X_univ, block_rows):
+            if clip_nonneg:
+                np.maximum(pred, 0.0, out=pred)
+            S_hat[start:start + len(pred), fitted] = pred
             if verbose:
-                print(f"    market {k+1}/{K}: zero variance, using mean={y.mean():.4g}",
-                      flush=True)
-            continue
-        cv = RidgeCV(alphas=alphas, fit_intercept=True, scoring=None, cv=None)
-        cv.fit(X_foia, y)
-        alpha = float(cv.alpha_)
-        model = Ridge(alpha=alpha, fit_intercept=True).fit(X_foia, y)
-        pred = X_univ.dot(model.coef_.astype(np.float64)) + float(model.intercept_)
-        if clip_nonneg:
-            np.maximum(pred, 0.0, out=pred)
-        S_hat[:, k] = pred
-        in_r2 = float(model.score(X_foia, y))
-        diag_rows.append({"col": k, "alpha": alpha, "in_r2": in_r2,
-                          "n_nonzero": n_nz})
-        if verbose and (k + 1) % 10 == 0:
-            print(f"    market {k+1}/{K}  alpha={alpha:.3g}  in_R2={in_r2:.3f}  "
-                  f"n_nz={n_nz}", flush=True)
-    return sp.csr_matrix(S_hat), pd.DataFrame(diag_rows)
-
-
-def apply_filters(df_univ, S_hat, args, df_foia, diag_file):
+                print(f"    predicted {start + len(pred):,}/{n_univ:,}", flush=True)
+    S_hat.flush()
+    del S_hat
+    os.replace(tmp_path, out_path)
+
+    diag = pd.DataFrame({"col": np.arange(K), "alpha": np.nan, "in_r2": 0.0,
+                         "loo_mse": np.nan, "n_nonzero": n_nz.astype(int)})
+    if fit is not None:
+        diag.loc[fitted, "alpha"] = fit.alpha
+        diag.loc[fitted, "in_r2"] = fit.in_r2
+        diag.loc[fitted, "loo_mse"] = fit.loo_mse[fit.alpha_idx, np.arange(fitted.sum())]
+        if verbose:
+            q = np.percentile(fit.in_r2, [25, 50, 75])
+            print(f"    alpha median={np.median(fit.alpha):.3g}  "
+                  f"at grid edge: {np.isin(fit.alpha_idx, [0, len(alphas) - 1]).sum()}  "
+                  f"in_R2 p25/p50/p75={q[0]:.3f}/{q[1]:.3f}/{q[2]:.3f}", flush=True)
+    return np.load(out_path, mmap_mode="r"), diag
+
+
+def take_rows_npy(S_hat, rows, path, block_rows=PREDICT_BLOCK_ROWS):
+    """Write S_hat[rows] to the .npy at path block by block and reopen it
+    with mmap_mode="r". S_hat may be the memory-mapped file being replaced:
+    the new rows go to a temp file that is renamed over path at the end."""
+    tmp_path = f"{path}.tmp"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=S_hat.dtype,
+                                    shape=(len(rows), S_hat.shape[1]))
+    for start in range(0, len(rows), block_rows):
+        out[start:start + block_rows] = S_hat[rows[start:start + block_rows]]
+    out.flush()
+    del out
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode="r")
+
+
+def shares_dot(S_hat, g, block_rows=PREDICT_BLOCK_ROWS):
+    """S_hat @ g as float64. A dense float32 S_hat (ridge) is multiplied in
+    row blocks: a mixed-dtype matmul would first cast all of it to float64."""
+    if sp.issparse(S_hat):
+        return np.asarray(S_hat @ g).ravel()
+    out = np.empty(S_hat.shape[0])
+    for s in range(0, len(out), block_rows):
+        out[s:s + block_rows] = S_hat[s:s + block_rows] @ g
+    return out
+
+
+def apply_filters(df_univ, args, df_foia, index_dir, diag_file):
     """Apply --min-max-sim, --cluster-filter and --ls-filter.
-    Returns filtered (df_univ, S_hat)."""
+    max_sim comes from the neighbor index when it exists, else from the
+    match diagnostics. Returns (filtered df_univ, positions of the kept rows
+    in the input), so the caller can cut S_hat without this function
+    loading it."""
+    rows = np.arange(len(df_univ))
     if args.min_max_sim > 0:
-        if not os.path.exists(diag_file):
-            raise SystemExit(f"--min-max-sim needs {diag_file}")
-        diag = pd.read_parquet(diag_file)[["athr_id", "max_sim"]]
+        if os.path.exists(index_dir):
+            diag = load_max_sim(index_dir)
+        elif os.path.exists(diag_file):
+            diag = pd.read_parquet(diag_file)[["athr_id", "max_sim"]]
+        else:
+            raise SystemExit(f"--min-max-sim needs {index_dir}/ or {diag_file}")
+        diag["athr_id"] = diag["athr_id"].astype(str)
         n_before = len(df_univ)
         df_univ = df_univ.merge(diag, on="athr_id", how="left")
         keep_mask = df_univ["max_sim"] >= args.min_max_sim
         keep_idx_mask = keep_mask.to_numpy()
         df_univ = df_univ.loc[keep_mask].drop(columns=["max_sim"])
-        S_hat = S_hat[keep_idx_mask]
+        rows = rows[keep_idx_mask]
         print(f"  max_sim filter (>= {args.min_max_sim}): "
               f"kept {len(df_univ):,}/{n_before:,}")
 
@@ -392,7 +486,7 @@ def apply_filters(df_univ, S_hat, args, df_foia, diag_file):
         )
         keep_idx_mask = keep_mask.to_numpy()
         df_univ = df_univ.loc[keep_mask].drop(columns=["cluster_label"])
-        S_hat = S_hat[keep_idx_mask]
+        rows = rows[keep_idx_mask]
         print(f"  cluster filter ({args.cluster_filter}, min-foia-per-cluster={min_n}): "
               f"kept {len(df_univ):,}/{n_before:,}")
 
@@ -408,11 +502,11 @@ def apply_filters(df_univ, S_hat, args, df_foia, diag_file):
         keep_mask = df_univ["athr_id"].isin(set(ls["athr_id"]))
         keep_idx_mask = keep_mask.to_numpy()
         df_univ = df_univ.loc[keep_mask]
-        S_hat = S_hat[keep_idx_mask]
+        rows = rows[keep_idx_mask]
         print(f"  ls filter ({args.ls_filter}): "
               f"kept {len(df_univ):,}/{n_before:,}")
 
-    return df_univ, S_hat
+    return df_univ, rows
 
 
 def main():
@@ -479,6 +573,10 @@ def main():
                          "other anchors ('_ebp'). Local priors preserve cross-"
                          "field basket differences; only within-neighborhood "
                          "idiosyncrasy is shrunk.")
+    ap.add_argument("--eb-peer-k", type=int, default=0,
+                    help="--eb-prior peer: use each anchor's top-k TF-IDF peers "
+                         "instead of all other anchors ('_ebp{k}n'). 0 = all "
+                         "(default, '_ebp'). Use for pools of many thousand anchors.")
     ap.add_argument("--eb-cluster-file", default="",
                     help="athr_id,cluster_label csv defining --eb-prior cluster "
                          "neighborhoods; defaults to --cluster-filter when set.")
@@ -501,6 +599,8 @@ def main():
     eb_sfx = ""
     if args.eb_alpha != "0":
         prior_tag = {"global": "", "cluster": "c", "peer": "p"}[args.eb_prior]
+        if args.eb_prior == "peer" and args.eb_peer_k > 0:
+            prior_tag += f"{args.eb_peer_k}n"
         if args.eb_alpha == "median":
             eb_sfx = f"_eb{prior_tag}med"
         else:
@@ -513,6 +613,7 @@ def main():
     universe_ids_file = f"{OUT_DIR}/universe_ids{tag}.parquet"
     foia_ids_file = f"{OUT_DIR}/foia_ids_ordered{tag}.csv"
     diag_file = f"{OUT_DIR}/match_diagnostics{tag}.parquet"
+    index_dir = index_path(OUT_DIR, tag)
     for p in (universe_ids_file, foia_ids_file):
         if not os.path.exists(p):
             raise SystemExit(f"missing: {p}")
@@ -570,6 +671,23 @@ def main():
 
     alphas = np.asarray(args.alphas) if args.alphas else DEFAULT_ALPHAS
 
+    # ---- Local EB prior neighborhoods (version-independent, built once) ----
+    eb_labels = None
+    eb_peer = None
+    if eb_sfx and args.eb_prior == "cluster":
+        cf = args.eb_cluster_file or args.cluster_filter
+        if not cf or not os.path.exists(cf):
+            raise SystemExit("--eb-prior cluster needs --eb-cluster-file (or --cluster-filter)")
+        cl = pd.read_csv(cf, dtype={"athr_id": str})
+        eb_labels = cl.set_index("athr_id")["cluster_label"].reindex(foia_ids).to_numpy()
+    elif eb_sfx and args.eb_prior == "peer":
+        X_peer = sp.load_npz(f"{OUT_DIR}/tfidf_foia{tag}.npz").tocsr().astype(np.float64)
+        if X_peer.shape[0] != len(foia_ids):
+            raise SystemExit(f"tfidf_foia{tag}.npz rows {X_peer.shape[0]} != n_foia {len(foia_ids)}")
+        eb_peer = peer_graph(X_peer, args.eb_peer_k, n_jobs=N_JOBS)
+        print(f"EB peer graph: {eb_peer.nnz:,} anchor pairs "
+              f"({'all' if args.eb_peer_k <= 0 else f'top-{args.eb_peer_k}'} peers)")
+
     # ---- PI characteristics (shared) ----
     print("Computing FOIA pre-period characteristics ...")
     pi_chars = compute_pi_characteristics(CATEGORY_SPEND_FILE, foia_ids)
@@ -602,7 +720,7 @@ def main():
             self_raw = np.asarray(S @ g).ravel()
             prior = None
             if args.eb_prior != "global":
-                prior = build_local_priors(S, T, args, foia_ids, tag, alpha_v)
+                prior = build_local_priors(S, T, alpha_v, labels=eb_labels, peer=eb_peer)
             S, sbar, own_wt = eb_shrink_shares(S, T, alpha_v, prior=prior)
             self_eb = np.asarray(S @ g).ravel()
             print(f"\n  --- EB shrinkage (alpha=${alpha_v:,.0f}, prior={args.eb_prior}) ---")
@@ -627,18 +745,24 @@ def main():
                 "sum_shares_eb": np.asarray(S.sum(axis=1)).ravel(),
             })
 
+        stem = f"_{version}{tag}{method_sfx}{eb_sfx}{filter_sfx}{k_sfx}"
+        out_csv = f"{OUT_DIR}/final_imputed_shift_share{stem}.csv"
+        out_shares = f"{OUT_DIR}/imputed_shares_matrix{stem}" + (
+            ".npz" if args.method == "knn" else ".npy")
+        out_markets = f"{OUT_DIR}/imputed_shares_markets{stem}.csv"
+
         print(f"Imputing shares  (method={args.method})  ...")
         if args.method == "knn":
             S_hat = impute_knn(S, W)
             ridge_diag = None
         else:
-            S_hat, ridge_diag = impute_ridge(S, X_foia, X_univ, alphas)
+            S_hat, ridge_diag = impute_ridge(S, X_foia, X_univ, alphas, out_shares)
 
         print("Aggregating: z_hat = S_hat @ g,  S_sum = rowsum(S_hat) ...")
-        z_hat = np.asarray(S_hat @ g).ravel()
-        S_sum = np.asarray(S_hat.sum(axis=1)).ravel()
+        z_hat = shares_dot(S_hat, g)
+        S_sum = np.asarray(S_hat.sum(axis=1, dtype=np.float64)).ravel()
 
-        s_bar = np.asarray(S_hat.mean(axis=0)).ravel()
+        s_bar = np.asarray(S_hat.mean(axis=0, dtype=np.float64)).ravel()
         ss = (s_bar ** 2).sum()
         eff_n_norm = (s_bar.sum() ** 2) / ss if ss > 0 else 0.0
         print(f"  effective number of shocks (BHJ-style): {eff_n_norm:.2f}")
@@ -683,16 +807,16 @@ def main():
         df_univ = df_univ_master.copy()
         df_univ["exposure_ss"] = z_hat
         df_univ["sum_imputed_shares"] = S_sum
-        df_univ, S_hat = apply_filters(df_univ, S_hat, args, df_foia, diag_file)
+        df_univ, rows = apply_filters(df_univ, args, df_foia, index_dir, diag_file)
 
         # ---- Save outputs (version-specific filenames) ----
-        stem = f"_{version}{tag}{method_sfx}{eb_sfx}{filter_sfx}{k_sfx}"
-        out_csv = f"{OUT_DIR}/final_imputed_shift_share{stem}.csv"
-        out_npz = f"{OUT_DIR}/imputed_shares_matrix{stem}.npz"
-        out_markets = f"{OUT_DIR}/imputed_shares_markets{stem}.csv"
-
         df_univ[["athr_id", "exposure_ss", "sum_imputed_shares"]].to_csv(out_csv, index=False)
-        sp.save_npz(out_npz, S_hat)
+        if len(rows) < S_hat.shape[0]:
+            # ridge S_hat is already on disk at out_shares; cut it block-wise
+            S_hat = (S_hat[rows] if sp.issparse(S_hat)
+                     else take_rows_npy(S_hat, rows, out_shares))
+        if sp.issparse(S_hat):
+            sp.save_npz(out_shares, S_hat)
 
         markets_df = pd.DataFrame({
             "market_idx": np.arange(len(market_index)),
@@ -720,7 +844,7 @@ def main():
             print(f"  Saved {out_self}  (shrunk anchor-level self exposure)")
 
         print(f"  Saved {out_csv}")
-        print(f"  Saved {out_npz}  (universe x K_treated imputed share matrix)")
+        print(f"  Saved {out_shares}  (universe x K_treated imputed share matrix)")
         print(f"  Saved {out_markets}")
 
         version_summary_rows.append({
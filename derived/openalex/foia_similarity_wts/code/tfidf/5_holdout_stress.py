@@ -31,6 +31,9 @@ import numpy as np
 import pandas as pd
 import scipy.sparse
 
+from lofo_engine import fold_slices, fold_topk, foia_similarity, holdout_folds
+from topk_engine import knn_predict
+
 OUT_DIR = "../../output"
 DEFAULT_EXPOSURE_DTA = "../../external/exposure_wts/athr_exposure_hc.dta"
 
@@ -49,23 +52,14 @@ def _paths(tag: str, out_suffix: str = "") -> dict:
     }
 
 
-def predict_holdout(sim_test_train, E_train, k, sharpen, floor):
-    """Top-K weighted-average prediction. sim is (n_test, n_train), already
-    L2-cosine. Mirrors 2_similarity_wts.process_batch exactly so this test
-    speaks to the production recipe."""
-    n_test, n_train = sim_test_train.shape
-    k = min(k, n_train)
-    topk_idx = np.argpartition(-sim_test_train, k - 1, axis=1)[:, :k]
-    rows = np.arange(n_test)[:, None]
-    vals = sim_test_train[rows, topk_idx].copy()
-    vals = np.where(vals >= floor, vals, 0.0)
-    if sharpen != 1.0:
-        vals = np.where(vals > 0, np.power(vals, sharpen), 0.0)
-    row_sums = vals.sum(axis=1, keepdims=True)
-    row_sums = np.where(row_sums > 0, row_sums, 1.0)
-    w = vals / row_sums
-    E_picked = E_train[topk_idx]
-    return (w * E_picked).sum(axis=1), sim_test_train.max(axis=1)
+def predict_holdout(sim, folds, E, k, sharpen, floor):
+    """Top-K weighted-average prediction of every fold's test rows from that
+    fold's train rows, all folds at once (lofo_engine.py: one FOIA x FOIA
+    similarity, test columns masked per fold). Same top-K + weighting code
+    that builds the production W in 2_similarity_wts.py, so this test speaks
+    to the production recipe. Returns (FoldTopK, pred)."""
+    fold_top = fold_topk(sim, folds, k, floor)
+    return fold_top, knn_predict(fold_top.top, E, k, floor, sharpen)
 
 
 def metrics(y_true, y_pred):
@@ -131,35 +125,27 @@ def main():
     print(f"Exposure: mean={E.mean():.4f}  sd={E.std():.4f}  "
           f"range=[{E.min():.4f}, {E.max():.4f}]   nonzero={(E != 0).sum()}/{n}")
 
-    rng = np.random.default_rng(args.seed)
-    n_test = int(round(args.holdout_frac * n))
-    rows = []
-
-    for f in range(args.folds):
-        perm = rng.permutation(n)
-        test_idx = np.sort(perm[:n_test])
-        train_idx = np.sort(perm[n_test:])
-        X_test = X[test_idx]
-        X_train = X[train_idx]
-
-        # cosine sim (rows already L2-normalized by 1_vectorize)
-        sim = (X_test @ X_train.T).toarray().astype(np.float32)
-        pred, max_sim = predict_holdout(sim, E[train_idx], args.k, args.sharpen, args.floor)
-
-        for j, i in enumerate(test_idx):
-            rows.append({
-                "fold": f,
-                "athr_id": foia_ids[i],
-                "n_train": int(len(train_idx)),
-                "max_sim_to_train": float(max_sim[j]),
-                "true_exposure": float(E[i]),
-                "pred_exposure": float(pred[j]),
-            })
-
-        m = metrics(E[test_idx], pred)
+    # cosine sim (rows already L2-normalized by 1_vectorize), once
+    sim = foia_similarity(X)
+    folds = holdout_folds(n, args.folds, args.holdout_frac,
+                          np.random.default_rng(args.seed))
+    fold_top, pred = predict_holdout(sim, folds, E, args.k, args.sharpen,
+                                     args.floor)
+
+    for f, q in fold_slices(fold_top):
+        test_idx = fold_top.row[q]
+        m = metrics(E[test_idx], pred[q])
         print(f"  fold {f:2d}: n_test={len(test_idx)}  MSE={m['mse']:.5f}  "
               f"corr={m['corr']:.3f}  slope={m['slope']:.3f}")
 
+    rows = {
+        "fold": fold_top.fold,
+        "athr_id": np.asarray(foia_ids, dtype=object)[fold_top.row],
+        "n_train": fold_top.n_train,
+        "max_sim_to_train": fold_top.top.max_sim.astype(np.float64),
+        "true_exposure": E[fold_top.row].astype(np.float64),
+        "pred_exposure": pred.astype(np.float64),
+    }
     df = pd.DataFrame(rows)
     df.to_csv(paths["out_pairs"], index=False)
     print(f"Saved per-(fold,FOIA) rows: {paths['out_pairs']}")
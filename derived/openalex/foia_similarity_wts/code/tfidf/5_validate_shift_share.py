@@ -49,6 +49,10 @@ import numpy as np
 import pandas as pd
 import scipy.sparse as sp
 
+from lofo_engine import fold_topk, foia_similarity, kfold_folds, train_mask
+from neighbor_index import index_path, load_index
+from topk_engine import knn_predict
+
 OUT_DIR = "../../output"
 VAL_DIR = f"{OUT_DIR}/validation"
 
@@ -116,109 +120,61 @@ def apply_cf_filter(df_univ, W, cluster_path, foia_ids, min_n=1):
 
 
 # --------------------------------------------------------------------------- #
-# KNN prediction (mirrors 2_similarity_wts.process_batch exactly)             #
-# --------------------------------------------------------------------------- #
-
-def knn_predict(sim, S_train, k, sharpen, floor):
-    """sim: (n_test, n_train) cosine. S_train: (n_train, M) shares.
-    Returns (S_pred, max_sim_to_train, sim_at_k). Applies floor -> sharpen ->
-    L1-norm exactly like production."""
-    n_test, n_train = sim.shape
-    k = min(k, n_train)
-    topk = np.argpartition(-sim, k - 1, axis=1)[:, :k]
-    r = np.arange(n_test)[:, None]
-    vals = sim[r, topk].copy()
-    max_sim = sim.max(axis=1)
-    sim_at_k = vals.min(axis=1)          # k-th neighbor sim (worst kept)
-    vals = np.where(vals >= floor, vals, 0.0)
-    if sharpen != 1.0:
-        vals = np.where(vals > 0, np.power(vals, sharpen), 0.0)
-    rs = vals.sum(axis=1, keepdims=True)
-    rs = np.where(rs > 0, rs, 1.0)
-    w = vals / rs
-    S_pred = np.zeros((n_test, S_train.shape[1]), dtype=np.float64)
-    S_train_dense = S_train.toarray() if sp.issparse(S_train) else np.asarray(S_train)
-    for i in range(n_test):
-        S_pred[i] = w[i] @ S_train_dense[topk[i]]
-    return S_pred, max_sim, sim_at_k
-
-
-# --------------------------------------------------------------------------- #
-# LOFO driver                                                                 #
+# LOFO driver (shared evaluation engine, same recipe as 2_similarity_wts.py)  #
 # --------------------------------------------------------------------------- #
 
-def lofo_folds(n, n_folds, rng):
-    """Yield (test_idx, train_idx). If n_folds >= n: leave-one-out.
-    Else: K-fold shuffled."""
-    perm = rng.permutation(n)
-    if n_folds >= n:
-        for i in range(n):
-            test = np.array([perm[i]])
-            train = np.concatenate([perm[:i], perm[i+1:]])
-            yield np.sort(test), np.sort(train)
-    else:
-        for f in range(n_folds):
-            lo = f * n // n_folds
-            hi = (f + 1) * n // n_folds
-            test = np.sort(perm[lo:hi])
-            train = np.sort(np.concatenate([perm[:lo], perm[hi:]]))
-            yield test, train
+def lofo_predict(X_foia, S_dense, k, sharpen, floor, n_folds, rng,
+                 method="knn", clusters=None, sim=None):
+    """Held-out share predictions for every FOIA over the folds drawn from
+    rng (kfold_folds: n_folds >= n => leave-one-out). All folds come out of
+    one FOIA x FOIA cosine (pass sim= to reuse it across calls) with each
+    fold's test columns masked (lofo_engine.py). KNN applies floor ->
+    sharpen -> L1-norm exactly like production; the baselines average the
+    fold's train rows (all of them, or those in the test FOIA's cluster).
+    Returns (FoldTopK, S_pred, sim_at_k)."""
+    n = X_foia.shape[0]
+    if sim is None:
+        sim = foia_similarity(X_foia)    # rows already L2-normalized by 1_vectorize
+    folds = kfold_folds(n, n_folds, rng)
+    if method == "knn":
+        fold_top = fold_topk(sim, folds, k, floor)
+        S_pred = knn_predict(fold_top.top, S_dense, k, floor, sharpen)
+        sim_at_k = fold_top.top.sim[:, -1]      # k-th neighbor sim (worst kept)
+        return fold_top, S_pred, sim_at_k
+
+    fold_top = fold_topk(sim, folds, 1)
+    train = train_mask(fold_top, n)
+    S_pred = (train @ S_dense) / fold_top.n_train[:, None]      # grand mean
+    if method == "cluster_mean":
+        if clusters is None:
+            raise ValueError("cluster_mean needs clusters= array")
+        cl_test = clusters[fold_top.row]
+        same = train & (clusters[None, :] == cl_test[:, None])
+        n_same = same.sum(axis=1)
+        use = (cl_test != -1) & (n_same > 0)
+        S_pred[use] = (same[use] @ S_dense) / n_same[use, None]
+    elif method != "grand_mean":
+        raise ValueError(f"unknown method {method}")
+    return fold_top, S_pred, np.zeros(len(fold_top.row))
 
 
 def run_lofo(X_foia, S, g, k, sharpen, floor, n_folds, rng,
-             method="knn", clusters=None):
+             method="knn", clusters=None, sim=None):
     """Run LOFO for one smoother. Returns per-FOIA DataFrame with
-    (fold, foia_row, true_z, pred_z, max_sim, sim_at_k, cell_l1)."""
-    n = X_foia.shape[0]
-    M = S.shape[1]
+    (foia_row, true_z, pred_z, max_sim, sim_at_k, cell_l1)."""
     S_dense = S.toarray()
     true_z = np.asarray(S @ g).ravel()
-    Xn = X_foia.astype(np.float32)     # rows already L2-normalized by 1_vectorize
-
-    rows = []
-    for test_idx, train_idx in lofo_folds(n, n_folds, rng):
-        X_test = Xn[test_idx]
-        X_train = Xn[train_idx]
-        S_train = sp.csr_matrix(S_dense[train_idx])
-        sim = (X_test @ X_train.T).toarray().astype(np.float32)
-
-        if method == "knn":
-            S_pred, max_sim, sim_at_k = knn_predict(sim, S_train, k, sharpen, floor)
-        elif method == "grand_mean":
-            mean_row = S_dense[train_idx].mean(axis=0)
-            S_pred = np.tile(mean_row, (len(test_idx), 1))
-            max_sim = sim.max(axis=1)
-            sim_at_k = np.zeros(len(test_idx))
-        elif method == "cluster_mean":
-            if clusters is None:
-                raise ValueError("cluster_mean needs clusters= array")
-            cl_train = clusters[train_idx]
-            cl_test = clusters[test_idx]
-            grand = S_dense[train_idx].mean(axis=0)
-            unique = np.unique(cl_train[cl_train != -1])
-            cl_means = {c: S_dense[train_idx][cl_train == c].mean(axis=0)
-                        for c in unique}
-            S_pred = np.vstack([
-                cl_means.get(c, grand) if c != -1 else grand
-                for c in cl_test
-            ])
-            max_sim = sim.max(axis=1)
-            sim_at_k = np.zeros(len(test_idx))
-        else:
-            raise ValueError(f"unknown method {method}")
-
-        pred_z = S_pred @ g
-        cell_l1 = np.abs(S_pred - S_dense[test_idx]).sum(axis=1)
-        for j, i in enumerate(test_idx):
-            rows.append({
-                "foia_row": int(i),
-                "true_z": float(true_z[i]),
-                "pred_z": float(pred_z[j]),
-                "max_sim": float(max_sim[j]),
-                "sim_at_k": float(sim_at_k[j]),
-                "cell_l1": float(cell_l1[j]),
-            })
-    return pd.DataFrame(rows)
+    fold_top, S_pred, sim_at_k = lofo_predict(X_foia, S_dense, k, sharpen, floor,
+                                              n_folds, rng, method, clusters, sim)
+    rows = fold_top.row
+    return pd.DataFrame({
+        "foia_row": rows.astype(np.int64),
+        "true_z": true_z[rows],
+        "pred_z": S_pred @ g,
+        "max_sim": fold_top.top.max_sim.astype(np.float64),
+        "sim_at_k": np.asarray(sim_at_k, dtype=np.float64),
+        "cell_l1": np.abs(S_pred - S_dense[rows]).sum(axis=1),
+    })
 
 
 def pi_metrics(df):
@@ -242,25 +198,15 @@ def pi_metrics(df):
 
 
 def cell_metrics(lofo_df, S, X_foia, foia_ids, market_index, g,
-                 k, sharpen, floor, n_folds, rng):
+                 k, sharpen, floor, n_folds, rng, sim=None):
     """Recompute LOFO holding cell-level residuals per market. Cheap: just
     aggregate S_pred - S over the same folds. Returns per-market DataFrame."""
-    n = X_foia.shape[0]
-    M = S.shape[1]
     S_dense = S.toarray()
-    resid_sq = np.zeros(M)
-    n_test_per = np.zeros(M, dtype=np.int64)
     nz_per = (S_dense > 0).sum(axis=0)
-    Xn = X_foia.astype(np.float32)
-    for test_idx, train_idx in lofo_folds(n, n_folds, rng):
-        X_test = Xn[test_idx]
-        X_train = Xn[train_idx]
-        S_train = sp.csr_matrix(S_dense[train_idx])
-        sim = (X_test @ X_train.T).toarray().astype(np.float32)
-        S_pred, _, _ = knn_predict(sim, S_train, k, sharpen, floor)
-        resid_sq += ((S_pred - S_dense[test_idx]) ** 2).sum(axis=0)
-        n_test_per += len(test_idx)
-    rmse = np.sqrt(resid_sq / np.maximum(n_test_per, 1))
+    fold_top, S_pred, _ = lofo_predict(X_foia, S_dense, k, sharpen, floor,
+                                       n_folds, rng, sim=sim)
+    resid_sq = ((S_pred - S_dense[fold_top.row]) ** 2).sum(axis=0)
+    rmse = np.sqrt(resid_sq / max(len(fold_top.row), 1))
     return pd.DataFrame({
         "category": market_index,
         "rmse": rmse,
@@ -274,18 +220,18 @@ def cell_metrics(lofo_df, S, X_foia, foia_ids, market_index, g,
 # E3 support diagnostics                                                      #
 # --------------------------------------------------------------------------- #
 
-def support_hist(diag_df, keep_mask, k, bins=25):
+def support_hist(diag_df, keep_mask, k, bins=25, index=None):
     """Return DataFrame with max_sim + sim_at_k histograms on the _cf universe."""
     d = diag_df.loc[keep_mask].copy()
-    # max_sim already computed. Third-neighbor sim would need the raw sim
-    # matrix. We approximate with mean_topk_sim if k matches — but honest
-    # option: use max_sim only for E3 histogram (the LOFO sim_at_k covers
-    # k-th neighbor behavior).
+    # max_sim + mean_topk_sim come from the match diagnostics. The k-th
+    # neighbor sim needs the raw neighbor list, i.e. the neighbor index;
+    # without one only max_sim / mean_topk_sim are reported (the LOFO
+    # sim_at_k covers k-th neighbor behavior on the FOIA side).
     max_edges = np.linspace(0, max(d["max_sim"].max(), 0.5), bins + 1)
     max_h, _ = np.histogram(d["max_sim"], bins=max_edges)
     mean_edges = np.linspace(0, max(d["mean_topk_sim"].max(), 0.5), bins + 1)
     mean_h, _ = np.histogram(d["mean_topk_sim"], bins=mean_edges)
-    return pd.DataFrame({
+    out = pd.DataFrame({
         "bin_lo": max_edges[:-1],
         "bin_hi": max_edges[1:],
         "max_sim_count": max_h,
@@ -293,6 +239,14 @@ def support_hist(diag_df, keep_mask, k, bins=25):
         "mean_topk_sim_bin_hi": mean_edges[1:],
         "mean_topk_sim_count": mean_h,
     })
+    if index is not None and index.top.sim.shape[1] >= k:
+        sim_at_k = np.asarray(index.top.sim[np.where(keep_mask)[0], k - 1],
+                              dtype=np.float32)
+        k_edges = np.linspace(0, max(sim_at_k.max(), 0.5), bins + 1)
+        out["sim_at_k_bin_lo"] = k_edges[:-1]
+        out["sim_at_k_bin_hi"] = k_edges[1:]
+        out["sim_at_k_count"] = np.histogram(sim_at_k, bins=k_edges)[0]
+    return out
 
 
 def coverage_vs_rmse(lofo_df, n_bins=5):
@@ -322,15 +276,21 @@ def coverage_vs_rmse(lofo_df, n_bins=5):
 # E5 face-validity                                                            #
 # --------------------------------------------------------------------------- #
 
-def face_validity_table(X_univ, X_foia, W, universe_ids, foia_ids,
-                        feature_names, keep_mask, k, per_quintile, rng):
+def face_validity_table(X_foia, W, universe_ids, foia_ids, feature_names,
+                        keep_mask, k, per_quintile, rng, index=None):
     """Stratify _cf universe by max_sim quintile, sample per_quintile per bin.
-    For each sampled universe PI: list its top-k FOIA neighbors from W, and
-    top-5 TF-IDF terms per neighbor.
+    For each sampled universe PI: list its top-k FOIA neighbors, their W
+    weights, and top-5 TF-IDF terms per neighbor.
+
+    With a neighbor index, max_sim is the raw best cosine and neighbors come
+    ranked by cosine (with their sims); without one, the largest W weight
+    stands in for max_sim and neighbors are ranked by weight.
     """
     keep_idx = np.where(keep_mask)[0]
-    W_kept = W[keep_idx]
-    max_sim = np.asarray(W_kept.max(axis=1).todense()).ravel()
+    if index is not None:
+        max_sim = np.asarray(index.top.max_sim[keep_idx])
+    else:
+        max_sim = np.asarray(W[keep_idx].max(axis=1).todense()).ravel()
 
     q = np.quantile(max_sim, np.linspace(0, 1, 6))
     rows = []
@@ -343,12 +303,16 @@ def face_validity_table(X_univ, X_foia, W, universe_ids, foia_ids,
         for local_idx in picks:
             univ_idx = keep_idx[local_idx]
             row = W[univ_idx]
-            # get k largest by weight
             dense = row.toarray().ravel()
             if dense.sum() == 0:
                 continue
-            top = np.argsort(-dense)[:k]
-            top = top[dense[top] > 0]
+            if index is not None:
+                top = np.asarray(index.top.idx[univ_idx, :k])
+                top_sims = np.asarray(index.top.sim[univ_idx, :k], dtype=np.float32)
+            else:
+                # get k largest by weight
+                top = np.argsort(-dense)[:k]
+                top = top[dense[top] > 0]
             neighbor_ids = [foia_ids[j] for j in top]
             neighbor_wts = [float(dense[j]) for j in top]
 
@@ -368,6 +332,8 @@ def face_validity_table(X_univ, X_foia, W, universe_ids, foia_ids,
                 "univ_max_sim": float(max_sim[local_idx]),
                 "neighbors": ";".join(neighbor_ids),
                 "neighbor_wts": ";".join(f"{w:.3f}" for w in neighbor_wts),
+                "neighbor_sims": (";".join(f"{v:.3f}" for v in top_sims)
+                                  if index is not None else ""),
                 "neighbor_top_terms": " || ".join(neighbor_terms),
             })
     return pd.DataFrame(rows)
@@ -417,7 +383,6 @@ def main():
     # ---- Load pipeline artifacts ----
     print(f"[load] tag={args.tag}  version={args.version}  filter={sfx}  k={args.k}")
     X_foia = sp.load_npz(f"{OUT_DIR}/tfidf_foia{tag}.npz").tocsr().astype(np.float32)
-    X_univ = sp.load_npz(f"{OUT_DIR}/tfidf_universe{tag}.npz").tocsr().astype(np.float32)
     foia_ids = pd.read_csv(f"{OUT_DIR}/foia_ids_ordered{tag}.csv",
                            dtype={"athr_id": str})["athr_id"].tolist()
     df_univ = pd.read_parquet(f"{OUT_DIR}/universe_ids{tag}.parquet")
@@ -427,7 +392,14 @@ def main():
         feature_names = pickle.load(f)
     W = sp.load_npz(f"{OUT_DIR}/weight_matrix{tag}.npz")
     diag = pd.read_parquet(f"{OUT_DIR}/match_diagnostics{tag}.parquet")
-    print(f"  X_foia={X_foia.shape}  X_univ={X_univ.shape}  |vocab|={len(feature_names)}")
+    print(f"  X_foia={X_foia.shape}  n_univ={len(universe_ids):,}  |vocab|={len(feature_names)}")
+    index = None
+    if os.path.exists(index_path(OUT_DIR, tag)):
+        index = load_index(index_path(OUT_DIR, tag))
+        print(f"  neighbor index: K={index.top.idx.shape[1]}  ({index_path(OUT_DIR, tag)})")
+        if index.top.idx.shape[0] != len(universe_ids):
+            raise SystemExit(f"neighbor index rows {index.top.idx.shape[0]} != "
+                             f"n_univ {len(universe_ids)}")
 
     market_index, g = load_shocks(args.betas_path)
     S = build_share_matrix(
@@ -453,12 +425,15 @@ def main():
     )
 
     rng = np.random.default_rng(args.seed)
+    # FOIA x FOIA cosine once; every LOFO run below masks its folds out of it.
+    foia_sim = foia_similarity(X_foia)
 
     # ------ E1: LOFO ------
     if "e1" not in args.skip:
         print("\n[E1] LOFO cross-validation of KNN(k=3)")
         lofo = run_lofo(X_foia, S, g, args.k, args.sharpen, args.floor,
-                        args.n_folds, np.random.default_rng(args.seed))
+                        args.n_folds, np.random.default_rng(args.seed),
+                        sim=foia_sim)
         lofo.to_csv(f"{VAL_DIR}/lofo_pi_{stem}.csv", index=False)
         m = pi_metrics(lofo)
         print(f"  PI-level: n={m['n']}  corr={m['corr']:.3f}  "
@@ -466,7 +441,8 @@ def main():
 
         cell = cell_metrics(lofo, S, X_foia, foia_ids, market_index, g,
                             args.k, args.sharpen, args.floor,
-                            args.n_folds, np.random.default_rng(args.seed))
+                            args.n_folds, np.random.default_rng(args.seed),
+                            sim=foia_sim)
         cell.to_csv(f"{VAL_DIR}/lofo_cell_{stem}.csv", index=False)
         with open(f"{VAL_DIR}/lofo_summary_{stem}.txt", "w") as f:
             f.write(f"LOFO KNN(k={args.k})  version={args.version}{sfx}\n")
@@ -492,15 +468,17 @@ def main():
             if m_name.startswith("knn"):
                 kk = int(m_name[3:])
                 df_m = run_lofo(X_foia, S, g, kk, args.sharpen, args.floor,
-                                args.n_folds, np.random.default_rng(args.seed))
+                                args.n_folds, np.random.default_rng(args.seed),
+                                sim=foia_sim)
             elif m_name == "grand_mean":
                 df_m = run_lofo(X_foia, S, g, args.k, args.sharpen, args.floor,
                                 args.n_folds, np.random.default_rng(args.seed),
-                                method="grand_mean")
+                                method="grand_mean", sim=foia_sim)
             elif m_name == "cluster_mean":
                 df_m = run_lofo(X_foia, S, g, args.k, args.sharpen, args.floor,
                                 args.n_folds, np.random.default_rng(args.seed),
-                                method="cluster_mean", clusters=foia_clusters)
+                                method="cluster_mean", clusters=foia_clusters,
+                                sim=foia_sim)
             else:
                 continue
             met = pi_metrics(df_m)
@@ -515,7 +493,7 @@ def main():
     # ------ E3: support diagnostics ------
     if "e3" not in args.skip:
         print("\n[E3] Support diagnostics under _cf")
-        hist = support_hist(diag, keep_mask, args.k)
+        hist = support_hist(diag, keep_mask, args.k, index=index)
         hist.to_csv(f"{VAL_DIR}/support_hist_{args.version}{sfx}.csv", index=False)
         print(f"  Saved {VAL_DIR}/support_hist_{args.version}{sfx}.csv")
         if "e1" not in args.skip:
@@ -530,7 +508,8 @@ def main():
         perm = rng.permutation(X_foia.shape[0])
         S_perm = sp.csr_matrix(S.toarray()[perm])
         placebo = run_lofo(X_foia, S_perm, g, args.k, args.sharpen, args.floor,
-                           args.n_folds, np.random.default_rng(args.seed))
+                           args.n_folds, np.random.default_rng(args.seed),
+                           sim=foia_sim)
         placebo.to_csv(f"{VAL_DIR}/placebo_pi_{stem}.csv", index=False)
         pm = pi_metrics(placebo)
         with open(f"{VAL_DIR}/placebo_summary_{stem}.txt", "w") as f:
@@ -545,9 +524,9 @@ def main():
     if "e5" not in args.skip:
         print("\n[E5] Face-validity table (stratified by max_sim quintile)")
         face_rng = np.random.default_rng(args.seed + 1)
-        face = face_validity_table(X_univ, X_foia, W, universe_ids, foia_ids,
+        face = face_validity_table(X_foia, W, universe_ids, foia_ids,
                                    feature_names, keep_mask, args.k,
-                                   args.face_per_quintile, face_rng)
+                                   args.face_per_quintile, face_rng, index=index)
         face.to_csv(f"{VAL_DIR}/face_validity_{stem}.csv", index=False)
         print(f"  Saved {VAL_DIR}/face_validity_{stem}.csv  ({len(face)} rows)")
 
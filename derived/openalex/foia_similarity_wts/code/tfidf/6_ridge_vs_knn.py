@@ -6,9 +6,11 @@ Each fold:
   1. Draw the same random train/test partition of the 208 FOIA anchors.
   2. K-NN prediction:  the production recipe from 5_holdout_stress.py
                        (top-K on cosine sim, floor, sharpen, L1-normalize,
-                       weighted average of train exposure).
-  3. Ridge prediction: RidgeCV over `--alphas` on the train fold to pick alpha
-                       (efficient LOO GCV), then Ridge.predict on the test fold.
+                       weighted average of train exposure), all folds in one
+                       pass of the shared engine (lofo_engine.py).
+  3. Ridge prediction: exact LOO over `--alphas` on the train fold to pick alpha
+                       (RidgeCV's efficient LOO, via ridge_engine.py), then
+                       the ridge fit at that alpha predicts the test fold.
   4. Also record `max_sim_to_train` for stratifying error curves by
                        "how close is my nearest anchor" — same axis as 5_.
 
@@ -27,7 +29,10 @@ import os
 import numpy as np
 import pandas as pd
 import scipy.sparse
-from sklearn.linear_model import Ridge, RidgeCV
+
+from lofo_engine import fold_slices, fold_topk, foia_similarity, holdout_folds
+from ridge_engine import ridge_gcv, ridge_predict
+from topk_engine import knn_predict
 
 OUT_DIR = "../../output"
 DEFAULT_EXPOSURE_DTA = "../../external/exposure_wts/athr_exposure_hc.dta"
@@ -48,31 +53,10 @@ def _paths(tag: str, out_suffix: str = "") -> dict:
     }
 
 
-def predict_knn(sim_test_train, E_train, k, sharpen, floor):
-    """Top-K sharpened weighted average. Mirrors 5_holdout_stress.predict_holdout
-    (which itself mirrors 2_similarity_wts.process_batch)."""
-    n_test, n_train = sim_test_train.shape
-    k = min(k, n_train)
-    topk_idx = np.argpartition(-sim_test_train, k - 1, axis=1)[:, :k]
-    rows = np.arange(n_test)[:, None]
-    vals = sim_test_train[rows, topk_idx].copy()
-    vals = np.where(vals >= floor, vals, 0.0)
-    if sharpen != 1.0:
-        vals = np.where(vals > 0, np.power(vals, sharpen), 0.0)
-    row_sums = vals.sum(axis=1, keepdims=True)
-    row_sums = np.where(row_sums > 0, row_sums, 1.0)
-    w = vals / row_sums
-    E_picked = E_train[topk_idx]
-    return (w * E_picked).sum(axis=1)
-
-
 def predict_ridge(X_train, y_train, X_test, alphas):
     """Pick alpha by GCV on train, predict on test. Returns pred, alpha_chosen."""
-    m = RidgeCV(alphas=alphas, fit_intercept=True, scoring=None, cv=None)
-    m.fit(X_train, y_train)
-    alpha = float(m.alpha_)
-    pred = Ridge(alpha=alpha, fit_intercept=True).fit(X_train, y_train).predict(X_test)
-    return pred, alpha
+    fit = ridge_gcv(X_train, y_train, alphas)
+    return ridge_predict(fit, X_test)[:, 0], float(fit.alpha[0])
 
 
 def metrics(y_true, y_pred):
@@ -142,42 +126,38 @@ def main():
     print(f"Exposure: mean={E.mean():.4f}  sd={E.std():.4f}  "
           f"range=[{E.min():.4f}, {E.max():.4f}]   nonzero={(E != 0).sum()}/{n}")
 
-    rng = np.random.default_rng(args.seed)
-    n_test = int(round(args.holdout_frac * n))
-    rows = []
-
-    for f in range(args.folds):
-        perm = rng.permutation(n)
-        test_idx = np.sort(perm[:n_test])
-        train_idx = np.sort(perm[n_test:])
-        X_test = X[test_idx]
-        X_train = X[train_idx]
-
-        # cosine sim (rows already L2-normalized by 1_vectorize)
-        sim = (X_test @ X_train.T).toarray().astype(np.float64)
-        max_sim = sim.max(axis=1)
-
-        pred_knn = predict_knn(sim, E[train_idx], args.k, args.sharpen, args.floor)
-        pred_ridge, alpha_f = predict_ridge(X_train, E[train_idx], X_test, alphas)
-
-        for j, i in enumerate(test_idx):
-            rows.append({
-                "fold": f,
-                "athr_id": foia_ids[i],
-                "n_train": int(len(train_idx)),
-                "max_sim_to_train": float(max_sim[j]),
-                "true_exposure": float(E[i]),
-                "pred_knn": float(pred_knn[j]),
-                "pred_ridge": float(pred_ridge[j]),
-                "ridge_alpha": alpha_f,
-            })
-
-        m_k = metrics(E[test_idx], pred_knn)
-        m_r = metrics(E[test_idx], pred_ridge)
-        print(f"  fold {f:2d}: alpha={alpha_f:8.4g}  "
+    # K-NN arm for every fold at once: one FOIA x FOIA cosine (rows already
+    # L2-normalized by 1_vectorize), test columns masked per fold -- the same
+    # engine and folds as 5_holdout_stress.py.
+    folds = holdout_folds(n, args.folds, args.holdout_frac,
+                          np.random.default_rng(args.seed))
+    fold_top = fold_topk(foia_similarity(X), folds, args.k, args.floor)
+    pred_knn = knn_predict(fold_top.top, E, args.k, args.floor, args.sharpen)
+    pred_ridge = np.empty(len(fold_top.row))
+    ridge_alpha = np.empty(len(fold_top.row))
+
+    for f, q in fold_slices(fold_top):
+        test_idx = folds[f]
+        train_idx = np.setdiff1d(np.arange(n), test_idx)
+        pred_ridge[q], ridge_alpha[q] = predict_ridge(X[train_idx], E[train_idx],
+                                                      X[test_idx], alphas)
+
+        m_k = metrics(E[test_idx], pred_knn[q])
+        m_r = metrics(E[test_idx], pred_ridge[q])
+        print(f"  fold {f:2d}: alpha={ridge_alpha[q][0]:8.4g}  "
               f"KNN MSE={m_k['mse']:.5f} corr={m_k['corr']:+.3f}   "
               f"Ridge MSE={m_r['mse']:.5f} corr={m_r['corr']:+.3f}")
 
+    rows = {
+        "fold": fold_top.fold,
+        "athr_id": np.asarray(foia_ids, dtype=object)[fold_top.row],
+        "n_train": fold_top.n_train,
+        "max_sim_to_train": fold_top.top.max_sim.astype(np.float64),
+        "true_exposure": E[fold_top.row],
+        "pred_knn": pred_knn.astype(np.float64),
+        "pred_ridge": pred_ridge,
+        "ridge_alpha": ridge_alpha,
+    }
     df = pd.DataFrame(rows)
     df.to_csv(paths["out_pairs"], index=False)
     print(f"\nSaved per-(fold,FOIA) rows: {paths['out_pairs']}")
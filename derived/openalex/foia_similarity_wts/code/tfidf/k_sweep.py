@@ -28,9 +28,10 @@ independent validation targets, holding everything else at production values
 Same random seed for holdout folds across K values so the sweep is a fair
 head-to-head.  Same coauthor pair set, same cluster labels.
 
-The universe TF-IDF matrix is the memory-heavy piece.  We compute the
-universe-FOIA cosine matrix once (dense, ~2.2 GB), then for each K just do
-argpartition on that matrix -- no re-matmul.
+The universe TF-IDF matrix is the memory-heavy piece.  Each sweep runs the
+shared top-K engine (topk_engine.py) once at max(K) and slices the sorted
+top-K buffer for every smaller K -- no re-matmul, no dense universe x FOIA
+matrix.
 
 Usage:
   python k_sweep.py --tag restricted --version hc --ks 1 2 3 5 10 20 \
@@ -52,6 +53,9 @@ import scipy.sparse
 import matplotlib.pyplot as plt
 from sklearn.feature_extraction.text import CountVectorizer
 
+from lofo_engine import fold_topk, foia_similarity, holdout_folds, sweep
+from topk_engine import knn_predict, topk_similarity
+
 OUT_DIR = "../../output"
 FIG_DIR = f"{OUT_DIR}/figures"
 EXPOSURE_DIR = "../../external/exposure_wts"
@@ -61,26 +65,6 @@ EDGES = "/n/home02/cxu75/sci_eq/derived/openalex/cluster_fields/output/bert/auth
 CLUSTER_DIR = "../../us_cluster_fields/output"
 
 
-# --------------------------------------------------------------------------
-# Core prediction primitive: mirrors 2_similarity_wts.process_batch exactly.
-# --------------------------------------------------------------------------
-def knn_predict_from_sim(sim, e_train, k, sharpen, floor):
-    """Top-K, floor, sharpen^power, L1-normalize, weighted average.
-    sim: (n_test, n_train) dense cosine.  Returns (pred, max_sim_row)."""
-    n_test, n_train = sim.shape
-    k = min(k, n_train)
-    topk_idx = np.argpartition(-sim, k - 1, axis=1)[:, :k]
-    rows = np.arange(n_test)[:, None]
-    vals = sim[rows, topk_idx].copy()
-    vals = np.where(vals >= floor, vals, 0.0)
-    if sharpen != 1.0:
-        vals = np.where(vals > 0, np.power(vals, sharpen), 0.0)
-    row_sums = vals.sum(axis=1, keepdims=True)
-    row_sums = np.where(row_sums > 0, row_sums, 1.0)
-    w = vals / row_sums
-    return (w * e_train[topk_idx]).sum(axis=1), sim.max(axis=1)
-
-
 def _metrics(y_true, y_pred):
     y_true = np.asarray(y_true, dtype=np.float64)
     y_pred = np.asarray(y_pred, dtype=np.float64)
@@ -124,34 +108,23 @@ def sweep_holdout(X, e_foia, foia_ids, ks, folds, holdout_frac, sharpen, floor,
     partition across K values so the comparison is not confounded by fold
     variance."""
     n = X.shape[0]
-    n_test = int(round(holdout_frac * n))
-    rng = np.random.default_rng(seed)
-    fold_partitions = [rng.permutation(n) for _ in range(folds)]
-
-    rows = []
-    for f, perm in enumerate(fold_partitions):
-        test_idx = np.sort(perm[:n_test])
-        train_idx = np.sort(perm[n_test:])
-        X_test = X[test_idx]; X_train = X[train_idx]
-        sim = (X_test @ X_train.T).toarray().astype(np.float32)
-        # Row-quintile assignment uses the row max_sim WITHIN THIS FOLD, and it
-        # is K-independent (it's the max cosine to the train pool, not any
-        # weighted quantity).  So quintile assignment is fixed across K.
-        max_sim = sim.max(axis=1)
-
-        for k in ks:
-            pred, _ = knn_predict_from_sim(sim, e_foia[train_idx], k, sharpen, floor)
-            for j, i in enumerate(test_idx):
-                rows.append({
-                    "k": k,
-                    "fold": f,
-                    "athr_id": foia_ids[i],
-                    "max_sim_to_train": float(max_sim[j]),
-                    "true": float(e_foia[i]),
-                    "pred": float(pred[j]),
-                })
-
-    df = pd.DataFrame(rows)
+    test_sets = holdout_folds(n, folds, holdout_frac, np.random.default_rng(seed))
+    # Every fold's test rows against its train rows in one masked pass over
+    # the FOIA x FOIA cosine (lofo_engine.py), at max(K); each K slices it.
+    # Row-quintile assignment uses the row max_sim WITHIN THIS FOLD, and it
+    # is K-independent (it's the max cosine to the train pool, not any
+    # weighted quantity).  So quintile assignment is fixed across K.
+    fold_top = fold_topk(foia_similarity(X), test_sets, max(ks), floor)
+    res = sweep(fold_top, e_foia, ks, [sharpen], [floor])
+    qry = res["query"]
+    df = pd.DataFrame({
+        "k": res["k"],
+        "fold": fold_top.fold[qry],
+        "athr_id": np.asarray(foia_ids, dtype=object)[fold_top.row[qry]],
+        "max_sim_to_train": fold_top.top.max_sim[qry].astype(np.float64),
+        "true": e_foia[fold_top.row[qry]].astype(np.float64),
+        "pred": res["pred"].astype(np.float64),
+    })
 
     # Assign quintile using the pooled max_sim distribution WITHIN THE
     # k=ks[0] slice (identical to any other k since it's K-independent).
@@ -236,8 +209,11 @@ def sweep_coauthor(X_foia, foia_ids, e_foia, tag, ks, sharpen, floor,
     X_co = _vectorize_in_foia_space(df_co["processed_text"].tolist(),
                                     feature_names, idf_values).astype(np.float64)
 
-    # Coauthor -> FOIA cosine similarity (dense, one-shot).
+    # Coauthor -> FOIA cosine similarity (dense, one-shot) -- the twin test
+    # ranks every FOIA, so it needs the full matrix; predictions use the
+    # top-K engine.
     sim = (X_co @ X_foia.T.astype(np.float64)).toarray().astype(np.float64)
+    top = topk_similarity(X_co, X_foia, max(ks), floor, dtype=np.float64)
 
     df_map = pd.read_stata(COAUTHORS_DTA)
     df_map["athr_id"] = df_map["athr_id"].astype(str)
@@ -259,7 +235,7 @@ def sweep_coauthor(X_foia, foia_ids, e_foia, tag, ks, sharpen, floor,
     rows = []
     pairs_all = []
     for k in ks:
-        pred, _ = knn_predict_from_sim(sim, e_foia, k, sharpen, floor)
+        pred = knn_predict(top, e_foia, k, floor, sharpen)
         preds_pair = pred[df["co_pos"].values]
         d = df.copy()
         d["k"] = k
@@ -303,34 +279,13 @@ def sweep_cluster(X_univ, X_foia, universe_ids, foia_ids, e_foia,
           f"univ no-cluster={int(univ_labels['cluster_label'].isna().sum()):,}"
           f"/{len(univ_labels):,}")
 
-    # Precompute universe × FOIA cosine ONCE (heavy).
-    print(f"  computing universe -> FOIA cosine (once, "
+    # Top-max(ks) universe -> FOIA neighbors ONCE (heavy), sorted so each
+    # K below just takes the first K columns.
+    print(f"  computing universe -> FOIA top-{max(ks)} (once, "
           f"{X_univ.shape[0]:,} x {X_foia.shape[0]})...")
-    X_foia_T = X_foia.T.toarray().astype(np.float32)   # tiny
-    n_univ = X_univ.shape[0]
-    n_foia = X_foia.shape[0]
-    # Batch to avoid a single 2.2 GB allocation peak on top of X_univ.
-    BATCH = 50_000
-    sim_top = None       # will hold the top-max(ks) per row: (n_univ, k_max)
-    sim_top_idx = None
-    k_max = max(ks)
-    sim_top = np.zeros((n_univ, k_max), dtype=np.float32)
-    sim_top_idx = np.zeros((n_univ, k_max), dtype=np.int32)
-    for s in range(0, n_univ, BATCH):
-        e = min(s + BATCH, n_univ)
-        batch_sim = X_univ[s:e].dot(X_foia_T)          # (b, n_foia) dense
-        # Argpartition to top k_max, then only keep those K columns.
-        b = batch_sim.shape[0]
-        if k_max < n_foia:
-            topk_idx = np.argpartition(-batch_sim, k_max - 1, axis=1)[:, :k_max]
-        else:
-            topk_idx = np.tile(np.arange(n_foia), (b, 1))
-        rows_local = np.repeat(np.arange(b), k_max)
-        topk_vals = batch_sim[rows_local, topk_idx.ravel()].reshape(b, k_max)
-        sim_top[s:e] = topk_vals.astype(np.float32)
-        sim_top_idx[s:e] = topk_idx.astype(np.int32)
-        del batch_sim, topk_vals, topk_idx
-    print(f"  done, sim_top: {sim_top.nbytes/1e6:.0f} MB")
+    top = topk_similarity(X_univ, X_foia, max(ks), floor,
+                          n_jobs=int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count() or 1)))
+    print(f"  done, top-K buffer: {(top.sim.nbytes + top.idx.nbytes)/1e6:.0f} MB")
 
     # Precompute per-cluster FOIA mean exposure.
     foia_ok = foia_labels.dropna(subset=["cluster_label"]).copy()
@@ -339,24 +294,7 @@ def sweep_cluster(X_univ, X_foia, universe_ids, foia_ids, e_foia,
 
     rows = []
     for k in ks:
-        # For this K, take the top-k columns of sim_top (subset of top-k_max).
-        # We need the top-k of the RANKED top-k_max, so partition again on the
-        # k_max-size row.
-        if k < k_max:
-            rank_idx = np.argpartition(-sim_top, k - 1, axis=1)[:, :k]
-            rows_local = np.arange(n_univ)[:, None]
-            vals = sim_top[rows_local, rank_idx]
-            idx  = sim_top_idx[rows_local, rank_idx]
-        else:
-            vals = sim_top
-            idx  = sim_top_idx
-        vals = np.where(vals >= floor, vals, 0.0)
-        if sharpen != 1.0:
-            vals = np.where(vals > 0, np.power(vals, sharpen), 0.0)
-        row_sums = vals.sum(axis=1, keepdims=True)
-        row_sums = np.where(row_sums > 0, row_sums, 1.0)
-        w = vals / row_sums
-        imputed_univ = (w * e_foia[idx]).sum(axis=1)
+        imputed_univ = knn_predict(top, e_foia, k, floor, sharpen)
 
         d = univ_labels.copy()
         d["imputed"] = imputed_univ
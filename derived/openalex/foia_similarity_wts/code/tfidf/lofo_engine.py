@@ -0,0 +1,137 @@
+"""
+Shared holdout / leave-one-FOIA-out evaluation engine for the K-NN recipe.
+
+5_holdout_stress.py, 6_ridge_vs_knn.py (K-NN arm), k_sweep.py (holdout arm)
+and 5_validate_shift_share.py (LOFO, E1/E2/E4) all score the recipe the same
+way: hold some FOIAs out, rank the rest by cosine, predict each held-out row
+from its top-K train neighbors. They used to slice X per fold and redo the
+sparse product every fold -- and again for every K, baseline and placebo.
+The anchor pool is ~208 rows, so the whole evaluation fits in one small
+dense block:
+
+  foia_similarity(X)
+      Full FOIA x FOIA cosine, computed once. Same sparse x dense product
+      topk_similarity() runs, so every (i, j) entry is bit-identical to what
+      the per-fold slices produced.
+
+  holdout_folds(n, folds, holdout_frac, rng) / kfold_folds(n, n_folds, rng)
+      Sorted test sets, drawn from rng in the order the scripts always drew
+      them (one permutation per holdout fold; one permutation cut into
+      contiguous chunks for K-fold / LOO), so existing seeds reproduce.
+
+  fold_topk(sim, folds, k, floor)
+      Stacks every (fold, held-out row) query, sets that fold's test columns
+      to -inf and runs the top-K reduction on the whole (Q, n) block at once.
+      FoldTopK carries columnar fold / row / n_train arrays and a TopK whose
+      idx are GLOBAL anchor rows, so knn_predict(fold_top.top, E, ...) takes
+      the full anchor vector (or share matrix): a held-out anchor can never
+      be a neighbor of its own fold.
+
+  train_mask(fold_top, n)
+      (Q, n) bool train membership per query, for neighbor-set baselines
+      (grand mean, cluster mean) as one matmul; fold_slices(fold_top) gives
+      each fold's contiguous query range for per-fold work (ridge refits).
+
+  sweep(fold_top, E, ks, sharpens, floors)
+      Predictions for every K x sharpen x floor combination from the one
+      top-max(K) buffer, as flat columns.
+
+Results are columnar (dicts of NumPy arrays, query-major in fold order),
+ready for pd.DataFrame.
+"""
+from typing import NamedTuple
+
+import numpy as np
+import scipy.sparse
+
+from topk_engine import TopK, knn_predict, topk_dense
+
+
+class FoldTopK(NamedTuple):
+    fold: np.ndarray     # (Q,) int32 fold of each query
+    row: np.ndarray      # (Q,) int32 held-out anchor row
+    n_train: np.ndarray  # (Q,) int32 train pool size of that fold
+    top: TopK            # (Q, K) neighbors among the fold's train rows
+
+
+def foia_similarity(X, dtype=np.float32):
+    """(n, n) dense cosine of L2-normalized rows."""
+    if scipy.sparse.issparse(X):
+        X = X.tocsr().astype(dtype)
+        sim = X @ np.ascontiguousarray(X.T.toarray())
+    else:
+        X = np.asarray(X, dtype=dtype)
+        sim = X @ X.T
+    return np.ascontiguousarray(sim, dtype=dtype)
+
+
+def holdout_folds(n, folds, holdout_frac, rng):
+    """Random holdout_frac test sets, one rng.permutation(n) per fold."""
+    n_test = int(round(holdout_frac * n))
+    return [np.sort(rng.permutation(n)[:n_test]) for _ in range(folds)]
+
+
+def kfold_folds(n, n_folds, rng):
+    """Partition one rng.permutation(n) into n_folds contiguous test sets;
+    n_folds >= n is leave-one-out (fold i holds out perm[i])."""
+    perm = rng.permutation(n)
+    if n_folds >= n:
+        return [perm[i:i + 1] for i in range(n)]
+    return [np.sort(perm[f * n // n_folds:(f + 1) * n // n_folds])
+            for f in range(n_folds)]
+
+
+def fold_topk(sim, folds, k, floor=0.0):
+    """Top-k train neighbors of every held-out row of every fold.
+
+    sim: (n, n) from foia_similarity; folds: list of test-index arrays.
+    k is clipped to the smallest train pool. max_sim / n_above_floor are
+    over the fold's train rows only."""
+    n = sim.shape[0]
+    sizes = np.array([len(t) for t in folds], dtype=np.int64)
+    fold = np.repeat(np.arange(len(folds), dtype=np.int32), sizes)
+    row = (np.concatenate(folds) if len(folds) else np.zeros(0)).astype(np.int32)
+    member = np.zeros((len(folds), n), dtype=bool)
+    member[fold, row] = True
+    n_train = (n - sizes[fold]).astype(np.int32)
+
+    block = sim[row]
+    block[member[fold]] = -np.inf
+    k = min(k, int(n_train.min())) if len(row) else k
+    return FoldTopK(fold=fold, row=row, n_train=n_train,
+                    top=topk_dense(block, k, floor))
+
+
+def train_mask(fold_top, n):
+    """(Q, n) bool: anchor j is in query q's train pool."""
+    member = np.zeros((int(fold_top.fold.max(initial=-1)) + 1, n), dtype=bool)
+    member[fold_top.fold, fold_top.row] = True
+    return ~member[fold_top.fold]
+
+
+def fold_slices(fold_top):
+    """[(fold, slice into the query axis)] -- queries are stored fold-major."""
+    bounds = np.flatnonzero(np.diff(fold_top.fold)) + 1
+    starts = np.concatenate([[0], bounds])
+    stops = np.concatenate([bounds, [len(fold_top.fold)]])
+    return [(int(fold_top.fold[s]), slice(int(s), int(e)))
+            for s, e in zip(starts, stops) if e > s]
+
+
+def sweep(fold_top, E, ks, sharpens, floors):
+    """Predictions for every (k, sharpen, floor) in the grid.
+
+    E: (n,) anchor values or (n, M) share rows. Returns columns k / sharpen /
+    floor / query (position in fold_top) of length G * Q, grid-major, and
+    pred of shape (G * Q,) or (G * Q, M)."""
+    Q = len(fold_top.row)
+    grid = [(k, s, f) for k in ks for s in sharpens for f in floors]
+    preds = [knn_predict(fold_top.top, E, k, f, s) for k, s, f in grid]
+    g = np.repeat(np.arange(len(grid)), Q)
+    return {
+        "k": np.array([c[0] for c in grid], dtype=np.int32)[g],
+        "sharpen": np.array([c[1] for c in grid], dtype=np.float64)[g],
+        "floor": np.array([c[2] for c in grid], dtype=np.float64)[g],
+        "query": np.tile(np.arange(Q, dtype=np.int32), len(grid)),
+        "pred": np.concatenate(preds) if preds else np.zeros(0),
+    }
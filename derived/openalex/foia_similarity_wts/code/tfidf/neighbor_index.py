@@ -0,0 +1,176 @@
+"""
+Persisted universe -> FOIA top-K neighbor index.
+
+2_similarity_wts.py (TF-IDF) and bert/2_similarity_wts.py (embeddings) both
+compute every universe author's nearest FOIA PIs and then collapse them into
+one L1-normalized W. The index keeps the raw neighbor list instead, so any
+W recipe, max_sim filter or match diagnostic can be derived later without
+reloading the universe matrix or redoing the similarity pass.
+
+On disk (one directory, every array memory-mappable):
+
+  neighbor_index{tag}/
+    idx.npy          (n, K) int32    FOIA row in foia_ids_ordered, by desc sim
+    sim.npy          (n, K) float32  raw cosine (float16 with --index-dtype)
+    max_sim.npy      (n,)   float32  best cosine over ALL FOIAs
+    n_above.npy      (n, F) int32    # FOIAs with sim >= each stored floor
+    athr_id.parquet  universe author ids, row-aligned with the arrays
+    meta.json        K, n_foia, floors, sim dtype, source + build info
+
+  load_index(path)                         -> NeighborIndex
+  load_max_sim(path)                       -> [athr_id, max_sim] frame
+  recipe_weights(index, k, floor, sharpen) -> (n, n_foia) CSR W
+  match_diagnostics(index, k, floor, unmatched_threshold)
+                                           -> match_diagnostics-style frame
+  n_above_floor(index, floor)              -> counts (exact for stored floors)
+
+Recipes with k <= K are exact prefixes of the stored list (the top-K buffer
+is sorted), so a W derived here equals the one 2_similarity_wts.py would
+build directly, up to float16 rounding when the index was saved that way.
+"""
+import json
+import os
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from topk_engine import TopK, knn_weights, weights_to_csr
+
+INDEX_K = 20
+INDEX_VERSION = 1
+
+
+class NeighborIndex(NamedTuple):
+    top: TopK                  # idx / sim memory-mapped; mean_topk_sim None when loaded
+    athr_id: np.ndarray        # (n,) universe author ids
+    n_foia: int
+    floors: list               # floors with exact n_above counts (top.n_above_floor cols)
+    meta: dict
+
+
+def index_path(out_dir, tag=""):
+    """Directory for the index built from tag's artifacts."""
+    if tag and not tag.startswith("_"):
+        tag = "_" + tag
+    return f"{out_dir}/neighbor_index{tag}"
+
+
+def save_index(path, top, athr_id, n_foia, floors=(), sim_dtype=np.float32,
+               meta=None):
+    """Write top (a TopK, n_above_floor counted against `floors`) as an index.
+
+    Written to a temp dir and swapped in, so a crashed run never leaves a
+    half-written index behind for the readers.
+    """
+    floors = [float(f) for f in np.atleast_1d(floors)]
+    n_above = np.asarray(top.n_above_floor, dtype=np.int32)
+    n_above = n_above.reshape(len(top.max_sim), len(floors))
+    tmp = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    np.save(f"{tmp}/idx.npy", np.asarray(top.idx, dtype=np.int32))
+    np.save(f"{tmp}/sim.npy", np.asarray(top.sim, dtype=sim_dtype))
+    np.save(f"{tmp}/max_sim.npy", np.asarray(top.max_sim, dtype=np.float32))
+    np.save(f"{tmp}/n_above.npy", n_above)
+    pd.DataFrame({"athr_id": np.asarray(athr_id)}).to_parquet(
+        f"{tmp}/athr_id.parquet", index=False)
+    with open(f"{tmp}/meta.json", "w") as f:
+        json.dump({
+            "version": INDEX_VERSION,
+            "k": int(top.idx.shape[1]),
+            "n_universe": int(top.idx.shape[0]),
+            "n_foia": int(n_foia),
+            "floors": floors,
+            "sim_dtype": np.dtype(sim_dtype).name,
+            **(meta or {}),
+        }, f, indent=2)
+    if os.path.isdir(path):
+        old = f"{path}.old-{os.getpid()}"
+        os.replace(path, old)
+        os.replace(tmp, path)
+        for name in os.listdir(old):
+            os.remove(os.path.join(old, name))
+        os.rmdir(old)
+    else:
+        os.replace(tmp, path)
+    return path
+
+
+def load_index(path, mmap=True):
+    """Open an index written by save_index. idx / sim stay memory-mapped
+    unless mmap=False; max_sim and the floor counts are small and loaded.
+    top.mean_topk_sim is None: match_diagnostics averages sim for its own k,
+    so opening the index never reads all of sim."""
+    if not os.path.exists(f"{path}/meta.json"):
+        raise FileNotFoundError(f"no neighbor index at {path}")
+    with open(f"{path}/meta.json") as f:
+        meta = json.load(f)
+    if meta.get("version") != INDEX_VERSION:
+        raise ValueError(f"{path}: index version {meta.get('version')} != "
+                         f"{INDEX_VERSION}; rebuild with 2_similarity_wts.py")
+    mode = "r" if mmap else None
+    idx = np.load(f"{path}/idx.npy", mmap_mode=mode)
+    sim = np.load(f"{path}/sim.npy", mmap_mode=mode)
+    top = TopK(
+        idx=idx,
+        sim=sim,
+        max_sim=np.load(f"{path}/max_sim.npy"),
+        mean_topk_sim=None,
+        n_above_floor=np.load(f"{path}/n_above.npy"),
+    )
+    athr_id = pd.read_parquet(f"{path}/athr_id.parquet")["athr_id"].to_numpy()
+    return NeighborIndex(top, athr_id, int(meta["n_foia"]),
+                         list(meta["floors"]), meta)
+
+
+def load_max_sim(path):
+    """[athr_id, max_sim] frame from an index, without opening idx / sim."""
+    if not os.path.exists(f"{path}/meta.json"):
+        raise FileNotFoundError(f"no neighbor index at {path}")
+    df = pd.read_parquet(f"{path}/athr_id.parquet")
+    df["max_sim"] = np.load(f"{path}/max_sim.npy")
+    return df
+
+
+def _check_k(index, k):
+    K = index.top.idx.shape[1]
+    if min(k, index.n_foia) > K:
+        raise ValueError(f"k={k} exceeds the index's stored K={K}; rebuild "
+                         f"with 2_similarity_wts.py --index-k {k}")
+    return min(k, index.n_foia)
+
+
+def n_above_floor(index, floor):
+    """# FOIAs with sim >= floor per author. Exact for the floors stored at
+    build time; otherwise counted from the top-K list, which is exact except
+    for authors whose K-th neighbor still clears the floor (reported as K)."""
+    if floor in index.floors:
+        return np.asarray(index.top.n_above_floor[:, index.floors.index(floor)])
+    return np.count_nonzero(np.asarray(index.top.sim) >= floor, axis=1).astype(np.int32)
+
+
+def recipe_weights(index, k, floor, sharpen, unmatched_threshold=None,
+                   l1_normalize=True):
+    """Production K-NN W for one recipe, derived from the index."""
+    k = _check_k(index, k)
+    weights = knn_weights(index.top, k, floor, sharpen,
+                          unmatched_threshold=unmatched_threshold,
+                          l1_normalize=l1_normalize)
+    return weights_to_csr(index.top, weights, index.n_foia)
+
+
+def match_diagnostics(index, k, floor, unmatched_threshold):
+    """Per-author frame with the match_diagnostics{tag}.parquet columns."""
+    k = _check_k(index, k)
+    top = index.top
+    if top.mean_topk_sim is not None and k == top.sim.shape[1]:
+        mean_topk_sim = top.mean_topk_sim
+    else:
+        mean_topk_sim = top.sim[:, :k].mean(axis=1, dtype=np.float32)
+    return pd.DataFrame({
+        "athr_id": index.athr_id,
+        "max_sim": top.max_sim,
+        "mean_topk_sim": mean_topk_sim,
+        "n_foia_above_floor": n_above_floor(index, floor),
+        "unmatched": top.max_sim < unmatched_threshold,
+    })
@@ -0,0 +1,128 @@
+"""
+Multi-target ridge on TF-IDF with closed-form leave-one-out alpha choice.
+
+4_impute_shift_share.py --method ridge used to run RidgeCV and then a
+second Ridge fit per market column -- hundreds of factorizations of the same
+X_foia -- and to fill a dense (n_univ, K) float64 S_hat. Every market shares
+X, so one decomposition serves them all:
+
+  ridge_gcv(X, Y, alphas)
+      Eigendecomposes the centered anchor gram Xc Xc' = Q diag(lam) Q'
+      (n_anchors x n_anchors; n_anchors << vocabulary). For every alpha the
+      dual coefficients c = (Xc Xc' + alpha I)^-1 yc and the exact LOO
+      residuals c / diag(G^-1) (intercept unpenalized) follow for all
+      targets at once from Q' Y; each target keeps the alpha with the
+      lowest mean squared LOO error (first one on ties). This is the
+      efficient LOO that RidgeCV(cv=None) runs in its "gram" mode, so the
+      alpha choices are the same.
+
+  ridge_predict_blocks(fit, X_new, block_rows)
+      Yields predictions for row blocks of X_new as one sparse x sparse
+      product against the anchors and a dense (block, n) @ (n, K) product,
+      without forming the (vocabulary x K) coefficient matrix.
+
+Predictions are the exact ridge solution; sklearn's Ridge on sparse input
+solves the same system iteratively (tol 1e-4), so the two agree to that
+tolerance.
+"""
+from typing import NamedTuple
+
+import numpy as np
+import scipy.sparse
+
+PREDICT_BLOCK_ROWS = 65_536
+
+
+class RidgeFit(NamedTuple):
+    alpha: np.ndarray      # (K,)  chosen alpha per target
+    alpha_idx: np.ndarray  # (K,)  its index in alphas
+    loo_mse: np.ndarray    # (A, K) mean squared LOO error per (alpha, target)
+    in_r2: np.ndarray      # (K,)  in-sample R^2 at the chosen alpha
+    dual: np.ndarray       # (n, K) dual coefficients c
+    x_mean: np.ndarray     # (V,)  anchor feature means
+    y_mean: np.ndarray     # (K,)
+    XT: object             # (V, n) anchors transposed (CSR when sparse)
+
+
+def _centered_gram(X, x_mean):
+    """Xc Xc' without centering (and densifying) a sparse X."""
+    G = X @ X.T
+    G = G.toarray() if scipy.sparse.issparse(G) else np.asarray(G)
+    Xm = np.asarray(X @ x_mean).ravel()
+    return G - Xm[:, None] - Xm[None, :] + x_mean @ x_mean
+
+
+def ridge_gcv(X, Y, alphas):
+    """Fit every column of Y on X, picking each column's alpha by exact LOO.
+
+    X: (n, V) sparse or dense; Y: (n,) or (n, K). Intercepts are fit and not
+    penalized (fit_intercept=True). Returns a RidgeFit.
+    """
+    X = X.tocsr().astype(np.float64) if scipy.sparse.issparse(X) else np.asarray(X, np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    if Y.ndim == 1:
+        Y = Y[:, None]
+    alphas = np.asarray(alphas, dtype=np.float64).ravel()
+    n = X.shape[0]
+
+    x_mean = np.asarray(X.mean(axis=0)).ravel()
+    y_mean = Y.mean(axis=0)
+    Yc = Y - y_mean
+    lam, Q = np.linalg.eigh(_centered_gram(X, x_mean))
+    QtY = Q.T @ Yc
+    Qt1 = Q.sum(axis=0)
+    Q2 = Q * Q
+
+    loo_mse = np.empty((len(alphas), Y.shape[1]))
+    for a, alpha in enumerate(alphas):
+        D = 1.0 / (lam + alpha)
+        c = Q @ (D[:, None] * QtY)
+        # diag(G^-1) less the intercept direction
+        d = Q2 @ D - (Q @ (D * Qt1)) / n
+        loo_mse[a] = np.mean((c / d[:, None]) ** 2, axis=0)
+
+    alpha_idx = np.argmin(loo_mse, axis=0)
+    dual = np.empty_like(Yc)
+    for a in np.unique(alpha_idx):
+        cols = np.flatnonzero(alpha_idx == a)
+        D = 1.0 / (lam + alphas[a])
+        dual[:, cols] = Q @ (D[:, None] * QtY[:, cols])
+    alpha = alphas[alpha_idx]
+
+    # residual y - yhat = alpha * c
+    ss_res = (alpha ** 2) * (dual ** 2).sum(axis=0)
+    ss_tot = (Yc ** 2).sum(axis=0)
+    in_r2 = np.where(ss_tot > 0, 1.0 - ss_res / np.where(ss_tot > 0, ss_tot, 1.0), 0.0)
+
+    XT = X.T.tocsr() if scipy.sparse.issparse(X) else np.ascontiguousarray(X.T)
+    return RidgeFit(alpha=alpha, alpha_idx=alpha_idx, loo_mse=loo_mse, in_r2=in_r2,
+                    dual=dual, x_mean=x_mean, y_mean=y_mean, XT=XT)
+
+
+def ridge_predict_blocks(fit, X_new, block_rows=PREDICT_BLOCK_ROWS):
+    """Yield (start, (b, K) float64 predictions) over row blocks of X_new.
+
+    pred = (U - x_mean) Xc' c + y_mean, expanded so that only U @ X' (b x n)
+    is formed per block.
+    """
+    c = fit.dual
+    c_sum = c.sum(axis=0)
+    Xm = np.asarray(fit.x_mean @ fit.XT).ravel()            # (n,) = X @ x_mean
+    intercept = fit.y_mean - Xm @ c + (fit.x_mean @ fit.x_mean) * c_sum
+    n_new = X_new.shape[0]
+    for s in range(0, n_new, block_rows):
+        U = X_new[s:min(s + block_rows, n_new)]
+        if U.dtype != np.float64:
+            U = U.astype(np.float64)
+        P = U @ fit.XT
+        P = P.toarray() if scipy.sparse.issparse(P) else np.asarray(P)
+        Um = np.asarray(U @ fit.x_mean).ravel()
+        yield s, P @ c - Um[:, None] * c_sum + intercept
+
+
+def ridge_predict(fit, X_new, block_rows=PREDICT_BLOCK_ROWS):
+    """(n_new, K) predictions as one dense array (small X_new)."""
+    out = np.empty((X_new.shape[0], fit.dual.shape[1]))
+    for s, block in ridge_predict_blocks(fit, X_new, block_rows):
+        out[s:s + len(block)] = block
+    return out
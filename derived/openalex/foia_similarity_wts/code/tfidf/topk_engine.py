@@ -0,0 +1,200 @@
+"""
+Shared top-K cosine engine for the K-NN imputation recipe.
+
+2_similarity_wts.py (production W), k_sweep.py, 5_holdout_stress.py and
+5_validate_shift_share.py all need the same thing: for every query row, the
+K most-similar anchor (FOIA) rows plus a few row diagnostics, then the
+production weighting (floor -> sharpen^p -> unmatched -> L1). They used to
+each materialize the full dense query x anchor block, argpartition it,
+fancy-index the top-K and compute diagnostics in separate passes. Here:
+
+  topk_similarity(X, Y, k, floor)
+      Streams X through sparse x dense products in cache-sized row tiles
+      (TILE_ROWS x n_anchors float32, ~1-2 MB for ~200 anchors). Each tile is
+      reduced while it is hot -- top-K (sorted by descending sim), row max,
+      mean top-K sim, count >= floor -- straight into preallocated output
+      arrays. At most n_jobs tiles of the dense similarity exist at once.
+
+  topk_dense(sim, k, floor)
+      The same reduction on a dense similarity block already in memory.
+
+  knn_weights(top, k, floor, sharpen, ...)
+      Production weighting on the first k columns of the sorted top-K
+      buffer, so one top-Kmax pass serves every k <= Kmax.
+
+  weights_to_csr(top, weights, n_cols)
+      W written directly as CSR (indptr from per-row nonzero counts).
+
+  knn_predict(top, E, k, floor, sharpen)
+      Weighted average of anchor values (1-D) or share rows (2-D).
+
+Which of several exactly-tied anchors at the K-th place is kept is
+arbitrary, as it was with argpartition.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+import scipy.sparse
+
+TILE_ROWS = 2048
+
+
+class TopK(NamedTuple):
+    idx: np.ndarray            # (n, K) int32 anchor columns, by descending sim
+    sim: np.ndarray            # (n, K) raw cosine of those anchors
+    max_sim: np.ndarray        # (n,)   best cosine over ALL anchors
+    mean_topk_sim: np.ndarray  # (n,)   mean of the K sims (pre-floor)
+    n_above_floor: np.ndarray  # (n,)   int32, # anchors with sim >= floor
+                               #        ((n, F) when F floors are passed)
+
+
+def _reduce_tile(tile, k, floor, out):
+    """Reduce one dense (b, m) similarity tile into the TopK output slices."""
+    b, m = tile.shape
+    out.max_sim[:] = tile.max(axis=1)
+    if np.ndim(floor):
+        for j, f in enumerate(floor):
+            out.n_above_floor[:, j] = np.count_nonzero(tile >= f, axis=1)
+    else:
+        out.n_above_floor[:] = np.count_nonzero(tile >= floor, axis=1)
+    if k < m:
+        part = np.argpartition(-tile, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(m), (b, m))
+    vals = np.take_along_axis(tile, part, axis=1)
+    order = np.argsort(-vals, axis=1, kind="stable")
+    out.idx[:] = np.take_along_axis(part, order, axis=1)
+    out.sim[:] = np.take_along_axis(vals, order, axis=1)
+    out.mean_topk_sim[:] = out.sim.mean(axis=1)
+
+
+def _alloc_topk(n, k, floor, dtype):
+    return TopK(
+        idx=np.empty((n, k), dtype=np.int32),
+        sim=np.empty((n, k), dtype=dtype),
+        max_sim=np.empty(n, dtype=dtype),
+        mean_topk_sim=np.empty(n, dtype=dtype),
+        n_above_floor=np.empty((n,) + np.shape(floor), dtype=np.int32),
+    )
+
+
+def topk_similarity(X, Y, k, floor=0.0, n_jobs=1, tile_rows=TILE_ROWS,
+                    dtype=np.float32, sparse_anchors=False):
+    """Top-k cosine neighbors of every row of X among the rows of Y.
+
+    X: (n, V) sparse or dense query rows; Y: (m, V) anchor rows. Rows are
+    assumed L2-normalized (1_vectorize.py output), so X @ Y.T is cosine.
+    A dense X may be a memory-mapped .npy, or anything with .shape whose row
+    slices are arrays (bert/embedding_store.EmbeddingStore): it is read one
+    tile at a time and never copied whole. k is clipped to m. floor only
+    feeds the n_above_floor diagnostic; pass a sequence of floors to count
+    against each of them in the same pass. sparse_anchors=True keeps a
+    sparse Y sparse (sparse x sparse tiles) instead of densifying Y.T --
+    for wide vocabularies with many anchor rows, e.g. the anchor-vs-anchor
+    peer graph.
+    """
+    n, m = X.shape[0], Y.shape[0]
+    k = min(k, m)
+    if sparse_anchors and scipy.sparse.issparse(Y):
+        Y_T = Y.T.tocsr().astype(dtype)
+    else:
+        Y_T = (Y.T.toarray() if scipy.sparse.issparse(Y) else np.asarray(Y).T)
+        Y_T = np.ascontiguousarray(Y_T, dtype=dtype)
+    if scipy.sparse.issparse(X):
+        X = X.tocsr()
+        if X.dtype != dtype:
+            X = X.astype(dtype)
+    elif not hasattr(X, "shape"):
+        X = np.asarray(X, dtype=dtype)
+
+    top = _alloc_topk(n, k, floor, dtype)
+
+    def run(span):
+        lo, hi = span
+        for s in range(lo, hi, tile_rows):
+            e = min(s + tile_rows, hi)
+            block = X[s:e]
+            if block.dtype != dtype:
+                block = block.astype(dtype)
+            tile = block @ Y_T
+            if scipy.sparse.issparse(tile):
+                tile = tile.toarray()
+            _reduce_tile(np.asarray(tile), k, floor,
+                         TopK(*(a[s:e] for a in top)))
+
+    if n == 0:
+        return top
+    # Contiguous row spans per thread; sparse @ dense and the numpy
+    # reductions release the GIL, so threads scale without copying X.
+    n_spans = max(1, min(n_jobs * 4, -(-n // tile_rows)))
+    bounds = np.linspace(0, n, n_spans + 1).astype(np.int64)
+    spans = list(zip(bounds[:-1], bounds[1:]))
+    if n_jobs <= 1 or len(spans) == 1:
+        for span in spans:
+            run(span)
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as ex:
+            list(ex.map(run, spans))
+    return top
+
+
+def topk_dense(sim, k, floor=0.0):
+    """TopK of a dense (n, m) similarity block already in memory, e.g. the
+    FOIA x FOIA matrix with held-out columns set to -inf (lofo_engine.py).
+    Columns at -inf are never among the top k as long as k <= the number of
+    finite columns per row."""
+    sim = np.asarray(sim)
+    n, m = sim.shape
+    k = min(k, m)
+    top = _alloc_topk(n, k, floor, sim.dtype)
+    if n:
+        _reduce_tile(sim, k, floor, top)
+    return top
+
+
+def knn_weights(top, k, floor, sharpen, unmatched_threshold=None,
+                l1_normalize=True):
+    """Production K-NN weights from the first k (<= K) neighbors in top.
+
+    floor -> sharpen^p -> zero rows whose max_sim < unmatched_threshold ->
+    L1-normalize (rows with no surviving weight stay all-zero).
+    Returns (n, k) float32 aligned with top.idx[:, :k].
+    """
+    k = min(k, top.sim.shape[1])
+    vals = np.where(top.sim[:, :k] >= floor, top.sim[:, :k], 0).astype(np.float32)
+    if sharpen != 1.0:
+        vals = np.where(vals > 0, np.power(vals, sharpen, dtype=np.float32), 0)
+        vals = vals.astype(np.float32, copy=False)
+    if unmatched_threshold is not None:
+        vals[top.max_sim < unmatched_threshold] = 0.0
+    if l1_normalize:
+        row_sums = vals.sum(axis=1, keepdims=True)
+        row_sums[row_sums == 0] = 1.0
+        vals = vals / row_sums
+    return vals
+
+
+def weights_to_csr(top, weights, n_cols):
+    """(n, n_cols) CSR W from knn_weights output; zero weights are dropped."""
+    k = weights.shape[1]
+    nz = weights > 0
+    indptr = np.zeros(weights.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.count_nonzero(nz, axis=1), out=indptr[1:])
+    W = scipy.sparse.csr_matrix(
+        (weights[nz].astype(np.float32), top.idx[:, :k][nz], indptr),
+        shape=(weights.shape[0], n_cols),
+    )
+    W.sort_indices()
+    return W
+
+
+def knn_predict(top, E, k, floor, sharpen):
+    """Weighted-average prediction from anchor values E (m,) or share rows
+    E (m, M), using the production recipe (no unmatched cut, L1-normalized)."""
+    k = min(k, top.sim.shape[1])
+    w = knn_weights(top, k, floor, sharpen)
+    E_nb = np.asarray(E)[top.idx[:, :k]]
+    if E_nb.ndim == 2:
+        return (w * E_nb).sum(axis=1)
+    return np.einsum("nk,nkm->nm", w, E_nb)
@@ -10,23 +10,66 @@ dims and L2-normalizing makes Euclidean K-means approximate spherical
 
 Mirrors cluster_fields/2_cluster.py exactly so US-only vs worldwide
 clusterings stay comparable.
+
+Out of core (cluster_fields/code/spherical_kmeans.py): the SVD basis is fit
+on at most --svd-fit-rows authors, the projection is written block by block
+into a memory-mapped .npy, spherical K-means reads it in batches / blocks,
+and TF-IDF-space centroids are one sparse segment sum. Peak memory beyond
+the sparse TF-IDF input does not grow with the corpus.
+
+The projection is cached under ../temp/svd_cache/<key>/ (key = TF-IDF
+matrix + --restrict-ids file identity, svd dim / fit rows / seed), so
+reruns and other K reuse it. --clusters-grid 30,50,100,200 runs every K in
+one job: one projection, K-means per K in parallel forked workers over the
+shared memory map, the usual per-K files, plus
+../output/cluster_grid_summary{out_sfx}.csv (inertia, size distribution,
+largest-cluster share per K).
 """
 import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
 import numpy as np
 import pandas as pd
 import scipy.sparse
 import pickle
-from sklearn.cluster import MiniBatchKMeans
 from sklearn.decomposition import TruncatedSVD
-from sklearn.preprocessing import normalize
+
+# Shared streaming spherical k-means (lives with the worldwide cluster_fields code).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "..", "cluster_fields", "code"))
+from spherical_kmeans import (grid_summary, project_to_memmap, segment_means,  # noqa: E402
+                              spherical_kmeans_grid)
+
+N_JOBS = int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count() or 1))
+TFIDF_PATH = "../output/tfidf_matrix.npz"
+# Bump CACHE_VERSION whenever the SVD fit or projection logic changes.
+SVD_CACHE_DIR = "../temp/svd_cache"
+CACHE_VERSION = 1
 
 parser = argparse.ArgumentParser()
-parser.add_argument('--clusters', type=int, required=True)
+group = parser.add_mutually_exclusive_group(required=True)
+group.add_argument('--clusters', type=int)
+group.add_argument('--clusters-grid', default="",
+                   help="Comma-separated K list, e.g. 30,50,100,200: one SVD "
+                        "projection, K-means per K in parallel workers, and "
+                        "a cluster_grid_summary csv.")
 parser.add_argument('--svd-dim', type=int, default=256,
                     help="Reduce to this many dims via TruncatedSVD before K-means. "
                          "0 = skip (old behavior). Default 256 is the LSI/text-clustering "
                          "convention.")
+parser.add_argument('--svd-fit-rows', type=int, default=500_000,
+                    help="Fit the SVD basis on a random sample of this many "
+                         "authors (0 = all). Every author is then projected "
+                         "onto it block by block.")
 parser.add_argument('--seed', type=int, default=42)
+parser.add_argument('--jobs', type=int, default=N_JOBS,
+                    help="Parallel K-means workers for --clusters-grid "
+                         "(BLAS threads are split between them).")
+parser.add_argument('--rebuild-cache', action='store_true',
+                    help="Refit the SVD even if a cached projection exists.")
 parser.add_argument('--restrict-ids', default="",
                     help="csv with an athr_id column; cluster only these "
                          "authors (e.g. author_ls_authors_indiv.csv, the "
@@ -43,14 +86,73 @@ parser.add_argument('--out-sfx', default="",
                          "overwrites the full-corpus labels.")
 args = parser.parse_args()
 
-NUM_CLUSTERS = args.clusters
+K_LIST = ([int(k) for k in args.clusters_grid.split(",") if k.strip()]
+          if args.clusters_grid else [args.clusters])
 SEED = args.seed
 np.random.seed(SEED)
 
-print(f"--- CLUSTER JOB (US): K={NUM_CLUSTERS}  svd_dim={args.svd_dim} ---")
+
+def _file_identity(path):
+    st = os.stat(path)
+    return [os.path.realpath(path), st.st_size, st.st_mtime_ns]
+
+
+def _cache_key(inputs):
+    payload = json.dumps(inputs, sort_keys=True).encode()
+    return hashlib.blake2b(payload, digest_size=10).hexdigest()
+
+
+def svd_projection(matrix):
+    """L2-normalized SVD projection of matrix as a read-only memory map,
+    fit + projected once per cache key (see module docstring)."""
+    inputs = {
+        "version": CACHE_VERSION,
+        "tfidf": _file_identity(TFIDF_PATH),
+        "restrict_ids": _file_identity(args.restrict_ids) if args.restrict_ids else "",
+        "svd_dim": args.svd_dim, "svd_fit_rows": args.svd_fit_rows, "seed": SEED,
+    }
+    cache_dir = os.path.join(SVD_CACHE_DIR, _cache_key(inputs))
+    proj_path = os.path.join(cache_dir, "proj.npy")
+    if os.path.exists(proj_path) and not args.rebuild_cache:
+        with open(os.path.join(cache_dir, "meta.json")) as f:
+            meta = json.load(f)
+        print(f"  cache hit: {cache_dir}  "
+              f"(cumulative explained variance: {meta['explained_variance']:.3f})")
+        return np.load(proj_path, mmap_mode="r")
+
+    svd = TruncatedSVD(
+        n_components=args.svd_dim,
+        random_state=SEED,
+        algorithm="randomized",
+        n_iter=7,
+    )
+    n_rows = matrix.shape[0]
+    if 0 < args.svd_fit_rows < n_rows:
+        fit_rows = np.sort(np.random.default_rng(SEED).choice(
+            n_rows, size=args.svd_fit_rows, replace=False))
+        print(f"  fitting basis on {len(fit_rows):,}/{n_rows:,} sampled authors")
+        svd.fit(matrix[fit_rows])
+    else:
+        svd.fit(matrix)
+    explained = float(svd.explained_variance_ratio_.sum())
+    print(f"  cumulative explained variance: {explained:.3f}")
+
+    tmp_dir = f"{cache_dir}.tmp{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    project_to_memmap(matrix, svd.components_, os.path.join(tmp_dir, "proj.npy"))
+    np.save(os.path.join(tmp_dir, "components.npy"), svd.components_.astype(np.float32))
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({**inputs, "explained_variance": explained}, f, indent=2)
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.replace(tmp_dir, cache_dir)
+    return np.load(proj_path, mmap_mode="r")
+
+
+print(f"--- CLUSTER JOB (US): K={','.join(map(str, K_LIST))}  svd_dim={args.svd_dim} ---")
 
 print("Loading TF-IDF matrix...")
-matrix = scipy.sparse.load_npz("../output/tfidf_matrix.npz")
+matrix = scipy.sparse.load_npz(TFIDF_PATH)
 print(f"  TF-IDF shape: {matrix.shape}  nnz/row mean: {matrix.nnz / matrix.shape[0]:.1f}")
 
 print("Loading helper files...")
@@ -72,76 +174,83 @@ print(f"  rows with <5 nonzero features: {(row_nnz < 5).sum():,}")
 # ---- SVD reduction ----
 if args.svd_dim and args.svd_dim > 0:
     print(f"\nReducing to {args.svd_dim} dims via TruncatedSVD...")
-    svd = TruncatedSVD(
-        n_components=args.svd_dim,
-        random_state=SEED,
-        algorithm="randomized",
-        n_iter=7,
-    )
-    X = svd.fit_transform(matrix).astype(np.float32)
-    print(f"  cumulative explained variance: {svd.explained_variance_ratio_.sum():.3f}")
-    print(f"  dense shape: {X.shape}   mem: {X.nbytes / 1e9:.2f} GB")
-    X = normalize(X, norm="l2", axis=1).astype(np.float32)
+    X = svd_projection(matrix)
+    print(f"  dense shape: {X.shape}   on disk: {X.nbytes / 1e9:.2f} GB")
     print(f"  L2-normalized; ready for spherical K-means semantics.")
 else:
     print("\nSkipping SVD (--svd-dim 0). Running K-means on raw sparse TF-IDF.")
     X = matrix
 
 # ---- K-means ----
-print(f"\nClustering into {NUM_CLUSTERS} clusters with MiniBatchKMeans...")
-kmeans = MiniBatchKMeans(
-    n_clusters=NUM_CLUSTERS,
-    random_state=SEED,
+n_jobs = min(args.jobs, len(K_LIST))
+print(f"\nClustering into K={','.join(map(str, K_LIST))} with streaming spherical "
+      f"K-means ({n_jobs} worker{'s' if n_jobs > 1 else ''})...")
+results = spherical_kmeans_grid(
+    X,
+    K_LIST,
+    n_jobs=n_jobs,
+    seed=SEED,
     batch_size=16384,
     n_init=3,
-    init="k-means++",
     max_iter=300,
     reassignment_ratio=0.01,
 )
-kmeans.fit(X)
-labels = kmeans.labels_
-
-# ---- diagnostic: cluster size distribution ----
-sizes = pd.Series(labels).value_counts().sort_values(ascending=False)
-top_share = sizes.iloc[0] / len(labels)
-print(f"\n--- CLUSTER SIZE DISTRIBUTION ---")
-print(f"  largest cluster: {sizes.iloc[0]:,} authors ({top_share*100:.2f}% of pool)")
-print(f"  median size: {int(sizes.median()):,}    smallest: {int(sizes.iloc[-1]):,}")
-print(f"  size pctiles: 10%={int(sizes.quantile(.1)):,}  "
-      f"25%={int(sizes.quantile(.25)):,}  "
-      f"75%={int(sizes.quantile(.75)):,}  "
-      f"90%={int(sizes.quantile(.9)):,}")
-if top_share > 0.5:
-    print(f"  WARNING: largest cluster holds {top_share*100:.1f}% of the pool -- "
-          f"the clustering looks degenerate. Try increasing --svd-dim or K.")
-
-# ---- save labels ----
-print("\nSaving Results...")
-pdf_ids['cluster_label'] = labels
-pdf_ids.to_csv(f"../output/author_static_clusters_{NUM_CLUSTERS}{args.out_sfx}.csv", index=False)
-
-# ---- top-term descriptions ----
-# With SVD on, kmeans.cluster_centers_ is in the SVD-reduced space, so we
-# can't read top terms off it directly. Recompute per-cluster centroids in
-# the original TF-IDF space.
-print("Writing cluster top-term descriptions...")
-if args.svd_dim and args.svd_dim > 0:
-    centers = np.zeros((NUM_CLUSTERS, matrix.shape[1]), dtype=np.float32)
-    for c in range(NUM_CLUSTERS):
-        rows = np.where(labels == c)[0]
-        if len(rows) == 0:
-            continue
-        centers[c] = np.asarray(matrix[rows].mean(axis=0)).ravel()
-else:
-    centers = kmeans.cluster_centers_
+del X
+
+
+def save_clustering(num_clusters, km):
+    """Size diagnostics, label csv and top-term descriptions for one K."""
+    labels = km.labels
+    print(f"\n===== K={num_clusters}: {km.n_steps:,} mini-batch steps   "
+          f"inertia (sum 1-cos): {km.inertia:,.1f} =====")
+
+    # ---- diagnostic: cluster size distribution ----
+    sizes = pd.Series(labels).value_counts().sort_values(ascending=False)
+    top_share = sizes.iloc[0] / len(labels)
+    print(f"--- CLUSTER SIZE DISTRIBUTION ---")
+    print(f"  largest cluster: {sizes.iloc[0]:,} authors ({top_share*100:.2f}% of pool)")
+    print(f"  median size: {int(sizes.median()):,}    smallest: {int(sizes.iloc[-1]):,}")
+    print(f"  size pctiles: 10%={int(sizes.quantile(.1)):,}  "
+          f"25%={int(sizes.quantile(.25)):,}  "
+          f"75%={int(sizes.quantile(.75)):,}  "
+          f"90%={int(sizes.quantile(.9)):,}")
+    if top_share > 0.5:
+        print(f"  WARNING: largest cluster holds {top_share*100:.1f}% of the pool -- "
+              f"the clustering looks degenerate. Try increasing --svd-dim or K.")
+
+    # ---- save labels ----
+    print("Saving Results...")
+    out = pdf_ids.assign(cluster_label=labels)
+    out.to_csv(f"../output/author_static_clusters_{num_clusters}{args.out_sfx}.csv", index=False)
+
+    # ---- top-term descriptions ----
+    # With SVD on, km.centers is in the SVD-reduced space, so we can't read
+    # top terms off it directly. Recompute per-cluster centroids in the
+    # original TF-IDF space (one sparse segment sum over all authors).
+    print("Writing cluster top-term descriptions...")
+    if args.svd_dim and args.svd_dim > 0:
+        centers = segment_means(matrix, labels, num_clusters)
+    else:
+        centers = km.centers
+
+    out_txt = f"../output/static_cluster_descriptions_{num_clusters}{args.out_sfx}.txt"
+    with open(out_txt, "w") as f:
+        for i in range(num_clusters):
+            n_i = int(sizes.get(i, 0))
+            top_idx = centers[i].argsort()[-15:][::-1]
+            top_terms = [feature_names[idx] for idx in top_idx]
+            f.write(f"Cluster {i} (n={n_i:,}): {', '.join(top_terms)}\n")
+    print(f"Saved {out_txt}")
+
 
-out_txt = f"../output/static_cluster_descriptions_{NUM_CLUSTERS}{args.out_sfx}.txt"
-with open(out_txt, "w") as f:
-    for i in range(NUM_CLUSTERS):
-        n_i = int(sizes.get(i, 0))
-        top_idx = centers[i].argsort()[-15:][::-1]
-        top_terms = [feature_names[idx] for idx in top_idx]
-        f.write(f"Cluster {i} (n={n_i:,}): {', '.join(top_terms)}\n")
+for num_clusters, km in results.items():
+    save_clustering(num_clusters, km)
 
-print(f"Saved {out_txt}")
+if args.clusters_grid:
+    summary = pd.DataFrame(grid_summary(results))
+    out_csv = f"../output/cluster_grid_summary{args.out_sfx}.csv"
+    summary.to_csv(out_csv, index=False)
+    print(f"\n--- K GRID ---")
+    print(summary.to_string(index=False, float_format=lambda v: f"{v:.4g}"))
+    print(f"Saved {out_csv}")
 print("Done.")
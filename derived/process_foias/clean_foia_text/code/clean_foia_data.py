@@ -11,11 +11,22 @@ Optimisations vs. the original script
     column-wise .apply() calls -- avoids creating a pd.Series per row.
   - Flat-match logic in entity extraction simplified.
   - File-reader dispatch consolidated into a dict.
+  - Descriptions are factorized first; each unique string is cleaned once
+    in a single fused pass (clean_desc + potential_sku + potential_unit),
+    fanned out over a process pool, and broadcast back to every row.
+  - Optional Parquet output (--format parquet), files processed
+    concurrently (--jobs), and Excel workbooks cached as Parquet keyed by
+    content hash so reruns skip the slow read_excel parse.
 """
+import hashlib
+import os
 import re
 import unicodedata
 import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
@@ -47,6 +58,7 @@ DEFAULT_DATA_DIR = ROOT_DIR / "external" / "samp"
 CATALOG_DIR = ROOT_DIR / "external" / "catalogs"
 GOVSPEND_DIR = ROOT_DIR / "external" / "govspend"
 DEFAULT_OUT_DIR = ROOT_DIR / "output"
+XLSX_CACHE_DIR = ROOT_DIR / "temp" / "xlsx_cache"
 
 # -- Greek-letter transliteration ------------------------------------------- #
 # The ASCII normalization line below (encode "ascii", "ignore") strips any
@@ -223,15 +235,135 @@ def get_potential_unit(desc) -> str:
     return ", ".join(_extract_matches(str(desc), _UNIT_COMPILED))
 
 
+def clean_and_extract(desc):
+    """Fused single-row pass: (clean_desc, potential_sku, potential_unit),
+    identical to the three get_* functions above."""
+    if pd.isna(desc):
+        return "", "", ""
+    text = str(desc)
+    return (
+        get_clean_description(text),
+        ", ".join(_extract_matches(text, _SKU_COMPILED)),
+        ", ".join(_extract_matches(text, _UNIT_COMPILED)),
+    )
+
+
+def _clean_chunk(values):
+    return [clean_and_extract(v) for v in values]
+
+
+def _default_workers():
+    """Honor CLEAN_WORKERS first, then the Slurm allocation, then the
+    process's CPU affinity (respects cgroups)."""
+    for var in ("CLEAN_WORKERS", "SLURM_CPUS_PER_TASK"):
+        v = os.environ.get(var)
+        if v:
+            try:
+                return max(1, int(v))
+            except ValueError:
+                pass
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except (AttributeError, OSError):
+        return min(os.cpu_count() or 1, 16)
+
+
+# Below this many unique descriptions pool startup outweighs the work.
+PARALLEL_MIN_UNIQUE = 20_000
+
+
+def clean_description_column(raw, workers=None):
+    """Return a DataFrame with clean_desc / potential_sku / potential_unit
+    for every row of *raw* (same index).
+
+    Procurement descriptions repeat heavily, so the column is factorized
+    and only unique strings are cleaned -- across a fork pool when there
+    are enough of them -- then broadcast back with the codes.  Missing
+    values map to empty strings, as in the get_* functions.
+    """
+    codes, uniques = pd.factorize(raw)
+    uniques = list(uniques)
+    workers = workers or _default_workers()
+
+    if len(uniques) >= PARALLEL_MIN_UNIQUE and workers > 1:
+        # ~4 chunks per worker so one slow chunk doesn't idle the pool;
+        # fork children inherit the compiled regexes and stopword set.
+        n_chunks = workers * 4
+        size = -(-len(uniques) // n_chunks)
+        chunks = [uniques[i:i + size] for i in range(0, len(uniques), size)]
+        print(f"  Cleaning {len(uniques):,} unique descriptions "
+              f"({len(raw):,} rows) on {workers} workers ...")
+        with mp.get_context("fork").Pool(workers) as pool:
+            results = [r for chunk in pool.map(_clean_chunk, chunks) for r in chunk]
+    else:
+        print(f"  Cleaning {len(uniques):,} unique descriptions ({len(raw):,} rows) ...")
+        results = _clean_chunk(uniques)
+
+    # Slot len(uniques) holds the missing-value result for code -1.
+    out = np.empty((len(uniques) + 1, 3), dtype=object)
+    if results:
+        out[:-1] = results
+    out[-1] = ("", "", "")
+    per_row = out[codes]
+    return pd.DataFrame(
+        {
+            "clean_desc": per_row[:, 0],
+            "potential_sku": per_row[:, 1],
+            "potential_unit": per_row[:, 2],
+        },
+        index=raw.index,
+    )
+
+
 # -- File I/O helpers ------------------------------------------------------- #
 
 _FILE_READERS = {
     ".csv":  lambda fp: pd.read_csv(fp, dtype=str, on_bad_lines="warn"),
-    ".xlsx": lambda fp: pd.read_excel(fp, dtype=str),
-    ".xls":  lambda fp: pd.read_excel(fp, dtype=str),
+    ".xlsx": lambda fp: _read_excel_cached(fp),
+    ".xls":  lambda fp: _read_excel_cached(fp),
     ".dta":  lambda fp: _read_stata(fp),
 }
 
+
+def _file_digest(fp):
+    h = hashlib.blake2b(digest_size=16)
+    with open(fp, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_excel_cached(fp):
+    """read_excel(dtype=str), memoized as Parquet under XLSX_CACHE_DIR.
+
+    The cache file is named after a hash of the workbook's bytes, so an
+    edited workbook is re-parsed and a touched-but-identical one is not.
+    Missing cells come back as NaN, exactly as from read_excel.
+    """
+    cache_path = XLSX_CACHE_DIR / f"{fp.stem}-{_file_digest(fp)}.parquet"
+    if cache_path.exists():
+        print(f"  Using cached parse of {fp.name}")
+        df = pd.read_parquet(cache_path)
+        return df.astype(object).where(df.notna(), np.nan)
+
+    df = pd.read_excel(fp, dtype=str)
+    # Parquet needs string column names; leave odd headers uncached.
+    if all(isinstance(c, str) for c in df.columns):
+        XLSX_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Only this workbook's own older digests: "ut-*" would also match
+        # the cache of ut-dallas.xlsx.
+        stale_re = re.compile(rf"{re.escape(fp.stem)}-[0-9a-f]{{32}}\.parquet")
+        for stale in XLSX_CACHE_DIR.iterdir():
+            if stale != cache_path and stale_re.fullmatch(stale.name):
+                stale.unlink(missing_ok=True)
+        # Write then rename, so a concurrent --jobs worker never reads a
+        # half-written file.
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        df.astype(object).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, cache_path)
+    return df
+
+
 def _read_stata(fp):
     df = pd.read_stata(fp)
     for col in df.select_dtypes(include=["object"]).columns:
@@ -261,6 +393,59 @@ def _resolve_desc_column(df, filename):
     return None
 
 
+# Text columns stored dictionary-encoded in Parquet output: descriptions
+# and supplier names repeat heavily across rows.
+_DICTIONARY_COLUMNS = [
+    "product_desc", "clean_desc", "potential_sku", "potential_unit",
+    "supplier", "suppliername", "vendor", "vendor_name",
+]
+_TEXT_COLUMNS = ["product_desc", "clean_desc", "potential_sku", "potential_unit"]
+
+
+def _csv_equivalent_frame(df):
+    """Apply the conversions a pd.read_csv of our CSV output would make --
+    read_csv's NA strings (and "") become null, and other columns whose
+    values all parse as numbers become numeric -- so Parquet and CSV
+    readers downstream see the same frame.  The four text columns above
+    always stay strings."""
+    from pandas._libs.parsers import STR_NA_VALUES
+
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        if s.dtype == object:
+            s = s.where(~s.isin(STR_NA_VALUES) & s.notna(), None)
+            if col not in _TEXT_COLUMNS:
+                try:
+                    s = pd.to_numeric(s)
+                except (ValueError, TypeError):
+                    pass
+        out[col] = s
+    return pd.DataFrame(out, index=df.index)
+
+
+def _write_table(df, out_path, fmt):
+    """Write *df* as CSV or Parquet; returns the path written."""
+    if fmt == "csv":
+        df.to_csv(out_path, index=False)
+        return out_path
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = _csv_equivalent_frame(df)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Stable schema: all-null text columns are typed as string, not null.
+    for i, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(i, pa.field(field.name, pa.string()),
+                                     table.column(i).cast(pa.string()))
+    pq.write_table(
+        table, out_path,
+        use_dictionary=[c for c in _DICTIONARY_COLUMNS if c in df.columns],
+    )
+    return out_path
+
+
 def _find_file(name, search_dirs):
     """Return the first existing path for *name* across *search_dirs*."""
     for d in search_dirs:
@@ -270,6 +455,60 @@ def _find_file(name, search_dirs):
     return None
 
 
+def process_file(fp, out_dir, fmt="csv", workers=None) -> None:
+    """Read, clean and write one workbook (runs in a worker under --jobs)."""
+    if not fp.exists():
+        print(f"  Warning: target file not found: {fp}. Skipping.")
+        return
+
+    print(f"Processing {fp.name} ...")
+
+    # -- Read --
+    reader = _FILE_READERS.get(fp.suffix)
+    if reader is None:
+        print(f"  Warning: unsupported file type: {fp.suffix}. Skipping.")
+        return
+    try:
+        df = reader(fp)
+    except Exception as e:
+        print(f"  Error: could not read {fp.name}: {e}")
+        return
+
+    # -- Standardise columns --
+    df.columns = df.columns.str.strip().str.lower()
+
+    desc_col = _resolve_desc_column(df, fp.name)
+    if desc_col is None:
+        print(f"  Warning: no description column found in {fp.name}. Skipping.")
+        return
+
+    if desc_col != "product_desc":
+        df.rename(columns={desc_col: "product_desc"}, inplace=True)
+
+    # -- Clean & extract (unique descriptions only, in parallel) --
+    cleaned = clean_description_column(df["product_desc"], workers)
+    df["clean_desc"]     = cleaned["clean_desc"]
+    df["potential_sku"]  = cleaned["potential_sku"]
+    df["potential_unit"] = cleaned["potential_unit"]
+
+    # -- Reorder columns --
+    priority = ["product_desc", "clean_desc", "potential_sku", "potential_unit"]
+    rest = [c for c in df.columns if c not in priority]
+    df = df[priority + rest]
+
+    # -- Write --
+    out_path = _write_table(df, out_dir / f"{fp.stem}_clean.{fmt}", fmt)
+    print(f"  -> Saved {out_path}")
+
+    # -- Save a 2010-2019 subset for umich_1998_2019 --
+    if "umich_1998_2019" in fp.stem and "date" in df.columns:
+        df_date = pd.to_datetime(df["date"], errors="coerce")
+        df_sub = df[(df_date.dt.year >= 2010) & (df_date.dt.year <= 2019)]
+        sub_path = out_dir / f"{fp.stem.replace('1998_2019', '2010_2019')}_clean.{fmt}"
+        _write_table(df_sub, sub_path, fmt)
+        print(f"  -> Saved {sub_path} ({len(df_sub)} rows)")
+
+
 # -- Main ------------------------------------------------------------------- #
 
 def main() -> None:
@@ -284,6 +523,19 @@ def main() -> None:
         "--files", default="",
         help="Comma-separated list of exact filenames to process.",
     )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Cleaning processes (default: CLEAN_WORKERS, Slurm allocation, "
+             "or the CPU affinity mask).",
+    )
+    parser.add_argument(
+        "--format", choices=["csv", "parquet"], default="csv",
+        help="Output format for *_clean files (default: csv).",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=1,
+        help="Number of files to process concurrently (default: 1).",
+    )
     args = parser.parse_args()
 
     data_dir = Path(args.data_dir)
@@ -312,58 +564,23 @@ def main() -> None:
 
     print(f"Found {len(files_to_process)} target workbook(s) to clean...")
 
-    for fp in files_to_process:
-        if not fp.exists():
-            print(f"  Warning: target file not found: {fp}. Skipping.")
-            continue
-
-        print(f"Processing {fp.name} ...")
-
-        # -- Read --
-        reader = _FILE_READERS.get(fp.suffix)
-        if reader is None:
-            print(f"  Warning: unsupported file type: {fp.suffix}. Skipping.")
-            continue
-        try:
-            df = reader(fp)
-        except Exception as e:
-            print(f"  Error: could not read {fp.name}: {e}")
-            continue
-
-        # -- Standardise columns --
-        df.columns = df.columns.str.strip().str.lower()
-
-        desc_col = _resolve_desc_column(df, fp.name)
-        if desc_col is None:
-            print(f"  Warning: no description column found in {fp.name}. Skipping.")
-            continue
-
-        if desc_col != "product_desc":
-            df.rename(columns={desc_col: "product_desc"}, inplace=True)
-
-        # -- Clean & extract (column-wise, not row-wise) --
-        raw = df["product_desc"]
-        df["clean_desc"]     = raw.apply(get_clean_description)
-        df["potential_sku"]  = raw.apply(get_potential_sku)
-        df["potential_unit"] = raw.apply(get_potential_unit)
-
-        # -- Reorder columns --
-        priority = ["product_desc", "clean_desc", "potential_sku", "potential_unit"]
-        rest = [c for c in df.columns if c not in priority]
-        df = df[priority + rest]
-
-        # -- Write --
-        out_path = out_dir / f"{fp.stem}_clean.csv"
-        df.to_csv(out_path, index=False)
-        print(f"  -> Saved {out_path}")
-
-        # -- Save a 2010-2019 subset for umich_1998_2019 --
-        if "umich_1998_2019" in fp.stem and "date" in df.columns:
-            df_date = pd.to_datetime(df["date"], errors="coerce")
-            df_sub = df[(df_date.dt.year >= 2010) & (df_date.dt.year <= 2019)]
-            sub_path = out_dir / f"{fp.stem.replace('1998_2019', '2010_2019')}_clean.csv"
-            df_sub.to_csv(sub_path, index=False)
-            print(f"  -> Saved {sub_path} ({len(df_sub)} rows)")
+    jobs = max(1, min(args.jobs, len(files_to_process)))
+    # Split the cleaning workers between concurrently processed files so
+    # the machine is not oversubscribed.
+    workers = args.workers or _default_workers()
+    per_file_workers = max(1, workers // jobs)
+    if jobs == 1:
+        for fp in files_to_process:
+            process_file(fp, out_dir, args.format, per_file_workers)
+    else:
+        print(f"Processing files on {jobs} concurrent jobs "
+              f"({per_file_workers} cleaning worker(s) each).")
+        with ProcessPoolExecutor(jobs, mp_context=mp.get_context("fork")) as ex:
+            futures = [ex.submit(process_file, fp, out_dir, args.format,
+                                 per_file_workers)
+                       for fp in files_to_process]
+            for fut in futures:
+                fut.result()
 
     print("\nAll targeted workbooks processed.")
 
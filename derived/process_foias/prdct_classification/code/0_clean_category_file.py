@@ -313,7 +313,7 @@ def main():
     # 2. Load the raw UT Dallas data and the category mapping file
     print("Loading raw data files...")
     try:
-        df_ut = pd.read_csv(config.UT_DALLAS_CLEAN_CSV, low_memory=False)
+        df_ut = config.read_clean_table(config.UT_DALLAS_CLEAN_CSV, low_memory=False)
         df_cat = pd.read_excel(config.UT_DALLAS_CATEGORIES_XLSX, keep_default_na=False, na_values=[''])
         print(f"  - Loaded {len(df_ut)} rows from UT Dallas main file.")
         print(f"  - Loaded {len(df_cat)} rows from category mapping file.")
@@ -460,7 +460,7 @@ def main_umich():
 
     print("Loading raw data files...")
     try:
-        df_um = pd.read_csv(config.UMICH_CLEAN_CSV, low_memory=False)
+        df_um = config.read_clean_table(config.UMICH_CLEAN_CSV, low_memory=False)
         df_cat = pd.read_excel(config.UMICH_CATEGORIES_XLSX, keep_default_na=False, na_values=[''])
         print(f"  - Loaded {len(df_um)} rows from UMich main file (2010-2019).")
         print(f"  - Loaded {len(df_cat)} rows from category mapping file.")
@@ -621,8 +621,8 @@ def main_combined():
 
     print("Loading raw data files...")
     try:
-        df_ut = pd.read_csv(config.UT_DALLAS_CLEAN_CSV, low_memory=False)
-        df_um = pd.read_csv(config.UMICH_CLEAN_CSV, low_memory=False)
+        df_ut = config.read_clean_table(config.UT_DALLAS_CLEAN_CSV, low_memory=False)
+        df_um = config.read_clean_table(config.UMICH_CLEAN_CSV, low_memory=False)
         df_cat = pd.read_excel(config.COMBINED_CATEGORIES_XLSX,
                                keep_default_na=False, na_values=[''])
         print(f"  - Loaded {len(df_ut)} rows from UT Dallas.")
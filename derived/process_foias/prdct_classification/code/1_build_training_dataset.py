@@ -25,21 +25,21 @@ from classifier import (
 )
 
 def load_ca_data():
-    df = pd.read_csv(config.CA_NON_LAB_DTA)
+    df = config.read_clean_table(config.CA_NON_LAB_DTA)
     df['cleaned_description'] = df[config.CLEAN_DESC_COL].fillna('')
     df['label'] = 0
     df['data_source'] = 'ca_non_lab'
     return df
 
 def load_fisher_lab_data():
-    df = pd.read_csv(config.FISHER_LAB)
+    df = config.read_clean_table(config.FISHER_LAB)
     df['cleaned_description'] = df[config.CLEAN_DESC_COL].fillna('')
     df['label'] = 1
     df['data_source'] = 'fisher_lab'
     return df
 
 def load_fisher_non_lab_data():
-    df = pd.read_csv(config.FISHER_NONLAB)
+    df = config.read_clean_table(config.FISHER_NONLAB)
     df['cleaned_description'] = df[config.CLEAN_DESC_COL].fillna('')
     df['label'] = 0
     df['data_source'] = 'fisher_non_lab'
@@ -60,7 +60,7 @@ def load_fisher_chemical_data(seed_automaton=None):
     is a second safety net: any row that collides with a fisher_lab item
     gets forced to label=0 (downgrades win).
     """
-    df = pd.read_csv(config.FISHER_CHEMICAL)
+    df = config.read_clean_table(config.FISHER_CHEMICAL)
     df['cleaned_description'] = df[config.CLEAN_DESC_COL].fillna('')
     df['label'] = 0
     df['data_source'] = 'fisher_chemical'
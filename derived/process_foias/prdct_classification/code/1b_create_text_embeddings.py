@@ -6,13 +6,16 @@ When USE_SUPPLIER is True, description and supplier tokens are vectorized
 separately and combined with explicit weights (config.DESC_WEIGHT / SUPPLIER_WEIGHT).
 
 Transformer encoding uses GPU when available (fp16 + larger batch + dedup) to
-keep wall-clock low; the model object itself is no longer pickled — downstream
-scripts re-instantiate from the HuggingFace cache via config.BERT_MODELS.
+keep wall-clock low, and descriptions already in the shared embedding cache
+(foia_similarity_wts/code/bert/embedding_cache.py, its default directory,
+shared with bert/1_vectorize.py) are not re-encoded; the model object itself
+is no longer pickled — downstream scripts re-instantiate from the HuggingFace
+cache via config.BERT_MODELS.
 """
 import pandas as pd
-import numpy as np
 import joblib
 import os
+import sys
 import argparse
 from scipy.sparse import hstack
 from sklearn.feature_extraction.text import TfidfVectorizer, ENGLISH_STOP_WORDS
@@ -21,6 +24,11 @@ from sklearn.preprocessing import normalize
 import config
 from classifier import compute_engineered_features
 
+# Shared embedding cache (lives with the foia_similarity_wts BERT code).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..",
+                                "openalex", "foia_similarity_wts", "code", "bert"))
+from embedding_cache import EmbeddingCache, encode_cached, encoder_settings  # noqa: E402
+
 
 def generate_tfidf_vectors(df):
     print("--- Generating TF-IDF Vectors for Gatekeeper ---")
@@ -89,29 +97,23 @@ def _load_encoder(model_id):
     return model, device
 
 
-def _encode_dedup(model, texts, batch_size=256):
+def _encode_dedup(model, texts, cache=None, batch_size=256):
     """Encode a list of strings with deduplication.  FOIA descriptions repeat
-    heavily; encoding only the unique strings and broadcasting back is usually
-    the largest practical speedup."""
-    # pd.factorize preserves order of first occurrence and returns int codes
-    codes, uniques = pd.factorize(pd.Series(texts), sort=False)
-    print(f"    Encoding {len(uniques)} unique texts (from {len(texts)} total, "
-          f"{100.0 * (1 - len(uniques)/max(len(texts),1)):.1f}% dedup)")
-    uniq_vecs = model.encode(
-        list(uniques),
-        batch_size=batch_size,
-        show_progress_bar=True,
-        convert_to_numpy=True,
-        normalize_embeddings=True,  # downstream L2-normalize becomes a no-op
-    )
-    return uniq_vecs[codes].astype(np.float32)
+    heavily; encoding only the unique strings (and only those the embedding
+    cache misses) and broadcasting back is usually the largest practical
+    speedup."""
+    return encode_cached(model, texts, cache, batch_size=batch_size,
+                         show_progress_bar=True)
 
 
 def generate_transformer_vectors(df, short_name, model_id):
     print(f"\n--- Generating Vectors for: {short_name} ({model_id}) ---")
     model, _device = _load_encoder(model_id)
+    cache = EmbeddingCache(model_id, **encoder_settings(model))
 
-    desc_vectors = _encode_dedup(model, df['prepared_description'].fillna('').tolist())
+    desc_vectors = _encode_dedup(model, df['prepared_description'].fillna('').tolist(), cache)
+    cache.report()
+    cache.close()
 
     output_filename = f"embeddings_{short_name}.joblib"
 
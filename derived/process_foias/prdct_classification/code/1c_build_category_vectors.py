@@ -2,10 +2,13 @@
 """
 Pre-computes and saves the average embedding vector for each LAB category
 from the UT Dallas data. This creates the knowledge base for the BERT expert model.
+Item descriptions go through the shared embedding cache (embedding_cache.py's
+default directory, shared with bert/1_vectorize.py).
 """
 import pandas as pd
 import joblib
 import os
+import sys
 import argparse
 from sentence_transformers import SentenceTransformer
 from sklearn.preprocessing import normalize
@@ -13,6 +16,11 @@ from scipy.sparse import hstack
 import numpy as np
 import config
 
+# Shared embedding cache (lives with the foia_similarity_wts BERT code).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..",
+                                "openalex", "foia_similarity_wts", "code", "bert"))
+from embedding_cache import EmbeddingCache, encode_cached, encoder_settings  # noqa: E402
+
 
 def _load_encoder(model_id):
     import torch
@@ -24,17 +32,10 @@ def _load_encoder(model_id):
     return model
 
 
-def _encode_dedup(model, texts, batch_size=256):
-    codes, uniques = pd.factorize(pd.Series(texts), sort=False)
-    print(f"    Encoding {len(uniques)} unique texts (from {len(texts)} total)")
-    uniq_vecs = model.encode(
-        list(uniques),
-        batch_size=batch_size,
-        show_progress_bar=True,
-        convert_to_numpy=True,
-        normalize_embeddings=True,
-    )
-    return uniq_vecs[codes].astype(np.float32)
+def _encode_dedup(model, texts, cache=None, batch_size=256):
+    return encode_cached(model, texts, cache, batch_size=batch_size,
+                         show_progress_bar=True)
+
 
 def main(embedding_name):
     model_id = config.BERT_MODELS[embedding_name]
@@ -87,11 +88,14 @@ def main(embedding_name):
     short_name = embedding_name
     print(f"\n--- Preparing vectors for expert model: {short_name} ({model_id}) ---")
     model = _load_encoder(model_id)
+    cache = EmbeddingCache(model_id, **encoder_settings(model))
 
     print("  - Generating embeddings for all lab item descriptions...")
 
     descriptions_list = df_lab_only[config.CLEAN_DESC_COL].fillna('').tolist()
-    embeddings = _encode_dedup(model, descriptions_list)
+    embeddings = _encode_dedup(model, descriptions_list, cache)
+    cache.report()
+    cache.close()
 
     if supplier_vectorizer is not None:
         supp_tokens = df_lab_only['supplier_token'].fillna('').astype(str).tolist()
@@ -11,6 +11,7 @@ import re
 import joblib
 import argparse
 import multiprocessing as mp
+import resource
 from scipy import sparse
 from sklearn.preprocessing import normalize
 import numpy as np # Added for NaN
@@ -18,15 +19,17 @@ import numpy as np # Added for NaN
 import config
 from rule_based_categorizer import RuleBasedCategorizer
 from categorize_items import TfidfItemCategorizer, EmbeddingItemCategorizer
+from prediction_cache import PredictionCache, artifact_fingerprint, resolve_step
 
 
 # ---------------------------------------------------------------------------
 # Multiprocessing helpers for step 4 (market override rules).
 #
-# The rule evaluation is embarrassingly parallel by row, and the single-core
-# cost (~1us/rule/row x 793 rules) dominates runtime on the 11M-obs job.
-# Workers each hold their own RuleBasedCategorizer so the 793 precompiled
-# rule regexes exist once per process.
+# The rule evaluation is embarrassingly parallel by row.  Even with the
+# single-pass scan engine in get_market_overrides_batch, the 11M-obs job
+# benefits from fanning out.  Workers each hold their own
+# RuleBasedCategorizer so the precompiled rule regexes and scan automata
+# exist once per process.
 # ---------------------------------------------------------------------------
 _WORKER_CATEGORIZER = None
 
@@ -61,7 +64,556 @@ def _default_override_workers():
     except (AttributeError, OSError):
         return min(os.cpu_count() or 1, 16)
 
-def main(gatekeeper_name: str, expert_choice: str, source_abbrev: str = None):
+
+def _run_market_rules(rule_categorizer, unique_clean, unique_raw):
+    """Market override rules on deduped (clean, raw) pairs, fanned out over
+    a fork pool for large inputs.  Returns an object Series with a
+    0..n-1 RangeIndex aligned with unique_clean."""
+    n_unique = len(unique_clean)
+    # Run market rules in parallel across worker processes.  The rule
+    # evaluation is CPU-bound (one automaton scan + keyword confirmations
+    # per row) and embarrassingly parallel by row, so we shard unique_clean /
+    # unique_raw into chunks and fan out.  Single-process path kicks in
+    # for small inputs where pool startup would dominate.
+    n_workers = _default_override_workers()
+    PARALLEL_MIN = 20_000
+    if n_unique >= PARALLEL_MIN and n_workers > 1:
+        # Aim for ~4 chunks per worker so a slow chunk doesn't idle the
+        # rest of the pool.  Chunk via iloc slices, which inherit the
+        # parent's RangeIndex (so pd.concat stacks them contiguously).
+        target_chunks = n_workers * 4
+        chunk_size = max(1, (n_unique + target_chunks - 1) // target_chunks)
+        chunks = []
+        for start in range(0, n_unique, chunk_size):
+            end = min(start + chunk_size, n_unique)
+            chunks.append((
+                unique_clean.iloc[start:end],
+                unique_raw.iloc[start:end] if unique_raw is not None else None,
+            ))
+        print(f"  - Applying market rules in parallel: "
+              f"{n_workers} workers x {len(chunks)} chunks "
+              f"(~{chunk_size} rows/chunk).")
+        # fork start method (Linux default) skips re-import of this
+        # module in the children; initializer still builds a fresh
+        # categorizer per worker so we don't depend on parent state.
+        ctx = mp.get_context('fork')
+        with ctx.Pool(
+            n_workers,
+            initializer=_init_override_worker,
+            initargs=(config.MARKET_RULES_YAML,),
+        ) as pool:
+            results = pool.map(_apply_overrides_chunk, chunks)
+        # ignore_index=True gives us a clean 0..n_unique-1 RangeIndex
+        # matching the input order (pool.map preserves input order).
+        return pd.concat(results, ignore_index=True)
+    return rule_categorizer.get_market_overrides_batch(unique_clean, unique_raw)
+
+
+def _predict_frame(df_new, cache, *, gatekeeper_model, expert_choice,
+                   expert_predictor, vectorizer_for_similarity,
+                   category_vectors_for_similarity, category_names_map,
+                   rule_categorizer):
+    """Steps 1-5 on one frame (a whole file, or one --stream chunk).  Every
+    output column is a row-wise function of that row's inputs, so chunked
+    and in-memory runs produce the same predictions."""
+    clean_descriptions = df_new[config.CLEAN_DESC_COL].astype(str).fillna("")
+    suppliers = df_new['supplier'] if config.USE_SUPPLIER and 'supplier' in df_new.columns else None
+
+    # --- Pipeline Logic ---
+    df_new['prediction_source'] = 'Non-Lab'
+    df_new['similarity_score'] = np.nan
+    y_pred = pd.Series("Non-Lab", index=df_new.index)
+
+    print("  - Step 1: Running gatekeeper...")
+    # Every step below goes through resolve_step: rows are deduped on the
+    # step's inputs, unique keys already in the prediction cache are
+    # served from it, and only the rest reach the model.
+    def _gatekeeper(pos):
+        return {'label': gatekeeper_model.predict(
+            clean_descriptions.iloc[pos],
+            suppliers=suppliers.iloc[pos] if suppliers is not None else None)}
+    gate_values, gate_codes = resolve_step(
+        cache, 'gatekeeper', [clean_descriptions, suppliers], _gatekeeper)
+    is_lab_mask = pd.Series(
+        gate_values['label'].astype(np.int64)[gate_codes] == 1,
+        index=df_new.index)
+    print(f"  - Gatekeeper identified {is_lab_mask.sum()} potential lab items.")
+
+    # --- Step 1.5: Supplier-based Non-Lab filter ---
+    if 'supplier' in df_new.columns:
+        supplier_lower = df_new['supplier'].astype(str).str.lower().str.strip()
+        # Exact matches -- single isin instead of a loop of == comparisons.
+        exact_set = {n.lower().strip() for n in config.NONLAB_SUPPLIER_EXACT}
+        if exact_set:
+            supplier_nonlab_mask = supplier_lower.isin(exact_set)
+        else:
+            supplier_nonlab_mask = pd.Series(False, index=df_new.index)
+        # Keyword substring matches -- fold every keyword into a single
+        # alternation regex and do ONE str.contains pass.  Pandas treats
+        # the pattern as regex by default, so we preserve the original
+        # (un-escaped) interpretation.
+        if config.NONLAB_SUPPLIER_KEYWORDS:
+            kw_re = re.compile(
+                '|'.join(f'(?:{kw.lower()})'
+                         for kw in config.NONLAB_SUPPLIER_KEYWORDS)
+            )
+            supplier_nonlab_mask |= supplier_lower.str.contains(kw_re, na=False)
+        # Force matched items to Non-Lab (remove from lab mask)
+        supplier_override_count = (is_lab_mask & supplier_nonlab_mask).sum()
+        if supplier_override_count > 0:
+            is_lab_mask = is_lab_mask & ~supplier_nonlab_mask
+            df_new.loc[supplier_nonlab_mask, 'prediction_source'] = 'Supplier Non-Lab'
+            print(f"  - Supplier filter: {supplier_override_count} items forced to Non-Lab ({supplier_nonlab_mask.sum()} total supplier Non-Lab).")
+
+    # Step 2 vectors for the expert keys computed this run, and the row ->
+    # vector-row lookup Step 5 uses to reuse them (-1 = not encoded).
+    step2 = {}
+    step2_vectors = None
+    row_vector_pos = np.full(len(df_new), -1, dtype=np.int64)
+    if is_lab_mask.any():
+        # Expert model uses clean descriptions (no supplier token) for
+        # content-based category matching
+        lab_descriptions = clean_descriptions[is_lab_mask]
+
+        print(f"  - Step 2: Predicting markets with '{expert_choice}' expert (batched)...")
+        # One transform/encode + one cosine matmul for all uncached lab
+        # keys.  item_vectors are kept for Step 5 to avoid re-encoding.
+        lab_suppliers = (suppliers.loc[lab_descriptions.index]
+                         if suppliers is not None else None)
+
+        def _expert(pos):
+            preds, scores, step2['vectors'] = expert_predictor.predict_batch(
+                lab_descriptions.iloc[pos],
+                suppliers=lab_suppliers.iloc[pos] if lab_suppliers is not None else None)
+            step2['pos'] = pos
+            return {'category': preds.to_numpy(), 'score': scores.to_numpy()}
+        expert_values, expert_codes = resolve_step(
+            cache, 'expert', [lab_descriptions, lab_suppliers], _expert)
+        expert_predictions = pd.Series(
+            expert_values['category'][expert_codes], index=lab_descriptions.index)
+        expert_scores = pd.Series(
+            expert_values['score'][expert_codes].astype(float),
+            index=lab_descriptions.index)
+
+        if 'vectors' in step2:
+            step2_vectors = step2.pop('vectors')
+            code_vector_pos = np.full(len(expert_values['category']), -1, dtype=np.int64)
+            code_vector_pos[expert_codes[step2.pop('pos')]] = np.arange(step2_vectors.shape[0])
+            row_vector_pos[np.flatnonzero(is_lab_mask.to_numpy())] = code_vector_pos[expert_codes]
+
+        # Step 2.5: Supplier-based category force.  Mono-category vendors
+        # (Peprotech / Avanti / Addgene / Bachem / ...) get their expert
+        # prediction overridden to the canonical category for that vendor.
+        # Runs before veto + market rules so a description-specific rule
+        # in Step 4 still wins.  Only fires when the supplier name matches
+        # and the category exists in the expert's known categories
+        # (otherwise the override is silently skipped to avoid debug
+        # warnings in Step 5).
+        supp_cat_regex = getattr(config, 'SUPPLIER_CATEGORY_REGEX', None)
+        if supp_cat_regex and lab_suppliers is not None:
+            lab_supp_lower = lab_suppliers.astype(str).str.lower()
+            total_forced = 0
+            for cat, regex in supp_cat_regex.items():
+                if cat not in category_names_map:
+                    continue
+                mask = lab_supp_lower.str.contains(regex, na=False)
+                if mask.any():
+                    expert_predictions.loc[mask] = cat
+                    total_forced += int(mask.sum())
+            if total_forced:
+                print(f"  - Step 2.5: Supplier-category force overrode {total_forced} expert predictions.")
+
+        print("  - Step 3: Applying prediction veto rules...")
+        validated_predictions = rule_categorizer.validate_predictions_batch(
+            expert_predictions, lab_descriptions
+        )
+        validated_predictions.index = lab_descriptions.index
+        num_vetoed = validated_predictions.isna().sum()
+        if num_vetoed > 0:
+            print(f"  - WARNING:Vetoed {num_vetoed} expert predictions.")
+
+        y_pred.update(validated_predictions)
+        survived_veto = validated_predictions.notna()
+        df_new.loc[validated_predictions.index[survived_veto], 'prediction_source'] = 'Expert Model'
+        df_new.loc[expert_scores.index, 'similarity_score'] = expert_scores # Store initial score
+
+    print("  - Step 4: Applying final market override rules...")
+    has_raw_col = config.RAW_DESC_COL in df_new.columns
+    clean_series_full = df_new[config.CLEAN_DESC_COL].astype(str)
+    raw_series_full = df_new[config.RAW_DESC_COL].astype(str) if has_raw_col else None
+
+    # FOIA product data is highly repetitive (same item ordered many
+    # times).  resolve_step dedupes (clean, raw) pairs so the rules run
+    # on uncached uniques only; rollups below also run on the uniques and
+    # are broadcast back to every row with a numpy fancy-index on codes.
+    def _market_rules(pos):
+        unique_clean = clean_series_full.iloc[pos].reset_index(drop=True)
+        unique_raw = (raw_series_full.iloc[pos].reset_index(drop=True)
+                      if has_raw_col else None)
+        return {'override': _run_market_rules(
+            rule_categorizer, unique_clean, unique_raw).to_numpy()}
+    rule_values, codes = resolve_step(
+        cache, 'rules', [clean_series_full, raw_series_full], _market_rules)
+    unique_overrides = pd.Series(rule_values['override'], dtype=object)
+    print(f"  - {len(unique_overrides)} unique description pairs among {len(codes)} rows")
+
+    # Remap rule outputs to the collapsed taxonomy the expert was trained
+    # on.  market_rules.yml is deliberately kept granular (e.g. "extended
+    # length pipette tips", "glass beakers", "rabbit-host anti-mouse
+    # polyclonal primary antibody") so rollups are reversible later --
+    # script 3 collapses at inference so the expert's category vectors
+    # can be matched.
+    #
+    # Two kinds of rollup, both mirroring script 0:
+    #   (a) explicit 1:1 renames from config.CATEGORY_CONSOLIDATION
+    #   (b) keyword-based buckets: any "pipette tip*" -> "pipette tips";
+    #       antibody + primary + polyclonal/monoclonal split + "secondary"
+    #       -> the three antibody buckets.
+    cons_map = getattr(config, 'CATEGORY_CONSOLIDATION', None)
+    if cons_map:
+        unique_overrides = unique_overrides.replace(cons_map)
+
+    # Mirror script 0's keyword-based rollups on rule outputs so rule
+    # categories like "extended length pipette tips" or "rabbit-host
+    # anti-mouse polyclonal primary antibody" don't fall off the expert
+    # model's category list (which only knows the collapsed names).
+    _lower = unique_overrides.str.lower()
+    unique_overrides.loc[
+        _lower.str.contains("pipette tip", na=False)] = "pipette tips"
+    unique_overrides.loc[
+        _lower.str.contains("elisa", na=False)] = "elisa kits"
+    _lower = unique_overrides.str.lower()  # recompute after elisa rollup
+    _is_ab = _lower.str.contains("antibod", na=False)
+    _is_prim = _lower.str.contains("primary", na=False)
+    _is_sec = _lower.str.contains("secondary", na=False)
+    _is_poly = _lower.str.contains("polyclonal", na=False)
+    _is_mono = _lower.str.contains("monoclonal", na=False)
+    unique_overrides.loc[_is_ab & _is_prim & _is_poly] = "polyclonal primary antibodies"
+    unique_overrides.loc[_is_ab & _is_prim & _is_mono] = "monoclonal primary antibodies"
+    unique_overrides.loc[_is_ab & _is_sec] = "secondary antibodies"
+
+    # Broadcast unique -> every row via numpy fancy-index on codes.
+    overrides = pd.Series(
+        unique_overrides.to_numpy()[codes],
+        index=df_new.index,
+    )
+    valid_overrides = overrides.dropna()
+    y_pred.update(valid_overrides)
+    print(f"  - Applied {len(valid_overrides)} market override rules.")
+    if not valid_overrides.empty:
+        df_new.loc[valid_overrides.index, 'prediction_source'] = 'Market Rules'
+
+    y_pred.fillna("unclassified", inplace=True)
+
+    # Deliberately no post-override re-consolidation here.  Previously
+    # this step flattened every antibody to "primary antibodies"/
+    # "secondary antibodies" and every elisa to "elisa kits", which
+    # overwrote the expert's fine-grained labels (e.g. polyclonal /
+    # monoclonal primary antibodies, pre-coated sandwich colorimetric
+    # elisa kits) and zeroed their precision/recall at eval.  Any
+    # taxonomy roll-up belongs in script 0's CATEGORY_CONSOLIDATION so
+    # the expert learns the collapsed labels in the first place.
+
+    # Detect items where the rule layer assigned a NON-LAB market
+    # category (e.g. "animal - drosophila supplies",
+    # "irrelevant chemicals - solvents", "instrument part - buffer dams").
+    # The rule patterns are deliberately kept in market_rules.yml so the
+    # granular category is preserved for downstream non-lab analysis —
+    # but for the binary lab/non-lab decision we trust the rule over the
+    # gatekeeper here.  Mark them so step 5 skips the lab-similarity
+    # lookup (which would just warn about missing categories — the
+    # expert is built on lab categories only).  Uses the same regex
+    # that scripts 0/1 use to define non-lab.
+    nonlab_from_rules_mask = y_pred.astype(str).str.contains(
+        config.NONLAB_REGEX, na=False
+    )
+    if nonlab_from_rules_mask.any():
+        n_nl = int(nonlab_from_rules_mask.sum())
+        print(f"  - {n_nl} items have a non-lab market category from rules; "
+              f"keeping granular label, flagging as non-lab for binary eval.")
+        df_new.loc[nonlab_from_rules_mask, 'is_nonlab_market'] = True
+
+    # +++ Step 5: Calculate FINAL similarity scores +++
+    print("  - Step 5: Calculating final similarity scores for lab predictions...")
+    final_lab_mask = (
+        (y_pred != "Non-Lab")
+        & (y_pred != "unclassified")
+        & (y_pred != "Prediction Error")
+        & (y_pred != "No Description")
+        & ~nonlab_from_rules_mask  # skip rule-assigned non-lab categories
+    )
+
+    if final_lab_mask.any():
+        lab_indices = final_lab_mask[final_lab_mask].index
+        lab_final_suppliers = (suppliers.loc[lab_indices]
+                               if suppliers is not None else None)
+
+        def _similarity(pos):
+            lab_final_preds = y_pred[lab_indices[pos]]
+            lab_final_descs = clean_descriptions[lab_indices[pos]]
+            # Reuse Step 2's vectors when every row's (description,
+            # supplier) key was encoded there.  Market overrides (Step 4)
+            # can promote rows outside is_lab_mask to a category, and
+            # cached expert keys were never encoded -- encode those fresh.
+            vector_pos = row_vector_pos[df_new.index.get_indexer(lab_indices[pos])]
+            if step2_vectors is not None and (vector_pos >= 0).all():
+                lab_embeddings = step2_vectors[vector_pos]
+            else:
+                lab_suppliers_pos = (lab_final_suppliers.iloc[pos]
+                                     if lab_final_suppliers is not None else None)
+                if expert_choice in config.BERT_MODELS:
+                    lab_embeddings = expert_predictor._encode_with_supplier(
+                        lab_final_descs.tolist(), lab_suppliers_pos
+                    )
+                else:
+                    lab_embeddings = vectorizer_for_similarity.transform(
+                        lab_final_descs, suppliers=lab_suppliers_pos
+                    )
+
+            # Vectorized row-wise cosine: gather each row's assigned category
+            # vector in one fancy-index, L2-normalize both sides, dot per row.
+            cat_idx_arr = np.array(
+                [category_names_map.get(c, -1) for c in lab_final_preds]
+            )
+            valid_pos = np.where(cat_idx_arr >= 0)[0]
+            missing_pos = np.where(cat_idx_arr < 0)[0]
+            if len(missing_pos):
+                for c in sorted(set(lab_final_preds.iloc[missing_pos].tolist())):
+                    print(f"  -  DEBUG: Category mismatch. Rule category '{c}' not found in expert model's category list.")
+
+            final_scores = np.full(len(pos), np.nan)
+            if len(valid_pos):
+                v_lab_n = normalize(lab_embeddings[valid_pos], axis=1)
+                cat_vecs_n = normalize(category_vectors_for_similarity, axis=1)
+                cat_idx_valid = cat_idx_arr[valid_pos]
+
+                # Group by assigned category and compute per-group. Avoids a
+                # fancy-index over category rows that blows up either memory
+                # (dense) or scipy's int32 nnz counter (sparse) when the
+                # number of selected rows is large.
+                scores = np.empty(len(valid_pos))
+                for ci in np.unique(cat_idx_valid):
+                    mask = cat_idx_valid == ci
+                    v_cat_row = cat_vecs_n[ci]
+                    v_lab_rows = v_lab_n[mask]
+                    if sparse.issparse(v_lab_rows):
+                        s = np.asarray(v_lab_rows.multiply(v_cat_row).sum(axis=1)).ravel()
+                    else:
+                        s = v_lab_rows @ np.asarray(v_cat_row).ravel()
+                    scores[mask] = s
+                final_scores[valid_pos] = scores
+            return {'score': final_scores}
+
+        # The score depends on the description / supplier (embedding) and
+        # the final category, so all three make up the key.
+        sim_values, sim_codes = resolve_step(
+            cache, 'similarity',
+            [clean_descriptions[lab_indices], lab_final_suppliers,
+             y_pred[lab_indices].astype(str)],
+            _similarity)
+        df_new.loc[lab_indices, 'similarity_score'] = (
+            sim_values['score'][sim_codes].astype(float))
+
+    if step2_vectors is not None:
+        del step2_vectors
+        step2_vectors = None
+
+    # Assign final predictions
+    df_new['predicted_market'] = y_pred
+    df_new['nonlab_bucket'] = config.assign_nonlab_bucket_series(df_new['predicted_market'])
+    # --- End of Pipeline ---
+    return df_new
+
+
+def _prepare_govspend_frame(df_gov, verbose=True):
+    """Map GovSpend's column names onto what the pipeline expects.  Returns
+    None (after printing an ERROR) if no description column exists."""
+    # Expect pre-cleaned data with clean_desc already present
+    # (run clean_foia_data.py on govspend_panel.csv first)
+    if config.CLEAN_DESC_COL in df_gov.columns:
+        if verbose:
+            print(f"  - Found pre-cleaned '{config.CLEAN_DESC_COL}' column.")
+    else:
+        # Fallback: copy raw description if clean_desc is missing
+        source_col_name = 'prdct_description' if 'prdct_description' in df_gov.columns else 'product_desc'
+        if source_col_name not in df_gov.columns:
+            print(f"ERROR: Could not find description column in GovSpend file.")
+            return None
+        if verbose:
+            print(f"  - WARNING: '{config.CLEAN_DESC_COL}' not found. "
+                  f"Using raw '{source_col_name}' -- run clean_foia_data.py first for best results.")
+        df_gov[config.CLEAN_DESC_COL] = df_gov[source_col_name]
+
+    # Ensure raw description column exists for market override rules
+    if config.RAW_DESC_COL not in df_gov.columns:
+        for candidate in ['prdct_description', 'product_desc']:
+            if candidate in df_gov.columns:
+                df_gov[config.RAW_DESC_COL] = df_gov[candidate]
+                break
+
+    # GovSpend uses 'suppliername'; training/inference code expects 'supplier'.
+    if 'supplier' not in df_gov.columns and 'suppliername' in df_gov.columns:
+        df_gov['supplier'] = df_gov['suppliername']
+    return df_gov
+
+
+# ---------------------------------------------------------------------------
+# --stream mode for GovSpend.
+#
+# The panel is read in row chunks (row batches of the parquet copy when it
+# exists), each chunk goes through _predict_frame with the models loaded once,
+# and results are appended as part files of a parquet dataset.  Peak memory
+# is set by the chunk size, not by the panel size.
+# ---------------------------------------------------------------------------
+_STREAM_PROBE_ROWS = 20_000
+_STREAM_MIN_CHUNK_ROWS = 10_000
+
+
+def _chunk_kind(s):
+    """dtype of one chunk's column, with the cases a per-chunk read infers
+    differently from a full read split out: 'bool_obj' (Python bools + NaN,
+    an object column) and 'null' (all NaN, read as float64)."""
+    if s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) == "boolean":
+        return "bool_obj"
+    if s.dtype == np.dtype('float64') and s.isna().all():
+        return "null"
+    return s.dtype
+
+
+def _merge_csv_dtype(a, b):
+    if a == b:
+        return a
+    if {a, b} == {np.dtype('int64'), np.dtype('float64')}:
+        return np.dtype('float64')
+    return np.dtype(object)
+
+
+def _infer_csv_dtypes(path, chunk_rows):
+    """Column dtypes a single full read_csv(low_memory=False) would infer,
+    found in one bounded-memory pass.  Pinning these keeps every chunk (and
+    so every part file) on the same schema as the in-memory path.
+
+    Returns (dtypes, bool_cols).  A column whose chunks are bool / bools
+    with NaN / all NaN is an object column of Python bools in a full read,
+    but read_csv(dtype=object) would give the strings 'True' / 'False'; such
+    columns are left unpinned and go in bool_cols, to be cast to object
+    after each chunk is read."""
+    kinds = {}
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, low_memory=False):
+        for col in chunk.columns:
+            kinds.setdefault(col, set()).add(_chunk_kind(chunk[col]))
+    dtypes, bool_cols = {}, []
+    for col, ks in kinds.items():
+        if ks == {"null"}:
+            dtypes[col] = np.dtype('float64')
+        elif ks <= {np.dtype(bool), "bool_obj", "null"} and ks != {np.dtype(bool)}:
+            bool_cols.append(col)
+        else:
+            dts = [np.dtype('float64') if k == "null"
+                   else np.dtype(object) if k == "bool_obj" else k for k in ks]
+            dt = dts[0]
+            for other in dts[1:]:
+                dt = _merge_csv_dtype(dt, other)
+            dtypes[col] = dt
+    return dtypes, bool_cols
+
+
+def _stream_chunk_rows(mem_gb):
+    """Rows per chunk so that a chunk's pipeline peak (input bytes x
+    config.STREAM_PEAK_MULTIPLIER) fits in mem_gb."""
+    if os.path.exists(config.GOVSPEND_PANEL_PARQUET):
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(config.GOVSPEND_PANEL_PARQUET)
+        probe = next(pf.iter_batches(batch_size=_STREAM_PROBE_ROWS)).to_pandas()
+    else:
+        probe = pd.read_csv(config.GOVSPEND_PANEL_CSV, nrows=_STREAM_PROBE_ROWS,
+                            low_memory=False)
+    bytes_per_row = probe.memory_usage(deep=True).sum() / max(len(probe), 1)
+    rows = int(mem_gb * 1024**3 / (bytes_per_row * config.STREAM_PEAK_MULTIPLIER))
+    return max(rows, _STREAM_MIN_CHUNK_ROWS)
+
+
+def _govspend_chunks(chunk_rows):
+    if os.path.exists(config.GOVSPEND_PANEL_PARQUET):
+        import pyarrow.parquet as pq
+        print(f"  - Reading row batches from {config.GOVSPEND_PANEL_PARQUET}")
+        pf = pq.ParquetFile(config.GOVSPEND_PANEL_PARQUET)
+        start = 0
+        for batch in pf.iter_batches(batch_size=chunk_rows):
+            chunk = config.restore_csv_nulls(batch.to_pandas(),
+                                           all_null_as_float=False)
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+        return
+    print(f"  - Inferring column types from {config.GOVSPEND_PANEL_CSV}...")
+    dtypes, bool_cols = _infer_csv_dtypes(config.GOVSPEND_PANEL_CSV, chunk_rows)
+    for chunk in pd.read_csv(config.GOVSPEND_PANEL_CSV, chunksize=chunk_rows,
+                             dtype=dtypes, low_memory=False):
+        for col in bool_cols:
+            chunk[col] = chunk[col].astype(object)
+        yield chunk
+
+
+def _peak_rss_gb():
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024**2
+
+
+def _run_govspend_stream(models, cache, expert_choice, mem_gb, chunk_rows=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    print(f"\nGovSpend specified (--stream). Processing the panel in chunks.")
+    if not (os.path.exists(config.GOVSPEND_PANEL_PARQUET)
+            or os.path.exists(config.GOVSPEND_PANEL_CSV)):
+        print(f"ERROR:GovSpend file not found at: {config.GOVSPEND_PANEL_CSV}")
+        return
+    mem_gb = mem_gb or config.STREAM_MEMORY_BUDGET_GB
+    chunk_rows = chunk_rows or _stream_chunk_rows(mem_gb)
+    print(f"  - Chunk size: {chunk_rows:,} rows (budget {mem_gb:g} GB)")
+
+    stem = os.path.splitext(os.path.basename(config.GOVSPEND_PANEL_CSV))[0]
+    output_dir = os.path.join(config.OUTPUT_DIR, f"{stem}_classified_with_{expert_choice}")
+    os.makedirs(output_dir, exist_ok=True)
+    # Drop part files from a previous run so the dataset is not mixed.
+    for old in glob.glob(os.path.join(output_dir, "part-*.parquet")):
+        os.remove(old)
+
+    schema = None
+    n_rows = 0
+    for i, chunk in enumerate(_govspend_chunks(chunk_rows)):
+        print(f"\n--- Processing chunk {i} (rows {n_rows:,}-{n_rows + len(chunk) - 1:,}) ---")
+        chunk = _prepare_govspend_frame(chunk, verbose=(i == 0))
+        if chunk is None:
+            return
+        chunk = _predict_frame(chunk, cache, **models)
+
+        # Pin the schema on the first chunk so every part file agrees:
+        # is_nonlab_market only appears when some row hits a non-lab rule,
+        # and all-null columns get no arrow type of their own.
+        if schema is None:
+            if 'is_nonlab_market' not in chunk.columns:
+                chunk['is_nonlab_market'] = np.nan
+            schema = pa.Table.from_pandas(chunk, preserve_index=False).schema
+            for j, field in enumerate(schema):
+                if pa.types.is_null(field.type):
+                    new_type = pa.bool_() if field.name == 'is_nonlab_market' else pa.string()
+                    schema = schema.set(j, pa.field(field.name, new_type))
+        chunk = chunk.reindex(columns=schema.names)
+        table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+        pq.write_table(table, os.path.join(output_dir, f"part-{i:05d}.parquet"))
+        n_rows += len(chunk)
+        print(f"  - Wrote part-{i:05d}.parquet; {n_rows:,} rows so far, "
+              f"peak RSS {_peak_rss_gb():.2f} GB")
+        del chunk, table
+
+    print(f"Prediction dataset saved to: {output_dir}")
+
+
+def main(gatekeeper_name: str, expert_choice: str, source_abbrev: str = None,
+         use_cache: bool = True, stream: bool = False,
+         stream_mem_gb: float = None, chunk_rows: int = None):
     print(f"--- Starting Prediction Pipeline [Variant: {config.VARIANT}] ---")
     print(f"  - Gatekeeper Model:    {gatekeeper_name}")
     print(f"  - Expert Model Choice:   {expert_choice}")
@@ -98,6 +650,24 @@ def main(gatekeeper_name: str, expert_choice: str, source_abbrev: str = None):
         print(f"ERROR:A required model or file was not found: {e}. Please run previous scripts.")
         return
 
+    # Per-step prediction cache.  The fingerprint covers every model
+    # artifact, the rule / seed YAMLs and the pipeline source, so a retrain
+    # or rule edit transparently starts a new cache file.
+    cache = None
+    if use_cache:
+        cache = PredictionCache(artifact_fingerprint(gatekeeper_name, expert_choice))
+        print(f"  - Prediction cache: {cache.path}")
+
+    models = dict(
+        gatekeeper_model=gatekeeper_model,
+        expert_choice=expert_choice,
+        expert_predictor=expert_predictor,
+        vectorizer_for_similarity=vectorizer_for_similarity,
+        category_vectors_for_similarity=category_vectors_for_similarity,
+        category_names_map=category_names_map,
+        rule_categorizer=rule_categorizer,
+    )
+
     # 2. Find and load input files
     dataframes_to_process = []
     source_lower = source_abbrev.lower() if source_abbrev else ''
@@ -117,51 +687,34 @@ def main(gatekeeper_name: str, expert_choice: str, source_abbrev: str = None):
         except FileNotFoundError:
             print(f"ERROR: Pre-merged UMich file not found. Run 0_clean_category_file.py first.")
             return
+    elif 'govspend' in source_lower and stream:
+        _run_govspend_stream(models, cache, expert_choice, stream_mem_gb, chunk_rows)
     elif 'govspend' in source_lower:
         print(f"\nGovSpend specified. Loading the GovSpend panel data.")
         try:
-            df_gov = pd.read_csv(config.GOVSPEND_PANEL_CSV, low_memory=False)
-
-            # Expect pre-cleaned data with clean_desc already present
-            # (run clean_foia_data.py on govspend_panel.csv first)
-            if config.CLEAN_DESC_COL in df_gov.columns:
-                print(f"  - Found pre-cleaned '{config.CLEAN_DESC_COL}' column.")
-            else:
-                # Fallback: copy raw description if clean_desc is missing
-                source_col_name = 'prdct_description' if 'prdct_description' in df_gov.columns else 'product_desc'
-                if source_col_name not in df_gov.columns:
-                    print(f"ERROR: Could not find description column in GovSpend file.")
-                    return
-                print(f"  - WARNING: '{config.CLEAN_DESC_COL}' not found. "
-                      f"Using raw '{source_col_name}' -- run clean_foia_data.py first for best results.")
-                df_gov[config.CLEAN_DESC_COL] = df_gov[source_col_name]
-
-            # Ensure raw description column exists for market override rules
-            if config.RAW_DESC_COL not in df_gov.columns:
-                for candidate in ['prdct_description', 'product_desc']:
-                    if candidate in df_gov.columns:
-                        df_gov[config.RAW_DESC_COL] = df_gov[candidate]
-                        break
-
-            # GovSpend uses 'suppliername'; training/inference code expects 'supplier'.
-            if 'supplier' not in df_gov.columns and 'suppliername' in df_gov.columns:
-                df_gov['supplier'] = df_gov['suppliername']
-
-            dataframes_to_process.append((os.path.basename(config.GOVSPEND_PANEL_CSV), df_gov))
+            df_gov = config.read_clean_table(config.GOVSPEND_PANEL_CSV, low_memory=False)
         except FileNotFoundError:
             print(f"ERROR:GovSpend file not found at: {config.GOVSPEND_PANEL_CSV}")
             return
+        df_gov = _prepare_govspend_frame(df_gov)
+        if df_gov is None:
+            return
+        dataframes_to_process.append((os.path.basename(config.GOVSPEND_PANEL_CSV), df_gov))
     else:
         # Load other university files
         search_pattern = os.path.join(config.FOIA_INPUT_DIR, f"{source_abbrev}*_standardized_clean.csv" if source_abbrev else "*_standardized_clean.csv")
-        input_files = glob.glob(search_pattern)
+        # clean_foia_data.py may have written .csv, .parquet or both; key
+        # each file by its .csv path and let read_clean_table pick.
+        input_files = sorted(set(glob.glob(search_pattern)) | {
+            os.path.splitext(p)[0] + ".csv"
+            for p in glob.glob(os.path.splitext(search_pattern)[0] + ".parquet")})
         if not input_files:
             print(f"ERROR:No files found for pattern: {search_pattern}")
             return
         print(f"\nFound {len(input_files)} file(s) to process.")
         for file_path in input_files:
             try:
-                df = pd.read_csv(file_path, low_memory=False)
+                df = config.read_clean_table(file_path, low_memory=False)
                 # --- Ensure the description column exists ---
                 if config.CLEAN_DESC_COL not in df.columns:
                      # Attempt to find common alternatives if standard isn't present
@@ -190,318 +743,7 @@ def main(gatekeeper_name: str, expert_choice: str, source_abbrev: str = None):
             print(f"  - WARNING:Skipping file: Still missing required column '{config.CLEAN_DESC_COL}' after checks.")
             continue
             
-        clean_descriptions = df_new[config.CLEAN_DESC_COL].astype(str).fillna("")
-        suppliers = df_new['supplier'] if config.USE_SUPPLIER and 'supplier' in df_new.columns else None
-
-        # --- Pipeline Logic ---
-        df_new['prediction_source'] = 'Non-Lab'
-        df_new['similarity_score'] = np.nan
-        y_pred = pd.Series("Non-Lab", index=df_new.index)
-
-        print("  - Step 1: Running gatekeeper...")
-        is_lab_mask = (gatekeeper_model.predict(clean_descriptions, suppliers=suppliers) == 1)
-        print(f"  - Gatekeeper identified {is_lab_mask.sum()} potential lab items.")
-
-        # --- Step 1.5: Supplier-based Non-Lab filter ---
-        if 'supplier' in df_new.columns:
-            supplier_lower = df_new['supplier'].astype(str).str.lower().str.strip()
-            # Exact matches -- single isin instead of a loop of == comparisons.
-            exact_set = {n.lower().strip() for n in config.NONLAB_SUPPLIER_EXACT}
-            if exact_set:
-                supplier_nonlab_mask = supplier_lower.isin(exact_set)
-            else:
-                supplier_nonlab_mask = pd.Series(False, index=df_new.index)
-            # Keyword substring matches -- fold every keyword into a single
-            # alternation regex and do ONE str.contains pass.  Pandas treats
-            # the pattern as regex by default, so we preserve the original
-            # (un-escaped) interpretation.
-            if config.NONLAB_SUPPLIER_KEYWORDS:
-                kw_re = re.compile(
-                    '|'.join(f'(?:{kw.lower()})'
-                             for kw in config.NONLAB_SUPPLIER_KEYWORDS)
-                )
-                supplier_nonlab_mask |= supplier_lower.str.contains(kw_re, na=False)
-            # Force matched items to Non-Lab (remove from lab mask)
-            supplier_override_count = (is_lab_mask & supplier_nonlab_mask).sum()
-            if supplier_override_count > 0:
-                is_lab_mask = is_lab_mask & ~supplier_nonlab_mask
-                df_new.loc[supplier_nonlab_mask, 'prediction_source'] = 'Supplier Non-Lab'
-                print(f"  - Supplier filter: {supplier_override_count} items forced to Non-Lab ({supplier_nonlab_mask.sum()} total supplier Non-Lab).")
-
-        step2_vectors = None
-        step2_indices = None
-        if is_lab_mask.any():
-            # Expert model uses clean descriptions (no supplier token) for
-            # content-based category matching
-            lab_descriptions = clean_descriptions[is_lab_mask]
-
-            print(f"  - Step 2: Predicting markets with '{expert_choice}' expert (batched)...")
-            # One transform/encode + one cosine matmul for all lab rows.
-            # item_vectors are cached for Step 5 to avoid re-encoding.
-            lab_suppliers = (suppliers.loc[lab_descriptions.index]
-                             if suppliers is not None else None)
-            expert_predictions, expert_scores, step2_vectors = (
-                expert_predictor.predict_batch(lab_descriptions, suppliers=lab_suppliers)
-            )
-            step2_indices = lab_descriptions.index
-
-            # Step 2.5: Supplier-based category force.  Mono-category vendors
-            # (Peprotech / Avanti / Addgene / Bachem / ...) get their expert
-            # prediction overridden to the canonical category for that vendor.
-            # Runs before veto + market rules so a description-specific rule
-            # in Step 4 still wins.  Only fires when the supplier name matches
-            # and the category exists in the expert's known categories
-            # (otherwise the override is silently skipped to avoid debug
-            # warnings in Step 5).
-            supp_cat_regex = getattr(config, 'SUPPLIER_CATEGORY_REGEX', None)
-            if supp_cat_regex and lab_suppliers is not None:
-                lab_supp_lower = lab_suppliers.astype(str).str.lower()
-                total_forced = 0
-                for cat, regex in supp_cat_regex.items():
-                    if cat not in category_names_map:
-                        continue
-                    mask = lab_supp_lower.str.contains(regex, na=False)
-                    if mask.any():
-                        expert_predictions.loc[mask] = cat
-                        total_forced += int(mask.sum())
-                if total_forced:
-                    print(f"  - Step 2.5: Supplier-category force overrode {total_forced} expert predictions.")
-
-            print("  - Step 3: Applying prediction veto rules...")
-            validated_predictions = rule_categorizer.validate_predictions_batch(
-                expert_predictions, lab_descriptions
-            )
-            validated_predictions.index = lab_descriptions.index
-            num_vetoed = validated_predictions.isna().sum()
-            if num_vetoed > 0:
-                print(f"  - WARNING:Vetoed {num_vetoed} expert predictions.")
-
-            y_pred.update(validated_predictions)
-            survived_veto = validated_predictions.notna()
-            df_new.loc[validated_predictions.index[survived_veto], 'prediction_source'] = 'Expert Model'
-            df_new.loc[expert_scores.index, 'similarity_score'] = expert_scores # Store initial score
-
-        print("  - Step 4: Applying final market override rules...")
-        has_raw_col = config.RAW_DESC_COL in df_new.columns
-        clean_series_full = df_new[config.CLEAN_DESC_COL].astype(str)
-        raw_series_full = df_new[config.RAW_DESC_COL].astype(str) if has_raw_col else None
-
-        # FOIA product data is highly repetitive (same item ordered many
-        # times).  Dedupe (clean, raw) pairs so the batch runs on uniques
-        # only; then broadcast results back to every row.  Uses factorize on
-        # a concatenated string key (C-level hashing) + numpy fancy-index to
-        # broadcast — avoids Python tuple construction / hashing for the
-        # 300k-row path.
-        if has_raw_col:
-            pair_key = clean_series_full.str.cat(raw_series_full, sep='\x1f')
-        else:
-            pair_key = clean_series_full
-        codes, _ = pd.factorize(pair_key.to_numpy())
-        # factorize assigns codes in first-appearance order, so the k-th
-        # unique row is the first row with codes == k.
-        n_unique = int(codes.max()) + 1 if len(codes) else 0
-        first_pos = np.unique(codes, return_index=True)[1]
-        print(f"  - {n_unique} unique description pairs among {len(pair_key)} rows")
-        unique_clean = clean_series_full.iloc[first_pos].reset_index(drop=True)
-        unique_raw = (raw_series_full.iloc[first_pos].reset_index(drop=True)
-                      if has_raw_col else None)
-
-        # Run market rules in parallel across worker processes.  The rule
-        # evaluation is CPU-bound (793 rules x N rows of re.search calls)
-        # and embarrassingly parallel by row, so we shard unique_clean /
-        # unique_raw into chunks and fan out.  Single-process path kicks in
-        # for small inputs where pool startup would dominate.
-        n_workers = _default_override_workers()
-        PARALLEL_MIN = 20_000
-        if n_unique >= PARALLEL_MIN and n_workers > 1:
-            # Aim for ~4 chunks per worker so a slow chunk doesn't idle the
-            # rest of the pool.  Chunk via iloc slices, which inherit the
-            # parent's RangeIndex (so pd.concat stacks them contiguously).
-            target_chunks = n_workers * 4
-            chunk_size = max(1, (n_unique + target_chunks - 1) // target_chunks)
-            chunks = []
-            for start in range(0, n_unique, chunk_size):
-                end = min(start + chunk_size, n_unique)
-                chunks.append((
-                    unique_clean.iloc[start:end],
-                    unique_raw.iloc[start:end] if unique_raw is not None else None,
-                ))
-            print(f"  - Applying market rules in parallel: "
-                  f"{n_workers} workers x {len(chunks)} chunks "
-                  f"(~{chunk_size} rows/chunk).")
-            # fork start method (Linux default) skips re-import of this
-            # module in the children; initializer still builds a fresh
-            # categorizer per worker so we don't depend on parent state.
-            ctx = mp.get_context('fork')
-            with ctx.Pool(
-                n_workers,
-                initializer=_init_override_worker,
-                initargs=(config.MARKET_RULES_YAML,),
-            ) as pool:
-                results = pool.map(_apply_overrides_chunk, chunks)
-            # ignore_index=True gives us a clean 0..n_unique-1 RangeIndex
-            # matching the input order (pool.map preserves input order).
-            unique_overrides = pd.concat(results, ignore_index=True)
-        else:
-            unique_overrides = rule_categorizer.get_market_overrides_batch(
-                unique_clean, unique_raw)
-
-        # Remap rule outputs to the collapsed taxonomy the expert was trained
-        # on.  market_rules.yml is deliberately kept granular (e.g. "extended
-        # length pipette tips", "glass beakers", "rabbit-host anti-mouse
-        # polyclonal primary antibody") so rollups are reversible later --
-        # script 3 collapses at inference so the expert's category vectors
-        # can be matched.
-        #
-        # Two kinds of rollup, both mirroring script 0:
-        #   (a) explicit 1:1 renames from config.CATEGORY_CONSOLIDATION
-        #   (b) keyword-based buckets: any "pipette tip*" -> "pipette tips";
-        #       antibody + primary + polyclonal/monoclonal split + "secondary"
-        #       -> the three antibody buckets.
-        cons_map = getattr(config, 'CATEGORY_CONSOLIDATION', None)
-        if cons_map:
-            unique_overrides = unique_overrides.replace(cons_map)
-
-        # Mirror script 0's keyword-based rollups on rule outputs so rule
-        # categories like "extended length pipette tips" or "rabbit-host
-        # anti-mouse polyclonal primary antibody" don't fall off the expert
-        # model's category list (which only knows the collapsed names).
-        _lower = unique_overrides.str.lower()
-        unique_overrides.loc[
-            _lower.str.contains("pipette tip", na=False)] = "pipette tips"
-        unique_overrides.loc[
-            _lower.str.contains("elisa", na=False)] = "elisa kits"
-        _lower = unique_overrides.str.lower()  # recompute after elisa rollup
-        _is_ab = _lower.str.contains("antibod", na=False)
-        _is_prim = _lower.str.contains("primary", na=False)
-        _is_sec = _lower.str.contains("secondary", na=False)
-        _is_poly = _lower.str.contains("polyclonal", na=False)
-        _is_mono = _lower.str.contains("monoclonal", na=False)
-        unique_overrides.loc[_is_ab & _is_prim & _is_poly] = "polyclonal primary antibodies"
-        unique_overrides.loc[_is_ab & _is_prim & _is_mono] = "monoclonal primary antibodies"
-        unique_overrides.loc[_is_ab & _is_sec] = "secondary antibodies"
-
-        # Broadcast unique -> every row via numpy fancy-index on codes.
-        overrides = pd.Series(
-            unique_overrides.to_numpy()[codes],
-            index=df_new.index,
-        )
-        valid_overrides = overrides.dropna()
-        y_pred.update(valid_overrides)
-        print(f"  - Applied {len(valid_overrides)} market override rules.")
-        if not valid_overrides.empty:
-            df_new.loc[valid_overrides.index, 'prediction_source'] = 'Market Rules'
-
-        y_pred.fillna("unclassified", inplace=True)
-
-        # Deliberately no post-override re-consolidation here.  Previously
-        # this step flattened every antibody to "primary antibodies"/
-        # "secondary antibodies" and every elisa to "elisa kits", which
-        # overwrote the expert's fine-grained labels (e.g. polyclonal /
-        # monoclonal primary antibodies, pre-coated sandwich colorimetric
-        # elisa kits) and zeroed their precision/recall at eval.  Any
-        # taxonomy roll-up belongs in script 0's CATEGORY_CONSOLIDATION so
-        # the expert learns the collapsed labels in the first place.
-
-        # Detect items where the rule layer assigned a NON-LAB market
-        # category (e.g. "animal - drosophila supplies",
-        # "irrelevant chemicals - solvents", "instrument part - buffer dams").
-        # The rule patterns are deliberately kept in market_rules.yml so the
-        # granular category is preserved for downstream non-lab analysis —
-        # but for the binary lab/non-lab decision we trust the rule over the
-        # gatekeeper here.  Mark them so step 5 skips the lab-similarity
-        # lookup (which would just warn about missing categories — the
-        # expert is built on lab categories only).  Uses the same regex
-        # that scripts 0/1 use to define non-lab.
-        nonlab_from_rules_mask = y_pred.astype(str).str.contains(
-            config.NONLAB_REGEX, na=False
-        )
-        if nonlab_from_rules_mask.any():
-            n_nl = int(nonlab_from_rules_mask.sum())
-            print(f"  - {n_nl} items have a non-lab market category from rules; "
-                  f"keeping granular label, flagging as non-lab for binary eval.")
-            df_new.loc[nonlab_from_rules_mask, 'is_nonlab_market'] = True
-
-        # +++ Step 5: Calculate FINAL similarity scores +++
-        print("  - Step 5: Calculating final similarity scores for lab predictions...")
-        final_lab_mask = (
-            (y_pred != "Non-Lab")
-            & (y_pred != "unclassified")
-            & (y_pred != "Prediction Error")
-            & (y_pred != "No Description")
-            & ~nonlab_from_rules_mask  # skip rule-assigned non-lab categories
-        )
-
-        if final_lab_mask.any():
-            lab_indices = final_lab_mask[final_lab_mask].index
-            lab_final_preds = y_pred[lab_indices]
-            lab_final_descs = clean_descriptions[lab_indices]
-
-            # Reuse Step 2's cached vectors when all final-lab rows were in
-            # the gatekeeper lab set.  Market overrides (Step 4) can promote
-            # rows outside is_lab_mask to a category — encode those fresh.
-            lab_final_suppliers = (suppliers.loc[lab_indices]
-                                   if suppliers is not None else None)
-            if step2_vectors is not None and lab_indices.isin(step2_indices).all():
-                positions = step2_indices.get_indexer(lab_indices)
-                lab_embeddings = step2_vectors[positions]
-            else:
-                if expert_choice in config.BERT_MODELS:
-                    lab_embeddings = expert_predictor._encode_with_supplier(
-                        lab_final_descs.tolist(), lab_final_suppliers
-                    )
-                else:
-                    lab_embeddings = vectorizer_for_similarity.transform(
-                        lab_final_descs, suppliers=lab_final_suppliers
-                    )
-
-            # Vectorized row-wise cosine: gather each row's assigned category
-            # vector in one fancy-index, L2-normalize both sides, dot per row.
-            cat_idx_arr = np.array(
-                [category_names_map.get(c, -1) for c in lab_final_preds]
-            )
-            valid_pos = np.where(cat_idx_arr >= 0)[0]
-            missing_pos = np.where(cat_idx_arr < 0)[0]
-            if len(missing_pos):
-                for c in sorted(set(lab_final_preds.iloc[missing_pos].tolist())):
-                    print(f"  -  DEBUG: Category mismatch. Rule category '{c}' not found in expert model's category list.")
-
-            final_scores = np.full(len(lab_indices), np.nan)
-            if len(valid_pos):
-                v_lab_n = normalize(lab_embeddings[valid_pos], axis=1)
-                cat_vecs_n = normalize(category_vectors_for_similarity, axis=1)
-                cat_idx_valid = cat_idx_arr[valid_pos]
-
-                # Group by assigned category and compute per-group. Avoids a
-                # fancy-index over category rows that blows up either memory
-                # (dense) or scipy's int32 nnz counter (sparse) when the
-                # number of selected rows is large.
-                scores = np.empty(len(valid_pos))
-                for ci in np.unique(cat_idx_valid):
-                    mask = cat_idx_valid == ci
-                    v_cat_row = cat_vecs_n[ci]
-                    v_lab_rows = v_lab_n[mask]
-                    if sparse.issparse(v_lab_rows):
-                        s = np.asarray(v_lab_rows.multiply(v_cat_row).sum(axis=1)).ravel()
-                    else:
-                        s = v_lab_rows @ np.asarray(v_cat_row).ravel()
-                    scores[mask] = s
-                final_scores[valid_pos] = scores
-
-            df_new.loc[lab_indices, 'similarity_score'] = final_scores
-
-            # Release big intermediates before to_csv so peak memory isn't
-            # (item vectors + full output frame) during write.
-            del lab_embeddings
-
-        if step2_vectors is not None:
-            del step2_vectors
-            step2_vectors = None
-
-        # Assign final predictions
-        df_new['predicted_market'] = y_pred
-        df_new['nonlab_bucket'] = config.assign_nonlab_bucket_series(df_new['predicted_market'])
-        # --- End of Pipeline ---
+        df_new = _predict_frame(df_new, cache, **models)
 
         # Step G: Save the results
         output_filename = f"{os.path.splitext(filename)[0]}_classified_with_{expert_choice}.csv"
@@ -509,6 +751,9 @@ def main(gatekeeper_name: str, expert_choice: str, source_abbrev: str = None):
         df_new.to_csv(output_path, index=False)
         print(f"Prediction file saved to: {output_path}")
 
+    if cache is not None:
+        cache.report()
+        cache.close()
     print("\n--- All files processed. ---")
 
 
@@ -520,10 +765,22 @@ if __name__ == "__main__":
                         help="Shortcut: use this model for BOTH gatekeeper and expert. Overridden per-role by --gatekeeper / --expert.")
     parser.add_argument("--gatekeeper", type=str, default=None, choices=_model_choices)
     parser.add_argument("--expert", type=str, default=None, choices=_model_choices)
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the persistent prediction cache (config.PREDICTION_CACHE_DIR) and recompute every step.")
+    parser.add_argument("--stream", action="store_true",
+                        help="GovSpend only: process the panel in row chunks and write a partitioned parquet dataset instead of one CSV.")
+    parser.add_argument("--stream-mem-gb", type=float, default=config.STREAM_MEMORY_BUDGET_GB,
+                        help="Peak-memory budget used to size --stream chunks (default: config.STREAM_MEMORY_BUDGET_GB).")
+    parser.add_argument("--chunk-rows", type=int, default=None,
+                        help="Explicit --stream chunk size in rows (overrides --stream-mem-gb).")
     args = parser.parse_args()
 
     gatekeeper = args.gatekeeper or args.model
     expert = args.expert or args.model
     if gatekeeper is None or expert is None:
         parser.error("Must specify the model positionally (e.g. 'tfidf') or via --gatekeeper and --expert.")
-    main(gatekeeper_name=gatekeeper, expert_choice=expert, source_abbrev=args.source_abbrev)
\ No newline at end of file
+    if args.stream and 'govspend' not in (args.source_abbrev or '').lower():
+        parser.error("--stream is only supported for the 'govspend' source.")
+    main(gatekeeper_name=gatekeeper, expert_choice=expert, source_abbrev=args.source_abbrev,
+         use_cache=not args.no_cache, stream=args.stream,
+         stream_mem_gb=args.stream_mem_gb, chunk_rows=args.chunk_rows)
\ No newline at end of file
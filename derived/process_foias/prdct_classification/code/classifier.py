@@ -342,6 +342,26 @@ def _is_trivial_desc(desc):
             return False
     return True
 
+def _as_object_array(values):
+    """1-D object ndarray of a list / Series without element conversion."""
+    if isinstance(values, pd.Series):
+        return values.to_numpy(dtype=object)
+    out = np.empty(len(values), dtype=object)
+    out[:] = list(values)
+    return out
+
+
+def _factorize_codes(values):
+    """pd.factorize codes for an object array, with missing values kept
+    apart by repr: None and NaN stringify differently (str(None) ==
+    'None'), so predict() must not merge them.  Returns (codes, n_codes)."""
+    codes = pd.factorize(values)[0].astype(np.int64)
+    na = codes < 0
+    if na.any():
+        na_codes = pd.factorize(np.array([repr(v) for v in values[na]], dtype=object))[0]
+        codes[na] = codes.max() + 1 + na_codes
+    return codes, int(codes.max()) + 1
+
 # --- The Main Hybrid Classifier Class ---
 class HybridClassifier:
     def __init__(self, ml_model, vectorizer, seed_automaton, anti_seed_automaton,
@@ -397,40 +417,52 @@ class HybridClassifier:
           6. No keyword match           -> ML model at PREDICTION_THRESHOLD
 
         Optional post-hoc filters (bulk-chemical, supplier-prior) are gated by
-        config flags.  When active they skip items in strong_lab_indices
+        config flags.  When active they skip items in strong_lab_mask
         (seed / primer matches) so those forced-lab items cannot be flipped back.
         """
         if not isinstance(descriptions, (list, pd.Series)):
             descriptions = [descriptions]
-
-        suppliers_list = None
+        desc_values = _as_object_array(descriptions)
+        if len(desc_values) == 0:
+            return np.array([])
+
+        # Every rule and model below is a pure function of the (description,
+        # supplier) pair, and procurement rows repeat heavily.  Factorize the
+        # pair once so cleaning, matching, vectorizing and predict_proba run
+        # on unique pairs only; labels are broadcast back with pair_codes.
+        desc_codes, _ = _factorize_codes(desc_values)
+        supp_values = None
         if suppliers is not None:
-            if isinstance(suppliers, pd.Series):
-                suppliers_list = suppliers.tolist()
-            else:
-                suppliers_list = list(suppliers)
-
-        final_predictions = {}
-        strong_lab_indices = set()
-        anti_seed_indices = set()
-        to_predict_ml = {'indices': [], 'data': []}
+            supp_values = _as_object_array(suppliers)
+            supp_codes, n_supp = _factorize_codes(supp_values)
+            pair_codes, _ = pd.factorize(desc_codes * n_supp + supp_codes)
+        else:
+            pair_codes = desc_codes
+        first_pos = np.unique(pair_codes, return_index=True)[1]
+        u_desc = desc_values[first_pos]
+        n = len(u_desc)
 
         use_market_gate = getattr(config, 'USE_MARKET_RULE_GATE', False)
         lab_supplier_regex = getattr(config, 'LAB_SUPPLIER_REGEX', None)
         primer_regex = getattr(self, 'primer_regex', None)
 
+        # Per unique supplier: its normalize_supplier token (computed once
+        # per distinct supplier, not per row) and the position of each
+        # unique pair's supplier in that table.
+        if supp_values is not None:
+            u_supp = supp_values[first_pos]
+            supp_first, supp_inv = np.unique(
+                supp_codes[first_pos], return_index=True, return_inverse=True)[1:]
+            supp_tokens = np.array(
+                [config.normalize_supplier(str(v)) for v in u_supp[supp_first]],
+                dtype=object)
+
         # Vectorize the rule pre-pass: clean once, run each matcher over the
-        # whole series, then resolve priorities from boolean masks.  Replaces
-        # a per-row loop that made 3–4 regex/AC calls (each re-lowercasing
-        # the string) — the big hold-out cost.
-        n = len(descriptions)
-        desc_series = pd.Series(
-            list(descriptions) if not isinstance(descriptions, pd.Series) else descriptions.values
-        )
-        cleaned_series = desc_series.map(
+        # whole series, then resolve priorities from boolean masks.
+        cleaned_series = pd.Series(u_desc).map(
             lambda d: config.clean_for_model(d) if isinstance(d, str) else ''
         )
-        cleaned_list = cleaned_series.tolist()
+        cleaned = cleaned_series.to_numpy(dtype=object)
 
         anti_mask = batch_has_match(cleaned_series, self.anti_seed_automaton).to_numpy()
         seed_mask = batch_has_match(cleaned_series, self.seed_automaton).to_numpy()
@@ -446,18 +478,14 @@ class HybridClassifier:
         # forms keeps 'saline' / 'pacific' / 'bearing' (lowercase prose) dark.
         enzyme_regex = getattr(self, 'enzyme_regex', None)
         if enzyme_regex is not None:
-            raw_series = pd.Series(
-                [str(d) if isinstance(d, str) else '' for d in (
-                    descriptions if isinstance(descriptions, (list, pd.Series)) else [descriptions]
-                )]
-            )
+            raw_series = pd.Series([d if isinstance(d, str) else '' for d in u_desc])
             enzyme_mask = raw_series.str.contains(enzyme_regex, na=False).to_numpy()
         else:
             enzyme_mask = np.zeros(n, dtype=bool)
 
         lab_supp_mask = np.zeros(n, dtype=bool)
-        if lab_supplier_regex is not None and suppliers_list is not None:
-            supp_series = pd.Series(['' if s is None else str(s) for s in suppliers_list])
+        if lab_supplier_regex is not None and supp_values is not None:
+            supp_series = pd.Series(['' if s is None else str(s) for s in u_supp])
             lab_supp_mask = supp_series.str.contains(lab_supplier_regex, na=False).to_numpy()
 
         if primer_regex is not None:
@@ -465,30 +493,23 @@ class HybridClassifier:
         else:
             primer_mask = np.zeros(n, dtype=bool)
 
+        # Anti-seed rows are 0, strong-lab rows are 1, everything else goes
+        # to the ML model.
         strong_lab_mask = (seed_mask | market_mask | enzyme_mask | lab_supp_mask | primer_mask) & ~anti_mask
         ml_mask = ~anti_mask & ~strong_lab_mask
+        labels = strong_lab_mask.astype(np.int64)
 
-        cleaned_descs = dict(enumerate(cleaned_list))
-        for i in np.flatnonzero(anti_mask).tolist():
-            final_predictions[i] = 0
-            anti_seed_indices.add(i)
-        for i in np.flatnonzero(strong_lab_mask).tolist():
-            final_predictions[i] = 1
-            strong_lab_indices.add(i)
-        ml_indices = np.flatnonzero(ml_mask).tolist()
-        to_predict_ml['indices'] = ml_indices
-        to_predict_ml['data'] = [cleaned_list[i] for i in ml_indices]
-
-        if to_predict_ml['data']:
+        ml_indices = np.flatnonzero(ml_mask)
+        if len(ml_indices):
+            ml_texts = cleaned[ml_indices].tolist()
             if self.is_bert:
-                desc_vectors = self.vectorizer.encode(to_predict_ml['data'], show_progress_bar=False)
+                desc_vectors = self.vectorizer.encode(ml_texts, show_progress_bar=False)
             else:
-                desc_vectors = self.vectorizer.transform(to_predict_ml['data'])
+                desc_vectors = self.vectorizer.transform(ml_texts)
 
-            if self.supplier_vectorizer is not None and suppliers_list is not None:
-                supp_tokens = [config.normalize_supplier(str(suppliers_list[i]))
-                               for i in to_predict_ml['indices']]
-                supp_vectors = self.supplier_vectorizer.transform(supp_tokens)
+            if self.supplier_vectorizer is not None and supp_values is not None:
+                supp_vectors = self.supplier_vectorizer.transform(
+                    supp_tokens[supp_inv[ml_indices]].tolist())
                 desc_norm = normalize(desc_vectors, norm='l2')
                 supp_norm = normalize(supp_vectors, norm='l2')
                 vectors = hstack([desc_norm * config.DESC_WEIGHT,
@@ -499,12 +520,11 @@ class HybridClassifier:
             # Append engineered description-level features (token count,
             # has-volume-unit).  Must mirror the same call in 1b.
             if getattr(config, 'USE_ENGINEERED_FEATURES', False):
-                extra = compute_engineered_features(to_predict_ml['data'])
+                extra = compute_engineered_features(ml_texts)
                 vectors = hstack([vectors, extra])
 
             ml_probas = self.ml_model.predict_proba(vectors)[:, 1]
-            for j, idx in enumerate(to_predict_ml['indices']):
-                final_predictions[idx] = int(ml_probas[j] >= config.PREDICTION_THRESHOLD)
+            labels[ml_indices] = ml_probas >= config.PREDICTION_THRESHOLD
 
         # Second-stage bulk-chemical / instrument-part filter.  Runs only on
         # items currently predicted as lab and without a strong lab signal —
@@ -515,40 +535,33 @@ class HybridClassifier:
                     and self.bulk_filter is not None
                     and self.bulk_filter_vectorizer is not None)
         if use_bulk:
-            candidates = [i for i, p in final_predictions.items()
-                          if p == 1 and i not in strong_lab_indices]
-            if candidates:
-                cand_texts = [cleaned_descs[i] for i in candidates]
-                X_cand = self.bulk_filter_vectorizer.transform(cand_texts)
+            candidates = np.flatnonzero((labels == 1) & ~strong_lab_mask)
+            if len(candidates):
+                X_cand = self.bulk_filter_vectorizer.transform(cleaned[candidates].tolist())
                 probs = self.bulk_filter.predict_proba(X_cand)[:, 1]
-                thr = config.BULK_FILTER_THRESHOLD
-                for i, prob in zip(candidates, probs):
-                    if prob >= thr:
-                        final_predictions[i] = 0
+                labels[candidates[probs >= config.BULK_FILTER_THRESHOLD]] = 0
 
         # Post-hoc supplier-prior overlay.  Flip predictions when the
         # supplier's training-split lab rate is extreme and its count meets
-        # the minimum.  Anti-seed and strong-lab items are preserved.
+        # the minimum.  Anti-seed and strong-lab items are preserved.  The
+        # prior is looked up once per distinct supplier token and gathered
+        # with supp_inv.
         use_prior = (getattr(config, 'USE_SUPPLIER_PRIOR', False)
                      and self.supplier_priors
-                     and suppliers_list is not None)
+                     and supp_values is not None)
         if use_prior:
             min_count = getattr(config, 'SUPPLIER_PRIOR_MIN_COUNT', 20)
             low_thr = getattr(config, 'SUPPLIER_PRIOR_LAB_THRESHOLD', 0.1)
             high_thr = getattr(config, 'SUPPLIER_PRIOR_LAB_HIGH_THRESHOLD', 0.9)
-            for i in range(len(descriptions)):
-                if i in anti_seed_indices or i in strong_lab_indices:
-                    continue
-                tok = config.normalize_supplier(str(suppliers_list[i]))
-                prior = self.supplier_priors.get(tok)
-                if prior is None:
-                    continue
-                cnt, rate = prior
-                if cnt < min_count:
-                    continue
-                if final_predictions[i] == 1 and rate <= low_thr:
-                    final_predictions[i] = 0
-                elif final_predictions[i] == 0 and rate >= high_thr:
-                    final_predictions[i] = 1
-
-        return np.array([final_predictions[i] for i in sorted(final_predictions)])
+            priors = [self.supplier_priors.get(tok) for tok in supp_tokens]
+            has_prior = np.array([p is not None for p in priors], dtype=bool)
+            prior_cnt = np.array([p[0] if p is not None else 0 for p in priors], dtype=float)
+            prior_rate = np.array([p[1] if p is not None else np.nan for p in priors], dtype=float)
+            eligible = (has_prior & (prior_cnt >= min_count))[supp_inv] & ml_mask
+            rate = prior_rate[supp_inv]
+            to_nonlab = eligible & (labels == 1) & (rate <= low_thr)
+            to_lab = eligible & (labels == 0) & (rate >= high_thr)
+            labels[to_nonlab] = 0
+            labels[to_lab] = 1
+
+        return labels[pair_codes]
@@ -5,6 +5,8 @@ Central configuration file for the lab consumables classification pipeline.
 import os
 import re
 
+import numpy as np
+
 # ==============================================================================
 # 1. Base Directory Setup & Variant Configuration
 # ==============================================================================
@@ -37,6 +39,10 @@ FISHER_CHEMICAL = os.path.join(BASE_DIR, "external", "samp", "fisher_chemical_cl
 MARKET_RULES_YAML = os.path.join(CODE_DIR, "market_rules.yml")
 GOVSPEND_PANEL_CSV = os.path.join(BASE_DIR, "external", "samp", "govspend_panel_clean.csv")
 
+# Parquet twin of the panel (clean_foia_data.py --format parquet); read by
+# read_clean_table and by `3_predict_product_markets.py govspend --stream`.
+GOVSPEND_PANEL_PARQUET = os.path.splitext(GOVSPEND_PANEL_CSV)[0] + ".parquet"
+
 # ==============================================================================
 # 3. Intermediate & Output File Paths (variant-specific)
 # ==============================================================================
@@ -47,6 +53,17 @@ UT_DALLAS_MERGED_CLEAN_PATH = os.path.join(TEMP_DIR, "utdallas_merged_clean.parq
 UMICH_MERGED_CLEAN_PATH = os.path.join(TEMP_DIR, "umich_merged_clean.parquet")
 COMBINED_MERGED_CLEAN_PATH = os.path.join(TEMP_DIR, "combined_merged_clean.parquet")
 
+# Content-addressed prediction cache used by script 3 (one SQLite file per
+# model / rules fingerprint -- see prediction_cache.py).
+PREDICTION_CACHE_DIR = os.path.join(TEMP_DIR, "prediction_cache")
+
+# --stream mode for GovSpend in script 3: peak-memory budget (GB) used to size
+# the row chunks, and the multiple of a chunk's in-memory input size that
+# steps 1-5 hold at peak (sparse TF-IDF / embeddings, rule intermediates,
+# output frame).
+STREAM_MEMORY_BUDGET_GB = 8.0
+STREAM_PEAK_MULTIPLIER = 12
+
 OUTPUT_DIR = os.path.join(BASE_DIR, "output", VARIANT)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -1239,3 +1256,39 @@ def get_sample_weights(data_sources, labels):
             mask = (src.values == s) & (lab.values == int(l))
             weights[mask] = float(w)
     return weights
+
+
+# ==============================================================================
+# 8. Clean-Table Readers
+# ==============================================================================
+def read_clean_table(path, **csv_kwargs):
+    """Load a *_clean table from clean_foia_data.py in either output format.
+
+    `path` is the configured .csv path.  If a .parquet twin exists next to it
+    (clean_foia_data.py --format parquet) and is at least as new as the CSV,
+    the Parquet file is read instead -- it was written with the same column
+    types and nulls a read_csv of the CSV would produce, so callers don't
+    change.  Raises FileNotFoundError when neither file exists.
+    """
+    import pandas as pd  # local import keeps config import-light
+    parquet_path = os.path.splitext(path)[0] + ".parquet"
+    if os.path.exists(parquet_path) and (
+            not os.path.exists(path)
+            or os.path.getmtime(parquet_path) >= os.path.getmtime(path)):
+        return restore_csv_nulls(pd.read_parquet(parquet_path))
+    return pd.read_csv(path, **csv_kwargs)
+
+
+def restore_csv_nulls(df, all_null_as_float=True):
+    """Arrow hands back None for null strings; read_csv gives NaN (and a
+    float64 column when every value is missing).  Pass
+    all_null_as_float=False for row batches, where a column can be all-null
+    in one batch only."""
+    obj_cols = df.columns[df.dtypes == object]
+    if len(obj_cols):
+        df[obj_cols] = df[obj_cols].where(df[obj_cols].notna(), np.nan)
+        all_null = [c for c in obj_cols
+                    if all_null_as_float and df[c].isna().all()]
+        if all_null:
+            df[all_null] = df[all_null].astype(float)
+    return df
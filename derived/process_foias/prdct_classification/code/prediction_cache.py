@@ -0,0 +1,188 @@
+# prediction_cache.py
+"""
+Persistent, content-addressed cache of per-description predictions for
+3_predict_product_markets.py.
+
+FOIA and GovSpend descriptions repeat heavily across files and reruns, so
+each pipeline step (gatekeeper label, expert category + score, market-rule
+override, final similarity score) is stored in SQLite keyed by a hash of the
+inputs that step depends on.  Only novel keys reach the models.
+
+Invalidation is automatic: every cache file is named after a fingerprint of
+the model artifacts (*.joblib in config.OUTPUT_DIR), the rule / seed YAMLs,
+the pipeline source files and the gatekeeper / expert choice.  Retraining a
+model or editing market_rules.yml yields a new fingerprint and therefore a
+fresh, empty cache file.
+"""
+import glob
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import config
+
+# Step name -> (column name, SQLite type) for the cached values.
+CACHE_STEPS = {
+    'gatekeeper': [('label', 'INTEGER')],
+    'expert': [('category', 'TEXT'), ('score', 'REAL')],
+    'rules': [('override', 'TEXT')],
+    'similarity': [('score', 'REAL')],
+}
+
+# Stands in for a missing key column (e.g. no supplier column in a file), so
+# "no supplier passed" and "empty supplier" hash differently.
+MISSING_FIELD = '\x00'
+
+# Source files whose edits can change predictions without touching any
+# joblib artifact (thresholds, cleaning, rule engine).
+_SOURCE_FILES = [
+    'config.py', 'classifier.py', 'categorize_items.py',
+    'rule_based_categorizer.py',
+]
+
+# SQLite caps the number of bound parameters per statement (999 on older
+# builds); look keys up in batches below that.
+_LOOKUP_BATCH = 900
+
+
+def _hash_file(path, h):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+
+
+def artifact_fingerprint(gatekeeper_name, expert_choice):
+    """Hex digest identifying every input that can change a prediction."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{config.VARIANT}\x1f{gatekeeper_name}\x1f{expert_choice}".encode())
+    paths = sorted(glob.glob(os.path.join(config.OUTPUT_DIR, '*.joblib')))
+    paths += [config.MARKET_RULES_YAML, config.SEED_KEYWORD_YAML,
+              config.ANTI_SEED_KEYWORD_YAML]
+    paths += [os.path.join(config.CODE_DIR, f) for f in _SOURCE_FILES]
+    for path in paths:
+        h.update(os.path.basename(path).encode() + b'\x1f')
+        if os.path.exists(path):
+            _hash_file(path, h)
+    return h.hexdigest()
+
+
+def _row_keys(columns):
+    """Combine per-row key columns into one string per row."""
+    parts = [MISSING_FIELD if c is None else c for c in columns]
+    series = [p for p in parts if isinstance(p, pd.Series)]
+    n = len(series[0])
+    parts = [pd.Series([p] * n, dtype=object) if isinstance(p, str)
+             else p.reset_index(drop=True).astype(str) for p in parts]
+    if len(parts) == 1:
+        return parts[0]
+    return parts[0].str.cat(parts[1:], sep='\x1f')
+
+
+def _to_sql(value, kind):
+    """Coerce numpy scalars / NaN to the Python types sqlite3 can bind."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return {'INTEGER': int, 'REAL': float, 'TEXT': str}[kind](value)
+
+
+def _digest(key):
+    return hashlib.blake2b(key.encode('utf-8', 'surrogatepass'),
+                           digest_size=16).digest()
+
+
+class PredictionCache:
+    def __init__(self, fingerprint, cache_dir=None):
+        cache_dir = cache_dir or config.PREDICTION_CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, f"{fingerprint}.sqlite")
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        for step, cols in CACHE_STEPS.items():
+            col_sql = ', '.join(f"{name} {kind}" for name, kind in cols)
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {step} "
+                f"(key BLOB PRIMARY KEY, {col_sql}) WITHOUT ROWID")
+        self.conn.commit()
+        # step -> [unique keys hit, unique keys looked up], across all files.
+        self.stats = {step: [0, 0] for step in CACHE_STEPS}
+
+    def get(self, step, keys):
+        """Look up hashed keys.  Returns (hit_mask, {column: values})."""
+        cols = [name for name, _ in CACHE_STEPS[step]]
+        found = {}
+        for start in range(0, len(keys), _LOOKUP_BATCH):
+            batch = keys[start:start + _LOOKUP_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.conn.execute(
+                f"SELECT key, {', '.join(cols)} FROM {step} "
+                f"WHERE key IN ({placeholders})", batch)
+            for row in rows:
+                found[row[0]] = row[1:]
+        hit = np.fromiter((k in found for k in keys), dtype=bool, count=len(keys))
+        values = {c: np.full(len(keys), None, dtype=object) for c in cols}
+        for i in np.flatnonzero(hit):
+            for c, v in zip(cols, found[keys[i]]):
+                values[c][i] = v
+        return hit, values
+
+    def put(self, step, keys, values):
+        """Store {column: values} for hashed keys (aligned)."""
+        cols = [name for name, _ in CACHE_STEPS[step]]
+        rows = zip(keys, *([_to_sql(v, kind) for v in values[name]]
+                           for name, kind in CACHE_STEPS[step]))
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO {step} (key, {', '.join(cols)}) "
+            f"VALUES ({','.join('?' * (len(cols) + 1))})", rows)
+        self.conn.commit()
+
+    def report(self):
+        print("  - Prediction cache hit rate by step (unique keys):")
+        for step, (hits, total) in self.stats.items():
+            if total:
+                print(f"      {step:<11} {hits:>10,} / {total:>10,}  ({hits / total:.1%})")
+
+    def close(self):
+        self.conn.close()
+
+
+def resolve_step(cache, step, key_columns, compute):
+    """Dedupe rows on key_columns, serve unique keys from `cache`, and run
+    compute(positions) only on the first row of each missing key.
+
+    key_columns: list of Series aligned with the rows (None = field absent).
+    compute(positions): given positional row indices, returns
+        {column: array-like} for those rows (columns per CACHE_STEPS[step]).
+    Returns (unique_values, codes): {column: ndarray over unique keys} and
+    the per-row code into it, so callers can post-process on uniques and
+    broadcast with values[codes].  cache=None just dedupes.
+    """
+    row_keys = _row_keys(key_columns)
+    codes, uniques = pd.factorize(row_keys.to_numpy())
+    first_pos = np.unique(codes, return_index=True)[1]
+    cols = [name for name, _ in CACHE_STEPS[step]]
+
+    if cache is None:
+        hit = np.zeros(len(uniques), dtype=bool)
+        values = {c: np.full(len(uniques), None, dtype=object) for c in cols}
+        keys = None
+    else:
+        keys = [_digest(k) for k in uniques]
+        hit, values = cache.get(step, keys)
+        n_hit = int(hit.sum())
+        cache.stats[step][0] += n_hit
+        cache.stats[step][1] += len(uniques)
+        print(f"  - Cache [{step}]: {n_hit:,} of {len(uniques):,} unique keys "
+              f"hit ({n_hit / max(len(uniques), 1):.1%})")
+
+    miss = np.flatnonzero(~hit)
+    if len(miss):
+        computed = compute(first_pos[miss])
+        for c in cols:
+            values[c][miss] = np.asarray(computed[c], dtype=object)
+        if cache is not None:
+            cache.put(step, [keys[i] for i in miss],
+                      {c: values[c][miss] for c in cols})
+    return values, codes
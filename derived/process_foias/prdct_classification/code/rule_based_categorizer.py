@@ -7,6 +7,7 @@ regex builder, now with support for exact-string matching.
 import warnings
 import yaml
 import re
+import ahocorasick
 import numpy as np
 import pandas as pd
 
@@ -16,6 +17,82 @@ warnings.filterwarnings(
     category=UserWarning,
 )
 
+# Leading global inline flags on a raw YAML regex, e.g. the `(?i)` most
+# regex_any_of entries start with.  Python 3.11+ rejects these anywhere but
+# the very start of a pattern, so they're hoisted into the compile flags when
+# several raw patterns are joined into one alternation (older Pythons applied
+# them to the whole expression anyway, so the semantics are unchanged).
+_GLOBAL_INLINE_FLAGS_RE = re.compile(r'^\(\?([aiLmsux]+)\)')
+_INLINE_FLAG_BITS = {
+    'a': re.ASCII, 'i': re.IGNORECASE, 'L': re.LOCALE,
+    'm': re.MULTILINE, 's': re.DOTALL, 'u': re.UNICODE, 'x': re.VERBOSE,
+}
+
+# The only non-ASCII code points that an IGNORECASE regex matches against an
+# ASCII letter (every ch with re.fullmatch(r'(?i)[a-z]', ch)): dotted /
+# dotless i, long s and the Kelvin sign.  The scan engine's lowercased anchor
+# lookup can't see those pairings, so rows containing them take the
+# per-clause regex path instead.
+_ASCII_CASEFOLD_RE = re.compile('[\u0130\u0131\u017f\u212a]')
+
+try:
+    from re import _parser as _sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+
+
+def _required_literals(items):
+    """Anchor set for a parsed regex sequence: lowercase ASCII strings at
+    least one of which occurs in every match, or None when no such set can
+    be read off the parse tree.  Conservative by design -- anything it
+    doesn't understand (lookarounds, optional repeats, negated or category
+    classes) just contributes no anchor."""
+    best = None
+
+    def consider(option):
+        nonlocal best
+        if not option:
+            return
+        if (best is None
+                or (min(map(len, option)), -len(option))
+                > (min(map(len, best)), -len(best))):
+            best = option
+
+    run = []
+    for op, av in list(items) + [(None, None)]:
+        if op is _sre_parse.LITERAL and av < 128:
+            run.append(chr(av).lower())
+            continue
+        if run:
+            consider({''.join(run)})
+            run = []
+        if op is _sre_parse.SUBPATTERN:
+            consider(_required_literals(av[-1]))
+        elif op in (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT) and av[0] >= 1:
+            consider(_required_literals(av[2]))
+        elif op is _sre_parse.BRANCH:
+            union = set()
+            for branch in av[1]:
+                sub = _required_literals(branch)
+                if not sub:
+                    union = None
+                    break
+                union |= sub
+            consider(union)
+        elif op is _sre_parse.IN and all(
+                o is _sre_parse.LITERAL and a < 128 for o, a in av):
+            consider({chr(a).lower() for _, a in av})
+    return best
+
+
+def _regex_anchors(rgx):
+    """Anchor set (see `_required_literals`) for a compiled regex."""
+    try:
+        return _required_literals(_sre_parse.parse(rgx.pattern, rgx.flags))
+    except Exception:
+        return None
+
+
 class RuleBasedCategorizer:
     def __init__(self, rules_filepath):
         print("Initializing RuleBasedCategorizer with upgraded logic...")
@@ -128,6 +205,132 @@ class RuleBasedCategorizer:
             re.IGNORECASE,
         )
 
+        self._build_scan_engine()
+
+    # ------------------------------------------------------------------
+    # Single-pass scan engine.  Every keyword of every rule becomes one
+    # "atom" (deduped across rules), and each clause becomes a bitmask over
+    # atoms.  A description is scanned ONCE per source text (clean / raw)
+    # with an Aho-Corasick automaton over each atom's longest literal word
+    # (its "anchor"); only atoms whose anchor occurs are confirmed with their
+    # own regex.  The confirmed hits form a per-row int bitset from which
+    # none_of / all_of / any_of / exact_any_of and first-match-wins priority
+    # are resolved without touching the text again.
+    # ------------------------------------------------------------------
+
+    def _build_scan_engine(self):
+        """Compile `_rule_compiled` into the atom / bitmask tables used by
+        `_match_rules_scan`.  Atom regexes come from the same `_get_regex`
+        cache as the per-row path, and raw-regex clauses reuse the combined
+        regex from `_rule_compiled` as a single atom, so a clause hits
+        exactly when its alternation regex would."""
+        atom_keys = {}
+        atom_regex = []
+        atom_src = []          # 0 = clean text, 1 = raw text
+        anchors = ({}, {})     # per source: anchor -> [atom ids]
+        unanchored = []        # atoms evaluated column-wise on every row
+
+        def add_atom(key, regex, src, anchor):
+            a = atom_keys.get(key)
+            if a is None:
+                a = len(atom_regex)
+                atom_keys[key] = a
+                atom_regex.append(regex)
+                atom_src.append(src)
+                if anchor:
+                    for lit in anchor:
+                        anchors[src].setdefault(lit, []).append(a)
+                else:
+                    unanchored.append(a)
+            return a
+
+        def keyword_atoms(keywords, src, ignore_case, exact_match=False):
+            atoms = []
+            for kw in keywords:
+                rgx = self._get_regex(kw, exact_match=exact_match,
+                                      ignore_case=ignore_case)
+                atoms.append(add_atom(('kw', str(kw), exact_match, ignore_case, src),
+                                      rgx, src, _regex_anchors(rgx)))
+            return atoms
+
+        def regex_atoms(rgx, src):
+            if rgx is None:
+                return []
+            return [add_atom(('rx', rgx.pattern, rgx.flags, src), rgx, src,
+                             _regex_anchors(rgx))]
+
+        def bits(atoms):
+            mask = 0
+            for a in atoms:
+                mask |= 1 << a
+            return mask
+
+        rule_specs = []
+        always_rules = []
+        trigger_rules = {}  # atom id -> rule indices it can fire
+        for rule, comp in zip(self.override_rules, self._rule_compiled):
+            src = 1 if comp['case_sensitive'] else 0
+            ignore_case = not comp['case_sensitive']
+
+            veto_atoms = regex_atoms(comp['regex_none_of'], src)
+            if comp['none_of'] is not None:
+                veto_atoms += keyword_atoms(
+                    self._expand_aliases(rule['none_of']), src, ignore_case)
+
+            all_atoms = None
+            if comp['all_of'] is not None:
+                if any(rgx is None for rgx in comp['all_of']):
+                    continue  # empty condition -> rule can never fire
+                all_atoms = [keyword_atoms(self.aliases.get(c, [c]), src, ignore_case)
+                             for c in rule['all_of']]
+
+            any_atoms = regex_atoms(comp['regex_any_of'], src)
+            if comp['any_of'] is not None:
+                any_atoms += keyword_atoms(
+                    self._expand_aliases(rule['any_of']), src, ignore_case)
+            if comp['exact_any_of'] is not None:
+                any_atoms += keyword_atoms(
+                    self._expand_aliases(rule['exact_any_of']), src,
+                    ignore_case, exact_match=True)
+
+            if any_atoms:
+                triggers = any_atoms
+            elif all_atoms:
+                triggers = all_atoms[0]
+            elif all_atoms is not None:
+                triggers = None  # `all_of: []` with no positive clause
+            else:
+                continue  # no positive clause -> rule cannot fire
+
+            k = len(rule_specs)
+            rule_specs.append((comp['name'], bits(veto_atoms),
+                               tuple(bits(c) for c in all_atoms or ()),
+                               bits(any_atoms)))
+            if triggers is None:
+                always_rules.append(k)
+            else:
+                for a in set(triggers):
+                    trigger_rules.setdefault(a, []).append(k)
+
+        automata = []
+        for src_anchors in anchors:
+            if not src_anchors:
+                automata.append(None)
+                continue
+            A = ahocorasick.Automaton()
+            for anchor, atoms in src_anchors.items():
+                A.add_word(anchor, tuple(atoms))
+            A.make_automaton()
+            automata.append(A)
+
+        self._scan_atom_regex = atom_regex
+        self._scan_atom_src = atom_src
+        self._scan_unanchored = unanchored
+        self._scan_automata = automata
+        self._scan_rule_specs = rule_specs
+        self._scan_always_rules = tuple(always_rules)
+        self._scan_trigger_rules = {a: tuple(ks) for a, ks in trigger_rules.items()}
+
     def _build_pattern_string(self, keyword, exact_match=False):
         """Translate a wildcard/plain keyword into its raw regex pattern
         string (without flags / anchors).  Shared between the per-keyword
@@ -181,7 +384,15 @@ class RuleBasedCategorizer:
         if not patterns:
             return None
         flags = re.IGNORECASE if ignore_case else 0
-        return re.compile('|'.join(f'(?:{p})' for p in patterns), flags)
+        parts = []
+        for p in patterns:
+            m = _GLOBAL_INLINE_FLAGS_RE.match(p)
+            if m:
+                for ch in m.group(1):
+                    flags |= _INLINE_FLAG_BITS[ch]
+                p = p[m.end():]
+            parts.append(f'(?:{p})')
+        return re.compile('|'.join(parts), flags)
 
     def _get_raw_regex(self, pattern, ignore_case=True):
         """Compile & cache a raw-regex keyword (used by regex_any_of /
@@ -313,35 +524,133 @@ class RuleBasedCategorizer:
         ($NAME -> keyword_groups[NAME])."""
         return [kw for alias in clause for kw in self.aliases.get(alias, [alias])]
 
-    def get_market_overrides_batch(self, clean_series, raw_series=None):
+    def get_market_overrides_batch(self, clean_series, raw_series=None,
+                                   engine='scan'):
         """Vectorized equivalent of iterating `get_market_override` over a
         Series.  Returns a pd.Series of override names (or None) aligned
         with clean_series.index.  Preserves first-match-wins semantics and
         all clause logic of the per-row path.
 
-        Perf notes:
-        - Per-rule regexes are precompiled at init (`_rule_compiled`) so
-          the hot loop does one `str.contains` per clause, no `re.compile`.
-        - The still-unassigned set is a numpy bool mask (`still_open`) with
-          O(1) updates, instead of a pandas Index rebuilt with .difference
-          after every match (that was O(N) * 786 rules).
-        - Each rule evaluates only on the still-unassigned slice; early
-          rules claim most rows so later rules run on a much shorter array.
-        - Tube/vial sibling guard is vectorized (single str.contains pass
-          over assigned category names, no per-row apply(lambda)).
+        engine='scan' (default) runs the single-pass Aho-Corasick scan
+        (`_match_rules_scan`): each description is read once, keyword hits
+        land in a per-row bitset, and rules are resolved from the bitset.
+        engine='regex' runs the older per-clause `str.contains` loop
+        (`_match_rules_regex`); both produce identical output and share the
+        implicit enzyme fallback and tube/vial guard.
         """
         n = len(clean_series)
         out_index = clean_series.index
         if not self._rule_compiled or n == 0:
             return pd.Series([None] * n, index=out_index, dtype='object')
 
-        # Underlying string arrays -- we do pandas str.contains on freshly
-        # sliced views of these, but track the unassigned set with a numpy
-        # bool mask so we don't pay Index.difference on every rule.
         clean_arr = clean_series.astype(str).to_numpy()
         raw_arr = (raw_series.astype(str).to_numpy()
                    if raw_series is not None else None)
 
+        if engine == 'scan':
+            overrides_np, still_open = self._match_rules_scan(clean_arr, raw_arr)
+        elif engine == 'regex':
+            overrides_np, still_open = self._match_rules_regex(clean_arr, raw_arr)
+        else:
+            raise ValueError(f"Unknown rule engine: {engine!r} (expected 'scan' or 'regex')")
+
+        self._apply_implicit_rules(overrides_np, still_open, clean_arr, raw_arr)
+        return pd.Series(overrides_np, index=out_index, dtype='object')
+
+    def _match_rules_scan(self, clean_arr, raw_arr):
+        """First-match-wins YAML rule pass via the single-pass scan engine.
+        Returns (overrides, still_open) numpy arrays aligned with clean_arr.
+
+        Rows containing one of the `_ASCII_CASEFOLD_RE` characters go
+        through `_match_rules_regex` instead: under IGNORECASE an ASCII
+        keyword can match them (`k` vs the Kelvin sign), which a lowercased
+        anchor scan would miss.  These rows are vanishingly rare.
+        """
+        n = len(clean_arr)
+        overrides_np = np.full(n, None, dtype=object)
+        still_open = np.ones(n, dtype=bool)
+        texts = (clean_arr, raw_arr if raw_arr is not None else clean_arr)
+
+        needs_regex = pd.Series(clean_arr).str.contains(
+            _ASCII_CASEFOLD_RE, na=False).to_numpy()
+        if raw_arr is not None:
+            needs_regex |= pd.Series(raw_arr).str.contains(
+                _ASCII_CASEFOLD_RE, na=False).to_numpy()
+        fallback_pos = np.flatnonzero(needs_regex)
+        if len(fallback_pos):
+            sub_overrides, sub_open = self._match_rules_regex(
+                clean_arr[fallback_pos],
+                raw_arr[fallback_pos] if raw_arr is not None else None)
+            overrides_np[fallback_pos] = sub_overrides
+            still_open[fallback_pos] = sub_open
+
+        scan_pos = np.flatnonzero(~needs_regex)
+        if not len(scan_pos):
+            return overrides_np, still_open
+
+        atom_regex = self._scan_atom_regex
+        atom_src = self._scan_atom_src
+        automata = self._scan_automata
+        rule_specs = self._scan_rule_specs
+        always_rules = self._scan_always_rules
+        trigger_rules = self._scan_trigger_rules
+        scan_texts = (texts[0][scan_pos], texts[1][scan_pos])
+
+        # Atoms without a literal anchor (raw-regex clauses, all-non-ASCII
+        # keywords) are few; evaluate each once over the whole column.
+        pre_hits = {}
+        for a in self._scan_unanchored:
+            hit = pd.Series(scan_texts[atom_src[a]]).str.contains(
+                atom_regex[a], na=False).to_numpy()
+            for j in np.flatnonzero(hit).tolist():
+                pre_hits.setdefault(j, []).append(a)
+
+        atom_search = [rgx.search for rgx in atom_regex]
+        for j in range(len(scan_pos)):
+            hit_atoms = pre_hits.get(j, [])
+            for src in (0, 1):
+                A = automata[src]
+                if A is None:
+                    continue
+                text = scan_texts[src][j]
+                candidates = {a for _, atoms in A.iter(text.lower()) for a in atoms}
+                hit_atoms += [a for a in candidates if atom_search[a](text) is not None]
+            if not hit_atoms and not always_rules:
+                continue
+
+            hits = 0
+            rule_candidates = set(always_rules)
+            for a in hit_atoms:
+                hits |= 1 << a
+                rule_candidates.update(trigger_rules.get(a, ()))
+            for k in sorted(rule_candidates):
+                name, veto, all_masks, any_mask = rule_specs[k]
+                if hits & veto:
+                    continue
+                if any_mask and not hits & any_mask:
+                    continue
+                if all(hits & m for m in all_masks):
+                    i = scan_pos[j]
+                    overrides_np[i] = name
+                    still_open[i] = False
+                    break
+
+        return overrides_np, still_open
+
+    def _match_rules_regex(self, clean_arr, raw_arr):
+        """First-match-wins YAML rule pass, one `str.contains` per clause.
+        Returns (overrides, still_open) numpy arrays aligned with clean_arr.
+
+        Perf notes:
+        - Per-rule regexes are precompiled at init (`_rule_compiled`) so
+          the hot loop does one `str.contains` per clause, no `re.compile`.
+        - The still-unassigned set is a numpy bool mask (`still_open`) with
+          O(1) updates, instead of a pandas Index rebuilt with .difference
+          after every match (that was O(N) * 786 rules).
+        - Each rule evaluates only on the still-unassigned slice; early
+          rules claim most rows so later rules run on a much shorter array.
+        """
+        n = len(clean_arr)
         overrides_np = np.full(n, None, dtype=object)
         still_open = np.ones(n, dtype=bool)
 
@@ -413,6 +722,12 @@ class RuleBasedCategorizer:
             overrides_np[matched_pos] = comp['name']
             still_open[matched_pos] = False
 
+        return overrides_np, still_open
+
+    def _apply_implicit_rules(self, overrides_np, still_open, clean_arr, raw_arr):
+        """Post-YAML passes shared by both rule engines; edits overrides_np
+        in place.
+        """
         # --- Implicit enzyme-regex fallback --------------------------------
         # The YAML `restriction enzymes` rules are case-sensitive, word-
         # bounded substring matches.  They miss spaced / hyphenated / Arabic-
@@ -448,8 +763,6 @@ class RuleBasedCategorizer:
                 if has_accessory.any():
                     overrides_np[tv_pos[has_accessory]] = None
 
-        return pd.Series(overrides_np, index=out_index, dtype='object')
-
     def validate_predictions_batch(self, predictions, descriptions):
         """Vectorized equivalent of iterating `validate_prediction` over a
         Series.  Returns an object Series aligned with predictions.index;